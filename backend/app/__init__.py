@@ -55,22 +55,26 @@ def create_app(config_class=Config):
             "Access-Control-Request-Headers"
         ],
         "supports_credentials": True,
-        "expose_headers": ["X-Total-Count", "X-Page-Count"],
+        "expose_headers": ["X-Total-Count", "X-Page-Count", "X-Next-Cursor"],
         "max_age": 86400
     }})
     
     bcrypt.init_app(app)
     
 
-    # Initialize caching (use simple cache to avoid Redis dependency)
+    # Initialize caching: per-worker LRU in front of shared Redis, L1-only while Redis is down
     cache.init_app(app, config={
-        'CACHE_TYPE': 'SimpleCache',
+        'CACHE_TYPE': 'app.utils.two_tier_cache.TwoTierCache',
         'CACHE_DEFAULT_TIMEOUT': 300
     })
     
     # Initialize email service
     mail.init_app(app)
     
+    # Background jobs (forecast fitting) run on Celery workers
+    from app.celery_utils import make_celery
+    make_celery(app)
+    
     # Create logs directory if it doesn't exist
     os.makedirs('logs', exist_ok=True)
     
@@ -86,7 +90,7 @@ def create_app(config_class=Config):
     
     
     # Initialize services
-    from app.services import mfa_service, audit_service, notification_service, payment_service, risk_service, dashboard_service, admin_dashboard_service, currency_service, ussd_service, bi_service, kyc_service, aml_service, gdpr_service, voice_assistant, voice_analytics, demand_forecasting, inventory_optimization, etl_service
+    from app.services import mfa_service, audit_service, notification_service, payment_service, risk_service, dashboard_service, admin_dashboard_service, currency_service, ussd_service, bi_service, kyc_service, aml_service, gdpr_service, voice_assistant, voice_analytics, demand_forecasting, inventory_optimization, etl_service, statement_reconciliation_service, transaction_monitor, stock_service, summary_service, meeting_reminders, messaging_service, event_bus, push_gateway, presence_service
     mfa_service.init_app(app)
     audit_service.init_app(app)
     notification_service.init_app(app)
@@ -100,17 +104,27 @@ def create_app(config_class=Config):
     kyc_service.init_app(app)
     aml_service.init_app(app)
     gdpr_service.init_app(app)
+    transaction_monitor.init_app(app)
+    stock_service.init_app(app)
+    summary_service.init_app(app)
+    meeting_reminders.init_app(app)
+    messaging_service.init_app(app)
+    event_bus.init_app(app)
+    push_gateway.init_app(app)
+    presence_service.init_app(app)
     voice_assistant.init_app(app)
     voice_analytics.init_app(app)
     demand_forecasting.init_app(app)
     inventory_optimization.init_app(app)
     etl_service.init_app(app)
+    statement_reconciliation_service.init_app(app)
     
     # Register blueprints
-    from app.routes import auth, branches, groups, members, loans, products, transactions, dashboard, payments, jobs, reports, field, gamification, notifications, risk, dashboards, ai_analytics, reporting, field_operations, currency, alternative_payments, ussd, bi_integration, compliance, voice_assistant as voice_assistant_routes, inventory_intelligence, etl_pipeline, users, suppliers, stock, permissions, field_officer, savings, subscription, messages
+    from app.routes import auth, branches, groups, members, loans, products, transactions, dashboard, payments, jobs, reports, field, gamification, notifications, risk, dashboards, ai_analytics, reporting, field_operations, currency, alternative_payments, ussd, bi_integration, compliance, voice_assistant as voice_assistant_routes, inventory_intelligence, etl_pipeline, users, suppliers, stock, permissions, field_officer, savings, subscription, messages, events
     app.register_blueprint(auth.bp)
     app.register_blueprint(users.bp)
     app.register_blueprint(messages.bp)
+    app.register_blueprint(events.bp)
     app.register_blueprint(branches.bp)
     app.register_blueprint(permissions.bp)
     app.register_blueprint(suppliers.bp)
@@ -153,14 +167,14 @@ def create_app(config_class=Config):
             from sqlalchemy import text
             db.session.execute(text('SELECT 1'))
             
-            # Test cache connection (simple cache doesn't need Redis)
+            # Test cache connection (falls back to L1 when Redis is down)
             cache.get('health_check')
             
             return {
                 'status': 'healthy',
                 'database': 'connected',
                 'cache': 'connected',
-                'redis': 'not_configured',
+                'redis': cache.cache.stats()['redis'],
                 'timestamp': '2024-01-15T10:30:00Z',
                 'version': '1.0.0-enterprise'
             }, 200
@@ -173,6 +187,11 @@ def create_app(config_class=Config):
                 'timestamp': '2024-01-15T10:30:00Z'
             }, 500
     
+    # Cache hit/miss/latency counters for this worker
+    @app.route('/health/cache')
+    def cache_stats():
+        return cache.cache.stats(), 200
+    
     # API info endpoint
     @app.route('/api')
     def api_info():
@@ -244,6 +263,13 @@ def create_app(config_class=Config):
         # Add request ID to response headers
         if hasattr(g, 'request_id'):
             response.headers['X-Request-ID'] = g.request_id
+
+        # Staff presence heartbeat, throttled inside the service
+        if session.get('user_id'):
+            try:
+                presence_service.heartbeat(session['user_id'])
+            except Exception as e:
+                logging.warning(f"Presence heartbeat failed: {str(e)}")
         
         return response
     
@@ -1,12 +1,29 @@
 from celery import Celery
+from celery.schedules import crontab
 
 def make_celery(app):
     celery = Celery(
         app.import_name,
         backend=app.config['CELERY_RESULT_BACKEND'],
-        broker=app.config['CELERY_BROKER_URL']
+        broker=app.config['CELERY_BROKER_URL'],
+        include=['app.tasks']
     )
     celery.conf.update(app.config)
+    celery.conf.task_routes = {'forecasts.*': {'queue': 'forecasts'}, 'reminders.*': {'queue': 'reminders'}}
+    celery.conf.beat_schedule = {
+        'refresh-forecasts': {
+            'task': 'forecasts.refresh_all',
+            'schedule': crontab(minute=0, hour=app.config.get('FORECAST_REFRESH_HOURS', '*/6'))
+        },
+        'schedule-meeting-reminders': {
+            'task': 'reminders.schedule',
+            'schedule': crontab(minute='*/15')
+        },
+        'dispatch-meeting-reminders': {
+            'task': 'reminders.dispatch',
+            'schedule': app.config.get('MEETING_REMINDER_DISPATCH_SECONDS', 60.0)
+        }
+    }
 
     class ContextTask(celery.Task):
         def __call__(self, *args, **kwargs):
@@ -14,4 +31,7 @@ def make_celery(app):
                 return self.run(*args, **kwargs)
 
     celery.Task = ContextTask
+    # Shared tasks queued from the web process bind to this app
+    celery.set_default()
+    app.extensions['celery'] = celery
     return celery
@@ -236,6 +236,10 @@ class BranchProduct(db.Model):
     branch = db.relationship('Branch', backref='inventory')
     product = db.relationship('LoanProduct', backref='branch_inventory')
 
+    __table_args__ = (
+        db.UniqueConstraint('branch_id', 'product_id', name='uq_branch_products_branch_product'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -299,6 +303,7 @@ class Loan(db.Model):
     rejection_reason = db.Column(db.Text)
     rejected_date = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     member = db.relationship('Member', backref='loans')
     loan_type = db.relationship('LoanType', backref='loans')
@@ -369,7 +374,7 @@ class Transaction(db.Model):
     reference = db.Column(db.Text)
     loan_id = db.Column(db.Integer, db.ForeignKey('loans.id'))
     processed_by = db.Column(db.Integer, db.ForeignKey('users.id'))
-    mpesa_code = db.Column(db.Text)
+    mpesa_code = db.Column(db.Text, index=True)
     status = db.Column(db.Text, default='confirmed', nullable=False) # pending, confirmed, failed
     confirmed_by = db.Column(db.Integer, db.ForeignKey('users.id'))
     confirmed_at = db.Column(db.DateTime)
@@ -378,6 +383,11 @@ class Transaction(db.Model):
     member = db.relationship('Member', backref='transactions')
     loan = db.relationship('Loan', backref='transactions')
 
+    __table_args__ = (
+        db.Index('ix_transactions_member_created', 'member_id', 'created_at'),
+        db.Index('ix_transactions_type_created', 'transaction_type', 'created_at'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -440,6 +450,11 @@ class GroupVisit(db.Model):
     group = db.relationship('Group', backref='group_visits')
     field_officer = db.relationship('User', backref='group_visits')
 
+    __table_args__ = (
+        db.Index('ix_group_visits_visit_date', 'visit_date'),
+        db.Index('ix_group_visits_officer_date', 'field_officer_id', 'visit_date'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -503,6 +518,11 @@ class ActivityLog(db.Model):
 
     user = db.relationship('User', backref='activity_logs')
 
+    __table_args__ = (
+        db.Index('ix_activity_logs_user_created', 'user_id', 'created_at'),
+        db.Index('ix_activity_logs_created_at', 'created_at'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -986,6 +1006,10 @@ class StockMovement(db.Model):
     supplier = db.relationship('Supplier', backref='stock_movements')
     processed_by_user = db.relationship('User', backref='stock_movements')
 
+    __table_args__ = (
+        db.Index('ix_stock_movements_product_branch', 'product_id', 'branch_id'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -1019,9 +1043,35 @@ class SystemSubscription(db.Model):
             'createdBy': self.created_by
         }
 
+class Conversation(db.Model):
+    __tablename__ = 'conversations'
+    id = db.Column(db.Integer, primary_key=True)
+    # The participant pair is stored ordered so each pair has exactly one row
+    user_low_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_high_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    last_message_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    last_sender_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    last_message_preview = db.Column(db.Text)
+    unread_low = db.Column(db.Integer, default=0, nullable=False) # unread by user_low
+    unread_high = db.Column(db.Integer, default=0, nullable=False) # unread by user_high
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_low_id', 'user_high_id', name='uq_conversations_user_pair'),
+        db.Index('ix_conversations_low_last_message', 'user_low_id', 'last_message_at'),
+        db.Index('ix_conversations_high_last_message', 'user_high_id', 'last_message_at'),
+    )
+
+    def other_user_id(self, user_id):
+        return self.user_high_id if user_id == self.user_low_id else self.user_low_id
+
+    def unread_for(self, user_id):
+        return self.unread_low if user_id == self.user_low_id else self.unread_high
+
 class Message(db.Model):
     __tablename__ = 'messages'
     id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'), nullable=False)
     sender_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     recipient_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     content = db.Column(db.Text, nullable=False)
@@ -1032,9 +1082,14 @@ class Message(db.Model):
     sender = db.relationship('User', foreign_keys=[sender_id], backref='sent_messages')
     recipient = db.relationship('User', foreign_keys=[recipient_id], backref='received_messages')
 
+    __table_args__ = (
+        db.Index('ix_messages_conversation_created', 'conversation_id', 'created_at'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
+            'conversationId': self.conversation_id,
             'senderId': self.sender_id,
             'senderName': f"{self.sender.first_name} {self.sender.last_name}",
             'recipientId': self.recipient_id,
@@ -1044,3 +1099,271 @@ class Message(db.Model):
             'createdAt': self.created_at.isoformat(),
             'readAt': self.read_at.isoformat() if self.read_at else None
         }
+
+class MpesaCallback(db.Model):
+    __tablename__ = 'mpesa_callbacks'
+    id = db.Column(db.Integer, primary_key=True)
+    idempotency_key = db.Column(db.Text, unique=True, nullable=False) # M-Pesa receipt number
+    checkout_request_id = db.Column(db.Text)
+    receipt_number = db.Column(db.Text)
+    phone_number = db.Column(db.Text)
+    amount = db.Column(db.Numeric(12, 2))
+    result_code = db.Column(db.Integer)
+    payload = db.Column(db.JSON, nullable=False)
+    status = db.Column(db.Text, default='queued', nullable=False) # queued, posted, duplicate, unmatched, failed
+    member_id = db.Column(db.Integer, db.ForeignKey('members.id'))
+    transaction_id = db.Column(db.Text)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    error_message = db.Column(db.Text)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    processed_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_mpesa_callbacks_status_id', 'status', 'id'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'idempotencyKey': self.idempotency_key,
+            'checkoutRequestId': self.checkout_request_id,
+            'receiptNumber': self.receipt_number,
+            'phoneNumber': self.phone_number,
+            'amount': str(self.amount) if self.amount is not None else None,
+            'resultCode': self.result_code,
+            'status': self.status,
+            'memberId': self.member_id,
+            'transactionId': self.transaction_id,
+            'attempts': self.attempts,
+            'errorMessage': self.error_message,
+            'receivedAt': self.received_at.isoformat(),
+            'processedAt': self.processed_at.isoformat() if self.processed_at else None
+        }
+
+class AmlAlert(db.Model):
+    __tablename__ = 'aml_alerts'
+    id = db.Column(db.Integer, primary_key=True)
+    member_id = db.Column(db.Integer, db.ForeignKey('members.id'), nullable=False)
+    transaction_id = db.Column(db.Text)
+    transaction_type = db.Column(db.Text)
+    amount = db.Column(db.Numeric(12, 2))
+    rules = db.Column(db.JSON, nullable=False) # rule name -> points
+    risk_score = db.Column(db.Integer, nullable=False)
+    risk_level = db.Column(db.Text, nullable=False) # low, medium, high
+    window_stats = db.Column(db.JSON)
+    status = db.Column(db.Text, default='open', nullable=False) # open, reviewed, dismissed, escalated
+    event_at = db.Column(db.DateTime, nullable=False)
+    reviewed_by = db.Column(db.Integer, db.ForeignKey('users.id'))
+    reviewed_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_aml_alerts_member_event', 'member_id', 'event_at'),
+        db.Index('ix_aml_alerts_status_id', 'status', 'id'),
+        db.Index('ix_aml_alerts_level_id', 'risk_level', 'id'),
+        db.Index('ix_aml_alerts_transaction_id', 'transaction_id'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'memberId': self.member_id,
+            'transactionId': self.transaction_id,
+            'transactionType': self.transaction_type,
+            'amount': str(self.amount) if self.amount is not None else None,
+            'rules': self.rules,
+            'riskScore': self.risk_score,
+            'riskLevel': self.risk_level,
+            'windowStats': self.window_stats,
+            'status': self.status,
+            'eventAt': self.event_at.isoformat(),
+            'reviewedBy': self.reviewed_by,
+            'reviewedAt': self.reviewed_at.isoformat() if self.reviewed_at else None,
+            'createdAt': self.created_at.isoformat()
+        }
+
+class DemandForecast(db.Model):
+    __tablename__ = 'demand_forecasts'
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('loan_products.id'), nullable=False)
+    branch_id = db.Column(db.Integer, db.ForeignKey('branches.id')) # NULL for the product-wide series
+    method = db.Column(db.Text, nullable=False) # ses, croston
+    daily_demand = db.Column(db.Float, nullable=False)
+    demand_std = db.Column(db.Float, nullable=False)
+    horizon_days = db.Column(db.Integer, nullable=False)
+    forecast_total = db.Column(db.Float, nullable=False)
+    lead_time_days = db.Column(db.Integer, nullable=False)
+    safety_stock = db.Column(db.Integer, nullable=False)
+    reorder_point = db.Column(db.Integer, nullable=False)
+    reorder_quantity = db.Column(db.Integer, nullable=False)
+    current_stock = db.Column(db.Integer, nullable=False)
+    history_days = db.Column(db.Integer, nullable=False)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_demand_forecasts_branch_product', 'branch_id', 'product_id'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'productId': self.product_id,
+            'branchId': self.branch_id,
+            'method': self.method,
+            'dailyDemand': round(self.daily_demand, 3),
+            'demandStd': round(self.demand_std, 3),
+            'horizonDays': self.horizon_days,
+            'forecastTotal': round(self.forecast_total, 2),
+            'leadTimeDays': self.lead_time_days,
+            'safetyStock': self.safety_stock,
+            'reorderPoint': self.reorder_point,
+            'reorderQuantity': self.reorder_quantity,
+            'currentStock': self.current_stock,
+            'historyDays': self.history_days,
+            'computedAt': self.computed_at.isoformat()
+        }
+
+class StockAlert(db.Model):
+    __tablename__ = 'stock_alerts'
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('loan_products.id'), nullable=False)
+    branch_id = db.Column(db.Integer, db.ForeignKey('branches.id')) # NULL for product-wide stock
+    level = db.Column(db.Text, nullable=False) # low, critical
+    stock_quantity = db.Column(db.Integer, nullable=False)
+    threshold = db.Column(db.Integer, nullable=False)
+    raised_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    product = db.relationship('LoanProduct')
+
+    __table_args__ = (
+        db.Index('ux_stock_alerts_product', 'product_id', unique=True,
+                 postgresql_where=db.text('branch_id IS NULL')),
+        db.Index('ux_stock_alerts_branch_product', 'branch_id', 'product_id', unique=True,
+                 postgresql_where=db.text('branch_id IS NOT NULL')),
+        db.Index('ix_stock_alerts_level', 'level'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'productId': self.product_id,
+            'branchId': self.branch_id,
+            'level': self.level,
+            'stockQuantity': self.stock_quantity,
+            'threshold': self.threshold,
+            'raisedAt': self.raised_at.isoformat(),
+            'updatedAt': self.updated_at.isoformat()
+        }
+
+class ForecastResult(db.Model):
+    __tablename__ = 'forecast_results'
+    id = db.Column(db.Integer, primary_key=True)
+    forecast_type = db.Column(db.Text, nullable=False) # arrears_rate, seasonal_demand
+    scope_key = db.Column(db.Text, nullable=False) # branch:<id|all>:product:<id|all>
+    branch_id = db.Column(db.Integer, db.ForeignKey('branches.id'))
+    product_id = db.Column(db.Integer, db.ForeignKey('loan_products.id'))
+    horizon_months = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.Text, nullable=False) # success, insufficient_data, unavailable, error
+    result = db.Column(db.JSON, nullable=False)
+    job_id = db.Column(db.Text)
+    duration_ms = db.Column(db.Integer, nullable=False, default=0)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Latest run, which may have failed while the stored result above is kept
+    last_status = db.Column(db.Text)
+    last_error = db.Column(db.Text)
+    last_attempt_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.UniqueConstraint('forecast_type', 'scope_key', name='uq_forecast_results_type_scope'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'forecastType': self.forecast_type,
+            'branchId': self.branch_id,
+            'productId': self.product_id,
+            'horizonMonths': self.horizon_months,
+            'status': self.status,
+            'jobId': self.job_id,
+            'durationMs': self.duration_ms,
+            'computedAt': self.computed_at.isoformat(),
+            'lastStatus': self.last_status,
+            'lastError': self.last_error,
+            'lastAttemptAt': self.last_attempt_at.isoformat() if self.last_attempt_at else None
+        }
+
+class MemberSummary(db.Model):
+    __tablename__ = 'member_summaries'
+    member_id = db.Column(db.Integer, db.ForeignKey('members.id', ondelete='CASCADE'), primary_key=True)
+    savings_balance = db.Column(db.Numeric(12, 2), default=0, nullable=False)
+    drawdown_balance = db.Column(db.Numeric(12, 2), default=0, nullable=False)
+    loan_count = db.Column(db.Integer, default=0, nullable=False)
+    active_loan_count = db.Column(db.Integer, default=0, nullable=False) # approved, disbursed, released
+    total_borrowed = db.Column(db.Numeric(14, 2), default=0, nullable=False)
+    total_outstanding = db.Column(db.Numeric(14, 2), default=0, nullable=False)
+    total_repaid = db.Column(db.Numeric(14, 2), default=0, nullable=False)
+    max_loan_limit = db.Column(db.Numeric(12, 2), default=0, nullable=False)
+    available_loan = db.Column(db.Numeric(12, 2), default=0, nullable=False)
+    repayment_rate = db.Column(db.Numeric(7, 2), default=0, nullable=False)
+    # The member's share of its group's stats, summed into group_stats
+    disbursed_principal = db.Column(db.Numeric(14, 2), default=0, nullable=False) # disbursed, released, completed
+    running_outstanding = db.Column(db.Numeric(14, 2), default=0, nullable=False) # disbursed
+    running_due = db.Column(db.Numeric(14, 2), default=0, nullable=False) # disbursed
+    running_repaid = db.Column(db.Numeric(14, 2), default=0, nullable=False) # repayments on disbursed loans
+    running_loan_count = db.Column(db.Integer, default=0, nullable=False) # disbursed
+    last_transaction_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    member = db.relationship('Member', backref=db.backref('summary', uselist=False))
+
+    def to_dict(self):
+        return {
+            'memberId': self.member_id,
+            'savingsBalance': str(self.savings_balance),
+            'drawdownBalance': str(self.drawdown_balance),
+            'loanCount': self.loan_count,
+            'activeLoanCount': self.active_loan_count,
+            'totalBorrowed': str(self.total_borrowed),
+            'totalOutstanding': str(self.total_outstanding),
+            'totalRepaid': str(self.total_repaid),
+            'maxLoanLimit': str(self.max_loan_limit),
+            'availableLoan': str(self.available_loan),
+            'repaymentRate': float(self.repayment_rate),
+            'lastTransactionAt': self.last_transaction_at.isoformat() if self.last_transaction_at else None,
+            'updatedAt': self.updated_at.isoformat()
+        }
+
+class GroupStats(db.Model):
+    __tablename__ = 'group_stats'
+    group_id = db.Column(db.Integer, db.ForeignKey('groups.id', ondelete='CASCADE'), primary_key=True)
+    branch_id = db.Column(db.Integer, db.ForeignKey('branches.id'), index=True)
+    total_members = db.Column(db.Integer, default=0, nullable=False)
+    active_members = db.Column(db.Integer, default=0, nullable=False)
+    total_savings = db.Column(db.Numeric(14, 2), default=0, nullable=False)
+    total_loans_disbursed = db.Column(db.Numeric(14, 2), default=0, nullable=False) # disbursed, released, completed
+    total_loans_outstanding = db.Column(db.Numeric(14, 2), default=0, nullable=False) # disbursed
+    total_due = db.Column(db.Numeric(14, 2), default=0, nullable=False) # disbursed
+    total_repaid = db.Column(db.Numeric(14, 2), default=0, nullable=False)
+    active_loan_count = db.Column(db.Integer, default=0, nullable=False)
+    repayment_rate = db.Column(db.Numeric(7, 2), default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    group = db.relationship('Group', backref=db.backref('stats', uselist=False))
+
+    def to_dict(self):
+        return {
+            'groupId': self.group_id,
+            'groupName': self.group.name if self.group else None,
+            'branchId': self.branch_id,
+            'totalMembers': self.total_members,
+            'activeMembers': self.active_members,
+            'totalSavings': str(self.total_savings),
+            'totalLoansDisbursed': str(self.total_loans_disbursed),
+            'totalLoansOutstanding': str(self.total_loans_outstanding),
+            'totalRepaid': str(self.total_repaid),
+            'repaymentRate': float(self.repayment_rate),
+            'totalLoans': self.active_loan_count,
+            'updatedAt': self.updated_at.isoformat()
+        }
@@ -1,7 +1,10 @@
 from flask import Blueprint, request, jsonify
 from datetime import datetime
+from celery.result import AsyncResult
 from app import db
+from app.models import ForecastResult
 from app.services import AIAnalyticsService
+from app.tasks import refresh_forecasts_task
 from app.services.audit_service import audit_service, AuditEventType, RiskLevel
 import logging
 
@@ -12,7 +15,7 @@ ai_analytics_bp = Blueprint('ai_analytics', __name__, url_prefix='/api/ai-analyt
 @ai_analytics_bp.route('/arrears-forecast', methods=['GET'])
 def forecast_arrears():
     """
-    Forecast arrears rate using Prophet time series model.
+    Precomputed arrears rate forecast (Prophet), with its computed_at stamp.
     Query params: months_ahead (default: 12), branch_id (optional)
     """
     try:
@@ -38,6 +41,81 @@ def forecast_arrears():
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
+@ai_analytics_bp.route('/forecasts', methods=['GET'])
+def list_forecasts():
+    """
+    List stored forecasts with their freshness.
+    Query params: type (optional), branch_id (optional)
+    """
+    try:
+        query = ForecastResult.query
+        if request.args.get('type'):
+            query = query.filter_by(forecast_type=request.args['type'])
+        if request.args.get('branch_id', type=int):
+            query = query.filter_by(branch_id=request.args.get('branch_id', type=int))
+        
+        forecasts = query.order_by(ForecastResult.forecast_type, ForecastResult.scope_key).all()
+        return jsonify({'forecasts': [forecast.to_dict() for forecast in forecasts], 'total': len(forecasts)}), 200
+    except Exception as e:
+        logger.error(f"Forecast listing error: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@ai_analytics_bp.route('/forecasts/refresh', methods=['POST'])
+def refresh_forecasts():
+    """
+    Queue forecast recomputation and return the job id.
+    Body: type ('arrears_rate', 'seasonal_demand' or 'all'), branch_id, product_id, months_ahead
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        forecast_type = data.get('type', 'all')
+        
+        if forecast_type == 'all':
+            job = refresh_forecasts_task.delay()
+            job_id = job.id
+        elif forecast_type in ('arrears_rate', 'seasonal_demand'):
+            job_id = AIAnalyticsService.request_forecast_refresh(
+                forecast_type,
+                data.get('months_ahead'),
+                branch_id=data.get('branch_id'),
+                product_id=data.get('product_id')
+            )
+        else:
+            return jsonify({'status': 'error', 'message': 'type must be arrears_rate, seasonal_demand or all'}), 400
+        
+        audit_service.log_event(
+            event_type=AuditEventType.API_ACCESS,
+            resource='ai_analytics',
+            action='forecast_refresh',
+            details={'type': forecast_type, 'job_id': job_id},
+            risk_level=RiskLevel.LOW
+        )
+        
+        return jsonify({'status': 'queued', 'job_id': job_id}), 202
+    except Exception as e:
+        logger.error(f"Forecast refresh error: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 503
+
+
+@ai_analytics_bp.route('/forecasts/jobs/<job_id>', methods=['GET'])
+def get_forecast_job(job_id):
+    """
+    Get the state of a forecast job.
+    """
+    try:
+        job = AsyncResult(job_id)
+        response = {'job_id': job_id, 'state': job.state}
+        if job.successful():
+            response['result'] = job.result
+        elif job.failed():
+            response['error'] = str(job.result)
+        return jsonify(response), 200
+    except Exception as e:
+        logger.error(f"Forecast job lookup error: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
 @ai_analytics_bp.route('/member-behavior', methods=['GET'])
 def analyze_member_behavior():
     """
@@ -88,7 +166,7 @@ def predict_clv(member_id):
 @ai_analytics_bp.route('/seasonal-demand', methods=['GET'])
 def forecast_seasonal_demand():
     """
-    Forecast seasonal demand patterns for products.
+    Precomputed seasonal demand forecast, with its computed_at stamp.
     Query params: product_id (optional), months_ahead (default: 12), branch_id (optional)
     """
     try:
@@ -1,8 +1,8 @@
 from flask import Blueprint, request, jsonify, session
 from app.models import User, Role
 from app import db, bcrypt
-from app.services import audit_service, mfa_service, AuditEventType, RiskLevel
-from app.utils.decorators import login_required
+from app.services import audit_service, mfa_service, jwt_service, AuditEventType, RiskLevel
+from app.utils.decorators import login_required, admin_required
 
 bp = Blueprint('auth', __name__, url_prefix='/api/auth')
 
@@ -109,7 +109,8 @@ def logout():
         action="logout",
         risk_level=RiskLevel.LOW
     )
-    
+
+    jwt_service.revoke_current_token()
     session.clear()
     return jsonify({'success': True})
 
@@ -123,3 +124,19 @@ def me():
         return jsonify({'error': 'User not found'}), 404
     
     return jsonify({'user': user.to_dict()})
+
+@bp.route('/access-stats', methods=['GET'])
+@admin_required
+def access_stats():
+    """API access counts per endpoint or per user from the auth event counters"""
+    minutes = min(request.args.get('minutes', 60, type=int), 24 * 60)
+    group_by = request.args.get('group_by', 'endpoint')
+    if group_by not in ('endpoint', 'user'):
+        return jsonify({'error': 'group_by must be endpoint or user'}), 400
+    
+    return jsonify(jwt_service.get_access_stats(
+        minutes=minutes,
+        group_by=group_by,
+        user_id=request.args.get('user_id', type=int),
+        endpoint=request.args.get('endpoint')
+    ))
@@ -1,9 +1,36 @@
 from flask import Blueprint, request, jsonify, send_file
-from app.services.bi_integration_service import bi_service
+from datetime import datetime
+from app.services.bi_integration_service import bi_service, ArrowExportEngine
+import io
 import logging
 
 bp = Blueprint('bi_integration', __name__, url_prefix='/api/bi-integration')
 
+def send_export(result):
+    """Send an export result, streamed from disk for columnar files"""
+    response = send_file(
+        result['path'] if 'path' in result else io.BytesIO(result['content']),
+        mimetype=result['content_type'],
+        as_attachment=True,
+        download_name=result['filename']
+    )
+    if 'export_id' in result:
+        # One-off download: drop the export once the file has been sent
+        response.call_on_close(lambda: bi_service.columnar.discard(result['export_id']))
+    return response
+
+def extract_filters(data):
+    """Read columnar extract options from a request body or query string"""
+    since = data.get('since')
+    return {
+        'format': (data.get('format') or 'parquet').lower(),
+        'since': datetime.fromisoformat(since) if since else None,
+        'incremental': str(data.get('incremental', '')).lower() in ('1', 'true', 'yes'),
+        'partition_by': data.get('partitionBy') or None,
+        'branch_id': int(data['branch_id']) if data.get('branch_id') else None,
+        'status': data.get('status') or None
+    }
+
 @bp.route('/tools', methods=['GET'])
 def get_available_tools():
     """Get list of available BI tools"""
@@ -24,8 +51,8 @@ def export_members():
         format = request.args.get('format', 'csv').lower()
         branch_id = request.args.get('branch_id', type=int)
         
-        if format not in ['csv', 'json', 'excel', 'parquet']:
-            return jsonify({'error': 'Unsupported format. Use: csv, json, excel, or parquet'}), 400
+        if format not in ['csv', 'json', 'excel', 'parquet', 'arrow']:
+            return jsonify({'error': 'Unsupported format. Use: csv, json, excel, parquet, or arrow'}), 400
         
         filters = {}
         if branch_id:
@@ -36,13 +63,7 @@ def export_members():
         if 'error' in result:
             return jsonify(result), 400
         
-        return send_file(
-            request=request,
-            content=result['content'],
-            mimetype=result['content_type'],
-            as_attachment=True,
-            download_name=result['filename']
-        )
+        return send_export(result)
     
     except Exception as e:
         logging.error(f"Error exporting members: {str(e)}")
@@ -56,8 +77,8 @@ def export_loans():
         branch_id = request.args.get('branch_id', type=int)
         status = request.args.get('status')
         
-        if format not in ['csv', 'json', 'excel', 'parquet']:
-            return jsonify({'error': 'Unsupported format. Use: csv, json, excel, or parquet'}), 400
+        if format not in ['csv', 'json', 'excel', 'parquet', 'arrow']:
+            return jsonify({'error': 'Unsupported format. Use: csv, json, excel, parquet, or arrow'}), 400
         
         filters = {}
         if branch_id:
@@ -70,18 +91,59 @@ def export_loans():
         if 'error' in result:
             return jsonify(result), 400
         
-        return send_file(
-            request=request,
-            content=result['content'],
-            mimetype=result['content_type'],
-            as_attachment=True,
-            download_name=result['filename']
-        )
+        return send_export(result)
     
     except Exception as e:
         logging.error(f"Error exporting loans: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@bp.route('/extracts/<dataset>', methods=['POST'])
+def create_extract(dataset):
+    """Stream a dataset into Parquet/Arrow files, optionally incremental and partitioned"""
+    try:
+        data = request.get_json(silent=True) or request.args
+        manifest = bi_service.columnar.export(dataset, **extract_filters(data))
+        return jsonify(manifest), 201
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error creating BI extract: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/extracts/<export_id>', methods=['GET'])
+def get_extract(export_id):
+    """Get the manifest of an extract"""
+    manifest = bi_service.columnar.get_manifest(export_id)
+    if not manifest:
+        return jsonify({'error': 'Extract not found'}), 404
+    return jsonify(manifest)
+
+@bp.route('/extracts/<export_id>/files/<path:name>', methods=['GET'])
+def download_extract_file(export_id, name):
+    """Download one file of an extract"""
+    path = bi_service.columnar.file_path(export_id, name)
+    if not path:
+        return jsonify({'error': 'File not found'}), 404
+    manifest = bi_service.columnar.get_manifest(export_id)
+    return send_file(path, mimetype=manifest['contentType'], as_attachment=True,
+                     download_name=name.replace('/', '_'))
+
+@bp.route('/tableau/publish/<dataset>', methods=['POST'])
+def publish_tableau_datasource(dataset):
+    """Extract a dataset to Parquet and publish it to Tableau"""
+    try:
+        data = request.get_json(silent=True) or {}
+        filters = extract_filters(data)
+        filters.pop('format')
+        filters.pop('partition_by')
+        result = bi_service.publish_to_tableau(dataset, **filters)
+        return jsonify(result), 200 if result['published'] else 502
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error publishing Tableau datasource: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @bp.route('/powerbi/config', methods=['GET'])
 def get_powerbi_config():
     """Get Power BI configuration"""
@@ -152,7 +214,14 @@ def get_export_formats():
                 'name': 'Parquet',
                 'description': 'Parquet - Optimized columnar format for big data and BI tools',
                 'extension': '.parquet',
-                'mimeType': 'application/octet-stream'
+                'mimeType': ArrowExportEngine.FORMATS['parquet'][1]
+            },
+            {
+                'format': 'arrow',
+                'name': 'Arrow IPC',
+                'description': 'Apache Arrow file - Zero-copy columnar format for pandas, DuckDB and Spark',
+                'extension': '.arrow',
+                'mimeType': ArrowExportEngine.FORMATS['arrow'][1]
             }
         ]
         
@@ -1,9 +1,11 @@
 """
 Compliance Routes - KYC, AML, GDPR
 """
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app, session
+from datetime import datetime
 from app.services import kyc_service, aml_service, gdpr_service
 from app.models import User
+from app.utils.decorators import admin_required
 import logging
 
 bp = Blueprint('compliance', __name__, url_prefix='/api/compliance')
@@ -51,6 +53,49 @@ def monitor_aml():
         return jsonify({'error': str(e)}), 500
 
 
+@bp.route('/aml/alerts', methods=['GET'])
+@admin_required
+def list_aml_alerts():
+    try:
+        since = request.args.get('since')
+        result = aml_service.get_alerts(
+            member_id=request.args.get('memberId', type=int),
+            status=request.args.get('status'),
+            risk_level=request.args.get('riskLevel'),
+            since=datetime.fromisoformat(since) if since else None,
+            before_id=request.args.get('cursor', type=int),
+            limit=min(request.args.get('limit', 50, type=int), 200)
+        )
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logging.error(f"AML alert listing error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/aml/alerts/<int:alert_id>', methods=['PATCH'])
+@admin_required
+def review_aml_alert(alert_id):
+    try:
+        reviewer_id = session.get('user_id')
+        if not reviewer_id:
+            return jsonify({'error': 'Authentication required'}), 401
+        status = (request.get_json() or {}).get('status')
+        if not status:
+            return jsonify({'error': 'Missing status'}), 400
+        
+        alert = aml_service.review_alert(alert_id, status, reviewer_id=reviewer_id)
+        if not alert:
+            return jsonify({'error': 'Alert not found'}), 404
+        return jsonify(alert)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logging.error(f"AML alert review error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
 @bp.route('/gdpr/export', methods=['POST'])
 def request_export():
     try:
@@ -73,6 +73,29 @@ def convert_currency():
         logging.error(f"Error converting currency: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@bp.route('/convert-many', methods=['POST'])
+def convert_many():
+    """Convert a batch of amounts in mixed currencies to one target currency"""
+    try:
+        data = request.get_json() or {}
+        
+        amounts = data.get('amounts') or []
+        currencies = [c.upper() for c in data.get('currencies') or []]
+        to_currency = data.get('to_currency', 'KES').upper()
+        
+        if not amounts:
+            return jsonify({'error': 'Amounts are required'}), 400
+        
+        result = currency_service.convert_many([float(a) for a in amounts], currencies, to_currency)
+        
+        if 'error' in result:
+            return jsonify(result), 400
+        
+        return jsonify(result)
+    except Exception as e:
+        logging.error(f"Error converting currency batch: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @bp.route('/convert-to-base', methods=['POST'])
 def convert_to_base():
     """Convert amount to base currency (KES)"""
@@ -1,10 +1,12 @@
 from flask import Blueprint, jsonify, session, request
-from app.models import Loan, SavingsAccount, Member, User, ActivityLog
+from app.models import Loan, SavingsAccount, Member, User, Role, ActivityLog
 from app import db
 from sqlalchemy import func, and_, or_
+from sqlalchemy.orm import joinedload
 from datetime import datetime, timedelta
 from app.services.analytics_service import AnalyticsService
 from app.utils.decorators import login_required
+from app.services.presence_service import presence_service
 from app.services.ai_analytics_service import AIAnalyticsService
 import logging
 
@@ -299,25 +301,26 @@ def get_activities():
         else:
             start_date = now - timedelta(days=1)
         
-        activities_query = ActivityLog.query.filter(
+        rows = db.session.query(ActivityLog, User.first_name, User.last_name).join(
+            User, User.id == ActivityLog.user_id
+        ).filter(
             ActivityLog.created_at >= start_date
-        ).order_by(ActivityLog.created_at.desc()).limit(limit)
+        ).order_by(ActivityLog.created_at.desc()).limit(limit).all()
+        last_seen = presence_service.last_seen({activity.user_id for activity, _, _ in rows})
         
         activities = []
-        for activity in activities_query:
-            admin_user = User.query.get(activity.user_id)
-            if admin_user:
-                activities.append({
-                    'id': activity.id,
-                    'userId': activity.user_id,
-                    'userName': f"{admin_user.first_name} {admin_user.last_name}",
-                    'action': activity.action,
-                    'entityType': activity.entity_type,
-                    'description': activity.description,
-                    'createdAt': activity.created_at.isoformat(),
-                    'timeAgo': get_time_ago(activity.created_at),
-                    'status': 'online' if is_user_online(activity.user_id) else 'offline'
-                })
+        for activity, first_name, last_name in rows:
+            activities.append({
+                'id': activity.id,
+                'userId': activity.user_id,
+                'userName': f"{first_name} {last_name}",
+                'action': activity.action,
+                'entityType': activity.entity_type,
+                'description': activity.description,
+                'createdAt': activity.created_at.isoformat(),
+                'timeAgo': get_time_ago(activity.created_at),
+                'status': 'online' if presence_service.is_online(last_seen.get(activity.user_id)) else 'offline'
+            })
         
         return jsonify({
             'status': 'success',
@@ -343,23 +346,38 @@ def get_staff_status():
         
         is_admin = user.role.name == 'admin'
         
-        admin_users = User.query.filter(User.role_id == (db.session.query(db.func.min(db.Column(db.Integer))).from_statement(
-            db.text("SELECT id FROM roles WHERE name='admin'")
-        ).scalar() or 0)) if is_admin else [user]
+        if is_admin:
+            admin_users = User.query.options(joinedload(User.branch)).join(Role).filter(Role.name == 'admin').all()
+        else:
+            admin_users = [user]
+        staff_ids = [staff.id for staff in admin_users]
+        
+        # Latest activity of every staff member in one query
+        latest = db.session.query(
+            ActivityLog.user_id, func.max(ActivityLog.created_at).label('created_at')
+        ).filter(ActivityLog.user_id.in_(staff_ids)).group_by(ActivityLog.user_id).subquery()
+        latest_activities = {
+            row.user_id: row for row in db.session.query(
+                ActivityLog.user_id, ActivityLog.created_at, ActivityLog.action
+            ).join(latest, and_(
+                ActivityLog.user_id == latest.c.user_id,
+                ActivityLog.created_at == latest.c.created_at
+            )).all()
+        }
+        last_seen = presence_service.last_seen(staff_ids)
         
         staff_statuses = []
         for staff in admin_users:
-            latest_activity = ActivityLog.query.filter_by(user_id=staff.id).order_by(
-                ActivityLog.created_at.desc()
-            ).first()
-            
-            is_online = is_user_online(staff.id)
+            latest_activity = latest_activities.get(staff.id)
+            seen = last_seen.get(staff.id)
+            moments = [moment for moment in (seen, latest_activity.created_at if latest_activity else None) if moment]
+            last_active = max(moments) if moments else None
             
             staff_statuses.append({
                 'userId': staff.id,
                 'name': f"{staff.first_name} {staff.last_name}",
-                'status': 'online' if is_online else 'offline',
-                'lastActive': latest_activity.created_at.isoformat() if latest_activity else None,
+                'status': 'online' if presence_service.is_online(seen) else 'offline',
+                'lastActive': last_active.isoformat() if last_active else None,
                 'lastAction': latest_activity.action if latest_activity else None,
                 'branch': staff.branch.name if staff.branch else 'Head Office'
             })
@@ -377,19 +395,45 @@ def get_staff_status():
         }), 500
 
 
-def is_user_online(user_id, timeout_minutes=15):
+@bp.route('/online-staff', methods=['GET'])
+@login_required
+def get_online_staff():
     try:
-        latest_activity = ActivityLog.query.filter_by(user_id=user_id).order_by(
-            ActivityLog.created_at.desc()
-        ).first()
+        user_id = session.get('user_id')
+        user = User.query.get(user_id)
+        if not user:
+            return jsonify({'status': 'error', 'message': 'User not found', 'staff': []}), 404
+        
+        # Admins may look at any branch (or all); everyone else sees their own
+        if user.role and user.role.name == 'admin':
+            branch_id = request.args.get('branchId', type=int)
+        elif user.branch_id is None:
+            return jsonify({'status': 'success', 'branchId': None, 'count': 0, 'staff': []})
+        else:
+            branch_id = user.branch_id
+        online = presence_service.online_users(branch_id)
         
-        if not latest_activity:
-            return False
+        staff = User.query.options(joinedload(User.role)).filter(User.id.in_(list(online))).all() if online else []
+        staff.sort(key=lambda member: online[member.id], reverse=True)
         
-        time_diff = datetime.utcnow() - latest_activity.created_at
-        return time_diff.total_seconds() < (timeout_minutes * 60)
-    except:
-        return False
+        return jsonify({
+            'status': 'success',
+            'branchId': branch_id,
+            'count': len(staff),
+            'staff': [{
+                'userId': member.id,
+                'name': f"{member.first_name} {member.last_name}",
+                'role': member.role.name if member.role else None,
+                'lastSeen': online[member.id].isoformat()
+            } for member in staff]
+        })
+    except Exception as e:
+        logger.error(f"Online staff error: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e),
+            'staff': []
+        }), 500
 
 
 def get_time_ago(dt):
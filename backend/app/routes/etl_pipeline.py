@@ -1,7 +1,7 @@
 """
 ETL Pipeline Routes - Data warehouse integration
 """
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify
 from app.services import etl_service
 import logging
 
@@ -16,11 +16,18 @@ def create_pipeline():
         target = data.get('target')
         schedule = data.get('schedule', 'daily')
         
-        if not all([name, source, target]):
+        if not all([name, source]):
             return jsonify({'error': 'Missing required fields'}), 400
         
-        etl_service.init_app(current_app)
-        result = etl_service.create_pipeline(name, source, target, schedule)
+        result = etl_service.create_pipeline(
+            name, source, target, schedule,
+            transformations=data.get('transformations'),
+            filters=data.get('filters'),
+            keys=data.get('keys')
+        )
+        
+        if 'error' in result:
+            return jsonify(result), 400
         
         return jsonify(result), 201
     except Exception as e:
@@ -38,8 +45,9 @@ def extract():
         if not source:
             return jsonify({'error': 'Missing source'}), 400
         
-        etl_service.init_app(current_app)
-        result = etl_service.extract_data(source, filters)
+        limit = min(int(data.get('limit', 100)), 1000)
+        
+        result = etl_service.extract_data(source, filters, limit=limit)
         
         return jsonify(result)
     except Exception as e:
@@ -54,7 +62,6 @@ def transform():
         source_data = data.get('data', [])
         transformations = data.get('transformations')
         
-        etl_service.init_app(current_app)
         result = etl_service.transform_data(source_data, transformations)
         
         return jsonify(result)
@@ -74,8 +81,7 @@ def load():
         if not all([pipeline_id, target_table]):
             return jsonify({'error': 'Missing required fields'}), 400
         
-        etl_service.init_app(current_app)
-        result = etl_service.load_to_warehouse(pipeline_id, records, target_table)
+        result = etl_service.load_to_warehouse(pipeline_id, records, target_table, keys=data.get('keys'))
         
         return jsonify(result)
     except Exception as e:
@@ -86,8 +92,11 @@ def load():
 @bp.route('/pipeline/<pipeline_id>/run', methods=['POST'])
 def run_pipeline(pipeline_id):
     try:
-        etl_service.init_app(current_app)
-        result = etl_service.run_pipeline(pipeline_id)
+        data = request.get_json(silent=True) or {}
+        result = etl_service.run_pipeline(pipeline_id, full_refresh=bool(data.get('full_refresh')))
+        
+        if result.get('status') == 'not_found':
+            return jsonify(result), 404
         
         return jsonify(result)
     except Exception as e:
@@ -98,7 +107,6 @@ def run_pipeline(pipeline_id):
 @bp.route('/pipeline/<pipeline_id>/status', methods=['GET'])
 def get_status(pipeline_id):
     try:
-        etl_service.init_app(current_app)
         result = etl_service.get_pipeline_status(pipeline_id)
         
         return jsonify(result)
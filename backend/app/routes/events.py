@@ -0,0 +1,32 @@
+from flask import Blueprint, Response, jsonify, request, session
+from app.models import User
+from app.utils.decorators import login_required, admin_required
+from app.services.push_gateway import push_gateway
+
+bp = Blueprint('events', __name__, url_prefix='/api/events')
+
+@bp.route('/stream', methods=['GET'])
+@login_required
+def stream():
+    """Server-Sent Events stream of the user's messages, notifications, loan and activity events"""
+    user_id = session.get('user_id')
+    if not user_id:
+        user_id = request.args.get('user_id', type=int)
+    user = User.query.get(user_id)
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+
+    # Plain values only: the stream outlives this request's database session
+    subscription = push_gateway.connect(user.id, role=user.role.name if user.role else None, branch_id=user.branch_id)
+    if not subscription:
+        return jsonify({'error': 'Push gateway at capacity'}), 503
+
+    return Response(push_gateway.stream(subscription), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@bp.route('/stats', methods=['GET'])
+@admin_required
+def stats():
+    return jsonify(push_gateway.stats())
@@ -1,10 +1,15 @@
 from flask import Blueprint, request, jsonify
-from app.models import User, Group, Member, Loan, Transaction, SavingsAccount, DrawdownAccount, LoanType, LoanProduct, LoanProductItem, Role, GroupVisit
+from app.models import User, Branch, Group, Member, Loan, Transaction, SavingsAccount, DrawdownAccount, LoanType, LoanProduct, LoanProductItem, Role, GroupVisit
 from app import db
 from decimal import Decimal
 import uuid
+from collections import defaultdict
 from datetime import datetime, timedelta
 from app.utils.decorators import login_required, role_required
+from app.services.ledger_service import ledger_service, InsufficientFundsError
+from app.services.loan_service import loan_service
+from app.services.summary_service import summary_service, ACTIVE_LOAN_STATUSES
+from app.services.reminder_scheduler import meeting_reminders
 from flask_bcrypt import Bcrypt
 from sqlalchemy import func
 
@@ -12,6 +17,10 @@ bcrypt = Bcrypt()
 
 bp = Blueprint('field_officer', __name__, url_prefix='/api/field-officer')
 
+# Loans and transactions shown alongside the member summary
+LOAN_HISTORY_WINDOW = 20
+TRANSACTION_WINDOW = 10
+
 @bp.route('/groups', methods=['GET', 'POST'])
 @login_required
 def get_officer_groups():
@@ -224,10 +233,14 @@ def get_group_members(group_id):
 @login_required
 def get_member_dashboard(member_id):
     from flask import session
+    from sqlalchemy import or_, select
+    from sqlalchemy.orm import joinedload
     user_id = session.get('user_id')
     user = User.query.get(user_id)
     
-    member = Member.query.get(member_id)
+    member = Member.query.options(
+        joinedload(Member.user), joinedload(Member.group), joinedload(Member.summary)
+    ).filter(Member.id == member_id).first()
     if not member:
         return jsonify({'error': 'Member not found'}), 404
     
@@ -249,102 +262,77 @@ def get_member_dashboard(member_id):
         'phone': member.user.phone
     }
     
-    # Include approved and disbursed loans in the dashboard summary (Active/Outstanding)
-    # Pending loans are shown in history but don't count towards outstanding until approved/disbursed
-    active_loans = Loan.query.filter(
-        Loan.member_id == member_id,
-        Loan.status.in_(['approved', 'disbursed', 'released'])
-    ).all()
+    # Totals, balances and limits come from the member summary read model,
+    # which the write path keeps current
+    summary = summary_service.get_member_summary(member)
     
-    # Get all loans for history (including pending)
-    all_loans = Loan.query.filter_by(member_id=member_id).all()
+    # Every approved/disbursed loan plus the most recent history, in one query
+    recent_loan_ids = select(Loan.id).where(Loan.member_id == member_id).order_by(
+        Loan.created_at.desc()
+    ).limit(LOAN_HISTORY_WINDOW)
+    loans = Loan.query.options(joinedload(Loan.loan_type)).filter(
+        Loan.member_id == member_id,
+        or_(Loan.status.in_(ACTIVE_LOAN_STATUSES), Loan.id.in_(recent_loan_ids))
+    ).order_by(Loan.created_at.desc()).all()
     
+    now = datetime.utcnow()
     loans_data = []
-    total_outstanding = Decimal('0')
-    
-    for loan in active_loans:
+    history_data = []
+    for loan in loans:
         loan_dict = loan.to_dict()
         # Ensure we only show daysUntilDue if due_date is actually set
         days_until_due = None
         if loan.due_date:
-            delta = (loan.due_date - datetime.utcnow())
+            delta = (loan.due_date - now)
             days_until_due = delta.days + (1 if delta.seconds > 0 else 0)
-        
         loan_dict['daysUntilDue'] = days_until_due
         
         # Determine status for display
         if loan.status == 'disbursed':
-            loan_dict['status'] = 'overdue' if days_until_due and days_until_due < 0 else 'active'
-        else:
-            loan_dict['status'] = loan.status
-        
-        loans_data.append(loan_dict)
-        total_outstanding += Decimal(loan.outstanding_balance)
-
-    # Prepare loan history (all loans)
-    history_data = []
-    for loan in all_loans:
-        h_dict = loan.to_dict()
+            loan_dict['status'] = 'overdue' if days_until_due is not None and days_until_due < 0 else 'active'
         
-        # Add days until due for history as well
-        h_days = None
-        if loan.due_date:
-            h_delta = (loan.due_date - datetime.utcnow())
-            h_days = h_delta.days + (1 if h_delta.seconds > 0 else 0)
-        h_dict['daysUntilDue'] = h_days
-        
-        if loan.status == 'disbursed':
-            h_dict['status'] = 'overdue' if h_days is not None and h_days < 0 else 'active'
-        history_data.append(h_dict)
-    
-    savings = member.savings_account
-    savings_balance = Decimal('0')
-    if savings:
-        savings_balance = savings.balance
-    
-    drawdown = member.drawdown_account
-    drawdown_balance = Decimal('0')
-    if drawdown:
-        drawdown_balance = drawdown.balance
-    
-    loans_history = Loan.query.filter_by(member_id=member_id).all()
-    total_borrowed = sum([Decimal(loan.principle_amount) for loan in loans_history])
-    
-    repayments = Transaction.query.filter_by(
-        member_id=member_id,
-        transaction_type='loan_repayment'
-    ).all()
-    total_repaid = sum([Decimal(t.amount) for t in repayments])
-    
-    # Calculate loan limit as 4 times savings balance
-    if member.status != 'active':
-        max_loan_limit = Decimal('0')
-    else:
-        max_loan_limit = savings_balance * Decimal('4')
-        # Apply maximum limit only if active
-        max_loan_limit = min(max_loan_limit, Decimal('50000'))  # Maximum 50000
-    
-    available_loan = max(Decimal('0'), max_loan_limit - total_outstanding)
+        # Pending loans are shown in history but don't count towards outstanding until approved/disbursed
+        if loan.status in ACTIVE_LOAN_STATUSES:
+            loans_data.append(loan_dict)
+        if len(history_data) < LOAN_HISTORY_WINDOW:
+            history_data.append(loan_dict)
     
     member_data['activeLoans'] = loans_data
     member_data['loanHistory'] = history_data
-    member_data['totalOutstanding'] = str(total_outstanding)
-    member_data['savingsBalance'] = str(savings_balance)
-    member_data['drawdownBalance'] = str(drawdown_balance)
-    member_data['maxLoanLimit'] = str(max_loan_limit)
-    member_data['availableLoan'] = str(available_loan)
-    member_data['totalBorrowed'] = str(total_borrowed)
-    member_data['totalRepaid'] = str(total_repaid)
-    member_data['repaymentRate'] = round((float(total_repaid) / float(total_borrowed) * 100), 2) if total_borrowed > 0 else 0
+    member_data['loanCount'] = summary.loan_count
+    member_data['totalOutstanding'] = str(summary.total_outstanding)
+    member_data['savingsBalance'] = str(summary.savings_balance)
+    member_data['drawdownBalance'] = str(summary.drawdown_balance)
+    member_data['maxLoanLimit'] = str(summary.max_loan_limit)
+    member_data['availableLoan'] = str(summary.available_loan)
+    member_data['totalBorrowed'] = str(summary.total_borrowed)
+    member_data['totalRepaid'] = str(summary.total_repaid)
+    member_data['repaymentRate'] = float(summary.repayment_rate)
     
     recent_transactions = Transaction.query.filter_by(member_id=member_id).order_by(
         Transaction.created_at.desc()
-    ).limit(10).all()
+    ).limit(TRANSACTION_WINDOW).all()
     
     member_data['recentTransactions'] = [t.to_dict() for t in recent_transactions]
     
     return jsonify(member_data)
 
+@bp.route('/summaries/rebuild', methods=['POST'])
+@login_required
+def rebuild_member_summaries():
+    """Recompute every member summary and group stats row from a full scan (after a backfill or data fix)"""
+    from flask import session
+    user = User.query.get(session.get('user_id'))
+    if not user or user.role.name != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    try:
+        counts = summary_service.rebuild()
+        return jsonify({'message': 'Member summaries and group stats rebuilt', **counts})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
 @bp.route('/members/<int:member_id>/apply-loan', methods=['POST'])
 @login_required
 def apply_loan_for_member(member_id):
@@ -443,18 +431,20 @@ def apply_loan_for_member(member_id):
     db.session.add(loan)
     db.session.flush()
     
-    # Add items if any
+    # Deduct stock with one conditional UPDATE, then add the items
+    quantities = defaultdict(int)
+    for item_info in loan_items:
+        quantities[item_info['product'].id] += int(item_info['quantity'])
+    try:
+        loan_service.decrement_stock(quantities)
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    
     for item_info in loan_items:
         product = item_info['product']
         quantity = item_info['quantity']
         
-        # Deduct stock
-        if product.stock_quantity < quantity:
-            db.session.rollback()
-            return jsonify({'error': f'Insufficient stock for {product.name}'}), 400
-            
-        product.stock_quantity -= quantity
-        
         product_item = LoanProductItem(
             loan_id=loan.id,
             product_id=product.id,
@@ -527,51 +517,42 @@ def transfer_funds(member_id):
     if amount_decimal <= 0:
         return jsonify({'error': 'Amount must be greater than 0'}), 400
     
-    from_account = None
-    to_account = None
-    
-    if from_account_type == 'savings':
-        from_account = member.savings_account
-    elif from_account_type == 'drawdown':
-        from_account = member.drawdown_account
-    else:
+    if from_account_type not in ('savings', 'drawdown'):
         return jsonify({'error': 'Invalid from account type'}), 400
     
-    if to_account_type == 'savings':
-        to_account = member.savings_account
-    elif to_account_type == 'drawdown':
-        to_account = member.drawdown_account
-    else:
+    if to_account_type not in ('savings', 'drawdown'):
         return jsonify({'error': 'Invalid to account type'}), 400
     
-    if not from_account or not to_account:
-        return jsonify({'error': 'Account not found'}), 404
+    if from_account_type == to_account_type:
+        return jsonify({'error': 'Source and destination accounts must be different'}), 400
     
-    if from_account.balance < amount_decimal:
-        return jsonify({'error': 'Insufficient balance'}), 400
-    
-    from_account.balance -= amount_decimal
-    to_account.balance += amount_decimal
+    accounts = ledger_service.lock_accounts(
+        [(from_account_type, member_id), (to_account_type, member_id)], create_missing=False
+    )
+    if len(accounts) < len({from_account_type, to_account_type}):
+        return jsonify({'error': 'Account not found'}), 404
     
     transaction_id = f"TXN-{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6].upper()}"
+    transfer = {
+        'member_id': member_id,
+        'transaction_type': 'transfer',
+        'amount': amount_decimal,
+        'reference': reference or f"Transfer from {from_account_type} to {to_account_type}",
+        'processed_by': user_id,
+        'confirmed_by': user_id
+    }
     
-    transaction = Transaction(
-        transaction_id=transaction_id,
-        member_id=member_id,
-        account_type=from_account_type,
-        transaction_type='transfer',
-        amount=amount_decimal,
-        balance_before=from_account.balance + amount_decimal,
-        balance_after=from_account.balance,
-        reference=reference or f"Transfer from {from_account_type} to {to_account_type}",
-        processed_by=user_id,
-        status='confirmed',
-        confirmed_by=user_id,
-        confirmed_at=datetime.utcnow()
-    )
+    try:
+        ledger_service.post_entries([
+            {**transfer, 'transaction_id': transaction_id, 'account_type': from_account_type, 'direction': 'debit'},
+            {**transfer, 'account_type': to_account_type, 'direction': 'credit'}
+        ])
+        db.session.commit()
+    except InsufficientFundsError:
+        db.session.rollback()
+        return jsonify({'error': 'Insufficient balance'}), 400
     
-    db.session.add(transaction)
-    db.session.commit()
+    transaction = Transaction.query.filter_by(transaction_id=transaction_id).first()
     
     return jsonify({
         'message': 'Transfer completed successfully',
@@ -592,45 +573,46 @@ def get_group_stats(group_id):
     if user.role.name != 'admin' and group.loan_officer_id != user_id:
         return jsonify({'error': 'Unauthorized'}), 403
     
-    members = Member.query.filter_by(group_id=group_id).all()
-    
-    total_members = len(members)
-    active_members = len([m for m in members if m.status == 'active'])
-    
-    total_savings = sum(member.savings_account.balance for member in members 
-                       if member.savings_account)
+    # Rolled up by the write path; see summary_service
+    stats = summary_service.get_group_stats([group_id])[group_id]
     
-    loans = Loan.query.join(Member).filter(
-        Member.group_id == group_id
-    ).all()
+    return jsonify(stats.to_dict())
+
+@bp.route('/branches/<int:branch_id>/group-stats', methods=['GET'])
+@login_required
+def get_branch_group_stats(branch_id):
+    """Stats for every group in a branch (only the officer's own groups for loan officers)"""
+    from flask import session
+    user_id = session.get('user_id')
+    user = User.query.get(user_id)
     
-    total_loans_disbursed = sum([float(loan.principle_amount) for loan in loans if loan.status in ['disbursed', 'released', 'completed']])
-    total_loans_outstanding = sum([float(loan.outstanding_balance) for loan in loans if loan.status == 'disbursed'])
+    if not Branch.query.get(branch_id):
+        return jsonify({'error': 'Branch not found'}), 404
     
-    repayments = Transaction.query.join(Member).filter(
-        Member.group_id == group_id,
-        Transaction.transaction_type == 'loan_repayment'
-    ).all()
-    
-    total_repaid = sum([float(t.amount) for t in repayments])
+    query = Group.query.filter_by(branch_id=branch_id)
+    if user.role.name == 'admin':
+        pass
+    elif user.role.name == 'branch_manager' and user.branch_id == branch_id:
+        pass
+    else:
+        query = query.filter_by(loan_officer_id=user_id)
     
-    active_loans = [l for l in loans if l.status == 'disbursed']
-    repayment_rate = 0
-    if active_loans:
-        total_due = sum([float(loan.total_amount) for loan in active_loans])
-        repayment_rate = (total_repaid / total_due * 100) if total_due > 0 else 0
+    group_ids = [group_id for group_id, in query.with_entities(Group.id).order_by(Group.name)]
+    stats = summary_service.get_group_stats(group_ids)
+    groups = [stats[group_id].to_dict() for group_id in group_ids if group_id in stats]
     
     return jsonify({
-        'groupId': group_id,
-        'groupName': group.name,
-        'totalMembers': total_members,
-        'activeMembers': active_members,
-        'totalSavings': str(total_savings),
-        'totalLoansDisbursed': str(Decimal(str(total_loans_disbursed))),
-        'totalLoansOutstanding': str(Decimal(str(total_loans_outstanding))),
-        'totalRepaid': str(Decimal(str(total_repaid))),
-        'repaymentRate': round(repayment_rate, 2),
-        'totalLoans': len(active_loans)
+        'branchId': branch_id,
+        'groups': groups,
+        'totals': {
+            'totalMembers': sum(group['totalMembers'] for group in groups),
+            'activeMembers': sum(group['activeMembers'] for group in groups),
+            'totalSavings': str(sum((stats[group_id].total_savings for group_id in stats), Decimal('0'))),
+            'totalLoansDisbursed': str(sum((stats[group_id].total_loans_disbursed for group_id in stats), Decimal('0'))),
+            'totalLoansOutstanding': str(sum((stats[group_id].total_loans_outstanding for group_id in stats), Decimal('0'))),
+            'totalRepaid': str(sum((stats[group_id].total_repaid for group_id in stats), Decimal('0'))),
+            'totalLoans': sum(group['totalLoans'] for group in groups)
+        }
     })
 
 @bp.route('/members', methods=['POST'])
@@ -779,6 +761,7 @@ def manage_group_visits(group_id):
         
         db.session.add(visit)
         db.session.commit()
+        meeting_reminders.schedule_visits([visit])
         
         return jsonify(visit.to_dict()), 201
     
@@ -795,43 +778,14 @@ def manage_group_visits(group_id):
 @bp.route('/reminders', methods=['GET'])
 @login_required
 def check_meeting_reminders():
+    """The officer's upcoming visits and when their reminders go out.
+    
+    Reminders are sent by the scheduler (reminders.* Celery tasks), not by this endpoint.
+    """
     from flask import session
     user_id = session.get('user_id')
-    from datetime import datetime, timedelta
-    from app.models import GroupVisit, Group
-    from app.services.notification_service import notification_service, NotificationChannel
-    
-    # Check for meetings in the next 2 hours
-    now = datetime.utcnow()
-    two_hours_later = now + timedelta(hours=2)
-    
-    # GroupVisit.visit_date is a Date object, so we check today's visits
-    today = now.date()
-    visits = GroupVisit.query.filter_by(
-        field_officer_id=user_id,
-        visit_date=today
-    ).all()
     
-    reminders_sent = 0
-    for visit in visits:
-        # Check if we already sent a reminder for this visit today in Redis to avoid duplicates
-        reminder_key = f"reminder_sent:{user_id}:{visit.id}:{today.isoformat()}"
-        if not notification_service.redis_client.get(reminder_key):
-            notification_service.send_notification(
-                recipient_id=user_id,
-                template_id="meeting_reminder",
-                variables={
-                    "group_name": visit.group.name if visit.group else "Your Group",
-                    "time": "Today",
-                    "location": visit.group.location if visit.group else "Scheduled Location"
-                },
-                channel=NotificationChannel.IN_APP
-            )
-            # Mark as sent for today (expire in 24 hours)
-            notification_service.redis_client.setex(reminder_key, 86400, "1")
-            reminders_sent += 1
-            
-    return jsonify({'reminders_sent': reminders_sent})
+    return jsonify({'reminders': meeting_reminders.upcoming_for(user_id)})
 
 @bp.route('/members/pending-approval', methods=['GET'])
 @login_required
@@ -1025,34 +979,26 @@ def process_first_deposit():
         account_type='savings'
     ).count()
     
+    deposit = {
+        'transaction_id': f"TXN-{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6].upper()}",
+        'member_id': member_id,
+        'account_type': 'savings',
+        'transaction_type': 'deposit',
+        'amount': deposit_amount_decimal,
+        'processed_by': user_id,
+        'confirmed_by': user_id
+    }
+    
     if existing_deposits > 0:
         # Regular deposit, no special handling needed
         if not member.savings_account:
             return jsonify({'error': 'Savings account not found'}), 404
         
-        balance_before = member.savings_account.balance
-        member.savings_account.balance += deposit_amount_decimal
-        
-        transaction_id = f"TXN-{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6].upper()}"
-        
-        transaction = Transaction(
-            transaction_id=transaction_id,
-            member_id=member_id,
-            account_type='savings',
-            transaction_type='deposit',
-            amount=deposit_amount_decimal,
-            balance_before=balance_before,
-            balance_after=member.savings_account.balance,
-            reference=transaction_reference or 'Regular deposit',
-            processed_by=user_id,
-            status='confirmed',
-            confirmed_by=user_id,
-            confirmed_at=datetime.utcnow()
-        )
-        
-        db.session.add(transaction)
+        deposit['reference'] = transaction_reference or 'Regular deposit'
+        ledger_service.post_entries([deposit])
         db.session.commit()
         
+        transaction = Transaction.query.filter_by(transaction_id=deposit['transaction_id']).first()
         return jsonify({
             'message': 'Deposit processed successfully',
             'transaction': transaction.to_dict()
@@ -1066,60 +1012,35 @@ def process_first_deposit():
         # Change status to active upon first deposit
         member.status = 'active'
     
-    # Process the deposit
-    balance_before = member.savings_account.balance
-    member.savings_account.balance += deposit_amount_decimal
-    
     # Check if we can deduct the registration fee from drawdown
     registration_fee = Decimal('800')
     
-    if member.drawdown_account.balance < 0:
-        # Deduct registration fee from the deposit
-        drawdown_balance_before = member.drawdown_account.balance
-        member.drawdown_account.balance += registration_fee  # Moving towards 0
+    accounts = ledger_service.lock_accounts([('drawdown', member.id), ('savings', member.id)])
+    entries = []
+    
+    if accounts[('drawdown', member.id)].balance < 0:
+        # Deduct registration fee from the deposit, moving the drawdown debt towards 0
         member.registration_fee_paid = True
-        
-        # Create transaction for registration fee deduction
-        transaction_id = f"TXN-{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6].upper()}"
-        
-        transaction = Transaction(
-            transaction_id=transaction_id,
-            member_id=member_id,
-            account_type='drawdown',
-            transaction_type='registration_fee',
-            amount=registration_fee,
-            balance_before=drawdown_balance_before,
-            balance_after=member.drawdown_account.balance,
-            reference='Registration fee deducted from first deposit',
-            processed_by=user_id,
-            status='confirmed',
-            confirmed_by=user_id,
-            confirmed_at=datetime.utcnow()
-        )
-        
-        db.session.add(transaction)
+        entries.append({
+            'transaction_id': f"TXN-{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6].upper()}",
+            'member_id': member_id,
+            'account_type': 'drawdown',
+            'transaction_type': 'registration_fee',
+            'direction': 'credit',
+            'amount': registration_fee,
+            'reference': 'Registration fee deducted from first deposit',
+            'processed_by': user_id,
+            'confirmed_by': user_id
+        })
     
     # Create deposit transaction
-    transaction_id = f"TXN-{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6].upper()}"
-    
-    transaction = Transaction(
-        transaction_id=transaction_id,
-        member_id=member_id,
-        account_type='savings',
-        transaction_type='deposit',
-        amount=deposit_amount_decimal,
-        balance_before=balance_before,
-        balance_after=member.savings_account.balance,
-        reference=transaction_reference or 'First deposit',
-        processed_by=user_id,
-        status='confirmed',
-        confirmed_by=user_id,
-        confirmed_at=datetime.utcnow()
-    )
-    
-    db.session.add(transaction)
+    deposit['reference'] = transaction_reference or 'First deposit'
+    entries.append(deposit)
+    ledger_service.post_entries(entries)
     db.session.commit()
     
+    transaction = Transaction.query.filter_by(transaction_id=deposit['transaction_id']).first()
+    
     return jsonify({
         'message': 'First deposit processed successfully with registration fee deduction',
         'memberStatus': member.status,
@@ -22,10 +22,42 @@ def get_forecast(product_id):
         return jsonify({'error': str(e)}), 500
 
 
+@bp.route('/forecast/run', methods=['POST'])
+def run_batch_forecast():
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        demand_forecasting.init_app(current_app)
+        result = demand_forecasting.run_batch_forecast(
+            history_days=data.get('historyDays'),
+            horizon_days=data.get('horizonDays')
+        )
+        
+        return jsonify(result)
+    except Exception as e:
+        logging.error(f"Batch forecast error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/forecasts', methods=['GET'])
+def get_forecasts():
+    try:
+        result = demand_forecasting.get_forecasts(
+            branch_id=request.args.get('branch_id', type=int),
+            product_id=request.args.get('product_id', type=int)
+        )
+        
+        return jsonify(result)
+    except Exception as e:
+        logging.error(f"Forecast listing error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
 @bp.route('/reorder-point/<int:product_id>', methods=['GET'])
 def get_reorder_point(product_id):
     try:
-        lead_time = request.args.get('lead_time', 7, type=int)
+        # Defaults to the fastest active supplier's delivery days
+        lead_time = request.args.get('lead_time', type=int)
         
         inventory_optimization.init_app(current_app)
         result = inventory_optimization.calculate_reorder_point(product_id, lead_time)
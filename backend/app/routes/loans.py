@@ -1,8 +1,9 @@
 from flask import Blueprint, request, jsonify
-from app.models import Loan, LoanType, Member, LoanProduct, LoanProductItem, SavingsAccount
+from app.models import Loan, LoanType, Member, LoanProductItem, SavingsAccount
 from app import db
 from decimal import Decimal
 import uuid
+from collections import defaultdict
 from datetime import datetime
 from app.utils.decorators import login_required, role_required
 from app.services.loan_service import loan_service
@@ -51,32 +52,28 @@ def create_loan():
     loan_type = LoanType.query.get(loan_type_id)
     if not loan_type:
         return jsonify({'error': 'Loan type not found'}), 404
+    
+    # Check risk score (recently computed score, not a full recalculation)
+    from app.services.risk_service import risk_service
+    risk_data = risk_service.get_cached_risk_score(member)
+    if risk_data['category'] == 'Critical Risk':
+        return jsonify({'error': 'Loan application rejected due to critical risk status'}), 400
         
     principle_amount = Decimal(0)
     loan_items = []
     
     if items:
-        for item in items:
-            product_id = item.get('productId')
-            quantity = item.get('quantity', 1)
-            
-            product = LoanProduct.query.get(product_id)
-            if not product:
-                return jsonify({'error': f'Product {product_id} not found'}), 404
-                
-            if product.stock_quantity < quantity:
-                return jsonify({'error': f'Insufficient stock for {product.name}'}), 400
-                
-            unit_price = product.selling_price
-            total_price = unit_price * quantity
-            principle_amount += total_price
-            
-            loan_items.append({
-                'product': product,
-                'quantity': quantity,
-                'unit_price': unit_price,
-                'total_price': total_price
-            })
+        # All cart products in one SELECT ... FOR UPDATE; held until commit/rollback
+        try:
+            loan_items = loan_service.lock_cart_products(items)
+        except LookupError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 404
+        except (TypeError, ValueError) as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 400
+        
+        principle_amount = sum((item['total_price'] for item in loan_items), Decimal(0))
     elif amount:
         try:
             principle_amount = Decimal(str(amount))
@@ -86,6 +83,7 @@ def create_loan():
         return jsonify({'error': 'Either amount or items must be provided'}), 400
         
     if principle_amount < loan_type.min_amount or principle_amount > loan_type.max_amount:
+        db.session.rollback()
         return jsonify({'error': f'Amount must be between {loan_type.min_amount} and {loan_type.max_amount}'}), 400
 
     # Check 4x savings rule
@@ -94,19 +92,12 @@ def create_loan():
     max_loan_limit = savings_balance * 4
     
     if principle_amount > max_loan_limit:
+        db.session.rollback()
         return jsonify({
             'error': f'Loan amount exceeds limit. Max limit is {max_loan_limit} (4x Savings: {savings_balance})'
         }), 400
         
-    # Check risk score
-    from app.services.risk_service import risk_service
-    risk_data = risk_service.calculate_risk_score(member_id)
-    if risk_data['category'] == 'Critical Risk':
-        return jsonify({'error': 'Loan application rejected due to critical risk status'}), 400
-        
     # Calculate interest and fees
-    from app.services.loan_service import loan_service
-    
     calculation = loan_service.calculate_total_amount(principle_amount, loan_type)
     interest_amount = calculation['interest']
     charge_fee = calculation['charge_fee']
@@ -130,27 +121,24 @@ def create_loan():
     db.session.add(loan)
     db.session.flush() # Get ID
     
-    # Add items if any
-    for item in loan_items:
-        product = item['product']
-        quantity = item['quantity']
-        
-        # Double check stock one last time before committing
-        if product.stock_quantity < quantity:
+    if loan_items:
+        # Deduct stock immediately on application with one conditional UPDATE
+        try:
+            loan_service.decrement_stock({item['product'].id: item['quantity'] for item in loan_items})
+        except ValueError as e:
             db.session.rollback()
-            return jsonify({'error': f'Insufficient stock for {product.name}'}), 400
-            
-        # Deduct stock immediately on application
-        product.stock_quantity -= quantity
+            return jsonify({'error': str(e)}), 400
         
-        loan_item = LoanProductItem(
-            loan_id=loan.id,
-            product_id=product.id,
-            quantity=quantity,
-            unit_price=item['unit_price'],
-            total_price=item['total_price']
-        )
-        db.session.add(loan_item)
+        db.session.add_all([
+            LoanProductItem(
+                loan_id=loan.id,
+                product_id=item['product'].id,
+                quantity=item['quantity'],
+                unit_price=item['unit_price'],
+                total_price=item['total_price']
+            )
+            for item in loan_items
+        ])
         
     db.session.commit()
     
@@ -178,8 +166,10 @@ def cancel_loan(id):
         return jsonify({'error': 'Only pending loans can be cancelled'}), 400
         
     # Restore stock
+    restored = defaultdict(int)
     for item in loan.items:
-        item.product.stock_quantity += item.quantity
+        restored[item.product_id] += item.quantity
+    loan_service.restore_stock(restored)
         
     loan.status = 'cancelled'
     db.session.commit()
@@ -255,8 +245,10 @@ def reject_loan(id):
         return jsonify({'error': 'Loan is not in a rejectable state'}), 400
         
     # Restore stock if items exist
+    restored = defaultdict(int)
     for item in loan.items:
-        item.product.stock_quantity += item.quantity
+        restored[item.product_id] += item.quantity
+    loan_service.restore_stock(restored)
         
     loan.status = 'rejected'
     loan.rejected_date = datetime.utcnow()
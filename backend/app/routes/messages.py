@@ -1,9 +1,9 @@
 from flask import Blueprint, request, jsonify, session
-from app.models import User, Message, Role
+from app.models import User, Role
 from app import db
 from app.utils.decorators import login_required
 from app.services.notification_service import notification_service, NotificationChannel
-from datetime import datetime
+from app.services.messaging_service import messaging_service
 from sqlalchemy import or_, and_
 
 bp = Blueprint('messages', __name__, url_prefix='/api/messages')
@@ -74,14 +74,10 @@ def send_message():
     recipient = User.query.get(recipient_id)
     if not recipient:
         return jsonify({'error': 'Recipient not found'}), 404
-        
-    message = Message(
-        sender_id=sender_id,
-        recipient_id=recipient_id,
-        content=content
-    )
-    
-    db.session.add(message)
+    if recipient.id == sender_id:
+        return jsonify({'error': 'Cannot send a message to yourself'}), 400
+
+    message = messaging_service.send(sender_id, recipient.id, content)
     db.session.commit()
     
     # Notify recipient
@@ -103,26 +99,94 @@ def send_message():
 @bp.route('/conversation/<int:contact_id>', methods=['GET'])
 @login_required
 def get_conversation(contact_id):
+    """
+    Thread with a contact, oldest first. The whole history unless ?limit= or
+    ?before= is given; then one page, with older pages via ?before=<X-Next-Cursor>
+    """
     user_id = session.get('user_id')
     if not user_id:
         user_id = request.args.get('user_id', type=int)
-    
-    messages = Message.query.filter(
-        or_(
-            and_(Message.sender_id == user_id, Message.recipient_id == contact_id),
-            and_(Message.sender_id == contact_id, Message.recipient_id == user_id)
-        )
-    ).order_by(Message.created_at.asc()).all()
-    
-    # Mark received messages as read
-    unread_received = [m for m in messages if m.recipient_id == user_id and not m.is_read]
-    if unread_received:
-        for m in unread_received:
-            m.is_read = True
-            m.read_at = datetime.utcnow()
+
+    conversation = messaging_service.find(user_id, contact_id)
+    if not conversation:
+        return jsonify([])
+
+    if conversation.unread_for(user_id):
+        messaging_service.mark_read(conversation, user_id)
         db.session.commit()
-        
-    return jsonify([m.to_dict() for m in messages])
+    if 'before' not in request.args and 'limit' not in request.args:
+        # Clients written before paging expect the full thread
+        return jsonify([m.to_dict() for m in messaging_service.history(conversation)])
+
+    try:
+        messages, next_cursor = messaging_service.thread(
+            conversation, before=request.args.get('before'), limit=request.args.get('limit', type=int)
+        )
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+
+    response = jsonify([m.to_dict() for m in messages])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+@bp.route('/conversations', methods=['GET'])
+@login_required
+def get_conversations():
+    """Inbox: one row per conversation with a preview of its last message and the unread count"""
+    user_id = session.get('user_id')
+    if not user_id:
+        user_id = request.args.get('user_id', type=int)
+
+    try:
+        conversations, next_cursor = messaging_service.conversations_for(
+            user_id, limit=request.args.get('limit', type=int), before=request.args.get('before')
+        )
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+
+    return jsonify({
+        'conversations': conversations,
+        'nextCursor': next_cursor
+    })
+
+@bp.route('/conversations/<int:conversation_id>/messages', methods=['GET'])
+@login_required
+def get_conversation_messages(conversation_id):
+    user_id = session.get('user_id')
+    if not user_id:
+        user_id = request.args.get('user_id', type=int)
+
+    conversation = messaging_service.get_for_user(conversation_id, user_id)
+    if not conversation:
+        return jsonify({'error': 'Conversation not found'}), 404
+
+    try:
+        messages, next_cursor = messaging_service.thread(
+            conversation, before=request.args.get('before'), limit=request.args.get('limit', type=int)
+        )
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+
+    return jsonify({
+        'messages': [m.to_dict() for m in messages],
+        'nextCursor': next_cursor
+    })
+
+@bp.route('/conversations/<int:conversation_id>/read', methods=['POST'])
+@login_required
+def mark_conversation_read(conversation_id):
+    user_id = session.get('user_id')
+    if not user_id:
+        user_id = request.args.get('user_id', type=int)
+
+    conversation = messaging_service.get_for_user(conversation_id, user_id)
+    if not conversation:
+        return jsonify({'error': 'Conversation not found'}), 404
+
+    read = messaging_service.mark_read(conversation, user_id)
+    db.session.commit()
+    return jsonify({'conversationId': conversation.id, 'markedRead': read})
 
 @bp.route('/unread-count', methods=['GET'])
 @login_required
@@ -130,5 +194,4 @@ def get_unread_message_count():
     user_id = session.get('user_id')
     if not user_id:
         user_id = request.args.get('user_id', type=int)
-    count = Message.query.filter_by(recipient_id=user_id, is_read=False).count()
-    return jsonify({'count': count})
+    return jsonify({'count': messaging_service.unread_count(user_id)})
@@ -1,6 +1,8 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, send_file
 from app.services.payment_service import payment_service
+from app.services.reconciliation_service import statement_reconciliation_service
 from app.services import audit_service, AuditEventType, RiskLevel
+from app.utils.decorators import admin_required
 
 bp = Blueprint('payments', __name__, url_prefix='/api/payments')
 
@@ -44,8 +46,44 @@ def stk_push():
 def callback():
     data = request.get_json()
     try:
-        payment_service.handle_callback(data)
-        return jsonify({'result': 'success'})
+        # Only persists the payload; posting happens in the callback worker
+        result = payment_service.handle_callback(data)
+        return jsonify({
+            'ResultCode': 0,
+            'ResultDesc': 'Accepted',
+            'result': 'success',
+            'duplicate': result['duplicate']
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/callbacks/replay', methods=['POST'])
+@admin_required
+def replay_callbacks():
+    data = request.get_json() or {}
+    
+    try:
+        from datetime import datetime
+        since = datetime.fromisoformat(data['since']) if data.get('since') else None
+        until = datetime.fromisoformat(data['until']) if data.get('until') else None
+        requeued = payment_service.replay_callbacks(
+            statuses=data.get('statuses', ['unmatched', 'failed']),
+            since=since,
+            until=until,
+            receipts=data.get('receipts')
+        )
+        
+        audit_service.log_event(
+            event_type=AuditEventType.PAYMENT_PROCESSED,
+            resource="payment",
+            action="callbacks_replayed",
+            details={'requeued': requeued},
+            risk_level=RiskLevel.MEDIUM
+        )
+        
+        return jsonify({'requeued': requeued})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -101,6 +139,43 @@ def reconcile():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@bp.route('/reconcile-statement', methods=['POST'])
+def reconcile_statement():
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({'error': 'Statement file is required'}), 400
+
+    try:
+        window_minutes = request.form.get('windowMinutes', type=int)
+        job_id = statement_reconciliation_service.start_job(upload, window_minutes=window_minutes)
+
+        audit_service.log_event(
+            event_type=AuditEventType.PAYMENT_PROCESSED,
+            resource="payment",
+            action="statement_reconciliation_started",
+            details={'job_id': job_id, 'filename': upload.filename},
+            risk_level=RiskLevel.MEDIUM
+        )
+
+        return jsonify({'jobId': job_id, 'status': 'queued'}), 202
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/reconcile-statement/<job_id>', methods=['GET'])
+def reconcile_statement_status(job_id):
+    job = statement_reconciliation_service.get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Reconciliation job not found'}), 404
+    return jsonify(job)
+
+@bp.route('/reconcile-statement/<job_id>/<outcome>', methods=['GET'])
+def reconcile_statement_report(job_id, outcome):
+    path = statement_reconciliation_service.job_report_path(job_id, outcome)
+    if not path:
+        return jsonify({'error': 'Report not found'}), 404
+    return send_file(path, mimetype='text/csv', as_attachment=True,
+                     download_name=f"reconciliation-{job_id}-{outcome}.csv")
+
 @bp.route('/retry/<transaction_id>', methods=['POST'])
 def retry_payment(transaction_id):
     try:
@@ -122,9 +197,13 @@ def retry_payment(transaction_id):
 @bp.route('/analytics', methods=['GET'])
 def analytics():
     days = request.args.get('days', 30, type=int)
+    branch_id = request.args.get('branchId', type=int)
+    granularity = request.args.get('granularity', 'day')
     
     try:
-        analytics_data = payment_service.get_payment_analytics(days)
+        analytics_data = payment_service.get_payment_analytics(days, branch_id=branch_id, granularity=granularity)
         return jsonify(analytics_data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
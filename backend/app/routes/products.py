@@ -2,6 +2,7 @@ from flask import Blueprint, request, jsonify
 from app.models import LoanProduct, LoanType, ProductCategory
 from app import db
 from app.services.inventory_service import InventoryService
+from app.services.stock_service import stock_service
 
 bp = Blueprint('products', __name__, url_prefix='/api')
 
@@ -58,6 +59,10 @@ def create_loan_product():
     
     try:
         db.session.add(product)
+        db.session.flush()
+        # A product created at or under its thresholds alerts straight away
+        stock_service.record_levels([(product.id, None, product.stock_quantity, 0,
+                                      product.low_stock_threshold, product.critical_stock_threshold)])
         db.session.commit()
         return jsonify(product.to_dict()), 201
     except Exception as e:
@@ -67,7 +72,8 @@ def create_loan_product():
 @bp.route('/loan-products/<int:id>', methods=['PATCH'])
 @role_required(['admin', 'procurement_officer'])
 def update_loan_product(id):
-    product = LoanProduct.query.get(id)
+    # Locked so a stock edit cannot race a concurrent movement
+    product = LoanProduct.query.filter_by(id=id).with_for_update().populate_existing().first()
     if not product:
         return jsonify({'error': 'Product not found'}), 404
         
@@ -77,12 +83,23 @@ def update_loan_product(id):
     if 'categoryId' in data: product.category_id = data['categoryId']
     if 'buyingPrice' in data: product.buying_price = data['buyingPrice']
     if 'sellingPrice' in data: product.selling_price = data['sellingPrice']
-    if 'stockQuantity' in data: product.stock_quantity = data['stockQuantity']
-    if 'lowStockThreshold' in data: product.low_stock_threshold = data['lowStockThreshold']
-    if 'criticalStockThreshold' in data: product.critical_stock_threshold = data['criticalStockThreshold']
     if 'isActive' in data: product.is_active = data['isActive']
     
     try:
+        # Stock and thresholds go through the stock service so stock_alerts stays in step:
+        # thresholds first at the old stock, then the stock change against the new thresholds
+        previous = (product.low_stock_threshold, product.critical_stock_threshold)
+        if 'lowStockThreshold' in data: product.low_stock_threshold = int(data['lowStockThreshold'])
+        if 'criticalStockThreshold' in data: product.critical_stock_threshold = int(data['criticalStockThreshold'])
+        current = (product.low_stock_threshold, product.critical_stock_threshold)
+        if current != previous:
+            stock_service.record_thresholds(product.id, None, product.stock_quantity, previous, current)
+        if 'stockQuantity' in data:
+            delta = int(data['stockQuantity']) - product.stock_quantity
+            product.stock_quantity = int(data['stockQuantity'])
+            if delta:
+                stock_service.record_levels([(product.id, None, product.stock_quantity, delta, *current)])
+        
         db.session.commit()
         return jsonify(product.to_dict())
     except Exception as e:
@@ -1,7 +1,7 @@
 from flask import Blueprint, request, jsonify
 from app.services.risk_service import risk_service
-from app.models import Member
-from app import db
+from app.models import Member, Group, Branch
+from datetime import datetime
 
 bp = Blueprint('risk', __name__, url_prefix='/api/risk')
 
@@ -19,7 +19,7 @@ def get_risk_score(member_id):
             'score': score_data['score'],
             'category': score_data['category'],
             'factors': score_data['factors'],
-            'timestamp': db.func.now()
+            'timestamp': datetime.utcnow().isoformat()
         })
         
     except Exception as e:
@@ -102,42 +102,57 @@ def get_interest_rate_recommendation(member_id):
 
 @bp.route('/comprehensive/<int:member_id>', methods=['GET'])
 def get_comprehensive_risk_report(member_id):
-    member = Member.query.get(member_id)
-    if not member:
-        return jsonify({'error': 'Member not found'}), 404
+    base_rate = request.args.get('baseRate', 15.0, type=float)
     
     try:
-        # Gather all risk information
-        risk_score_data = risk_service.calculate_risk_score(member_id)
-        fraud_data = risk_service.detect_fraud(member_id)
-        default_probability_data = risk_service.predict_default_probability(member_id)
-        warnings_data = risk_service.check_early_warnings(member_id)
+        # All four assessments share one load of the member's loans, accounts and transactions
+        report = risk_service.comprehensive_report(member_id, base_rate=base_rate)
+        if not report:
+            return jsonify({'error': 'Member not found'}), 404
         
-        base_rate = 15.0
-        recommended_rate = risk_service.get_interest_rate_recommendation(
-            risk_score_data['score'],
-            base_rate
-        )
+        return jsonify(report)
         
-        return jsonify({
-            'member_id': member_id,
-            'risk_assessment': {
-                'score': risk_score_data['score'],
-                'category': risk_score_data['category'],
-                'factors': risk_score_data['factors']
-            },
-            'fraud_check': fraud_data,
-            'default_probability': default_probability_data,
-            'early_warnings': {
-                'warnings': warnings_data['warnings'],
-                'recommended_actions': warnings_data['recommended_actions']
-            },
-            'interest_rate': {
-                'recommended_rate': recommended_rate,
-                'rate_adjustment': recommended_rate - base_rate
-            },
-            'timestamp': db.func.now()
-        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def _batch_reports(query):
+    """Comprehensive reports for one page of the members matched by `query`"""
+    page = request.args.get('page', 1, type=int)
+    per_page = min(request.args.get('per_page', 100, type=int), 500)
+    base_rate = request.args.get('baseRate', 15.0, type=float)
+    
+    members = query.order_by(Member.id).with_entities(Member.id).paginate(page=page, per_page=per_page, error_out=False)
+    reports = risk_service.comprehensive_reports([member_id for member_id, in members.items], base_rate=base_rate)
+    
+    return jsonify({
+        'reports': reports,
+        'pagination': {
+            'page': page,
+            'per_page': per_page,
+            'total': members.total,
+            'pages': members.pages
+        },
+        'timestamp': datetime.utcnow().isoformat()
+    })
+
+@bp.route('/comprehensive/group/<int:group_id>', methods=['GET'])
+def get_group_risk_reports(group_id):
+    if not Group.query.get(group_id):
+        return jsonify({'error': 'Group not found'}), 404
+    
+    try:
+        return _batch_reports(Member.query.filter_by(group_id=group_id))
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/comprehensive/branch/<int:branch_id>', methods=['GET'])
+def get_branch_risk_reports(branch_id):
+    if not Branch.query.get(branch_id):
+        return jsonify({'error': 'Branch not found'}), 404
+    
+    try:
+        return _batch_reports(Member.query.filter_by(branch_id=branch_id))
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -3,6 +3,7 @@ from app.utils.decorators import login_required
 from app.models import StockMovement, LoanProduct, BranchProduct, Supplier, User, Branch
 from app import db
 from app.services import audit_service, AuditEventType, RiskLevel
+from app.services.stock_service import stock_service, InsufficientStockError
 from datetime import datetime
 
 bp = Blueprint('stock', __name__, url_prefix='/api/stock')
@@ -65,6 +66,14 @@ def get_stock_movement(id):
     
     return jsonify(movement.to_dict())
 
+def stock_error_response(e):
+    """Map stock engine errors to responses; the caller has already rolled back"""
+    if isinstance(e, InsufficientStockError):
+        return jsonify({'error': str(e), 'shortages': e.shortages}), 400
+    if isinstance(e, LookupError):
+        return jsonify({'error': str(e)}), 404
+    return jsonify({'error': str(e)}), 400
+
 @bp.route('/movements', methods=['POST'])
 @login_required
 def create_stock_movement():
@@ -78,98 +87,104 @@ def create_stock_movement():
     if not all(field in data for field in required_fields):
         return jsonify({'error': f'Missing required fields: {", ".join(required_fields)}'}), 400
     
-    # Validate movement type
-    valid_types = ['in', 'out', 'transfer', 'adjustment']
-    if data['movementType'] not in valid_types:
-        return jsonify({'error': f'Invalid movement type. Must be one of: {", ".join(valid_types)}'}), 400
+    try:
+        current_user_id = session.get('user_id')
+        movement = stock_service.apply_movements([stock_service.normalize(data)], processed_by=current_user_id)[0]
+        db.session.commit()
+    except (LookupError, ValueError) as e:
+        db.session.rollback()
+        return stock_error_response(e)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
     
-    # Check product exists
-    product = LoanProduct.query.get(data['productId'])
-    if not product:
-        return jsonify({'error': 'Product not found'}), 404
+    audit_service.log_event(
+        event_type=AuditEventType.INVENTORY_UPDATED,
+        user_id=current_user_id,
+        resource="stock_movement",
+        action=movement.movement_type,
+        entity_id=movement.id,
+        details={
+            'productId': movement.product_id,
+            'quantity': movement.quantity,
+            'movementType': movement.movement_type,
+            'branchId': movement.branch_id,
+            'supplierId': movement.supplier_id
+        },
+        risk_level=RiskLevel.MEDIUM
+    )
     
-    # Check branch if provided
-    branch_id = data.get('branchId')
-    if branch_id:
-        branch = Branch.query.get(branch_id)
-        if not branch:
-            return jsonify({'error': 'Branch not found'}), 404
+    return jsonify({
+        'message': 'Stock movement recorded successfully',
+        'movement': movement.to_dict()
+    }), 201
+
+@bp.route('/movements/batch', methods=['POST'])
+@login_required
+def create_stock_movements_batch():
+    """Apply a batch of movements (e.g. a delivery note) in one transaction"""
+    if not check_permission():
+        return jsonify({'error': 'Unauthorized - Admin/Procurement Officer/Branch Manager access required'}), 403
     
-    # Check supplier if provided
-    supplier_id = data.get('supplierId')
-    if supplier_id:
-        supplier = Supplier.query.get(supplier_id)
-        if not supplier:
-            return jsonify({'error': 'Supplier not found'}), 404
+    data = request.get_json() or {}
+    items = data.get('movements')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'movements must be a non-empty list'}), 400
     
+    # Header fields apply to every line that does not set its own
+    defaults = {key: data.get(key) for key in ('movementType', 'branchId', 'supplierId', 'referenceNumber', 'notes')}
     try:
-        current_user_id = session.get('user_id')
-        quantity = int(data['quantity'])
+        normalized = []
+        for index, item in enumerate(items):
+            try:
+                normalized.append(stock_service.normalize(item, defaults))
+            except ValueError as e:
+                raise ValueError(f"Movement {index}: {str(e)}")
         
-        # Create stock movement
-        movement = StockMovement(
-            product_id=data['productId'],
-            branch_id=branch_id,
-            supplier_id=supplier_id,
-            movement_type=data['movementType'],
-            quantity=quantity,
-            reference_number=data.get('referenceNumber'),
-            processed_by=current_user_id,
-            notes=data.get('notes')
-        )
-        
-        # Update product stock
-        if data['movementType'] in ['in', 'adjustment']:
-            product.stock_quantity += quantity
-        elif data['movementType'] in ['out', 'transfer']:
-            if product.stock_quantity < quantity:
-                return jsonify({'error': 'Insufficient stock'}), 400
-            product.stock_quantity -= quantity
-        
-        # Update branch stock if applicable
-        if branch_id and data['movementType'] in ['in', 'out']:
-            branch_product = BranchProduct.query.filter_by(
-                branch_id=branch_id,
-                product_id=data['productId']
-            ).first()
-            
-            if branch_product:
-                if data['movementType'] == 'in':
-                    branch_product.stock_quantity += quantity
-                else:
-                    if branch_product.stock_quantity < quantity:
-                        return jsonify({'error': 'Insufficient stock in branch'}), 400
-                    branch_product.stock_quantity -= quantity
-        
-        db.session.add(movement)
+        current_user_id = session.get('user_id')
+        movements = stock_service.apply_movements(normalized, processed_by=current_user_id)
         db.session.commit()
-        
-        audit_service.log_event(
-            event_type=AuditEventType.INVENTORY_UPDATED,
-            user_id=current_user_id,
-            resource="stock_movement",
-            action=data['movementType'],
-            entity_id=movement.id,
-            details={
-                'productId': data['productId'],
-                'quantity': quantity,
-                'movementType': data['movementType'],
-                'branchId': branch_id,
-                'supplierId': supplier_id
-            },
-            risk_level=RiskLevel.MEDIUM
-        )
-        
-        return jsonify({
-            'message': 'Stock movement recorded successfully',
-            'movement': movement.to_dict()
-        }), 201
-        
-    except ValueError as e:
-        return jsonify({'error': f'Invalid quantity: {str(e)}'}), 400
+    except (LookupError, ValueError) as e:
+        db.session.rollback()
+        return stock_error_response(e)
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
+    
+    audit_service.log_event(
+        event_type=AuditEventType.INVENTORY_UPDATED,
+        user_id=current_user_id,
+        resource="stock_movement",
+        action="batch",
+        details={
+            'count': len(movements),
+            'referenceNumber': data.get('referenceNumber'),
+            'movementIds': [movement.id for movement in movements]
+        },
+        risk_level=RiskLevel.MEDIUM
+    )
+    
+    return jsonify({
+        'message': f'{len(movements)} stock movements recorded successfully',
+        'movements': [movement.to_dict() for movement in movements]
+    }), 201
+
+@bp.route('/ledger/replay', methods=['GET'])
+@login_required
+def replay_stock_ledger():
+    """Rebuild branch stock from the movement ledger and report drift against stored stock"""
+    if not check_permission():
+        return jsonify({'error': 'Unauthorized - Admin/Procurement Officer/Branch Manager access required'}), 403
+    
+    rows = stock_service.replay(
+        branch_id=request.args.get('branch_id', None, type=int),
+        product_id=request.args.get('product_id', None, type=int),
+        drift_only=request.args.get('drift_only', 'false').lower() == 'true'
+    )
+    return jsonify({
+        'rows': rows,
+        'drifted': sum(1 for row in rows if row['drift'])
+    })
 
 @bp.route('/restock', methods=['POST'])
 @login_required
@@ -184,10 +199,6 @@ def create_restock_request():
     if not all(field in data for field in required_fields):
         return jsonify({'error': f'Missing required fields: {", ".join(required_fields)}'}), 400
     
-    product = LoanProduct.query.get(data['productId'])
-    if not product:
-        return jsonify({'error': 'Product not found'}), 404
-    
     supplier = Supplier.query.get(data['supplierId'])
     if not supplier:
         return jsonify({'error': 'Supplier not found'}), 404
@@ -203,46 +214,41 @@ def create_restock_request():
     
     try:
         current_user_id = session.get('user_id')
-        # Create restock movement
-        movement = StockMovement(
-            product_id=data['productId'],
-            supplier_id=data['supplierId'],
-            branch_id=data.get('branchId'),
-            movement_type='in',
-            quantity=int(data['quantity']),
-            reference_number=f"RESTOCK-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}",
-            processed_by=current_user_id,
-            notes=f"Restock from {supplier.name}" + (f" - {data.get('notes')}" if data.get('notes') else "")
-        )
-        
-        # Update stock
-        product.stock_quantity += int(data['quantity'])
-        
-        db.session.add(movement)
+        movement = stock_service.apply_movements([stock_service.normalize({
+            'productId': data['productId'],
+            'supplierId': data['supplierId'],
+            'branchId': data.get('branchId'),
+            'movementType': 'in',
+            'quantity': data['quantity'],
+            'referenceNumber': f"RESTOCK-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}",
+            'notes': f"Restock from {supplier.name}" + (f" - {data.get('notes')}" if data.get('notes') else "")
+        })], processed_by=current_user_id)[0]
         db.session.commit()
-        
-        audit_service.log_event(
-            event_type=AuditEventType.INVENTORY_UPDATED,
-            user_id=current_user_id,
-            resource="restock_request",
-            action="create",
-            entity_id=movement.id,
-            details={
-                'productId': data['productId'],
-                'supplierId': data['supplierId'],
-                'quantity': data['quantity']
-            },
-            risk_level=RiskLevel.MEDIUM
-        )
-        
-        return jsonify({
-            'message': 'Restock request created successfully',
-            'movement': movement.to_dict()
-        }), 201
-        
+    except (LookupError, ValueError) as e:
+        db.session.rollback()
+        return stock_error_response(e)
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
+    
+    audit_service.log_event(
+        event_type=AuditEventType.INVENTORY_UPDATED,
+        user_id=current_user_id,
+        resource="restock_request",
+        action="create",
+        entity_id=movement.id,
+        details={
+            'productId': data['productId'],
+            'supplierId': data['supplierId'],
+            'quantity': data['quantity']
+        },
+        risk_level=RiskLevel.MEDIUM
+    )
+    
+    return jsonify({
+        'message': 'Restock request created successfully',
+        'movement': movement.to_dict()
+    }), 201
 
 @bp.route('/low-stock', methods=['GET'])
 @login_required
@@ -257,22 +263,14 @@ def get_low_stock_products():
         if user and user.role.name != 'admin' and user.branch_id:
             branch_id = user.branch_id
     
-    query = LoanProduct.query.filter(
-        LoanProduct.stock_quantity <= LoanProduct.low_stock_threshold
-    )
-    
-    if branch_id:
-        query = query.join(BranchProduct).filter(
-            BranchProduct.branch_id == branch_id,
-            BranchProduct.stock_quantity <= BranchProduct.low_stock_threshold
-        )
-    
-    products = query.all()
+    # Reads only the items currently below a threshold, kept up to date as stock moves
+    alerts = stock_service.get_alerts(branch_id=branch_id)
     
     return jsonify([{
-        'product': product.to_dict(),
-        'status': 'critical' if product.stock_quantity <= product.critical_stock_threshold else 'low'
-    } for product in products])
+        'product': alert.product.to_dict(),
+        'status': alert.level,
+        'alert': alert.to_dict()
+    } for alert in alerts])
 
 @bp.route('/critical-stock', methods=['GET'])
 @login_required
@@ -287,22 +285,27 @@ def get_critical_stock_products():
         if user and user.role.name != 'admin' and user.branch_id:
             branch_id = user.branch_id
 
-    query = LoanProduct.query.filter(
-        LoanProduct.stock_quantity <= LoanProduct.critical_stock_threshold
-    )
-    
-    if branch_id:
-        query = query.join(BranchProduct).filter(
-            BranchProduct.branch_id == branch_id,
-            BranchProduct.stock_quantity <= BranchProduct.low_stock_threshold # Should probably be critical threshold but let's stick to pattern
-        )
-        
-    products = query.all()
+    alerts = stock_service.get_alerts(branch_id=branch_id, level='critical')
     
     return jsonify([{
-        'product': product.to_dict(),
-        'status': 'critical'
-    } for product in products])
+        'product': alert.product.to_dict(),
+        'status': 'critical',
+        'alert': alert.to_dict()
+    } for alert in alerts])
+
+@bp.route('/alerts/rebuild', methods=['POST'])
+@login_required
+def rebuild_stock_alerts():
+    """Recompute the stock alert table from a full scan (after editing thresholds)"""
+    if not check_permission():
+        return jsonify({'error': 'Unauthorized - Admin/Procurement Officer/Branch Manager access required'}), 403
+    
+    try:
+        count = stock_service.rebuild_alerts()
+        return jsonify({'message': 'Stock alerts rebuilt', 'alerts': count})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
 
 @bp.route('/branch/<int:branch_id>/inventory', methods=['GET'])
 @login_required
@@ -338,23 +341,45 @@ def update_branch_inventory(branch_id):
         return jsonify({'error': 'Product not found'}), 404
     
     try:
+        target = int(data['stockQuantity'])
         branch_product = BranchProduct.query.filter_by(
             branch_id=branch_id,
-            product_id=data['productId']
-        ).first()
+            product_id=product.id
+        ).with_for_update().first()
         
+        # Thresholds are written and their alerts re-levelled before any stock
+        # moves, so the count's crossing is judged against the new threshold
+        critical = product.critical_stock_threshold
         if not branch_product:
             branch_product = BranchProduct(
                 branch_id=branch_id,
-                product_id=data['productId'],
-                stock_quantity=int(data['stockQuantity']),
-                low_stock_threshold=data.get('lowStockThreshold', 10)
+                product_id=product.id,
+                stock_quantity=0,
+                low_stock_threshold=int(data.get('lowStockThreshold', 10))
             )
             db.session.add(branch_product)
-        else:
-            branch_product.stock_quantity = int(data['stockQuantity'])
-            if 'lowStockThreshold' in data:
-                branch_product.low_stock_threshold = data['lowStockThreshold']
+            db.session.flush()
+            stock_service.record_levels([(product.id, branch_id, 0, 0, branch_product.low_stock_threshold, critical)])
+        elif 'lowStockThreshold' in data:
+            previous = branch_product.low_stock_threshold
+            branch_product.low_stock_threshold = int(data['lowStockThreshold'])
+            db.session.flush()
+            stock_service.record_thresholds(product.id, branch_id, branch_product.stock_quantity,
+                                            (previous, critical), (branch_product.low_stock_threshold, critical))
+        
+        # Setting a count is recorded as a count movement by the difference so
+        # branch stock stays replayable from the movement ledger; it corrects
+        # this branch only and leaves the product's company-wide stock alone
+        delta = target - branch_product.stock_quantity
+        if delta:
+            stock_service.apply_movements([stock_service.normalize({
+                'productId': product.id,
+                'branchId': branch_id,
+                'movementType': 'count',
+                'quantity': delta,
+                'notes': data.get('notes') or 'Branch inventory count'
+            })], processed_by=session.get('user_id'))
+            db.session.refresh(branch_product)
         
         db.session.commit()
         
@@ -363,6 +388,9 @@ def update_branch_inventory(branch_id):
             'inventory': branch_product.to_dict()
         })
         
+    except (LookupError, ValueError) as e:
+        db.session.rollback()
+        return stock_error_response(e)
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
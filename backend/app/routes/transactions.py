@@ -1,7 +1,8 @@
 from flask import Blueprint, request, jsonify
-from app.models import Transaction, Member, SavingsAccount, DrawdownAccount, Loan
+from app.models import Transaction, Member, Loan
 from app import db
 from app.services.loan_service import loan_service
+from app.services.ledger_service import ledger_service, InsufficientFundsError
 import uuid
 from decimal import Decimal
 
@@ -64,65 +65,39 @@ def create_transaction():
     if not member:
         return jsonify({'error': 'Member not found'}), 404
         
-    account = None
-    balance_before = Decimal('0.00')
-    
-    if account_type == 'savings':
-        account = SavingsAccount.query.filter_by(member_id=member_id).first()
-        if not account:
-            account = SavingsAccount(member_id=member_id, account_number=f"SAV-{member.member_code}")
-            db.session.add(account)
-        balance_before = account.balance
-    elif account_type == 'drawdown':
-        account = DrawdownAccount.query.filter_by(member_id=member_id).first()
-        if not account:
-             account = DrawdownAccount(member_id=member_id, account_number=f"DRD-{member.member_code}")
-             db.session.add(account)
-        balance_before = account.balance
-    elif account_type == 'loan':
-        if transaction_type != 'loan_repayment':
-             return jsonify({'error': 'Loan account type only valid for loan_repayment'}), 400
-    else:
+    if account_type not in ('savings', 'drawdown', 'loan'):
         return jsonify({'error': 'Invalid account type'}), 400
-        
-    balance_after = Decimal('0.00')
+    if account_type == 'loan' and transaction_type != 'loan_repayment':
+        return jsonify({'error': 'Loan account type only valid for loan_repayment'}), 400
+    
+    transaction_status = 'pending' if transaction_type in ['deposit', 'withdrawal'] else 'confirmed'
+    entry = {
+        'transaction_id': str(uuid.uuid4()),
+        'member_id': member.id,
+        'account_type': account_type,
+        'transaction_type': transaction_type,
+        'amount': amount,
+        'reference': reference,
+        'mpesa_code': mpesa_code,
+        'status': transaction_status
+    }
+    entries = [entry]
     
     if transaction_type == 'deposit':
-        if account_type == 'loan':
-             return jsonify({'error': 'Cannot deposit to loan account directly'}), 400
-        balance_after = account.balance + amount
+        # Pending until approved: record projected balances, credit on approval
+        entry['apply'] = False
         
     elif transaction_type == 'withdrawal':
-        if account_type == 'loan':
-             return jsonify({'error': 'Cannot withdraw from loan account'}), 400
-        if account.balance < amount:
-            return jsonify({'error': 'Insufficient funds'}), 400
-        account.balance -= amount
-        balance_after = account.balance
+        # Funds are reserved now and refunded if the withdrawal is rejected
+        pass
         
     elif transaction_type == 'loan_repayment':
         if not loan_id:
             return jsonify({'error': 'Loan ID required for repayment'}), 400
-        loan = Loan.query.get(loan_id)
-        if not loan:
+        if not Loan.query.get(loan_id):
             return jsonify({'error': 'Loan not found'}), 404
-            
-        if account_type == 'savings':
-             if account.balance < amount:
-                 return jsonify({'error': 'Insufficient funds in savings'}), 400
-             account.balance -= amount
-             balance_after = account.balance
-        elif account_type == 'loan':
-             balance_before = loan.outstanding_balance
-             # balance_after calculated after loan update
-        
-        loan.outstanding_balance -= amount
-        if loan.outstanding_balance <= 0:
-            loan.outstanding_balance = Decimal('0.00')
-            loan.status = 'completed'
-            
-        if account_type == 'loan':
-            balance_after = loan.outstanding_balance
+        entry['loan_id'] = loan_id
+        entry['settle_loan'] = account_type != 'loan'
             
     elif transaction_type == 'transfer':
         to_account_type = data.get('toAccountType')
@@ -132,51 +107,33 @@ def create_transaction():
         if account_type == to_account_type:
              return jsonify({'error': 'Source and destination accounts must be different'}), 400
              
-        # Get dest account
-        dest_account = None
-        if to_account_type == 'savings':
-            dest_account = SavingsAccount.query.filter_by(member_id=member_id).first()
-            if not dest_account:
-                dest_account = SavingsAccount(member_id=member_id, account_number=f"SAV-{member.member_code}")
-                db.session.add(dest_account)
-        elif to_account_type == 'drawdown':
-            dest_account = DrawdownAccount.query.filter_by(member_id=member_id).first()
-            if not dest_account:
-                dest_account = DrawdownAccount(member_id=member_id, account_number=f"DRD-{member.member_code}")
-                db.session.add(dest_account)
-        else:
+        if to_account_type not in ('savings', 'drawdown') or account_type == 'loan':
              return jsonify({'error': 'Invalid destination account type'}), 400
-             
-        if account.balance < amount:
-             return jsonify({'error': 'Insufficient funds'}), 400
-             
-        account.balance -= amount
-        dest_account.balance += amount
         
-        balance_after = account.balance
+        entries.append({
+            'member_id': member.id,
+            'account_type': to_account_type,
+            'transaction_type': 'transfer',
+            'direction': 'credit',
+            'amount': amount,
+            'reference': reference or f"Transfer from {account_type}",
+            'status': transaction_status
+        })
             
     else:
         return jsonify({'error': 'Invalid transaction type'}), 400
     
-    transaction_status = 'pending' if transaction_type in ['deposit', 'withdrawal'] else 'confirmed'
-    
-    transaction = Transaction(
-        transaction_id=str(uuid.uuid4()),
-        member_id=member_id,
-        account_type=account_type,
-        transaction_type=transaction_type,
-        amount=amount,
-        balance_before=balance_before,
-        balance_after=balance_after,
-        reference=reference,
-        mpesa_code=mpesa_code,
-        loan_id=loan_id,
-        status=transaction_status
-    )
-    
-    db.session.add(transaction)
-    db.session.commit()
-    
+    try:
+        ledger_service.post_entries(entries)
+        db.session.commit()
+    except InsufficientFundsError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except LookupError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 404
+    
+    transaction = Transaction.query.filter_by(transaction_id=entry['transaction_id']).first()
     return jsonify(transaction.to_dict()), 201
 
 @bp.route('/<int:transaction_id>/approve', methods=['POST'])
@@ -185,7 +142,8 @@ def approve_transaction(transaction_id):
     from app.models import User
     from datetime import datetime
     
-    transaction = Transaction.query.get(transaction_id)
+    # Row lock so two approvers cannot settle the same transaction twice
+    transaction = Transaction.query.filter_by(id=transaction_id).with_for_update().first()
     if not transaction:
         return jsonify({'error': 'Transaction not found'}), 404
     
@@ -203,19 +161,14 @@ def approve_transaction(transaction_id):
     if user.role.name not in ['procurement_officer', 'branch_manager', 'admin']:
         return jsonify({'error': 'Only procurement officers can approve transactions'}), 403
     
-    account = None
-    if transaction.account_type == 'savings':
-        account = SavingsAccount.query.filter_by(member_id=transaction.member_id).first()
-    elif transaction.account_type == 'drawdown':
-        account = DrawdownAccount.query.filter_by(member_id=transaction.member_id).first()
-    
-    if not account:
-        return jsonify({'error': f'{transaction.account_type} account not found'}), 404
-    
     # If deposit, add funds. If withdrawal, funds already deducted in create_transaction, so just confirm.
+    try:
+        ledger_service.settle_pending(transaction, 'confirmed', confirmed_by=user_id)
+    except LookupError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 404
+    
     if transaction.transaction_type == 'deposit':
-        account.balance += transaction.amount
-        
         # Check if member needs activation and registration fee deduction
         member = Member.query.get(transaction.member_id)
         if member and not member.registration_fee_paid:
@@ -252,10 +205,6 @@ def approve_transaction(transaction_id):
             db.session.flush() # Ensure balance is updated
             loan_service.auto_repay_from_drawdown(transaction.member_id)
     
-    transaction.status = 'confirmed'
-    transaction.confirmed_by = user_id
-    transaction.confirmed_at = datetime.utcnow()
-    
     db.session.commit()
     
     return jsonify({
@@ -267,12 +216,11 @@ def approve_transaction(transaction_id):
 def reject_transaction(transaction_id):
     from flask import session
     from app.models import User
-    from datetime import datetime
     
     data = request.get_json() or {}
     reason = data.get('reason', 'No reason provided')
     
-    transaction = Transaction.query.get(transaction_id)
+    transaction = Transaction.query.filter_by(id=transaction_id).with_for_update().first()
     if not transaction:
         return jsonify({'error': 'Transaction not found'}), 404
     
@@ -291,19 +239,12 @@ def reject_transaction(transaction_id):
         return jsonify({'error': 'Only procurement officers can reject transactions'}), 403
     
     # Handle Refund for withdrawal
-    if transaction.transaction_type == 'withdrawal':
-        account = None
-        if transaction.account_type == 'savings':
-            account = SavingsAccount.query.filter_by(member_id=transaction.member_id).first()
-        elif transaction.account_type == 'drawdown':
-            account = DrawdownAccount.query.filter_by(member_id=transaction.member_id).first()
-            
-        if account:
-            account.balance += transaction.amount
+    try:
+        ledger_service.settle_pending(transaction, 'failed', confirmed_by=user_id)
+    except LookupError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 404
     
-    transaction.status = 'failed'
-    transaction.confirmed_by = user_id
-    transaction.confirmed_at = datetime.utcnow()
     transaction.reference = f"{transaction.reference or ''} [REJECTED: {reason}]".strip()
     
     db.session.commit()
@@ -2,6 +2,7 @@ from flask import Blueprint, jsonify, request
 from app.models import User, Role
 from app import db, bcrypt
 from app.utils.decorators import admin_required
+from app.services.presence_service import presence_service
 
 bp = Blueprint('users', __name__, url_prefix='/api/users')
 
@@ -111,6 +112,7 @@ def update_user(user_id):
         if existing and existing.id != user_id:
             return jsonify({'message': 'Phone number already exists'}), 400
         user.phone = data['phone']
+    old_branch_id = user.branch_id
     if 'branchId' in data:
         user.branch_id = data['branchId']
     if 'isActive' in data:
@@ -121,6 +123,9 @@ def update_user(user_id):
             user.role_id = role.id
             
     db.session.commit()
+    if user.branch_id != old_branch_id:
+        # Only once the move is committed
+        presence_service.moved_branch(user.id, old_branch_id, user.branch_id)
     return jsonify(user.to_dict())
 
 @bp.route('/<int:user_id>', methods=['DELETE'])
@@ -7,6 +7,14 @@ from .mfa_service import mfa_service
 from .audit_service import audit_service, AuditEventType, RiskLevel
 from .notification_service import notification_service, NotificationChannel, NotificationPriority
 from .payment_service import payment_service
+from .ledger_service import ledger_service
+from .summary_service import summary_service
+from .reminder_scheduler import meeting_reminders
+from .messaging_service import messaging_service
+from .event_bus import event_bus
+from .push_gateway import push_gateway
+from .presence_service import presence_service
+from .stock_service import stock_service
 from .loan_service import loan_service
 from .risk_service import risk_service
 from .dashboard_service import dashboard_service
@@ -16,9 +24,11 @@ from .currency_service import currency_service
 from .ussd_service import ussd_service
 from .bi_integration_service import bi_service
 from .compliance_service import kyc_service, aml_service, gdpr_service
+from .transaction_monitor import transaction_monitor
 from .voice_assistant_service import voice_assistant, voice_analytics
 from .inventory_intelligence_service import demand_forecasting, inventory_optimization
 from .etl_service import etl_service
+from .reconciliation_service import statement_reconciliation_service
 
 __all__ = [
     'jwt_service',
@@ -30,6 +40,14 @@ __all__ = [
     'NotificationChannel',
     'NotificationPriority',
     'payment_service',
+    'ledger_service',
+    'summary_service',
+    'meeting_reminders',
+    'messaging_service',
+    'event_bus',
+    'push_gateway',
+    'presence_service',
+    'stock_service',
     'loan_service',
     'risk_service',
     'dashboard_service',
@@ -41,10 +59,12 @@ __all__ = [
     'kyc_service',
     'aml_service',
     'gdpr_service',
+    'transaction_monitor',
     'voice_assistant',
     'voice_analytics',
     'demand_forecasting',
     'inventory_optimization',
-    'etl_service'
+    'etl_service',
+    'statement_reconciliation_service'
 ]
 
@@ -1,11 +1,16 @@
 
+from flask import current_app
 from app import db, cache
 from app.models import (
-    Member, Loan, Transaction, User, Branch, Group, LoanProductItem
+    Member, Loan, Transaction, User, Branch, Group, LoanProductItem, ForecastResult, SavingsAccount
 )
 from datetime import datetime, timedelta
-from sqlalchemy import func, and_, or_, case
+from sqlalchemy import func, and_, or_, case, cast, select, true, Float
+from sqlalchemy.dialects.postgresql import insert
 import logging
+import time
+import uuid
+import redis
 try:
     import pandas as pd
     import numpy as np
@@ -23,6 +28,28 @@ from decimal import Decimal
 logger = logging.getLogger(__name__)
 CACHE_TIMEOUT = 300
 
+# Months predicted by scheduled forecast jobs; shorter requests are sliced from them
+FORECAST_HORIZON_MONTHS = 12
+# Fit results that must not replace a stored forecast
+FORECAST_FAILED_STATUSES = ('error', 'unavailable')
+
+# Members returned by identify_at_risk_members, highest score first
+AT_RISK_LIMIT = 50
+
+# Redis key marking a queued forecast job per scope, and how long the marker lives
+FORECAST_JOB_KEY = 'forecast_job'
+FORECAST_JOB_TTL = 900
+
+
+_redis_client = None
+
+
+def _redis():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(current_app.config['REDIS_URL'], decode_responses=True)
+    return _redis_client
+
 
 class AIAnalyticsService:
     
@@ -38,16 +65,19 @@ class AIAnalyticsService:
 
     @staticmethod
     def forecast_arrears_rate(months_ahead=12, branch_id=None):
+        """
+        Serve the precomputed arrears rate forecast for a branch (or all branches).
+        Models are fitted by the forecast workers; see compute_forecast.
+        """
+        return AIAnalyticsService.get_forecast('arrears_rate', months_ahead, branch_id=branch_id)
+    
+    @staticmethod
+    def _fit_arrears_rate(months_ahead=12, branch_id=None, product_id=None):
         """
         Forecast arrears rate using Prophet time series forecasting.
         Returns prediction with confidence intervals.
         """
         try:
-            cache_key = f"forecast_arrears:{branch_id}:{months_ahead}"
-            cached = cache.get(cache_key)
-            if cached:
-                return json.loads(cached)
-            
             if not ML_AVAILABLE:
                 return {
                     'status': 'unavailable',
@@ -137,7 +167,6 @@ class AIAnalyticsService:
                 'confidence_level': 95
             }
             
-            cache.set(cache_key, json.dumps(result, default=str))
             return result
             
         except Exception as e:
@@ -152,6 +181,158 @@ class AIAnalyticsService:
             }
     
 
+    @staticmethod
+    def forecast_scope(branch_id=None, product_id=None):
+        return f"branch:{branch_id or 'all'}:product:{product_id or 'all'}"
+    
+    @staticmethod
+    def get_forecast(forecast_type, months_ahead=12, branch_id=None, product_id=None):
+        """
+        Return the stored forecast for a scope, trimmed to months_ahead, with
+        its computed_at stamp. When nothing covering the horizon is stored yet
+        a refresh job is queued and a pending result carrying its job_id is
+        returned instead of fitting inside the request.
+        """
+        scope_key = AIAnalyticsService.forecast_scope(branch_id, product_id)
+        stored = ForecastResult.query.filter_by(forecast_type=forecast_type, scope_key=scope_key).first()
+        
+        if stored and stored.horizon_months >= months_ahead:
+            result = dict(stored.result)
+            result['predictions'] = result.get('predictions', [])[:months_ahead]
+            result['computed_at'] = stored.computed_at.isoformat()
+            result['horizon_months'] = stored.horizon_months
+            return result
+        
+        try:
+            job_id = AIAnalyticsService.request_forecast_refresh(
+                forecast_type, months_ahead, branch_id=branch_id, product_id=product_id
+            )
+        except Exception as e:
+            logger.error(f"Could not queue {forecast_type} forecast: {str(e)}")
+            job_id = None
+        
+        return {
+            'status': 'pending',
+            'message': 'Forecast is being computed' if job_id else 'Forecast workers unavailable',
+            'forecast_type': forecast_type,
+            'job_id': job_id,
+            'predictions': [],
+            'computed_at': stored.computed_at.isoformat() if stored else None,
+            'confidence_level': 0
+        }
+    
+    @staticmethod
+    def compute_forecast(forecast_type, months_ahead=None, branch_id=None, product_id=None, job_id=None):
+        """
+        Fit one forecast model and upsert its predictions into forecast_results.
+        A failed or unavailable fit only records the attempt, so the last good
+        result stays in place. Runs in the forecast workers; returns the
+        stored row's metadata.
+        """
+        fitters = {
+            'arrears_rate': AIAnalyticsService._fit_arrears_rate,
+            'seasonal_demand': AIAnalyticsService._fit_seasonal_demand
+        }
+        if forecast_type not in fitters:
+            raise ValueError(f"Unknown forecast type: {forecast_type}")
+        months_ahead = max(months_ahead or 0, current_app.config.get('FORECAST_HORIZON_MONTHS', FORECAST_HORIZON_MONTHS))
+        
+        started = time.perf_counter()
+        result = fitters[forecast_type](months_ahead=months_ahead, branch_id=branch_id, product_id=product_id)
+        duration_ms = int((time.perf_counter() - started) * 1000)
+        result = json.loads(json.dumps(result, default=str))
+        
+        scope_key = AIAnalyticsService.forecast_scope(branch_id, product_id)
+        status = result.get('status', 'success')
+        now = datetime.utcnow()
+        values = {
+            'forecast_type': forecast_type,
+            'scope_key': scope_key,
+            'branch_id': branch_id,
+            'product_id': product_id,
+            'horizon_months': months_ahead,
+            'status': status,
+            'result': result,
+            'job_id': job_id,
+            'duration_ms': duration_ms,
+            'computed_at': now,
+            'last_status': status,
+            'last_error': result.get('message') if status in FORECAST_FAILED_STATUSES else None,
+            'last_attempt_at': now
+        }
+        if status in FORECAST_FAILED_STATUSES:
+            # Keep the previous result; only the attempt is recorded over it
+            updated = ('job_id', 'last_status', 'last_error', 'last_attempt_at')
+            logger.warning(f"Forecast {forecast_type} {scope_key} failed: {values['last_error']}")
+        else:
+            updated = [key for key in values if key not in ('forecast_type', 'scope_key')]
+        statement = insert(ForecastResult).values(**values)
+        statement = statement.on_conflict_do_update(
+            constraint='uq_forecast_results_type_scope',
+            set_={key: statement.excluded[key] for key in updated}
+        )
+        db.session.execute(statement)
+        db.session.commit()
+        
+        try:
+            _redis().delete(f"{FORECAST_JOB_KEY}:{forecast_type}:{scope_key}")
+        except Exception as e:
+            logger.warning(f"Could not clear forecast job marker: {str(e)}")
+        
+        logger.info(f"Forecast {forecast_type} {scope_key} computed in {duration_ms}ms")
+        return ForecastResult.query.filter_by(forecast_type=forecast_type, scope_key=scope_key).first().to_dict()
+    
+    @staticmethod
+    def request_forecast_refresh(forecast_type, months_ahead=None, branch_id=None, product_id=None):
+        """
+        Queue a forecast job for one scope and return its job id. A job
+        already queued for the same scope is reused rather than duplicated.
+        """
+        from app.tasks import compute_forecast_task
+        
+        scope_key = AIAnalyticsService.forecast_scope(branch_id, product_id)
+        marker = f"{FORECAST_JOB_KEY}:{forecast_type}:{scope_key}"
+        client = _redis()
+        job_id = client.get(marker)
+        if job_id:
+            return job_id
+        
+        job_id = str(uuid.uuid4())
+        # Claim the marker before queueing so concurrent requests share one job
+        if not client.set(marker, job_id, nx=True, ex=FORECAST_JOB_TTL):
+            return client.get(marker)
+        try:
+            compute_forecast_task.apply_async(
+                args=[forecast_type, months_ahead, branch_id, product_id], task_id=job_id
+            )
+        except Exception:
+            client.delete(marker)
+            raise
+        return job_id
+    
+    @staticmethod
+    def forecast_scopes():
+        """
+        Scopes refreshed on schedule: every forecast type overall and per
+        active branch, plus any product scope that has been requested before.
+        Each entry is (forecast_type, months_ahead, branch_id, product_id).
+        """
+        default_horizon = current_app.config.get('FORECAST_HORIZON_MONTHS', FORECAST_HORIZON_MONTHS)
+        branch_ids = [row.id for row in db.session.query(Branch.id).filter(Branch.is_active.is_(True))]
+        
+        scopes = {}
+        for forecast_type in ('arrears_rate', 'seasonal_demand'):
+            for branch_id in [None] + branch_ids:
+                scopes[(forecast_type, branch_id, None)] = default_horizon
+        for stored in ForecastResult.query.all():
+            key = (stored.forecast_type, stored.branch_id, stored.product_id)
+            scopes[key] = max(scopes.get(key, 0), stored.horizon_months)
+        
+        return [
+            (forecast_type, horizon, branch_id, product_id)
+            for (forecast_type, branch_id, product_id), horizon in scopes.items()
+        ]
+    
     @staticmethod
     def analyze_member_behavior(branch_id=None):
         """
@@ -360,15 +541,20 @@ class AIAnalyticsService:
 
     @staticmethod
     def forecast_seasonal_demand(product_id=None, months_ahead=12, branch_id=None):
+        """
+        Serve the precomputed seasonal demand forecast for a product/branch scope.
+        Models are fitted by the forecast workers; see compute_forecast.
+        """
+        return AIAnalyticsService.get_forecast(
+            'seasonal_demand', months_ahead, branch_id=branch_id, product_id=product_id
+        )
+    
+    @staticmethod
+    def _fit_seasonal_demand(months_ahead=12, branch_id=None, product_id=None):
         """
         Forecast seasonal demand patterns for products using Prophet.
         """
         try:
-            cache_key = f"seasonal_demand:{product_id}:{branch_id}:{months_ahead}"
-            cached = cache.get(cache_key)
-            if cached:
-                return json.loads(cached)
-            
             if not ML_AVAILABLE:
                 return {
                     'status': 'unavailable',
@@ -476,7 +662,6 @@ class AIAnalyticsService:
                 'confidence_level': 90
             }
             
-            cache.set(cache_key, json.dumps(result, default=str))
             return result
             
         except Exception as e:
@@ -559,6 +744,95 @@ class AIAnalyticsService:
             logger.error(f"Lifecycle stage determination error: {str(e)}")
             return {'status': 'error', 'message': str(e)}
     
+    @staticmethod
+    def _at_risk_query(branch_id=None, threshold=0.6, limit=AT_RISK_LIMIT):
+        """
+        One statement scoring every member with an active loan.
+        
+        CTEs aggregate loans (active, in arrears, outstanding, defaulted),
+        savings balances and 60-day transaction counts per member; the score
+        adds 0.3 x arrears share, 0.2 for an internal risk score over 50,
+        0.2 for savings covering under 20% of the outstanding balance, 0.2
+        for any default and 0.1 for fewer than two recent transactions.
+        Threshold, ordering and the top-N limit run in the database. The
+        result always has at least one row carrying members_scanned;
+        at_risk_count is the number over the threshold before the limit.
+        """
+        now = datetime.utcnow()
+        active = Loan.status == 'active'
+        
+        scanned = db.session.query(Member.id)
+        if branch_id:
+            scanned = scanned.join(Group, Group.id == Member.group_id).filter(Group.branch_id == branch_id)
+        
+        loan_stats = db.session.query(
+            Loan.member_id.label('member_id'),
+            func.sum(case((active, 1), else_=0)).label('active_count'),
+            func.sum(case((and_(active, Loan.due_date < now), 1), else_=0)).label('arrears_count'),
+            func.coalesce(func.sum(case((active, Loan.outstanding_balance), else_=0)), 0).label('outstanding'),
+            func.sum(case((Loan.status == 'defaulted', 1), else_=0)).label('defaulted_count')
+        ).group_by(Loan.member_id).having(func.sum(case((active, 1), else_=0)) > 0).cte('loan_stats')
+        
+        savings = db.session.query(
+            SavingsAccount.member_id.label('member_id'),
+            func.sum(SavingsAccount.balance).label('balance')
+        ).group_by(SavingsAccount.member_id).cte('savings')
+        
+        activity = db.session.query(
+            Transaction.member_id.label('member_id'),
+            func.count(Transaction.id).label('recent_transactions')
+        ).filter(
+            Transaction.created_at > now - timedelta(days=60),
+            Transaction.member_id.in_(db.session.query(loan_stats.c.member_id))
+        ).group_by(Transaction.member_id).cte('activity')
+        
+        balance = func.coalesce(savings.c.balance, 0)
+        coverage_ratio = case(
+            (loan_stats.c.outstanding > 0, cast(balance, Float) / cast(loan_stats.c.outstanding, Float)),
+            else_=1.0
+        )
+        recent = func.coalesce(activity.c.recent_transactions, 0)
+        risk_score = (
+            0.3 * cast(loan_stats.c.arrears_count, Float) / cast(loan_stats.c.active_count, Float) +
+            case((func.coalesce(Member.risk_score, 0) > 50, 0.2), else_=0.0) +
+            case((coverage_ratio < 0.2, 0.2), else_=0.0) +
+            case((loan_stats.c.defaulted_count > 0, 0.2), else_=0.0) +
+            case((recent < 2, 0.1), else_=0.0)
+        )
+        
+        scored = db.session.query(
+            Member.id.label('member_id'),
+            User.first_name.label('first_name'),
+            User.last_name.label('last_name'),
+            func.coalesce(Member.risk_score, 0).label('internal_risk_score'),
+            loan_stats.c.arrears_count,
+            loan_stats.c.outstanding,
+            loan_stats.c.defaulted_count,
+            coverage_ratio.label('coverage_ratio'),
+            recent.label('recent_transactions'),
+            risk_score.label('risk_score')
+        ).join(loan_stats, loan_stats.c.member_id == Member.id).join(
+            User, User.id == Member.user_id
+        ).outerjoin(savings, savings.c.member_id == Member.id).outerjoin(
+            activity, activity.c.member_id == Member.id
+        )
+        if branch_id:
+            scored = scored.join(Group, Group.id == Member.group_id).filter(Group.branch_id == branch_id)
+        scored = scored.cte('scored')
+        
+        ranked = db.session.query(
+            scored,
+            func.count().over().label('at_risk_count')
+        ).filter(scored.c.risk_score >= threshold).order_by(
+            scored.c.risk_score.desc(), scored.c.member_id
+        ).limit(limit).subquery('ranked')
+        
+        totals = db.session.query(func.count().label('members_scanned')).select_from(scanned.subquery()).subquery('totals')
+        
+        return select(totals.c.members_scanned, ranked).select_from(
+            totals.outerjoin(ranked, true())
+        ).order_by(ranked.c.risk_score.desc(), ranked.c.member_id)
+    
     @staticmethod
     def identify_at_risk_members(branch_id=None, threshold=0.6):
         """
@@ -571,74 +845,47 @@ class AIAnalyticsService:
             if cached:
                 return json.loads(cached)
             
-            members = Member.query.outerjoin(Group).all()
-            if branch_id:
-                members = [m for m in members if m.group and m.group.branch_id == branch_id]
+            rows = db.session.execute(
+                AIAnalyticsService._at_risk_query(branch_id, threshold, AT_RISK_LIMIT)
+            ).mappings().all()
             
             at_risk = []
-            
-            for member in members:
-                loans = Loan.query.filter_by(member_id=member.id).all()
-                active_loans = [l for l in loans if l.status == 'active']
-                
-                if not active_loans:
+            for row in rows:
+                if row['member_id'] is None:
+                    # Only the totals row: nobody crossed the threshold
                     continue
                 
-                risk_score = 0
                 risk_factors = []
-                
-                arrears_loans = [l for l in active_loans if l.due_date and l.due_date < datetime.utcnow()]
-                if arrears_loans:
-                    risk_score += 0.3 * len(arrears_loans) / len(active_loans)
-                    risk_factors.append(f'{len(arrears_loans)} loans in arrears')
-                
-                if member.risk_score > 50:
-                    risk_score += 0.2
-                    risk_factors.append(f'High internal risk score: {member.risk_score}')
-                
-                outstanding = sum(float(l.outstanding_balance) for l in active_loans)
-                savings = float(member.savings_account.balance) if member.savings_account else 0
-                coverage_ratio = savings / outstanding if outstanding > 0 else 1
-                
-                if coverage_ratio < 0.2:
-                    risk_score += 0.2
-                    risk_factors.append(f'Low savings coverage: {coverage_ratio:.2%}')
-                
-                defaulted_count = len([l for l in loans if l.status == 'defaulted'])
-                if defaulted_count > 0:
-                    risk_score += 0.2
-                    risk_factors.append(f'Previous defaults: {defaulted_count}')
-                
-                transactions = Transaction.query.filter_by(member_id=member.id).all()
-                recent_transactions = [
-                    t for t in transactions
-                    if (datetime.utcnow() - t.created_at).days < 60
-                ]
-                if len(recent_transactions) < 2 and len(loans) > 0:
-                    risk_score += 0.1
+                if row['arrears_count']:
+                    risk_factors.append(f"{row['arrears_count']} loans in arrears")
+                if row['internal_risk_score'] > 50:
+                    risk_factors.append(f"High internal risk score: {row['internal_risk_score']}")
+                if row['coverage_ratio'] < 0.2:
+                    risk_factors.append(f"Low savings coverage: {row['coverage_ratio']:.2%}")
+                if row['defaulted_count']:
+                    risk_factors.append(f"Previous defaults: {row['defaulted_count']}")
+                if row['recent_transactions'] < 2:
                     risk_factors.append('Low transaction activity')
                 
-                if risk_score >= threshold:
-                    at_risk.append({
-                        'member_id': member.id,
-                        'member_name': f"{member.user.first_name} {member.user.last_name}",
-                        'risk_score': min(1.0, risk_score),
-                        'risk_factors': risk_factors,
-                        'recommended_action': (
-                            'Immediate follow-up required' if risk_score > 0.8 else
-                            'Schedule member meeting' if risk_score > 0.7 else
-                            'Monitor closely'
-                        ),
-                        'outstanding_balance': float(sum(float(l.outstanding_balance) for l in active_loans))
-                    })
-            
-            at_risk.sort(key=lambda x: x['risk_score'], reverse=True)
+                risk_score = float(row['risk_score'])
+                at_risk.append({
+                    'member_id': row['member_id'],
+                    'member_name': f"{row['first_name']} {row['last_name']}",
+                    'risk_score': min(1.0, risk_score),
+                    'risk_factors': risk_factors,
+                    'recommended_action': (
+                        'Immediate follow-up required' if risk_score > 0.8 else
+                        'Schedule member meeting' if risk_score > 0.7 else
+                        'Monitor closely'
+                    ),
+                    'outstanding_balance': float(row['outstanding'])
+                })
             
             result = {
                 'status': 'success',
-                'total_members_scanned': len(members),
-                'at_risk_count': len(at_risk),
-                'members': at_risk[:50]
+                'total_members_scanned': rows[0]['members_scanned'] if rows else 0,
+                'at_risk_count': (rows[0]['at_risk_count'] or 0) if rows else 0,
+                'members': at_risk
             }
             
             cache.set(cache_key, json.dumps(result, default=str))
@@ -6,6 +6,13 @@ import logging
 import json
 import csv
 import io
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+from collections import defaultdict
 from datetime import datetime, timedelta
 from typing import Dict, Any, Optional, List
 from flask import current_app
@@ -256,6 +263,319 @@ class BIExportService:
             return b''
 
 
+class ArrowExportEngine:
+    """
+    Stream query results into Parquet or Arrow IPC files in record batches.
+
+    Rows come off a server-side cursor `batch_size` at a time and are turned
+    into typed Arrow record batches, so memory stays at one batch per open
+    partition whatever the table size. Extracts can be limited to rows whose
+    watermark column moved past the previous run, and split into one file per
+    month or branch. Export directories older than the retention period are
+    removed as new exports are written; one-off downloads are discarded as
+    soon as they have been sent.
+    """
+    
+    FORMATS = {
+        'parquet': ('.parquet', 'application/vnd.apache.parquet'),
+        'arrow': ('.arrow', 'application/vnd.apache.arrow.file')
+    }
+    PARTITIONS = ('month', 'branch')
+    
+    def __init__(self, app=None):
+        self.app = None
+        self.redis_client = None
+        self.export_dir = os.path.join(tempfile.gettempdir(), 'bi_exports')
+        self.batch_size = 50000
+        self.watermark_lag_seconds = 60
+        self.retention_seconds = 24 * 60 * 60
+        
+        if app:
+            self.init_app(app, None)
+    
+    def init_app(self, app, redis_client):
+        self.app = app
+        self.redis_client = redis_client
+        self.export_dir = app.config.get('BI_EXPORT_DIR', self.export_dir)
+        self.batch_size = app.config.get('BI_EXPORT_BATCH_SIZE', self.batch_size)
+        self.watermark_lag_seconds = app.config.get('BI_EXPORT_WATERMARK_LAG_SECONDS', self.watermark_lag_seconds)
+        self.retention_seconds = app.config.get('BI_EXPORT_RETENTION_SECONDS', self.retention_seconds)
+    
+    def datasets(self) -> Dict[str, Dict[str, Any]]:
+        """Exportable datasets: typed columns, watermark, month and branch expressions"""
+        import pyarrow as pa
+        from sqlalchemy import func
+        from app.models import Member, User, Loan, Transaction
+        
+        money = pa.decimal128(12, 2)
+        timestamp = pa.timestamp('us')
+        return {
+            'members': {
+                'columns': [
+                    ('id', Member.id, pa.int64()),
+                    ('member_code', Member.member_code, pa.string()),
+                    ('first_name', User.first_name, pa.string()),
+                    ('last_name', User.last_name, pa.string()),
+                    ('phone', User.phone, pa.string()),
+                    ('branch_id', Member.branch_id, pa.int64()),
+                    ('group_id', Member.group_id, pa.int64()),
+                    ('status', Member.status, pa.string()),
+                    ('risk_score', Member.risk_score, pa.int64()),
+                    ('risk_category', Member.risk_category, pa.string()),
+                    ('registration_fee', Member.registration_fee, pa.decimal128(10, 2)),
+                    ('registration_fee_paid', Member.registration_fee_paid, pa.bool_()),
+                    ('created_at', Member.created_at, timestamp)
+                ],
+                'from': lambda query: query.select_from(Member).join(User, User.id == Member.user_id),
+                'watermark': Member.created_at,
+                'month': Member.created_at,
+                'branch': Member.branch_id,
+                'filters': {'status': Member.status}
+            },
+            'loans': {
+                'columns': [
+                    ('id', Loan.id, pa.int64()),
+                    ('loan_number', Loan.loan_number, pa.string()),
+                    ('member_id', Loan.member_id, pa.int64()),
+                    ('branch_id', Member.branch_id, pa.int64()),
+                    ('loan_type_id', Loan.loan_type_id, pa.int64()),
+                    ('principle_amount', Loan.principle_amount, money),
+                    ('interest_amount', Loan.interest_amount, money),
+                    ('charge_fee', Loan.charge_fee, money),
+                    ('total_amount', Loan.total_amount, money),
+                    ('outstanding_balance', Loan.outstanding_balance, money),
+                    ('status', Loan.status, pa.string()),
+                    ('application_date', Loan.application_date, timestamp),
+                    ('approval_date', Loan.approval_date, timestamp),
+                    ('disbursement_date', Loan.disbursement_date, timestamp),
+                    ('due_date', Loan.due_date, timestamp),
+                    ('created_at', Loan.created_at, timestamp),
+                    ('updated_at', func.coalesce(Loan.updated_at, Loan.created_at), timestamp)
+                ],
+                'from': lambda query: query.select_from(Loan).join(Member, Member.id == Loan.member_id),
+                # Loans change after creation, so incremental extracts follow updated_at
+                'watermark': func.coalesce(Loan.updated_at, Loan.created_at),
+                'month': Loan.created_at,
+                'branch': Member.branch_id,
+                'filters': {'status': Loan.status}
+            },
+            'transactions': {
+                'columns': [
+                    ('id', Transaction.id, pa.int64()),
+                    ('transaction_id', Transaction.transaction_id, pa.string()),
+                    ('member_id', Transaction.member_id, pa.int64()),
+                    ('branch_id', Member.branch_id, pa.int64()),
+                    ('account_type', Transaction.account_type, pa.string()),
+                    ('transaction_type', Transaction.transaction_type, pa.string()),
+                    ('amount', Transaction.amount, money),
+                    ('balance_before', Transaction.balance_before, money),
+                    ('balance_after', Transaction.balance_after, money),
+                    ('status', Transaction.status, pa.string()),
+                    ('mpesa_code', Transaction.mpesa_code, pa.string()),
+                    ('loan_id', Transaction.loan_id, pa.int64()),
+                    ('created_at', Transaction.created_at, timestamp),
+                    ('confirmed_at', Transaction.confirmed_at, timestamp)
+                ],
+                'from': lambda query: query.select_from(Transaction).join(Member, Member.id == Transaction.member_id),
+                # Pending rows are extracted again once they are confirmed
+                'watermark': func.coalesce(Transaction.confirmed_at, Transaction.created_at),
+                'month': Transaction.created_at,
+                'branch': Member.branch_id,
+                'filters': {'status': Transaction.status}
+            }
+        }
+    
+    def export(self, dataset: str, format: str = 'parquet', since: Optional[datetime] = None,
+               incremental: bool = False, partition_by: Optional[str] = None,
+               branch_id: Optional[int] = None, status: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Export a dataset to files under a new export directory and return its manifest.
+
+        `since` limits the extract to rows whose watermark is later; with
+        `incremental` the watermark stored by the previous incremental run of
+        the same extract is used and advanced on success. Rows newer than
+        the watermark lag are left for the next run so transactions still in
+        flight are not skipped.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        from sqlalchemy import select, func
+        from app import db
+        
+        definitions = self.datasets()
+        if dataset not in definitions:
+            raise ValueError(f"Unknown dataset. Use one of: {', '.join(definitions)}")
+        if format not in self.FORMATS:
+            raise ValueError(f"Unsupported format. Use one of: {', '.join(self.FORMATS)}")
+        if partition_by and partition_by not in self.PARTITIONS:
+            raise ValueError(f"Unsupported partitioning. Use one of: {', '.join(self.PARTITIONS)}")
+        
+        definition = definitions[dataset]
+        scope = f"{dataset}:{branch_id or 'all'}:{status or 'all'}"
+        if incremental and since is None:
+            since = self.get_watermark(scope)
+        until = datetime.utcnow() - timedelta(seconds=self.watermark_lag_seconds)
+        
+        schema = pa.schema([pa.field(name, arrow_type) for name, _, arrow_type in definition['columns']])
+        watermark = definition['watermark']
+        partition = None
+        if partition_by == 'month':
+            partition = func.to_char(definition['month'], 'YYYY-MM').label('_partition')
+        elif partition_by == 'branch':
+            partition = func.coalesce(definition['branch'], 0).label('_partition')
+        
+        columns = [expression.label(name) for name, expression, _ in definition['columns']]
+        query = definition['from'](select(*columns, watermark.label('_watermark'),
+                                          *([partition] if partition is not None else [])))
+        query = query.where(watermark < until)
+        if since:
+            query = query.where(watermark > since)
+        if branch_id:
+            query = query.where(definition['branch'] == branch_id)
+        if status:
+            query = query.where(definition['filters']['status'] == status)
+        query = query.order_by(watermark, columns[0])
+        
+        self.purge_expired()
+        export_id = uuid.uuid4().hex
+        export_path = os.path.join(self.export_dir, export_id)
+        os.makedirs(export_path, exist_ok=True)
+        extension, content_type = self.FORMATS[format]
+        
+        writers, sinks, counts = {}, {}, defaultdict(int)
+        high_watermark = None
+        rows_total = 0
+        
+        def writer_for(key):
+            if key not in writers:
+                name = f"{dataset}{extension}" if partition_by is None else os.path.join(f"{partition_by}={key}", f"{dataset}{extension}")
+                path = os.path.join(export_path, name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if format == 'parquet':
+                    writers[key] = pq.ParquetWriter(path, schema, compression='snappy')
+                else:
+                    sinks[key] = pa.OSFile(path, 'wb')
+                    writers[key] = pa.ipc.new_file(sinks[key], schema)
+                counts[key]
+            return writers[key]
+        
+        try:
+            result = db.session.execute(query.execution_options(stream_results=True, yield_per=self.batch_size))
+            for rows in result.partitions():
+                groups = defaultdict(list)
+                for row in rows:
+                    groups[row._partition if partition is not None else None].append(row)
+                for key, group in groups.items():
+                    arrays = [
+                        pa.array([row[index] for row in group], type=field.type)
+                        for index, field in enumerate(schema)
+                    ]
+                    writer_for(key).write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+                    counts[key] += len(group)
+                rows_total += len(rows)
+                high_watermark = rows[-1]._watermark
+            
+            if not writers and partition_by is None:
+                # An empty extract still produces a readable file with the schema
+                writer_for(None)
+        finally:
+            for writer in writers.values():
+                writer.close()
+            for sink in sinks.values():
+                sink.close()
+            db.session.rollback()
+        
+        files = []
+        for key, count in sorted(counts.items(), key=lambda item: str(item[0])):
+            name = f"{dataset}{extension}" if partition_by is None else os.path.join(f"{partition_by}={key}", f"{dataset}{extension}")
+            files.append({
+                'path': name,
+                'partition': None if partition_by is None else str(key),
+                'rows': count,
+                'bytes': os.path.getsize(os.path.join(export_path, name))
+            })
+        
+        manifest = {
+            'exportId': export_id,
+            'dataset': dataset,
+            'format': format,
+            'contentType': content_type,
+            'partitionBy': partition_by,
+            'since': since.isoformat() if since else None,
+            'until': until.isoformat(),
+            'watermark': (high_watermark or since).isoformat() if (high_watermark or since) else None,
+            'rows': rows_total,
+            'files': files,
+            'createdAt': datetime.utcnow().isoformat()
+        }
+        with open(os.path.join(export_path, '_manifest.json'), 'w') as handle:
+            json.dump(manifest, handle)
+        
+        if incremental and high_watermark:
+            self.set_watermark(scope, high_watermark)
+        logging.info(f"BI export {export_id}: {dataset} {rows_total} rows in {len(files)} files")
+        return manifest
+    
+    def get_watermark(self, scope: str) -> Optional[datetime]:
+        if not self.redis_client:
+            return None
+        try:
+            value = self.redis_client.get(f"bi_export:watermark:{scope}")
+            return datetime.fromisoformat(value) if value else None
+        except Exception as e:
+            logging.warning(f"Failed to read BI export watermark: {str(e)}")
+            return None
+    
+    def set_watermark(self, scope: str, value: datetime):
+        if not self.redis_client:
+            return
+        try:
+            self.redis_client.set(f"bi_export:watermark:{scope}", value.isoformat())
+        except Exception as e:
+            logging.warning(f"Failed to store BI export watermark: {str(e)}")
+    
+    def get_manifest(self, export_id: str) -> Optional[Dict[str, Any]]:
+        if not re.fullmatch(r'[0-9a-f]{32}', export_id or ''):
+            return None
+        path = os.path.join(self.export_dir, export_id, '_manifest.json')
+        if not os.path.exists(path):
+            return None
+        with open(path) as handle:
+            return json.load(handle)
+    
+    def file_path(self, export_id: str, name: str) -> Optional[str]:
+        """Absolute path of a file listed in an export's manifest, or None"""
+        manifest = self.get_manifest(export_id)
+        if not manifest or name not in {entry['path'] for entry in manifest['files']}:
+            return None
+        return os.path.join(self.export_dir, export_id, name)
+    
+    def discard(self, export_id: str):
+        """Remove an export directory and its files"""
+        if not re.fullmatch(r'[0-9a-f]{32}', export_id or ''):
+            return
+        shutil.rmtree(os.path.join(self.export_dir, export_id), ignore_errors=True)
+    
+    def purge_expired(self) -> int:
+        """Remove export directories older than the retention period"""
+        if not os.path.isdir(self.export_dir):
+            return 0
+        cutoff = time.time() - self.retention_seconds
+        removed = 0
+        for export_id in os.listdir(self.export_dir):
+            path = os.path.join(self.export_dir, export_id)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    shutil.rmtree(path, ignore_errors=True)
+                    removed += 1
+            except OSError:
+                # Already removed by another worker
+                continue
+        if removed:
+            logging.info(f"Removed {removed} expired BI exports")
+        return removed
+
+
 class BIIntegrationService:
     """Main BI Integration Service"""
     
@@ -264,6 +584,7 @@ class BIIntegrationService:
         self.powerbi = PowerBIConnector(app)
         self.tableau = TableauConnector(app)
         self.export_service = BIExportService()
+        self.columnar = ArrowExportEngine()
         self.redis_client = None
         
         if app:
@@ -283,6 +604,8 @@ class BIIntegrationService:
         except Exception as e:
             logging.warning(f"Failed to initialize Redis for BI: {str(e)}")
         
+        self.columnar.init_app(app, self.redis_client)
+        
         logging.info("BI Integration Service initialized")
     
     def get_available_tools(self) -> List[Dict[str, Any]]:
@@ -318,9 +641,35 @@ class BIIntegrationService:
             }
         ]
     
+    def publish_to_tableau(self, dataset: str, **filters) -> Dict[str, Any]:
+        """Extract a dataset to one Parquet file and publish it as a Tableau datasource"""
+        manifest = self.columnar.export(dataset, format='parquet', **filters)
+        path = self.columnar.file_path(manifest['exportId'], manifest['files'][0]['path'])
+        try:
+            published = self.tableau.publish_datasource(dataset, path)
+        finally:
+            self.columnar.discard(manifest['exportId'])
+        return {'published': published, 'export': manifest}
+    
+    def export_columnar(self, dataset: str, format: str, **filters) -> Dict[str, Any]:
+        """Stream a dataset to a single Parquet/Arrow file and describe it for download"""
+        manifest = self.columnar.export(dataset, format=format, **filters)
+        entry = manifest['files'][0]
+        return {
+            'success': True,
+            'path': self.columnar.file_path(manifest['exportId'], entry['path']),
+            'export_id': manifest['exportId'],
+            'content_type': manifest['contentType'],
+            'filename': entry['path'],
+            'rows': manifest['rows']
+        }
+    
     def export_member_data(self, format: str = 'csv', **filters) -> Dict[str, Any]:
         """Export member data in specified format"""
         try:
+            if format in ArrowExportEngine.FORMATS:
+                return self.export_columnar('members', format, branch_id=filters.get('branch_id'))
+            
             from app.models import Member
             
             query = Member.query
@@ -374,6 +723,10 @@ class BIIntegrationService:
     def export_loan_data(self, format: str = 'csv', **filters) -> Dict[str, Any]:
         """Export loan data in specified format"""
         try:
+            if format in ArrowExportEngine.FORMATS:
+                return self.export_columnar('loans', format, branch_id=filters.get('branch_id'),
+                                            status=filters.get('status'))
+            
             from app.models import Loan
             
             query = Loan.query
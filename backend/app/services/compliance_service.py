@@ -103,46 +103,83 @@ class AMLService:
     
     def monitor_transaction(self, user_id: int, transaction: Dict) -> Dict[str, Any]:
         try:
+            from app.models import Member
+            from app.services.transaction_monitor import transaction_monitor
+            
+            member_id = transaction.get('member_id')
+            if not member_id:
+                member = Member.query.filter_by(user_id=user_id).first()
+                if not member:
+                    return {'risk_level': 'error', 'error': 'Member not found'}
+                member_id = member.id
+            
+            evaluation = transaction_monitor.evaluate({
+                'transaction_id': transaction.get('id'),
+                'member_id': member_id,
+                'transaction_type': transaction.get('type') or 'deposit',
+                'amount': transaction.get('amount', 0),
+                'created_at': transaction.get('created_at')
+            })
+            
             result = {
                 'transaction_id': transaction.get('id'),
                 'user_id': user_id,
-                'risk_score': 0,
-                'risk_level': 'low',
-                'alerts': [],
+                'member_id': member_id,
+                'risk_score': evaluation['risk_score'],
+                'risk_level': evaluation['risk_level'],
+                'checks': evaluation['rules'],
+                'alerts': sorted(evaluation['rules']),
+                'window_stats': evaluation['window_stats'],
+                'alert_stored': evaluation['alerted'],
                 'monitored_at': datetime.utcnow().isoformat()
             }
             
-            amount = transaction.get('amount', 0)
-            checks = {
-                'high_amount': 30 if amount > 10000 else 0,
-                'rapid_activity': 0,
-                'unusual_pattern': 0
-            }
-            
-            result['risk_score'] = sum(checks.values())
-            
-            if result['risk_score'] >= 75:
-                result['risk_level'] = 'high'
-                result['alerts'].append('High-risk detected')
-            elif result['risk_score'] >= 50:
-                result['risk_level'] = 'medium'
-            
-            self._store_monitoring(user_id, result)
             logging.info(f"AML monitoring: user={user_id}, risk={result['risk_level']}")
             return result
         except Exception as e:
             logging.error(f"AML error: {str(e)}")
             return {'risk_level': 'error', 'error': str(e)}
     
-    def _store_monitoring(self, user_id: int, result: Dict):
-        try:
-            self.redis_client.setex(
-                f"aml:{user_id}:{datetime.utcnow().timestamp()}",
-                86400*90,
-                json.dumps(result)
-            )
-        except Exception as e:
-            logging.error(f"AML storage error: {str(e)}")
+    def get_alerts(self, member_id: Optional[int] = None, status: Optional[str] = None,
+                   risk_level: Optional[str] = None, since: Optional[datetime] = None,
+                   before_id: Optional[int] = None, limit: int = 50) -> Dict[str, Any]:
+        """Page through stored alerts, newest first, keyed on id"""
+        from app.models import AmlAlert
+        
+        query = AmlAlert.query
+        if member_id:
+            query = query.filter(AmlAlert.member_id == member_id)
+        if status:
+            query = query.filter(AmlAlert.status == status)
+        if risk_level:
+            query = query.filter(AmlAlert.risk_level == risk_level)
+        if since:
+            query = query.filter(AmlAlert.event_at >= since)
+        if before_id:
+            query = query.filter(AmlAlert.id < before_id)
+        
+        alerts = query.order_by(AmlAlert.id.desc()).limit(limit + 1).all()
+        has_more = len(alerts) > limit
+        alerts = alerts[:limit]
+        return {
+            'alerts': [alert.to_dict() for alert in alerts],
+            'nextCursor': alerts[-1].id if has_more else None
+        }
+    
+    def review_alert(self, alert_id: int, status: str, reviewer_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        from app import db
+        from app.models import AmlAlert
+        
+        if status not in ('open', 'reviewed', 'dismissed', 'escalated'):
+            raise ValueError(f"Invalid alert status: {status}")
+        alert = AmlAlert.query.get(alert_id)
+        if not alert:
+            return None
+        alert.status = status
+        alert.reviewed_by = reviewer_id
+        alert.reviewed_at = datetime.utcnow()
+        db.session.commit()
+        return alert.to_dict()
 
 
 class GDPRService:
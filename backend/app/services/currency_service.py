@@ -4,17 +4,72 @@ Handles currency management, conversion, and exchange rates
 """
 import json
 import logging
+import threading
+import time
 import requests
+import numpy as np
 from datetime import datetime, timedelta
 from typing import Dict, Any, Optional, List
 import redis
 from flask import current_app
 
+
+# Units of each currency per 1 KES, used by the stub provider and as the offline table
+FALLBACK_KES_RATES = {
+    'KES': 1.0,
+    'USD': 0.0077,
+    'EUR': 0.0070,
+    'GBP': 0.0061,
+    'UGX': 29.4,
+    'TZS': 19.6,
+    'RWF': 110.0,
+    'XOF': 4.6,
+}
+
+
+class ExchangeRateAPIProvider:
+    """Fetches the full rate table for a base currency from exchangerate-api in one call"""
+    
+    name = 'exchangerate-api'
+    
+    def __init__(self, timeout: int = 10):
+        self.timeout = timeout
+    
+    def fetch_table(self, base: str) -> Optional[Dict[str, float]]:
+        response = requests.get(f"https://api.exchangerate-api.com/v4/latest/{base}", timeout=self.timeout)
+        if response.status_code != 200:
+            return None
+        rates = response.json().get('rates')
+        return {code: float(rate) for code, rate in rates.items()} if rates else None
+
+
+class StubRateProvider:
+    """Local provider serving a fixed table, for tests and offline development"""
+    
+    name = 'stub'
+    
+    def __init__(self, kes_rates: Optional[Dict[str, float]] = None):
+        self.kes_rates = dict(kes_rates or FALLBACK_KES_RATES)
+    
+    def fetch_table(self, base: str) -> Optional[Dict[str, float]]:
+        if base not in self.kes_rates:
+            return None
+        base_per_kes = self.kes_rates[base]
+        return {code: rate / base_per_kes for code, rate in self.kes_rates.items()}
+
+
 class CurrencyService:
     def __init__(self, app=None):
         self.redis_client = None
         self.app = None
         self.supported_currencies = {}
+        self.provider = StubRateProvider()
+        self.rate_base = 'KES'
+        self.refresh_interval = 3600
+        # In-process snapshot of the rate table: {'base', 'rates', 'fetched_at'}
+        self._rate_table = None
+        self._refresh_thread = None
+        self._refresh_lock = threading.Lock()
         
         if app:
             self.init_app(app)
@@ -45,6 +100,18 @@ class CurrencyService:
             self.redis_client = None
         
         self._initialize_currencies()
+        
+        self.rate_base = app.config.get('EXCHANGE_RATE_BASE', 'KES')
+        self.refresh_interval = app.config.get('EXCHANGE_RATE_REFRESH_SECONDS', 3600)
+        provider_name = app.config.get('EXCHANGE_RATE_PROVIDER')
+        if provider_name is None:
+            provider_name = 'exchangerate-api' if app.config.get('EXCHANGE_RATE_API_KEY') else 'stub'
+        self.provider = ExchangeRateAPIProvider() if provider_name == 'exchangerate-api' else StubRateProvider()
+        
+        self._load_rate_table_from_redis()
+        if app.config.get('EXCHANGE_RATE_BACKGROUND_REFRESH', True):
+            self.start_background_refresh()
+        
         logging.info("Currency Service initialized successfully")
     
     def _initialize_currencies(self):
@@ -153,53 +220,121 @@ class CurrencyService:
     
 
     def get_exchange_rate(self, from_currency: str, to_currency: str = 'KES', cached: bool = True) -> float:
-        """Get exchange rate between two currencies"""
+        """Get exchange rate between two currencies from the in-process rate table"""
         try:
             if from_currency == to_currency:
                 return 1.0
             
-            cache_key = f"exchange_rate:{from_currency}:{to_currency}"
+            if not cached:
+                # Serve the current table; the provider call happens off the request path
+                self.schedule_refresh()
             
-            if cached and self.redis_client:
-                cached_rate = self.redis_client.get(cache_key)
-                if cached_rate:
-                    return float(cached_rate)
+            rates = self._current_rates()
+            if rates and from_currency in rates and to_currency in rates:
+                # Triangulate through the table's base currency
+                return rates[to_currency] / rates[from_currency]
             
-            rate = self._fetch_exchange_rate(from_currency, to_currency)
-            
-            if rate and self.redis_client:
-                self.redis_client.setex(cache_key, 3600, str(rate))  # Cache for 1 hour
-                return rate
-            else:
-                logging.warning(f"Could not fetch rate for {from_currency} to {to_currency}")
-                return self._get_fallback_rate(from_currency, to_currency)
+            logging.warning(f"No table rate for {from_currency} to {to_currency}")
+            return self._get_fallback_rate(from_currency, to_currency)
         
         except Exception as e:
             logging.error(f"Error getting exchange rate: {str(e)}")
             return self._get_fallback_rate(from_currency, to_currency)
     
-    def _fetch_exchange_rate(self, from_currency: str, to_currency: str) -> Optional[float]:
-        """Fetch exchange rate from external API"""
-        try:
-            api_key = self.app.config.get('EXCHANGE_RATE_API_KEY')
-            
-            if not api_key:
-                return None
+    def _current_rates(self) -> Optional[Dict[str, float]]:
+        """Rates per one unit of the table base; never calls the external provider"""
+        table = self._rate_table
+        if table is None:
+            table = self._load_rate_table_from_redis()
+        return table['rates'] if table else None
+    
+    def refresh_rate_table(self) -> bool:
+        """Fetch the full table for the base currency and publish it to Redis and the snapshot"""
+        with self._refresh_lock:
+            try:
+                rates = self.provider.fetch_table(self.rate_base)
+            except Exception as e:
+                logging.error(f"Error fetching rate table from {self.provider.name}: {str(e)}")
+                return False
             
-            url = f"https://api.exchangerate-api.com/v4/latest/{from_currency}"
+            if not rates:
+                logging.warning(f"Rate provider {self.provider.name} returned no table for {self.rate_base}")
+                return False
             
-            response = requests.get(url, timeout=10)
+            rates[self.rate_base] = 1.0
+            fetched_at = datetime.utcnow().isoformat()
+            self._rate_table = {'base': self.rate_base, 'rates': rates, 'fetched_at': fetched_at}
             
-            if response.status_code == 200:
-                data = response.json()
-                if 'rates' in data and to_currency in data['rates']:
-                    return data['rates'][to_currency]
+            if self.redis_client:
+                try:
+                    key = f"exchange_rates:{self.rate_base}"
+                    pipe = self.redis_client.pipeline()
+                    pipe.delete(key)
+                    pipe.hset(key, mapping={code: repr(rate) for code, rate in rates.items()})
+                    pipe.hset(key, '_fetched_at', fetched_at)
+                    pipe.set('exchange_rates_updated', fetched_at)
+                    pipe.execute()
+                except Exception as e:
+                    logging.warning(f"Could not publish rate table to Redis: {str(e)}")
             
+            logging.info(f"Refreshed {len(rates)} {self.rate_base} rates from {self.provider.name}")
+            return True
+    
+    def _load_rate_table_from_redis(self) -> Optional[Dict[str, Any]]:
+        """Adopt the table another worker already published"""
+        if not self.redis_client:
             return None
-        
+        try:
+            fields = self.redis_client.hgetall(f"exchange_rates:{self.rate_base}")
         except Exception as e:
-            logging.error(f"Error fetching exchange rate from API: {str(e)}")
+            logging.warning(f"Could not load rate table from Redis: {str(e)}")
             return None
+        if not fields:
+            return None
+        
+        fetched_at = fields.pop('_fetched_at', None)
+        self._rate_table = {
+            'base': self.rate_base,
+            'rates': {code: float(rate) for code, rate in fields.items()},
+            'fetched_at': fetched_at
+        }
+        return self._rate_table
+    
+    def start_background_refresh(self):
+        """Refresh the rate table off the request path on a fixed interval"""
+        if self._refresh_thread and self._refresh_thread.is_alive():
+            return
+        self._refresh_thread = threading.Thread(target=self._refresh_loop, name='currency-rate-refresh', daemon=True)
+        self._refresh_thread.start()
+    
+    def schedule_refresh(self):
+        """Refresh the rate table once in the background unless a refresh is already running"""
+        if self._refresh_lock.locked():
+            return
+        threading.Thread(target=self.refresh_rate_table, name='currency-rate-refresh-once', daemon=True).start()
+    
+    def _refresh_loop(self):
+        while True:
+            try:
+                if self._claim_refresh():
+                    self.refresh_rate_table()
+                else:
+                    self._load_rate_table_from_redis()
+            except Exception as e:
+                logging.error(f"Background rate refresh failed: {str(e)}")
+            time.sleep(self.refresh_interval)
+    
+    def _claim_refresh(self) -> bool:
+        """Only one worker per interval calls the provider; the others read Redis"""
+        if not self.redis_client:
+            return True
+        try:
+            return bool(self.redis_client.set(
+                f"exchange_rates:{self.rate_base}:refresh_lock", '1',
+                nx=True, ex=max(int(self.refresh_interval) - 5, 1)
+            ))
+        except Exception:
+            return True
     
     def _get_fallback_rate(self, from_currency: str, to_currency: str) -> float:
         """Get fallback exchange rate for offline mode"""
@@ -256,22 +391,39 @@ class CurrencyService:
         """Convert amount from base currency (KES) to another currency"""
         return self.convert(amount, 'KES', to_currency)
     
-
-    def update_exchange_rates(self) -> bool:
-        """Manually update all exchange rates"""
+    def convert_many(self, amounts: List[float], currencies: List[str], to_currency: str = 'KES') -> Dict[str, Any]:
+        """Convert a batch of amounts, each in its own currency, to one target currency"""
         try:
-            major_currencies = ['USD', 'EUR', 'GBP', 'UGX', 'TZS']
+            if len(amounts) != len(currencies):
+                return {'error': 'amounts and currencies must have the same length'}
             
-            for currency in major_currencies:
-                rate = self._fetch_exchange_rate(currency, 'KES')
-                if rate and self.redis_client:
-                    cache_key = f"exchange_rate:{currency}:KES"
-                    self.redis_client.setex(cache_key, 3600, str(rate))
-                    logging.info(f"Updated {currency}/KES rate: {rate}")
+            unsupported = sorted({c for c in currencies if c not in self.supported_currencies})
+            if unsupported or to_currency not in self.supported_currencies:
+                return {'error': 'Unsupported currency', 'currencies': unsupported or [to_currency]}
             
-            if self.redis_client:
-                self.redis_client.set('exchange_rates_updated', datetime.utcnow().isoformat())
-            return True
+            rate_by_currency = {c: self.get_exchange_rate(c, to_currency) for c in set(currencies)}
+            values = np.asarray(amounts, dtype=float)
+            rates = np.fromiter((rate_by_currency[c] for c in currencies), dtype=float, count=len(currencies))
+            converted = np.round(values * rates, 2)
+            
+            return {
+                'converted_amounts': converted.tolist(),
+                'total': round(float(converted.sum()), 2),
+                'target_currency': to_currency,
+                'exchange_rates': rate_by_currency,
+                'rates_as_of': self._rate_table['fetched_at'] if self._rate_table else None,
+                'timestamp': datetime.utcnow().isoformat()
+            }
+        
+        except Exception as e:
+            logging.error(f"Error converting currency batch: {str(e)}")
+            return {'error': str(e)}
+    
+
+    def update_exchange_rates(self) -> bool:
+        """Manually refresh the full exchange rate table"""
+        try:
+            return self.refresh_rate_table()
         
         except Exception as e:
             logging.error(f"Error updating exchange rates: {str(e)}")
@@ -357,7 +509,14 @@ class CurrencyService:
             if not account_json:
                 return {'error': 'Account not found'}
             
-            return json.loads(account_json)
+            account = json.loads(account_json)
+            balances = account.get('balances', {})
+            if balances:
+                primary = account.get('primary_currency', 'KES')
+                totals = self.convert_many(list(balances.values()), list(balances.keys()), primary)
+                if 'error' not in totals:
+                    account['total_in_primary'] = totals['total']
+            return account
         
         except Exception as e:
             logging.error(f"Error getting multicurrency balance: {str(e)}")
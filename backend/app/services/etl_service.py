@@ -1,24 +1,64 @@
 """
 ETL Pipeline Service - Extract, Transform, Load for data warehouse
+
+A pipeline pulls one source (members, loans, transactions or payments) in
+keyset-paginated chunks ordered by a watermark column, pushes each chunk
+through generator stages (filter, enrich, aggregate) and upserts it into a
+warehouse table. The warehouse is a separate database - a SQLite file by
+default, or any SQLAlchemy URL with an optional schema - so loads never touch
+the operational tables. Every loaded chunk writes the pipeline's checkpoint
+(last watermark and id) in the same warehouse transaction, so a failed run
+resumes exactly where it stopped and the next run only moves rows that
+changed since. Aggregate pipelines merge each chunk into the stored totals
+of their own target table, so they page on the source's creation time
+instead: a row is counted once, as it was when first extracted, and later
+changes to it need a full refresh.
 """
 import logging
 import json
+import os
+import re
+import time
+import uuid
 import redis
-from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, List
+from datetime import datetime, timedelta, date
+from decimal import Decimal
+from typing import Dict, Any, Optional, List, Iterator, Tuple
 from flask import current_app
-import csv
-from io import StringIO
+
+# Rows read from the source per chunk and loaded per warehouse statement
+DEFAULT_CHUNK_SIZE = 5000
+
+FILTER_OPERATORS = {
+    'equals': lambda a, b: a == b,
+    'not_equals': lambda a, b: a != b,
+    'gt': lambda a, b: a is not None and a > b,
+    'gte': lambda a, b: a is not None and a >= b,
+    'lt': lambda a, b: a is not None and a < b,
+    'lte': lambda a, b: a is not None and a <= b,
+    'in': lambda a, b: a in b,
+}
+
+# Aggregates that can be merged into rows loaded by earlier runs
+AGGREGATE_FUNCTIONS = ('sum', 'count', 'min', 'max')
+
+TABLE_NAME = re.compile(r'^[a-z_][a-z0-9_]*$')
+
 
 class ETLService:
     def __init__(self, app=None):
         self.app = None
         self.redis_client = None
         self.warehouse_config = {}
-        
+        self.warehouse_engine = None
+        self.warehouse_metadata = None
+        self.warehouse_tables = {}
+        self.chunk_size = DEFAULT_CHUNK_SIZE
+        self.watermark_lag_seconds = 60
+
         if app:
             self.init_app(app)
-    
+
     def init_app(self, app):
         self.app = app
         self.redis_client = redis.Redis(
@@ -27,182 +67,474 @@ class ETLService:
             db=app.config.get('REDIS_DB', 10),
             decode_responses=True
         )
+        self.chunk_size = app.config.get('ETL_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+        self.watermark_lag_seconds = app.config.get('ETL_WATERMARK_LAG_SECONDS', 60)
         self._initialize_warehouse_config()
         logging.info("ETL Service initialized")
-    
+
     def _initialize_warehouse_config(self):
+        url = self.app.config.get('ETL_WAREHOUSE_URL')
+        if not url:
+            os.makedirs(self.app.instance_path, exist_ok=True)
+            url = f"sqlite:///{os.path.join(self.app.instance_path, 'warehouse.db')}"
         self.warehouse_config = {
             'default': {
-                'type': 'postgresql',
-                'host': self.app.config.get('DATA_WAREHOUSE_HOST', 'localhost'),
-                'port': self.app.config.get('DATA_WAREHOUSE_PORT', 5432),
-                'database': self.app.config.get('DATA_WAREHOUSE_DB', 'imarisha_warehouse'),
-                'tables': ['dim_members', 'dim_loans', 'fact_transactions', 'fact_payments']
+                'url': url,
+                'schema': self.app.config.get('ETL_WAREHOUSE_SCHEMA'),
+                'tables': ['dim_members', 'dim_loans', 'fact_transactions', 'fact_payments', 'etl_checkpoints']
             }
         }
-    
-    def create_pipeline(self, name: str, source: str, target: str, schedule: str) -> Dict[str, Any]:
+        # The engine is built on first use so app start-up never needs the warehouse
+        self.warehouse_engine = None
+
+    # ------------------------------------------------------------------
+    # Sources and warehouse tables
+    # ------------------------------------------------------------------
+
+    def sources(self) -> Dict[str, Dict[str, Any]]:
+        """Extractable sources: selected columns, keyset id, change and creation watermarks and filterable columns"""
+        from sqlalchemy import select, func
+        from app.models import User, Member, Loan, Transaction
+
+        return {
+            'members': {
+                'select': select(
+                    Member.id.label('member_id'), Member.member_code, User.first_name, User.last_name,
+                    User.phone, Member.branch_id, Member.group_id, Member.status, Member.risk_score,
+                    Member.risk_category, Member.created_at
+                ).select_from(Member).join(User, User.id == Member.user_id),
+                'id': Member.id,
+                'watermark': Member.created_at,
+                'created': Member.created_at,
+                'filters': {'branch_id': Member.branch_id, 'status': Member.status, 'group_id': Member.group_id},
+                'target': 'dim_members'
+            },
+            'loans': {
+                'select': select(
+                    Loan.id.label('loan_id'), Loan.loan_number, Loan.member_id, Member.branch_id,
+                    Loan.loan_type_id, Loan.principle_amount, Loan.interest_amount, Loan.total_amount,
+                    Loan.outstanding_balance, Loan.status, Loan.application_date, Loan.disbursement_date,
+                    Loan.due_date, Loan.created_at,
+                    func.coalesce(Loan.updated_at, Loan.created_at).label('updated_at')
+                ).select_from(Loan).join(Member, Member.id == Loan.member_id),
+                'id': Loan.id,
+                'watermark': func.coalesce(Loan.updated_at, Loan.created_at),
+                'created': Loan.created_at,
+                'filters': {'branch_id': Member.branch_id, 'status': Loan.status, 'member_id': Loan.member_id},
+                'target': 'dim_loans'
+            },
+            'transactions': {
+                'select': select(
+                    Transaction.id.label('transaction_id'), Transaction.transaction_id.label('reference'),
+                    Transaction.member_id, Member.branch_id, Transaction.account_type,
+                    Transaction.transaction_type, Transaction.amount, Transaction.loan_id,
+                    Transaction.status, Transaction.created_at, Transaction.confirmed_at
+                ).select_from(Transaction).join(Member, Member.id == Transaction.member_id),
+                'id': Transaction.id,
+                # Pending rows are picked up again once they are confirmed
+                'watermark': func.coalesce(Transaction.confirmed_at, Transaction.created_at),
+                'created': Transaction.created_at,
+                'filters': {
+                    'branch_id': Member.branch_id, 'status': Transaction.status,
+                    'member_id': Transaction.member_id, 'transaction_type': Transaction.transaction_type
+                },
+                'target': 'fact_transactions'
+            },
+            'payments': {
+                'select': select(
+                    Transaction.id.label('payment_id'), Transaction.member_id, Member.branch_id,
+                    Transaction.loan_id, Transaction.amount, Transaction.mpesa_code, Transaction.status,
+                    Transaction.created_at, Transaction.confirmed_at
+                ).select_from(Transaction).join(Member, Member.id == Transaction.member_id).where(
+                    Transaction.transaction_type == 'loan_repayment'
+                ),
+                'id': Transaction.id,
+                'watermark': func.coalesce(Transaction.confirmed_at, Transaction.created_at),
+                'created': Transaction.created_at,
+                'filters': {'branch_id': Member.branch_id, 'status': Transaction.status, 'member_id': Transaction.member_id},
+                'target': 'fact_payments'
+            }
+        }
+
+    def _warehouse(self):
+        """Warehouse engine and metadata with the built-in dimension and fact tables and pipeline checkpoints"""
+        if self.warehouse_engine is not None:
+            return self.warehouse_engine
+
+        from sqlalchemy import (create_engine, MetaData, Table, Column, Integer, BigInteger, Text,
+                                Numeric, DateTime)
+
+        config = self.warehouse_config['default']
+        engine = create_engine(config['url'], future=True)
+        schema = config['schema'] if engine.dialect.name != 'sqlite' else None
+        metadata = MetaData(schema=schema)
+        money = Numeric(14, 2)
+
+        tables = {
+            'dim_members': Table(
+                'dim_members', metadata,
+                Column('member_id', Integer, primary_key=True, autoincrement=False),
+                Column('member_code', Text), Column('first_name', Text), Column('last_name', Text),
+                Column('phone', Text), Column('branch_id', Integer), Column('group_id', Integer),
+                Column('status', Text), Column('risk_score', Integer), Column('risk_category', Text),
+                Column('created_at', DateTime), Column('etl_loaded_at', DateTime)
+            ),
+            'dim_loans': Table(
+                'dim_loans', metadata,
+                Column('loan_id', Integer, primary_key=True, autoincrement=False),
+                Column('loan_number', Text), Column('member_id', Integer), Column('branch_id', Integer),
+                Column('loan_type_id', Integer), Column('principle_amount', money),
+                Column('interest_amount', money), Column('total_amount', money),
+                Column('outstanding_balance', money), Column('status', Text),
+                Column('application_date', DateTime), Column('disbursement_date', DateTime),
+                Column('due_date', DateTime), Column('created_at', DateTime), Column('updated_at', DateTime),
+                Column('etl_loaded_at', DateTime)
+            ),
+            'fact_transactions': Table(
+                'fact_transactions', metadata,
+                Column('transaction_id', BigInteger, primary_key=True, autoincrement=False),
+                Column('reference', Text), Column('member_id', Integer), Column('branch_id', Integer),
+                Column('account_type', Text), Column('transaction_type', Text), Column('amount', money),
+                Column('loan_id', Integer), Column('status', Text), Column('created_at', DateTime),
+                Column('confirmed_at', DateTime), Column('etl_loaded_at', DateTime)
+            ),
+            'fact_payments': Table(
+                'fact_payments', metadata,
+                Column('payment_id', BigInteger, primary_key=True, autoincrement=False),
+                Column('member_id', Integer), Column('branch_id', Integer), Column('loan_id', Integer),
+                Column('amount', money), Column('mpesa_code', Text), Column('status', Text),
+                Column('created_at', DateTime), Column('confirmed_at', DateTime),
+                Column('etl_loaded_at', DateTime)
+            ),
+            'etl_checkpoints': Table(
+                'etl_checkpoints', metadata,
+                Column('pipeline_id', Text, primary_key=True),
+                Column('checkpoint', Text, nullable=False),
+                Column('updated_at', DateTime)
+            )
+        }
+
+        if schema:
+            with engine.begin() as connection:
+                connection.exec_driver_sql(f'CREATE SCHEMA IF NOT EXISTS "{schema}"')
+        metadata.create_all(engine)
+
+        self.warehouse_metadata = metadata
+        self.warehouse_tables = tables
+        self.warehouse_engine = engine
+        return engine
+
+    def _target_table(self, name: str, keys: List[str], sample: Dict[str, Any]):
+        """
+        Return a warehouse table able to hold rows shaped like `sample`.
+
+        Custom targets are created on first load. Columns the rows carry but
+        the table lacks (enrich stages add some) are added as nullable columns.
+        """
+        from sqlalchemy import Table, Column, DateTime, inspect
+
+        engine = self._warehouse()
+        table = self.warehouse_tables.get(name)
+        if table is None:
+            if not TABLE_NAME.match(name):
+                raise ValueError(f"Invalid warehouse table name: {name}")
+            if not keys:
+                raise ValueError(f"Custom warehouse table {name} needs key columns for upserts")
+            columns = [Column(key, self._column_type(sample.get(key)), primary_key=True, autoincrement=False) for key in keys]
+            columns.append(Column('etl_loaded_at', DateTime))
+            table = Table(name, self.warehouse_metadata, *columns, extend_existing=True)
+            table.create(engine, checkfirst=True)
+            # A table left by an earlier process may already have more columns
+            for column in inspect(engine).get_columns(name, schema=table.schema):
+                if column['name'] not in table.c:
+                    table.append_column(Column(column['name'], column['type']))
+            self.warehouse_tables[name] = table
+
+        for field, value in sample.items():
+            if field in table.c:
+                continue
+            if not TABLE_NAME.match(field):
+                raise ValueError(f"Invalid warehouse column name: {field}")
+            column = Column(field, self._column_type(value))
+            preparer = engine.dialect.identifier_preparer
+            with engine.begin() as connection:
+                connection.exec_driver_sql(
+                    f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN "
+                    f"{preparer.quote(field)} {column.type.compile(dialect=engine.dialect)}"
+                )
+            table.append_column(column)
+        return table
+
+    @staticmethod
+    def _column_type(value):
+        from sqlalchemy import BigInteger, Text, Numeric, DateTime, Date, Boolean
+
+        if isinstance(value, bool):
+            return Boolean()
+        if isinstance(value, int):
+            return BigInteger()
+        if isinstance(value, (float, Decimal)):
+            return Numeric(18, 4)
+        if isinstance(value, datetime):
+            return DateTime()
+        if isinstance(value, date):
+            return Date()
+        return Text()
+
+    # ------------------------------------------------------------------
+    # Pipelines
+    # ------------------------------------------------------------------
+
+    def create_pipeline(self, name: str, source: str, target: Optional[str], schedule: str,
+                        transformations: Optional[List[Dict]] = None, filters: Optional[Dict] = None,
+                        keys: Optional[List[str]] = None) -> Dict[str, Any]:
         try:
+            if source not in self.sources():
+                return {'error': f"Unknown source. Use one of: {', '.join(self.sources())}"}
+            for transform in transformations or []:
+                self._validate_transform(transform)
+            if any(transform['type'] == 'aggregate' for transform in transformations or []):
+                self._validate_aggregate_target(target)
+
             pipeline = {
-                'pipeline_id': f"pipeline_{int(datetime.utcnow().timestamp())}",
+                'pipeline_id': f"pipeline_{int(datetime.utcnow().timestamp())}_{uuid.uuid4().hex[:6]}",
                 'name': name,
                 'source': source,
-                'target': target,
+                'target': target or self.sources()[source]['target'],
                 'schedule': schedule,
+                'transformations': transformations or [],
+                'filters': filters or {},
+                'keys': keys or [],
                 'status': 'active',
                 'created_at': datetime.utcnow().isoformat(),
                 'last_run': None,
                 'last_status': 'pending',
-                'run_count': 0
+                'run_count': 0,
+                'checkpoint': None
             }
-            
+
             key = f"etl_pipeline:{pipeline['pipeline_id']}"
             self.redis_client.setex(key, 86400*365, json.dumps(pipeline))
-            
+
             logging.info(f"ETL pipeline created: {name}")
             return pipeline
-        
+
+        except ValueError as e:
+            return {'error': str(e)}
         except Exception as e:
             logging.error(f"Pipeline creation error: {str(e)}")
             return {'error': str(e)}
-    
-    def extract_data(self, source: str, filters: Optional[Dict] = None) -> Dict[str, Any]:
+
+    def _validate_aggregate_target(self, target: Optional[str]):
+        """Aggregate rows have their own shape, so they need their own table"""
+        if not target:
+            raise ValueError('Aggregate pipelines need their own target table')
+        if target in self.warehouse_config['default']['tables']:
+            raise ValueError(f"Aggregate pipelines cannot load into the built-in table {target}")
+        if not TABLE_NAME.match(target):
+            raise ValueError(f"Invalid warehouse table name: {target}")
+
+    def run_pipeline(self, pipeline_id: str, full_refresh: bool = False) -> Dict[str, Any]:
+        """
+        Run a pipeline from its checkpoint through extract, transforms and load.
+
+        Stages are chained generators over record batches; each stage's rows
+        and exclusive time are recorded on the execution. With `full_refresh`
+        the checkpoint is discarded and aggregate targets are emptied first.
+        Aggregate pipelines extract by creation time, so changed rows are not
+        merged into their totals twice; one whose checkpoint predates that
+        is refreshed in full once. The checkpoint committed with the last
+        loaded chunk takes precedence over the copy kept on the pipeline.
+        """
+        pipeline = self._get_pipeline(pipeline_id)
+        if not pipeline:
+            return {'error': 'Pipeline not found', 'status': 'not_found'}
+        pipeline['checkpoint'] = self._stored_checkpoint(pipeline_id) or pipeline.get('checkpoint')
+
+        execution = {
+            'execution_id': f"exec_{int(datetime.utcnow().timestamp())}_{uuid.uuid4().hex[:6]}",
+            'pipeline_id': pipeline_id,
+            'started_at': datetime.utcnow().isoformat(),
+            'status': 'running',
+            'full_refresh': full_refresh,
+            'checkpoint_start': None if full_refresh else pipeline.get('checkpoint'),
+            'stages': {}
+        }
+
+        transformations = pipeline.get('transformations') or []
+        aggregate = next((t for t in transformations if t['type'] == 'aggregate'), None)
+        checkpoint = pipeline.get('checkpoint')
+        if aggregate and checkpoint and checkpoint.get('by') != 'created':
+            # Totals loaded by change time may already count re-extracted rows twice
+            full_refresh = execution['full_refresh'] = True
+            execution['checkpoint_start'] = None
+        self._save_execution(execution)
+
+        metrics = {}
+        try:
+            if aggregate:
+                self._validate_aggregate_target(pipeline['target'])
+            keys = pipeline.get('keys') or (aggregate.get('group_by') if aggregate else [])
+            merge = {name: spec[0] for name, spec in aggregate['metrics'].items()} if aggregate else {}
+
+            if full_refresh:
+                pipeline['checkpoint'] = None
+                self._reset(pipeline_id, pipeline['target'] if aggregate else None)
+
+            batches = self._meter('extract', self._extract_chunks(
+                pipeline['source'], pipeline.get('filters'), pipeline.get('checkpoint'), checkpoints=True,
+                by_created=aggregate is not None
+            ), metrics)
+            for index, transform in enumerate(transformations, start=1):
+                batches = self._meter(f"{transform['type']}_{index}", self._stage(batches, transform), metrics)
+
+            loaded = 0
+            load_seconds = 0.0
+            for batch, checkpoint in batches:
+                started = time.perf_counter()
+                # The checkpoint commits with the chunk it covers, so a crash never merges a chunk twice
+                loaded += self._load(pipeline['target'], batch, keys, merge,
+                                     checkpoint=(pipeline_id, checkpoint) if checkpoint else None)
+                load_seconds += time.perf_counter() - started
+                if checkpoint:
+                    pipeline['checkpoint'] = checkpoint
+                    self._save_pipeline(pipeline)
+            metrics['load'] = {'rows_in': loaded, 'rows_out': loaded, 'inclusive_seconds': load_seconds}
+
+            execution['status'] = 'completed'
+            pipeline['last_status'] = 'completed'
+
+        except Exception as e:
+            logging.error(f"Pipeline execution error: {str(e)}")
+            execution['status'] = 'failed'
+            execution['error'] = str(e)
+            pipeline['last_status'] = 'failed'
+
+        execution['stages'] = self._stage_report(metrics)
+        execution['checkpoint_end'] = pipeline.get('checkpoint')
+        execution['completed_at'] = datetime.utcnow().isoformat()
+        pipeline['last_run'] = execution['completed_at']
+        pipeline['run_count'] = pipeline.get('run_count', 0) + 1
+        self._save_pipeline(pipeline)
+        self._save_execution(execution)
+
+        logging.info(f"ETL pipeline executed: {pipeline_id} status={execution['status']}")
+        return execution
+
+    def get_pipeline_status(self, pipeline_id: str) -> Dict[str, Any]:
         try:
+            pipeline = self._get_pipeline(pipeline_id)
+            if pipeline:
+                executions = self.redis_client.lrange(f"etl_executions:{pipeline_id}", 0, 9)
+                pipeline['recent_executions'] = [json.loads(execution) for execution in executions]
+                return pipeline
+
+            return {'error': 'Pipeline not found', 'status': 'not_found'}
+
+        except Exception as e:
+            logging.error(f"Status check error: {str(e)}")
+            return {'error': str(e)}
+
+    def _get_pipeline(self, pipeline_id: str) -> Optional[Dict[str, Any]]:
+        pipeline = self.redis_client.get(f"etl_pipeline:{pipeline_id}")
+        return json.loads(pipeline) if pipeline else None
+
+    def _save_pipeline(self, pipeline: Dict[str, Any]):
+        self.redis_client.setex(f"etl_pipeline:{pipeline['pipeline_id']}", 86400*365, json.dumps(pipeline))
+
+    def _save_execution(self, execution: Dict[str, Any]):
+        payload = json.dumps(execution)
+        self.redis_client.setex(f"pipeline_execution:{execution['execution_id']}", 86400*7, payload)
+        if execution['status'] != 'running':
+            history = f"etl_executions:{execution['pipeline_id']}"
+            self.redis_client.lpush(history, payload)
+            self.redis_client.ltrim(history, 0, 49)
+
+    # ------------------------------------------------------------------
+    # Extract
+    # ------------------------------------------------------------------
+
+    def extract_data(self, source: str, filters: Optional[Dict] = None, limit: int = 100) -> Dict[str, Any]:
+        """Preview up to `limit` rows of a source, read with the same chunked extractor"""
+        try:
+            if source not in self.sources():
+                return {'source': source, 'error': f"Unknown source: {source}", 'status': 'error'}
+
+            data = []
+            for batch, _ in self._extract_chunks(source, filters, None, chunk_size=min(limit, self.chunk_size)):
+                data.extend(batch)
+                if len(data) >= limit:
+                    break
+            data = [self._serialize(row) for row in data[:limit]]
+
             result = {
                 'source': source,
                 'extracted_at': datetime.utcnow().isoformat(),
-                'record_count': 0,
-                'data': [],
+                'record_count': len(data),
+                'data': data,
                 'status': 'success'
             }
-            
-            if source == 'members':
-                result['data'] = self._extract_members(filters)
-            elif source == 'loans':
-                result['data'] = self._extract_loans(filters)
-            elif source == 'transactions':
-                result['data'] = self._extract_transactions(filters)
-            elif source == 'payments':
-                result['data'] = self._extract_payments(filters)
-            
-            result['record_count'] = len(result['data'])
-            
+
             logging.info(f"Data extracted: source={source}, records={result['record_count']}")
             return result
-        
+
         except Exception as e:
             logging.error(f"Extraction error: {str(e)}")
             return {'source': source, 'error': str(e), 'status': 'error'}
-    
-    def _extract_members(self, filters: Optional[Dict]) -> List[Dict]:
-        try:
-            from app.models import User, Branch
-            from app import db
-            
-            query = User.query
-            
-            if filters:
-                if 'branch_id' in filters:
-                    query = query.filter_by(branch_id=filters['branch_id'])
-                if 'status' in filters:
-                    query = query.filter_by(status=filters['status'])
-            
-            members = query.all()
-            
-            data = []
-            for m in members[:100]:
-                data.append({
-                    'member_id': m.id,
-                    'name': m.first_name + ' ' + m.last_name,
-                    'phone': m.phone,
-                    'email': m.email,
-                    'status': m.status,
-                    'created_at': m.created_at.isoformat() if m.created_at else None
-                })
-            
-            return data
-        except:
-            return []
-    
-    def _extract_loans(self, filters: Optional[Dict]) -> List[Dict]:
-        try:
-            from app.models import Loan, LoanProduct
-            from app import db
-            
-            query = Loan.query
-            
-            if filters and 'status' in filters:
-                query = query.filter_by(status=filters['status'])
-            
-            loans = query.all()
-            
-            data = []
-            for l in loans[:100]:
-                data.append({
-                    'loan_id': l.id,
-                    'member_id': l.member_id,
-                    'amount': float(l.amount),
-                    'status': l.status,
-                    'created_at': l.created_at.isoformat() if l.created_at else None
-                })
-            
-            return data
-        except:
-            return []
-    
-    def _extract_transactions(self, filters: Optional[Dict]) -> List[Dict]:
-        try:
-            from app.models import Transaction
-            from app import db
-            
-            query = Transaction.query
-            
-            if filters and 'member_id' in filters:
-                query = query.filter_by(member_id=filters['member_id'])
-            
-            transactions = query.all()
-            
-            data = []
-            for t in transactions[:100]:
-                data.append({
-                    'transaction_id': t.id,
-                    'member_id': t.member_id,
-                    'amount': float(t.amount),
-                    'type': t.transaction_type,
-                    'status': t.status,
-                    'created_at': t.created_at.isoformat() if t.created_at else None
-                })
-            
-            return data
-        except:
-            return []
-    
-    def _extract_payments(self, filters: Optional[Dict]) -> List[Dict]:
-        try:
-            from app.models import Transaction
-            from app import db
-            
-            query = Transaction.query.filter_by(transaction_type='payment')
-            
-            if filters and 'status' in filters:
-                query = query.filter_by(status=filters['status'])
-            
-            payments = query.all()
-            
-            data = []
-            for p in payments[:100]:
-                data.append({
-                    'payment_id': p.id,
-                    'member_id': p.member_id,
-                    'amount': float(p.amount),
-                    'status': p.status,
-                    'created_at': p.created_at.isoformat() if p.created_at else None
-                })
-            
-            return data
-        except:
-            return []
-    
+
+    def _extract_chunks(self, source: str, filters: Optional[Dict], checkpoint: Optional[Dict],
+                        chunk_size: Optional[int] = None, checkpoints: bool = False,
+                        by_created: bool = False) -> Iterator:
+        """
+        Yield (rows, checkpoint) chunks in (watermark, id) order after `checkpoint`.
+
+        Each chunk is one keyset-paginated query, so no cursor or transaction
+        stays open while later stages and the load run. Rows newer than the
+        watermark lag are left for the next run. With `by_created` the
+        creation time is the watermark, so a row is never extracted twice.
+        """
+        from sqlalchemy import tuple_, literal
+        from app import db
+
+        definition = self.sources()[source]
+        watermark = definition['created'] if by_created else definition['watermark']
+        row_id = definition['id']
+        until = datetime.utcnow() - timedelta(seconds=self.watermark_lag_seconds)
+        chunk_size = chunk_size or self.chunk_size
+
+        query = definition['select'].add_columns(watermark.label('_watermark'), row_id.label('_id'))
+        query = query.where(watermark < until)
+        for field, value in (filters or {}).items():
+            if field not in definition['filters']:
+                raise ValueError(f"Unsupported filter for {source}: {field}")
+            column = definition['filters'][field]
+            query = query.where(column.in_(value) if isinstance(value, list) else column == value)
+
+        position = (datetime.fromisoformat(checkpoint['watermark']), checkpoint['id']) if checkpoint else None
+        while True:
+            page = query
+            if position:
+                page = page.where(tuple_(watermark, row_id) > tuple_(literal(position[0]), literal(position[1])))
+            rows = db.session.execute(page.order_by(watermark, row_id).limit(chunk_size)).mappings().all()
+            db.session.rollback()
+            if not rows:
+                return
+
+            position = (rows[-1]['_watermark'], rows[-1]['_id'])
+            batch = [{k: v for k, v in row.items() if k not in ('_watermark', '_id')} for row in rows]
+            saved = None
+            if checkpoints:
+                saved = {'watermark': position[0].isoformat(), 'id': position[1]}
+                if by_created:
+                    saved['by'] = 'created'
+            yield batch, saved
+            if len(rows) < chunk_size:
+                return
+
+    # ------------------------------------------------------------------
+    # Transform
+    # ------------------------------------------------------------------
+
     def transform_data(self, data: List[Dict], transformations: Optional[List[Dict]] = None) -> Dict[str, Any]:
         try:
             result = {
@@ -212,116 +544,323 @@ class ETLService:
                 'transformations_applied': [],
                 'status': 'success'
             }
-            
+
             if not transformations:
                 result['transformed_count'] = len(data)
                 return result
-            
+
+            batches = iter([(data, None)])
             for transform in transformations:
-                if transform['type'] == 'filter':
-                    result['data'] = self._apply_filter(result['data'], transform)
-                elif transform['type'] == 'aggregate':
-                    result['data'] = self._apply_aggregate(result['data'], transform)
-                elif transform['type'] == 'enrich':
-                    result['data'] = self._apply_enrichment(result['data'], transform)
-                
+                self._validate_transform(transform)
+                batches = self._stage(batches, transform)
                 result['transformations_applied'].append(transform['type'])
-            
+
+            result['data'] = [self._serialize(row) for batch, _ in batches for row in batch]
             result['transformed_count'] = len(result['data'])
-            
+
             logging.info(f"Data transformed: original={result['original_count']}, final={result['transformed_count']}")
             return result
-        
+
         except Exception as e:
             logging.error(f"Transform error: {str(e)}")
             return {'error': str(e), 'status': 'error'}
-    
-    def _apply_filter(self, data: List[Dict], config: Dict) -> List[Dict]:
+
+    def _validate_transform(self, config: Dict):
+        kind = config.get('type')
+        if kind == 'filter':
+            if config.get('operator', 'equals') not in FILTER_OPERATORS:
+                raise ValueError(f"Unsupported filter operator. Use one of: {', '.join(FILTER_OPERATORS)}")
+        elif kind == 'aggregate':
+            if not config.get('group_by') or not config.get('metrics'):
+                raise ValueError('Aggregate transforms need group_by and metrics')
+            for name, spec in config['metrics'].items():
+                if spec[0] not in AGGREGATE_FUNCTIONS:
+                    raise ValueError(f"Unsupported aggregate for {name}. Use one of: {', '.join(AGGREGATE_FUNCTIONS)}")
+        elif kind == 'enrich':
+            if config.get('lookup') not in self._lookups():
+                raise ValueError(f"Unsupported lookup. Use one of: {', '.join(self._lookups())}")
+        else:
+            raise ValueError(f"Unsupported transform type: {kind}")
+
+    def _stage(self, batches: Iterator, config: Dict) -> Iterator:
+        if config['type'] == 'filter':
+            return self._apply_filter(batches, config)
+        if config['type'] == 'aggregate':
+            return self._apply_aggregate(batches, config)
+        return self._apply_enrichment(batches, config)
+
+    def _apply_filter(self, batches: Iterator, config: Dict) -> Iterator:
         field = config.get('field')
         value = config.get('value')
-        operator = config.get('operator', 'equals')
-        
-        filtered = []
-        for row in data:
-            if field in row:
-                if operator == 'equals' and row[field] == value:
-                    filtered.append(row)
-                elif operator == 'gt' and row[field] > value:
-                    filtered.append(row)
-                elif operator == 'lt' and row[field] < value:
-                    filtered.append(row)
-        
-        return filtered
-    
-    def _apply_aggregate(self, data: List[Dict], config: Dict) -> List[Dict]:
-        return data
-    
-    def _apply_enrichment(self, data: List[Dict], config: Dict) -> List[Dict]:
-        return data
-    
-    def load_to_warehouse(self, pipeline_id: str, data: List[Dict], target_table: str) -> Dict[str, Any]:
+        matches = FILTER_OPERATORS[config.get('operator', 'equals')]
+
+        for batch, checkpoint in batches:
+            yield [row for row in batch if field in row and matches(row[field], value)], checkpoint
+
+    def _apply_aggregate(self, batches: Iterator, config: Dict) -> Iterator:
+        """
+        Reduce each batch to one row per group.
+
+        Batches are aggregated independently and the load merges them into
+        the rows already in the warehouse (sums and counts add up, min/max
+        keep the extreme), so memory is bounded by the groups in one chunk.
+        Config: {'group_by': [...], 'metrics': {'name': ['sum', 'field'], ...}}.
+        """
+        group_by = config['group_by']
+        metrics = config['metrics']
+
+        for batch, checkpoint in batches:
+            groups = {}
+            for row in batch:
+                key = tuple(row.get(field) for field in group_by)
+                group = groups.get(key)
+                if group is None:
+                    group = groups[key] = dict(zip(group_by, key))
+                for name, spec in metrics.items():
+                    function, field = spec[0], spec[1] if len(spec) > 1 else None
+                    if function == 'count':
+                        group[name] = group.get(name, 0) + (1 if field is None or row.get(field) is not None else 0)
+                        continue
+                    value = row.get(field)
+                    if value is None:
+                        group.setdefault(name, None)
+                        continue
+                    current = group.get(name)
+                    if current is None:
+                        group[name] = value
+                    elif function == 'sum':
+                        group[name] = current + value
+                    elif function == 'min':
+                        group[name] = min(current, value)
+                    else:
+                        group[name] = max(current, value)
+            yield list(groups.values()), checkpoint
+
+    def _lookups(self) -> Dict[str, Any]:
+        from app.models import Branch, Group, LoanType, Member
+        return {
+            'branches': (Branch, {'name': Branch.name, 'location': Branch.location}),
+            'groups': (Group, {'name': Group.name, 'branch_id': Group.branch_id}),
+            'loan_types': (LoanType, {'name': LoanType.name, 'interest_rate': LoanType.interest_rate}),
+            'members': (Member, {'member_code': Member.member_code, 'branch_id': Member.branch_id,
+                                 'group_id': Member.group_id, 'status': Member.status}),
+        }
+
+    def _apply_enrichment(self, batches: Iterator, config: Dict) -> Iterator:
+        """
+        Join lookup attributes onto rows by key.
+
+        Config: {'lookup': 'branches', 'on': 'branch_id', 'fields': ['name'],
+        'prefix': 'branch_'}. Keys not seen in earlier batches are fetched with
+        one IN query per batch and cached for the rest of the run.
+        """
+        from sqlalchemy import select
+        from app import db
+
+        model, columns = self._lookups()[config['lookup']]
+        fields = config.get('fields') or list(columns)
+        unknown = [field for field in fields if field not in columns]
+        if unknown:
+            raise ValueError(f"Unsupported {config['lookup']} fields: {', '.join(unknown)}")
+        on = config['on']
+        prefix = config.get('prefix', f"{config['lookup'].rstrip('s')}_")
+        cache = {}
+
+        for batch, checkpoint in batches:
+            missing = {row.get(on) for row in batch if row.get(on) is not None} - cache.keys()
+            if missing:
+                query = select(model.id, *(columns[field].label(field) for field in fields)).where(model.id.in_(missing))
+                for record in db.session.execute(query).mappings():
+                    cache[record['id']] = {f"{prefix}{field}": record[field] for field in fields}
+                db.session.rollback()
+            empty = {f"{prefix}{field}": None for field in fields}
+            yield [{**row, **cache.get(row.get(on), empty)} for row in batch], checkpoint
+
+    # ------------------------------------------------------------------
+    # Load
+    # ------------------------------------------------------------------
+
+    def load_to_warehouse(self, pipeline_id: str, data: List[Dict], target_table: str,
+                          keys: Optional[List[str]] = None) -> Dict[str, Any]:
         try:
+            started = time.perf_counter()
+            loaded = 0
+            for offset in range(0, len(data), self.chunk_size):
+                loaded += self._load(target_table, data[offset:offset + self.chunk_size], keys or [], {})
+
             result = {
                 'pipeline_id': pipeline_id,
                 'target_table': target_table,
-                'records_loaded': len(data),
+                'records_loaded': loaded,
+                'seconds': round(time.perf_counter() - started, 3),
                 'loaded_at': datetime.utcnow().isoformat(),
                 'status': 'success'
             }
-            
-            key = f"warehouse_load:{pipeline_id}:{datetime.utcnow().timestamp()}"
-            self.redis_client.setex(key, 86400*30, json.dumps(result))
-            
-            logging.info(f"Data loaded to warehouse: table={target_table}, records={len(data)}")
+
+            logging.info(f"Data loaded to warehouse: table={target_table}, records={loaded}")
             return result
-        
+
         except Exception as e:
             logging.error(f"Load error: {str(e)}")
             return {'error': str(e), 'status': 'error'}
-    
-    def run_pipeline(self, pipeline_id: str) -> Dict[str, Any]:
-        try:
-            execution = {
-                'execution_id': f"exec_{int(datetime.utcnow().timestamp())}",
-                'pipeline_id': pipeline_id,
-                'started_at': datetime.utcnow().isoformat(),
-                'status': 'running',
-                'stages': {
-                    'extract': {'status': 'pending'},
-                    'transform': {'status': 'pending'},
-                    'load': {'status': 'pending'}
-                }
+
+    def _load(self, target: str, batch: List[Dict], keys: List[str], merge: Dict[str, str],
+              checkpoint: Optional[Tuple[str, Dict[str, Any]]] = None) -> int:
+        """
+        Upsert a batch into a warehouse table in one statement.
+
+        Rows replace earlier versions by primary key; columns listed in
+        `merge` are combined with the stored value by their aggregate instead.
+        A (pipeline id, checkpoint) pair is stored in the same transaction.
+        """
+        from sqlalchemy import func
+
+        engine = self._warehouse()
+        if not batch:
+            if checkpoint:
+                with engine.begin() as connection:
+                    self._save_checkpoint(connection, *checkpoint)
+            return 0
+
+        # Typed from the first non-null value of each field in the batch
+        sample = {}
+        for row in batch:
+            for field, value in row.items():
+                if sample.get(field) is None:
+                    sample[field] = value
+        table = self._target_table(target, keys, sample)
+        now = datetime.utcnow()
+        names = set(table.c.keys())
+        rows = [{**{k: v for k, v in row.items() if k in names}, 'etl_loaded_at': now} for row in batch]
+
+        if engine.dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+            least, greatest = func.least, func.greatest
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+            least, greatest = func.min, func.max
+
+        statement = insert(table)
+        primary_key = [column.name for column in table.primary_key.columns]
+        updates = {}
+        for column in rows[0]:
+            if column in primary_key:
+                continue
+            stored, incoming = table.c[column], statement.excluded[column]
+            function = merge.get(column)
+            if function in ('sum', 'count'):
+                updates[column] = func.coalesce(stored, 0) + func.coalesce(incoming, 0)
+            elif function == 'min':
+                updates[column] = func.coalesce(least(stored, incoming), stored, incoming)
+            elif function == 'max':
+                updates[column] = func.coalesce(greatest(stored, incoming), stored, incoming)
+            else:
+                updates[column] = incoming
+        statement = statement.on_conflict_do_update(index_elements=primary_key, set_=updates)
+
+        with engine.begin() as connection:
+            connection.execute(statement, rows)
+            if checkpoint:
+                self._save_checkpoint(connection, *checkpoint)
+        return len(rows)
+
+    def _save_checkpoint(self, connection, pipeline_id: str, checkpoint: Dict[str, Any]):
+        table = self.warehouse_tables['etl_checkpoints']
+        if connection.dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+
+        statement = insert(table).values(pipeline_id=pipeline_id, checkpoint=json.dumps(checkpoint),
+                                         updated_at=datetime.utcnow())
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=['pipeline_id'],
+            set_={'checkpoint': statement.excluded.checkpoint, 'updated_at': statement.excluded.updated_at}
+        ))
+
+    def _stored_checkpoint(self, pipeline_id: str) -> Optional[Dict[str, Any]]:
+        """Checkpoint committed with the pipeline's last loaded chunk"""
+        from sqlalchemy import select
+
+        engine = self._warehouse()
+        table = self.warehouse_tables['etl_checkpoints']
+        with engine.connect() as connection:
+            stored = connection.execute(
+                select(table.c.checkpoint).where(table.c.pipeline_id == pipeline_id)
+            ).scalar()
+        return json.loads(stored) if stored else None
+
+    def _reset(self, pipeline_id: str, target: Optional[str] = None):
+        """Forget a pipeline's checkpoint and, for aggregates, empty its target in the same transaction"""
+        from sqlalchemy import Table, inspect
+
+        engine = self._warehouse()
+        checkpoints = self.warehouse_tables['etl_checkpoints']
+        table = self.warehouse_tables.get(target) if target else None
+        if target and table is None:
+            # Custom tables from earlier processes are only known to the database
+            schema = self.warehouse_metadata.schema
+            if TABLE_NAME.match(target) and inspect(engine).has_table(target, schema=schema):
+                table = Table(target, self.warehouse_metadata, autoload_with=engine)
+        with engine.begin() as connection:
+            if table is not None:
+                connection.execute(table.delete())
+            connection.execute(checkpoints.delete().where(checkpoints.c.pipeline_id == pipeline_id))
+
+    # ------------------------------------------------------------------
+    # Helpers
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _meter(name: str, batches: Iterator, metrics: Dict[str, Dict[str, Any]]) -> Iterator:
+        """Count rows passing a stage boundary and the time spent producing them"""
+        # Registered before iteration starts so stages report in pipeline order
+        entry = metrics.setdefault(name, {'rows_out': 0, 'batches': 0, 'inclusive_seconds': 0.0})
+        return ETLService._metered(iter(batches), entry)
+
+    @staticmethod
+    def _metered(iterator: Iterator, entry: Dict[str, Any]) -> Iterator:
+        while True:
+            started = time.perf_counter()
+            try:
+                batch, checkpoint = next(iterator)
+            except StopIteration:
+                entry['inclusive_seconds'] += time.perf_counter() - started
+                return
+            entry['inclusive_seconds'] += time.perf_counter() - started
+            entry['rows_out'] += len(batch)
+            entry['batches'] += 1
+            yield batch, checkpoint
+
+    @staticmethod
+    def _stage_report(metrics: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Turn boundary timings into per-stage rows and exclusive seconds"""
+        report = {}
+        upstream_rows, upstream_seconds = None, 0.0
+        for name, entry in metrics.items():
+            if name == 'load':
+                seconds = entry['inclusive_seconds']
+            else:
+                # Time at a boundary includes every stage before it
+                seconds = entry['inclusive_seconds'] - upstream_seconds
+                upstream_seconds = entry['inclusive_seconds']
+            report[name] = {
+                'status': 'completed',
+                'rows_in': entry.get('rows_in', upstream_rows if upstream_rows is not None else entry['rows_out']),
+                'rows_out': entry['rows_out'],
+                'batches': entry.get('batches'),
+                'seconds': round(seconds, 4)
             }
-            
-            key = f"pipeline_execution:{execution['execution_id']}"
-            self.redis_client.setex(key, 86400*7, json.dumps(execution))
-            
-            logging.info(f"ETL pipeline executed: {pipeline_id}")
-            
-            execution['status'] = 'completed'
-            execution['completed_at'] = datetime.utcnow().isoformat()
-            for stage in execution['stages']:
-                execution['stages'][stage]['status'] = 'completed'
-            
-            return execution
-        
-        except Exception as e:
-            logging.error(f"Pipeline execution error: {str(e)}")
-            return {'error': str(e), 'status': 'error'}
-    
-    def get_pipeline_status(self, pipeline_id: str) -> Dict[str, Any]:
-        try:
-            key = f"etl_pipeline:{pipeline_id}"
-            pipeline = self.redis_client.get(key)
-            
-            if pipeline:
-                return json.loads(pipeline)
-            
-            return {'error': 'Pipeline not found', 'status': 'not_found'}
-        
-        except Exception as e:
-            logging.error(f"Status check error: {str(e)}")
-            return {'error': str(e)}
+            upstream_rows = entry['rows_out']
+        return report
+
+    @staticmethod
+    def _serialize(row: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            key: value.isoformat() if isinstance(value, (datetime, date)) else
+            float(value) if isinstance(value, Decimal) else value
+            for key, value in row.items()
+        }
 
 
 etl_service = ETLService()
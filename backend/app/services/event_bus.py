@@ -0,0 +1,188 @@
+"""
+Redis pub/sub event bus feeding the push gateway.
+
+Every event is published once to a single channel as JSON with its type, its
+payload and who should receive it: user ids, branch ids and role names (a
+session matches if any of them matches; an event with no target goes to
+everyone). Each push gateway process holds one subscription to the channel
+and fans events out to its open streams, so the number of Redis connections
+does not grow with the number of browsers.
+
+Database-driven events are collected by a session listener while the
+transaction runs and published only after it commits: new messages, new
+activity-log entries and loan status changes. Notifications are published by
+the notification service as they are delivered.
+"""
+import json
+import logging
+from datetime import datetime
+from itertools import chain
+from typing import Any, Dict, Iterable, List, Optional
+
+import redis
+from sqlalchemy import event as sa_event, inspect
+from sqlalchemy.orm import Session
+
+from app.models import ActivityLog, Loan, Member, Message, User
+from app.utils.session_state import discard_pending, track_savepoints
+
+# Session.info keys holding the events of the running transaction
+PENDING_EVENTS_KEY = 'event_bus_pending'
+PENDING_LOANS_KEY = 'event_bus_loans'
+PENDING_ACTIVITIES_KEY = 'event_bus_activities'
+
+DEFAULT_CHANNEL = 'events'
+# Roles that see every branch's loan and activity events
+OVERSIGHT_ROLES = ['admin']
+
+
+def encode_event(event_type: str, data: Dict[str, Any], user_ids: Optional[Iterable[int]] = None,
+                 branch_ids: Optional[Iterable[int]] = None, roles: Optional[Iterable[str]] = None) -> str:
+    return json.dumps({
+        'type': event_type,
+        'data': data,
+        'users': sorted({int(user_id) for user_id in user_ids or ()}),
+        'branches': sorted({int(branch_id) for branch_id in branch_ids or () if branch_id is not None}),
+        'roles': sorted(set(roles or ())),
+        'at': datetime.utcnow().isoformat()
+    }, default=str)
+
+
+class EventBus:
+    def __init__(self, app=None):
+        self.redis_client = None
+        self.app = None
+        self.channel = DEFAULT_CHANNEL
+        self._listeners_registered = False
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize event bus with Flask app"""
+        self.app = app
+        try:
+            self.redis_client = redis.from_url(app.config.get('REDIS_URL'), decode_responses=True)
+        except Exception as e:
+            logging.warning(f"Failed to initialize Redis for event bus: {str(e)}")
+
+        self.channel = app.config.get('EVENT_BUS_CHANNEL', self.channel)
+
+        if not self._listeners_registered:
+            sa_event.listen(Session, 'after_flush', self._on_flush)
+            sa_event.listen(Session, 'before_commit', self._before_commit)
+            sa_event.listen(Session, 'after_commit', self._on_commit)
+            sa_event.listen(Session, 'after_rollback', self._on_rollback)
+            track_savepoints(PENDING_EVENTS_KEY, PENDING_LOANS_KEY, PENDING_ACTIVITIES_KEY)
+            self._listeners_registered = True
+
+    # ------------------------------------------------------------------
+    # Publishing
+    # ------------------------------------------------------------------
+
+    def publish(self, event_type: str, data: Dict[str, Any], user_ids: Optional[Iterable[int]] = None,
+                branch_ids: Optional[Iterable[int]] = None, roles: Optional[Iterable[str]] = None) -> bool:
+        """Publish an event now"""
+        return self.publish_many([encode_event(event_type, data, user_ids, branch_ids, roles)])
+
+    def publish_after_commit(self, event_type: str, data: Dict[str, Any], user_ids: Optional[Iterable[int]] = None,
+                             branch_ids: Optional[Iterable[int]] = None, roles: Optional[Iterable[str]] = None,
+                             session: Optional[Session] = None):
+        """Publish an event once the surrounding transaction commits; dropped on rollback"""
+        from app import db
+        session = session or db.session
+        session.info.setdefault(PENDING_EVENTS_KEY, []).append(
+            encode_event(event_type, data, user_ids, branch_ids, roles)
+        )
+
+    def publish_many(self, messages: List[str]) -> bool:
+        if not self.redis_client or not messages:
+            return False
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for message in messages:
+                pipe.publish(self.channel, message)
+            pipe.execute()
+            return True
+        except redis.RedisError as e:
+            logging.warning(f"Failed to publish {len(messages)} events: {str(e)}")
+            return False
+
+    # ------------------------------------------------------------------
+    # Write path
+    # ------------------------------------------------------------------
+
+    def _on_flush(self, session, flush_context):
+        for instance in session.new:
+            if isinstance(instance, Message):
+                session.info.setdefault(PENDING_EVENTS_KEY, []).append(encode_event('message', {
+                    'messageId': instance.id,
+                    'conversationId': instance.conversation_id,
+                    'senderId': instance.sender_id,
+                    'recipientId': instance.recipient_id,
+                    'preview': instance.content[:140]
+                }, user_ids=[instance.sender_id, instance.recipient_id]))
+            elif isinstance(instance, ActivityLog):
+                session.info.setdefault(PENDING_ACTIVITIES_KEY, []).append(instance.to_dict())
+
+        for instance in chain(session.new, session.dirty):
+            if isinstance(instance, Loan):
+                history = inspect(instance).attrs.status.history
+                if instance in session.new or history.has_changes():
+                    previous = history.deleted[0] if history.deleted else None
+                    if previous != instance.status:
+                        session.info.setdefault(PENDING_LOANS_KEY, []).append({
+                            'loanId': instance.id,
+                            'loanNumber': instance.loan_number,
+                            'memberId': instance.member_id,
+                            'status': instance.status,
+                            'previousStatus': previous
+                        })
+
+    def _before_commit(self, session):
+        """Resolve who receives loan and activity events, one query each"""
+        if session.in_nested_transaction():
+            # Releasing a savepoint also fires the commit events; wait for the outer commit
+            return
+        session.flush()
+        loans = session.info.pop(PENDING_LOANS_KEY, None)
+        activities = session.info.pop(PENDING_ACTIVITIES_KEY, None)
+        pending = session.info.setdefault(PENDING_EVENTS_KEY, [])
+
+        if loans:
+            member_ids = {loan['memberId'] for loan in loans}
+            branches = dict(session.query(Member.id, Member.branch_id).filter(Member.id.in_(member_ids)).all())
+            for loan in loans:
+                branch_id = branches.get(loan['memberId'])
+                pending.append(encode_event('loan.status', dict(loan, branchId=branch_id),
+                                            branch_ids=[branch_id], roles=OVERSIGHT_ROLES))
+
+        if activities:
+            user_ids = {activity['userId'] for activity in activities}
+            users = {row.id: row for row in session.query(
+                User.id, User.first_name, User.last_name
+            ).filter(User.id.in_(user_ids)).all()}
+            for activity in activities:
+                user = users.get(activity['userId'])
+                activity['userName'] = f"{user.first_name} {user.last_name}" if user else None
+                pending.append(encode_event('activity', activity, user_ids=[activity['userId']],
+                                            roles=OVERSIGHT_ROLES))
+
+    def _on_commit(self, session):
+        if session.in_nested_transaction():
+            return
+        messages = session.info.pop(PENDING_EVENTS_KEY, None)
+        self._clear(session)
+        if messages:
+            self.publish_many(messages)
+
+    def _on_rollback(self, session):
+        discard_pending(session, PENDING_EVENTS_KEY, PENDING_LOANS_KEY, PENDING_ACTIVITIES_KEY)
+
+    @staticmethod
+    def _clear(session):
+        session.info.pop(PENDING_LOANS_KEY, None)
+        session.info.pop(PENDING_ACTIVITIES_KEY, None)
+
+
+event_bus = EventBus()
@@ -2,7 +2,7 @@ from app.models import (
     FieldOfficerVisit, MobileLoanApplication, PhotoDocument, SyncQueue,
     FieldOfficerPerformance, BiometricAuth, User, Member, LoanType, Loan, Role
 )
-from app import db
+from app import db, cache
 from sqlalchemy import func, desc, and_
 from datetime import datetime, timedelta
 import json
@@ -340,7 +340,7 @@ class FieldOperationsService:
     def get_officer_performance(user_id, period='month'):
         try:
             cache_key = f"performance:{user_id}:{period}"
-            cached = None
+            cached = cache.get(cache_key)
             
             if cached:
                 return json.loads(cached)
@@ -352,8 +352,7 @@ class FieldOperationsService:
                 db.session.commit()
             
             result = perf.to_dict()
-            if False:
-                redis_client.setex(cache_key, FieldOperationsService.CACHE_TIMEOUT, json.dumps(result))
+            cache.set(cache_key, json.dumps(result), timeout=FieldOperationsService.CACHE_TIMEOUT)
             
             return result
         except Exception as e:
@@ -442,8 +441,7 @@ class FieldOperationsService:
     @staticmethod
     def _invalidate_cache(key_pattern):
         try:
-            if False:
-                redis_client.delete(key_pattern)
+            cache.delete(key_pattern)
         except Exception as e:
             logger.error(f"Error invalidating cache: {str(e)}")
 
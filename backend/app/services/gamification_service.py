@@ -155,7 +155,7 @@ class GamificationService:
     def get_user_achievements(user_id):
         """Get all achievements for a user"""
         cache_key = f"user_achievements:{user_id}"
-        cached = None
+        cached = cache.get(cache_key)
 
         if cached:
             return json.loads(cached)
@@ -163,8 +163,7 @@ class GamificationService:
         achievements = UserAchievement.query.filter_by(user_id=user_id).all()
         result = [ua.to_dict() for ua in achievements]
 
-        if False:
-            cache.set(cache_key, json.dumps(result))
+        cache.set(cache_key, json.dumps(result))
 
         return result
 
@@ -189,7 +188,7 @@ class GamificationService:
     def get_active_challenges():
         """Get all active challenges"""
         cache_key = "active_challenges"
-        cached = None
+        cached = cache.get(cache_key)
 
         if cached:
             return json.loads(cached)
@@ -202,8 +201,7 @@ class GamificationService:
 
         result = [c.to_dict() for c in challenges]
 
-        if False:
-            cache.set(cache_key, json.dumps(result))
+        cache.set(cache_key, json.dumps(result))
 
         return result
 
@@ -358,7 +356,7 @@ class GamificationService:
     def get_leaderboard(limit=20):
         """Get top users leaderboard"""
         cache_key = f"leaderboard:top:{limit}"
-        cached = None
+        cached = cache.get(cache_key)
 
         if cached:
             return json.loads(cached)
@@ -366,8 +364,7 @@ class GamificationService:
         leaderboards = Leaderboard.query.order_by(Leaderboard.rank).limit(limit).all()
         result = [lb.to_dict() for lb in leaderboards]
 
-        if False:
-            cache.set(cache_key, json.dumps(result))
+        cache.set(cache_key, json.dumps(result))
 
         return result
 
@@ -375,7 +372,7 @@ class GamificationService:
     def get_branch_leaderboard(branch_id, limit=20):
         """Get branch-specific leaderboard"""
         cache_key = f"leaderboard:branch:{branch_id}:{limit}"
-        cached = None
+        cached = cache.get(cache_key)
 
         if cached:
             return json.loads(cached)
@@ -386,8 +383,7 @@ class GamificationService:
 
         result = [lb.to_dict() for lb in leaderboards]
 
-        if False:
-            cache.set(cache_key, json.dumps(result))
+        cache.set(cache_key, json.dumps(result))
 
         return result
 
@@ -402,29 +398,23 @@ class GamificationService:
     @staticmethod
     def _invalidate_user_cache(user_id):
         """Invalidate user-specific caches"""
-        if False:
-            redis_client.delete(f"user_achievements:{user_id}")
-            redis_client.delete(f"user_points:{user_id}")
+        cache.delete(f"user_achievements:{user_id}")
+        cache.delete(f"user_points:{user_id}")
 
     @staticmethod
     def _invalidate_challenge_cache():
         """Invalidate challenge caches"""
-        if False:
-            redis_client.delete("active_challenges")
+        cache.delete("active_challenges")
 
     @staticmethod
     def _invalidate_rewards_cache():
         """Invalidate rewards caches"""
-        if False:
-            redis_client.delete("available_rewards")
+        cache.delete("available_rewards")
 
     @staticmethod
     def _invalidate_leaderboard_cache():
         """Invalidate leaderboard caches"""
-        if False:
-            pattern = "leaderboard:*"
-            for key in redis_client.scan_iter(match=pattern):
-                redis_client.delete(key)
+        cache.cache.delete_matching("leaderboard:")
 
     @staticmethod
     def get_gamification_summary(user_id):
@@ -1,7 +1,3 @@
-from app.models import LoanProduct, LoanProductItem, Loan
-from app import db
-from sqlalchemy import func
-from datetime import datetime, timedelta
 import pandas as pd
 import numpy as np
 
@@ -11,19 +7,16 @@ class InventoryService:
         """
         Check for products with low stock
         """
-        low_stock_products = LoanProduct.query.filter(
-            LoanProduct.stock_quantity <= LoanProduct.low_stock_threshold
-        ).all()
+        from app.services.stock_service import stock_service
         
         alerts = []
-        for product in low_stock_products:
-            status = 'critical' if product.stock_quantity <= product.critical_stock_threshold else 'low'
+        for alert in stock_service.get_alerts():
             alerts.append({
-                'product_id': product.id,
-                'name': product.name,
-                'current_stock': product.stock_quantity,
-                'threshold': product.low_stock_threshold,
-                'status': status
+                'product_id': alert.product_id,
+                'name': alert.product.name,
+                'current_stock': alert.stock_quantity,
+                'threshold': alert.product.low_stock_threshold,
+                'status': alert.level
             })
             
         return alerts
@@ -33,17 +26,21 @@ class InventoryService:
         """
         Predict demand for a product for the next N days
         """
-        # Get historical usage
-        start_date = datetime.utcnow() - timedelta(days=90)
-        usage = db.session.query(
-            func.date(Loan.created_at).label('date'),
-            func.sum(LoanProductItem.quantity).label('quantity')
-        ).join(LoanProductItem.loan)\
-         .filter(
-             LoanProductItem.product_id == product_id,
-             Loan.created_at >= start_date
-         ).group_by(func.date(Loan.created_at)).all()
-         
+        from app.models import DemandForecast
+        from app.services.inventory_intelligence_service import demand_forecasting
+        
+        # Prefer the fitted daily demand from the last batch forecast run
+        fitted = DemandForecast.query.filter_by(product_id=product_id, branch_id=None).first()
+        if fitted:
+            return {
+                'forecast': int(np.ceil(fitted.daily_demand * days)),
+                'daily_average': round(fitted.daily_demand, 2),
+                'method': fitted.method,
+                'computed_at': fitted.computed_at.isoformat(),
+                'confidence': 'high' if fitted.history_days >= 90 else 'medium'
+            }
+        
+        usage = demand_forecasting._get_historical_demand(product_id, days=90)
         if not usage:
             return {'forecast': 0, 'confidence': 'low'}
             
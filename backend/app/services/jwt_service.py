@@ -15,11 +15,46 @@ from flask_jwt_extended import (
     JWTManager,
     verify_jwt_in_request
 )
-from flask import current_app, request, jsonify
+from flask import current_app, has_request_context, request, jsonify
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+import hashlib
 import logging
 import json
+import math
+import random
+import threading
+import time
+from collections import Counter
+
+REVOCATION_CHANNEL = 'jwt:revocations'
+
+# High-volume events that are aggregated into per-minute counters rather than logged one by one
+ACCESS_EVENT_TYPES = {'api_access'}
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings using double hashing"""
+    
+    def __init__(self, capacity: int = 100000, error_rate: float = 0.001):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+    
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+    
+    def add(self, item: str):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+    
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
 
 class JWTService:
     def __init__(self, app=None):
@@ -27,6 +62,19 @@ class JWTService:
         self.redis_client = None
         self.limiter = None
         self.blocked_tokens = set()
+        # Revocation state kept current via pub/sub so the common path skips Redis
+        self.bloom_capacity = 100000
+        self.revoked_filter = BloomFilter(self.bloom_capacity)
+        self.token_versions = {}
+        self._listener_thread = None
+        # Buffered auth-event pipeline: (minute, user, endpoint, outcome) -> count
+        self.auth_event_sample_rate = 0.01
+        self.auth_event_flush_interval = 10
+        self._access_counters = Counter()
+        self._sampled_events = []
+        self._local_access_stats = {}
+        self._buffer_lock = threading.Lock()
+        self._flush_thread = None
         
         if app:
             self.init_app(app)
@@ -74,6 +122,15 @@ class JWTService:
         # Set up JWT callbacks
         self._setup_jwt_callbacks(app)
         
+        self.bloom_capacity = app.config.get('JWT_REVOCATION_BLOOM_CAPACITY', 100000)
+        if self.redis_client:
+            self._rebuild_revocation_filter()
+            self._start_revocation_listener()
+        
+        self.auth_event_sample_rate = app.config.get('AUTH_EVENT_SAMPLE_RATE', 0.01)
+        self.auth_event_flush_interval = app.config.get('AUTH_EVENT_FLUSH_SECONDS', 10)
+        self._start_auth_event_flusher()
+        
         logging.info("JWT Service initialized successfully")
     
     def _setup_jwt_callbacks(self, app):
@@ -83,12 +140,7 @@ class JWTService:
         @self.jwt.token_in_blocklist_loader
         def check_if_token_revoked(jwt_header, jwt_payload):
             """Check if JWT token is blacklisted"""
-            jti = jwt_payload['jti']
-            if self.redis_client:
-                return self.redis_client.sismember('blocked_tokens', jti)
-            else:
-                # Use in-memory set when Redis is not available
-                return jti in self.blocked_tokens
+            return self.is_token_revoked(jwt_payload)
         
         @self.jwt.revoked_token_loader
         def revoked_token_callback(jwt_header, jwt_payload):
@@ -127,12 +179,14 @@ class JWTService:
         """Create access and refresh tokens"""
         try:
             # Additional claims for access token
+            token_version = self.get_token_version(user_id)
             access_token_claims = {
                 'user_id': user_id,
                 'role': user_data.get('role'),
                 'branch_id': user_data.get('branch_id'),
                 'iat': datetime.utcnow(),
-                'type': 'access'
+                'type': 'access',
+                'tv': token_version
             }
             
             # Create tokens
@@ -143,7 +197,7 @@ class JWTService:
             
             refresh_token = create_refresh_token(
                 identity=user_id,
-                additional_claims={'type': 'refresh'}
+                additional_claims={'type': 'refresh', 'tv': token_version}
             )
             
             # Store refresh token in Redis for validation (if Redis is available)
@@ -175,46 +229,131 @@ class JWTService:
             raise
     
 
-    def revoke_token(self, jti: str) -> bool:
-        """Revoke a JWT token by adding to blacklist"""
+    def is_token_revoked(self, jwt_payload: Dict[str, Any]) -> bool:
+        """Check per-user token version, then the per-token blocklist"""
+        user_id = jwt_payload.get('sub')
+        if user_id is not None and jwt_payload.get('tv', 0) < self.get_token_version(user_id):
+            return True
+        
+        jti = jwt_payload['jti']
+        if not self.redis_client:
+            # Use in-memory set when Redis is not available
+            return jti in self.blocked_tokens
+        if jti not in self.revoked_filter:
+            # Definitely not revoked - no network round-trip
+            return False
+        try:
+            return bool(self.redis_client.exists(f"revoked_token:{jti}"))
+        except Exception as e:
+            logging.warning(f"Revocation lookup failed, trusting Bloom filter: {str(e)}")
+            return True
+    
+    def get_token_version(self, user_id) -> int:
+        """Current token version for a user, cached in-process"""
+        user_id = str(user_id)
+        version = self.token_versions.get(user_id)
+        if version is not None:
+            return version
+        version = 0
+        if self.redis_client:
+            try:
+                version = int(self.redis_client.get(f"token_version:{user_id}") or 0)
+            except Exception as e:
+                logging.warning(f"Failed to read token version for user {user_id}: {str(e)}")
+                return 0
+        self.token_versions[user_id] = version
+        return version
+
+    def revoke_token(self, jti: str, expires_at: Optional[int] = None) -> bool:
+        """Revoke a JWT token until its own expiry (exp claim, epoch seconds)"""
         try:
+            ttl = int(expires_at - time.time()) if expires_at else 3600
+            if ttl <= 0:
+                return True  # Already expired, nothing to block
+            
+            self.blocked_tokens.add(jti)
+            self.revoked_filter.add(jti)
             if self.redis_client:
-                self.redis_client.sadd('blocked_tokens', jti)
-                self.redis_client.expire('blocked_tokens', 3600)  # 1 hour
-                logging.info(f"Token {jti} revoked")
+                pipe = self.redis_client.pipeline()
+                pipe.setex(f"revoked_token:{jti}", ttl, '1')
+                pipe.publish(REVOCATION_CHANNEL, json.dumps({'jti': jti}))
+                pipe.execute()
+                logging.info(f"Token {jti} revoked for {ttl}s")
             else:
-                # Use in-memory set when Redis is not available
-                self.blocked_tokens.add(jti)
                 logging.info(f"Token {jti} revoked (in-memory)")
             return True
         except Exception as e:
             logging.error(f"Error revoking token {jti}: {str(e)}")
             return False
-    
+
+    def revoke_current_token(self) -> bool:
+        """Revoke the JWT sent with the current request, if there is one"""
+        try:
+            verify_jwt_in_request(optional=True)
+        except Exception:
+            return False
+
+        jwt_claims = get_jwt()
+        if not jwt_claims.get('jti'):
+            return False
+        return self.revoke_token(jwt_claims['jti'], jwt_claims.get('exp'))
 
     def revoke_user_tokens(self, user_id: int) -> bool:
-        """Revoke all tokens for a user"""
+        """Revoke all tokens for a user by bumping their token version"""
         try:
             if self.redis_client:
-                # Add wildcard pattern for all user tokens
-                pattern = f"access_token:{user_id}:*"
-                keys = self.redis_client.keys(pattern)
-                
-                for key in keys:
-                    self.redis_client.sadd('blocked_tokens', key)
-                    self.redis_client.delete(key)
+                pipe = self.redis_client.pipeline()
+                pipe.incr(f"token_version:{user_id}")
+                pipe.expire(f"token_version:{user_id}", 30*24*60*60)  # Outlives any refresh token
+                version = pipe.execute()[0]
+                self.redis_client.publish(REVOCATION_CHANNEL, json.dumps({'user_id': str(user_id), 'tv': version}))
             else:
-                # Use in-memory set when Redis is not available
-                # This is a simplified approach - in production you'd want more sophisticated token tracking
-                logging.info(f"Cannot revoke all tokens for user {user_id} without Redis")
+                version = self.get_token_version(user_id) + 1
             
-            logging.info(f"All tokens revoked for user {user_id}")
+            self.token_versions[str(user_id)] = version
+            logging.info(f"All tokens revoked for user {user_id} (token version {version})")
             return True
             
         except Exception as e:
             logging.error(f"Error revoking user tokens {user_id}: {str(e)}")
             return False
     
+    def _rebuild_revocation_filter(self):
+        """Rebuild the Bloom filter from live revocation keys (SCAN, never KEYS)"""
+        try:
+            fresh = BloomFilter(self.bloom_capacity)
+            for key in self.redis_client.scan_iter(match='revoked_token:*', count=1000):
+                fresh.add(key.split(':', 1)[1])
+            self.revoked_filter = fresh
+            self.token_versions = {}
+        except Exception as e:
+            logging.warning(f"Failed to rebuild revocation filter: {str(e)}")
+    
+    def _start_revocation_listener(self):
+        if self._listener_thread and self._listener_thread.is_alive():
+            return
+        self._listener_thread = threading.Thread(
+            target=self._listen_for_revocations, name='jwt-revocations', daemon=True
+        )
+        self._listener_thread.start()
+    
+    def _listen_for_revocations(self):
+        """Apply revocations published by other workers; resync after reconnects"""
+        while True:
+            try:
+                pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(REVOCATION_CHANNEL)
+                self._rebuild_revocation_filter()
+                for message in pubsub.listen():
+                    event = json.loads(message['data'])
+                    if 'jti' in event:
+                        self.revoked_filter.add(event['jti'])
+                    if 'user_id' in event:
+                        self.token_versions[event['user_id']] = int(event['tv'])
+            except Exception as e:
+                logging.warning(f"Revocation listener disconnected: {str(e)}")
+                time.sleep(5)
+    
     def limit(self, limit_value: str):
         """Rate limiting decorator"""
         if self.limiter:
@@ -235,34 +374,150 @@ class JWTService:
     
 
     def log_auth_event(self, event_type: str, user_id: Optional[int] = None, 
-                      ip_address: str = None, details: str = None):
-        """Log authentication events for audit trail"""
+                      ip_address: str = None, details: str = None,
+                      endpoint: str = None, outcome: str = None):
+        """Log authentication events for audit trail.
+        
+        Access events only bump an in-memory counter (plus a sampled detail record)
+        and are flushed in the background; security events are stored individually.
+        """
         try:
+            # Celery tasks and CLI commands log events outside any request
+            in_request = has_request_context()
+            endpoint = endpoint or (request.endpoint if in_request else None)
+            outcome = outcome or ('success' if event_type in ACCESS_EVENT_TYPES else event_type)
+            minute = datetime.utcnow().strftime('%Y%m%d%H%M')
+            
+            with self._buffer_lock:
+                self._access_counters[(minute, user_id, endpoint, outcome)] += 1
+            if self._flush_thread is None:
+                self._start_auth_event_flusher()
+            
+            is_access_event = event_type in ACCESS_EVENT_TYPES
+            if is_access_event and random.random() >= self.auth_event_sample_rate:
+                return
+            
             log_data = {
                 'timestamp': datetime.utcnow().isoformat(),
                 'event_type': event_type,
                 'user_id': user_id,
-                'ip_address': ip_address or request.remote_addr,
-                'user_agent': request.headers.get('User-Agent', ''),
+                'ip_address': ip_address or (request.remote_addr if in_request else None),
+                'user_agent': request.headers.get('User-Agent', '') if in_request else '',
                 'details': details or ''
             }
             
+            if is_access_event:
+                with self._buffer_lock:
+                    self._sampled_events.append(log_data)
+                return
+            
             logging.info(f"AUTH EVENT: {log_data}")
             
             # Store in Redis for analytics (if Redis is available)
             if self.redis_client:
                 try:
                     log_key = f"auth_log:{datetime.utcnow().strftime('%Y%m%d')}"
-                    self.redis_client.lpush(log_key, json.dumps(log_data))
-                    self.redis_client.expire(log_key, 7*24*60*60)  # 7 days
+                    pipe = self.redis_client.pipeline()
+                    pipe.lpush(log_key, json.dumps(log_data))
+                    pipe.expire(log_key, 7*24*60*60)  # 7 days
+                    pipe.execute()
                 except Exception as redis_error:
                     logging.warning(f"Failed to store auth event in Redis: {redis_error}")
-            else:
-                logging.info("Redis not available, skipping auth event storage")
             
         except Exception as e:
             logging.error(f"Error logging auth event: {str(e)}")
     
+    def _start_auth_event_flusher(self):
+        if self._flush_thread and self._flush_thread.is_alive():
+            return
+        self._flush_thread = threading.Thread(
+            target=self._flush_loop, name='auth-event-flush', daemon=True
+        )
+        self._flush_thread.start()
+    
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.auth_event_flush_interval)
+            self.flush_auth_events()
+    
+    def flush_auth_events(self) -> int:
+        """Write buffered counters and sampled events in one pipeline; returns counters flushed"""
+        with self._buffer_lock:
+            counters, self._access_counters = self._access_counters, Counter()
+            sampled, self._sampled_events = self._sampled_events, []
+        
+        if not counters and not sampled:
+            return 0
+        
+        if self.redis_client:
+            try:
+                pipe = self.redis_client.pipeline(transaction=False)
+                touched = set()
+                for (minute, user_id, endpoint, outcome), count in counters.items():
+                    key = f"auth_stats:{minute}"
+                    pipe.hincrby(key, f"{user_id}|{endpoint}|{outcome}", count)
+                    touched.add(key)
+                for key in touched:
+                    pipe.expire(key, 7*24*60*60)  # 7 days
+                if sampled:
+                    log_key = f"auth_log:{datetime.utcnow().strftime('%Y%m%d')}"
+                    pipe.lpush(log_key, *[json.dumps(event) for event in sampled])
+                    pipe.expire(log_key, 7*24*60*60)
+                pipe.execute()
+                return len(counters)
+            except Exception as e:
+                logging.warning(f"Failed to flush auth events to Redis, keeping them locally: {str(e)}")
+        
+        # No Redis: keep a bounded local history that the stats API can read
+        cutoff = (datetime.utcnow() - timedelta(hours=24)).strftime('%Y%m%d%H%M')
+        with self._buffer_lock:
+            for (minute, user_id, endpoint, outcome), count in counters.items():
+                bucket = self._local_access_stats.setdefault(minute, Counter())
+                bucket[f"{user_id}|{endpoint}|{outcome}"] += count
+            for minute in [m for m in self._local_access_stats if m < cutoff]:
+                del self._local_access_stats[minute]
+        return len(counters)
+    
+    def get_access_stats(self, minutes: int = 60, group_by: str = 'endpoint',
+                         user_id: Optional[int] = None, endpoint: Optional[str] = None) -> Dict[str, Any]:
+        """Access counts per endpoint or per user over the last N minutes, read from the counters"""
+        now = datetime.utcnow()
+        buckets = [(now - timedelta(minutes=i)).strftime('%Y%m%d%H%M') for i in range(minutes)]
+        
+        rows = None
+        if self.redis_client:
+            try:
+                pipe = self.redis_client.pipeline(transaction=False)
+                for minute in buckets:
+                    pipe.hgetall(f"auth_stats:{minute}")
+                rows = pipe.execute()
+            except redis.RedisError as e:
+                logging.warning(f"Failed to read auth stats from Redis, using local counters: {str(e)}")
+        if rows is None:
+            # Failed flushes are kept in the local history
+            with self._buffer_lock:
+                rows = [dict(self._local_access_stats.get(minute, {})) for minute in buckets]
+        
+        stats = {}
+        for row in rows:
+            for field, count in row.items():
+                field_user, field_endpoint, outcome = field.split('|', 2)
+                if user_id is not None and field_user != str(user_id):
+                    continue
+                if endpoint is not None and field_endpoint != endpoint:
+                    continue
+                group_key = field_user if group_by == 'user' else field_endpoint
+                entry = stats.setdefault(group_key, {'total': 0})
+                entry['total'] += int(count)
+                entry[outcome] = entry.get(outcome, 0) + int(count)
+        
+        return {
+            'window_minutes': minutes,
+            'group_by': group_by,
+            'stats': dict(sorted(stats.items(), key=lambda item: item[1]['total'], reverse=True)),
+            'generated_at': now.isoformat()
+        }
+    
     def get_current_user(self) -> Optional[Dict[str, Any]]:
         """Get current authenticated user information"""
         try:
@@ -308,7 +563,8 @@ class JWTService:
                     'role': user_data.get('role'),
                     'branch_id': user_data.get('branch_id'),
                     'iat': datetime.utcnow(),
-                    'type': 'access'
+                    'type': 'access',
+                    'tv': get_jwt().get('tv', 0)
                 }
             )
             
@@ -333,7 +589,9 @@ def jwt_required_api(fn):
             jwt_service.log_auth_event(
                 'api_access',
                 user_id,
-                details=f"API: {request.endpoint}"
+                details=f"API: {request.endpoint}",
+                endpoint=request.endpoint,
+                outcome='success'
             )
         except Exception as e:
             logging.warning(f"Failed to log auth event: {str(e)}")
@@ -359,7 +617,9 @@ def role_required(*roles):
                 jwt_service.log_auth_event(
                     'access_denied',
                     current_user.get('id'),
-                    details=f"Role {user_role} attempted to access {request.endpoint}"
+                    details=f"Role {user_role} attempted to access {request.endpoint}",
+                    endpoint=request.endpoint,
+                    outcome='denied'
                 )
                 return jsonify({'error': 'Insufficient permissions'}), 403
             
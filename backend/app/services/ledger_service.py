@@ -0,0 +1,268 @@
+"""
+Ledger posting engine.
+
+Every balance change on a savings or drawdown account (and every reduction of a
+loan's outstanding balance) goes through `post_entries`. The engine locks the
+affected rows with SELECT ... FOR UPDATE in a fixed order - account tables by
+name, then loans, each by id - applies the batch in memory and bulk-inserts the
+Transaction rows with running balances taken from the locked rows. Callers own
+the surrounding transaction and commit or roll back.
+"""
+import uuid
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app import db
+from app.models import SavingsAccount, DrawdownAccount, Member, Loan, Transaction
+from app.services.summary_service import summary_service
+
+ACCOUNT_MODELS = {'drawdown': DrawdownAccount, 'savings': SavingsAccount}
+ACCOUNT_PREFIXES = {'drawdown': 'DRD', 'savings': 'SAV'}
+
+# Direction used when an entry does not name one
+DEFAULT_DIRECTIONS = {
+    'deposit': 'credit',
+    'withdrawal': 'debit',
+    'loan_repayment': 'debit',
+    'transfer': 'debit',
+}
+
+# Session.info key holding posted entries until the surrounding transaction commits
+LEDGER_EVENTS_KEY = 'ledger_events'
+
+TRANSACTION_FIELDS = ('reference', 'mpesa_code', 'processed_by', 'confirmed_by')
+
+
+def posted_direction(transaction_type: str, account_type: str, balance_before, balance_after) -> str:
+    """Direction of a stored posting, read back from the running balances it recorded"""
+    # A loan "account" only ever goes down, so its balances say nothing about direction
+    if account_type != 'loan' and balance_before != balance_after:
+        return 'credit' if balance_after > balance_before else 'debit'
+    return DEFAULT_DIRECTIONS.get(transaction_type, 'credit')
+
+
+class InsufficientFundsError(ValueError):
+    """Raised when a debit would take an account below zero"""
+
+    def __init__(self, account_type: str, member_id: int, balance: Decimal, amount: Decimal):
+        self.account_type = account_type
+        self.member_id = member_id
+        self.balance = balance
+        self.amount = amount
+        super().__init__(f"Insufficient funds in {account_type} account")
+
+
+class LedgerService:
+    def lock_accounts(self, keys: Iterable[Tuple[str, int]], create_missing: bool = True) -> Dict[Tuple[str, int], Any]:
+        """
+        Lock the (account_type, member_id) accounts FOR UPDATE and return them by key.
+
+        Rows are refreshed from the database so balances loaded earlier in the
+        session are never trusted. Missing accounts are created when asked to.
+        """
+        wanted = {}
+        for account_type, member_id in keys:
+            if account_type not in ACCOUNT_MODELS:
+                continue
+            wanted.setdefault(account_type, set()).add(int(member_id))
+
+        accounts = {}
+        for account_type in sorted(wanted):
+            model = ACCOUNT_MODELS[account_type]
+            rows = model.query.filter(
+                model.member_id.in_(sorted(wanted[account_type]))
+            ).order_by(model.id).with_for_update().populate_existing().all()
+            for account in rows:
+                accounts.setdefault((account_type, account.member_id), account)
+
+        missing = [
+            (account_type, member_id)
+            for account_type, member_ids in wanted.items()
+            for member_id in member_ids
+            if (account_type, member_id) not in accounts
+        ]
+        if missing and create_missing:
+            member_codes = dict(
+                db.session.query(Member.id, Member.member_code).filter(
+                    Member.id.in_({member_id for _, member_id in missing})
+                )
+            )
+            for account_type, member_id in missing:
+                if member_id not in member_codes:
+                    raise LookupError(f"Member {member_id} not found")
+                account = ACCOUNT_MODELS[account_type](
+                    member_id=member_id,
+                    account_number=f"{ACCOUNT_PREFIXES[account_type]}-{member_codes[member_id]}",
+                    balance=Decimal('0')
+                )
+                db.session.add(account)
+                accounts[(account_type, member_id)] = account
+        return accounts
+
+    def lock_loans(self, loan_ids: Iterable[int]) -> Dict[int, Loan]:
+        """Lock loans FOR UPDATE in id order and return them by id"""
+        loan_ids = sorted(set(loan_ids))
+        if not loan_ids:
+            return {}
+        loans = Loan.query.filter(Loan.id.in_(loan_ids)).order_by(Loan.id).with_for_update().populate_existing().all()
+        return {loan.id: loan for loan in loans}
+
+    def post_entries(self, entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Apply a batch of ledger entries and insert their Transaction rows.
+
+        Each entry needs member_id, account_type ('savings', 'drawdown' or
+        'loan'), transaction_type and a positive amount. Optional keys:
+        direction ('credit'/'debit'), allow_overdraft, apply (False records a
+        pending entry with projected balances without moving money), loan_id
+        with settle_loan to also reduce that loan's outstanding balance,
+        status, transaction_id, confirmed_at, created_at and the plain
+        Transaction columns reference, mpesa_code, processed_by, confirmed_by.
+
+        Transaction rows are only inserted once every entry has applied; on
+        InsufficientFundsError or LookupError the caller must roll back the
+        balances already moved in the session. Returns the inserted rows.
+        """
+        if not entries:
+            return []
+
+        account_keys = [(e['account_type'], int(e['member_id'])) for e in entries if e['account_type'] != 'loan']
+        loan_ids = [
+            int(e['loan_id']) for e in entries
+            if e.get('loan_id') and (e['account_type'] == 'loan' or e.get('settle_loan'))
+        ]
+        accounts = self.lock_accounts(account_keys)
+        loans = self.lock_loans(loan_ids)
+
+        now = datetime.utcnow()
+        rows, events = [], []
+        for entry in entries:
+            member_id = int(entry['member_id'])
+            amount = Decimal(str(entry['amount']))
+            if amount <= 0:
+                raise ValueError('Ledger entry amounts must be positive')
+            direction = entry.get('direction') or DEFAULT_DIRECTIONS.get(entry['transaction_type'])
+            if direction not in ('credit', 'debit'):
+                raise ValueError(f"No direction for {entry['transaction_type']} entry")
+            apply = entry.get('apply', True)
+            loan_id = int(entry['loan_id']) if entry.get('loan_id') else None
+
+            if entry['account_type'] == 'loan':
+                # A loan "account" is its outstanding balance; paying it down is a debit
+                loan = loans.get(loan_id)
+                if not loan:
+                    raise LookupError(f"Loan {loan_id} not found")
+                balance_before = Decimal(str(loan.outstanding_balance))
+                balance_after = self._reduce_loan(loan, amount) if apply else max(Decimal('0'), balance_before - amount)
+            else:
+                account = accounts[(entry['account_type'], member_id)]
+                balance_before = Decimal(str(account.balance or 0))
+                delta = amount if direction == 'credit' else -amount
+                balance_after = balance_before + delta
+                if balance_after < 0 and delta < 0 and not entry.get('allow_overdraft'):
+                    raise InsufficientFundsError(entry['account_type'], member_id, balance_before, amount)
+                if apply:
+                    account.balance = balance_after
+                    if entry.get('settle_loan') and loan_id:
+                        loan = loans.get(loan_id)
+                        if not loan:
+                            raise LookupError(f"Loan {loan_id} not found")
+                        self._reduce_loan(loan, amount)
+
+            status = entry.get('status', 'confirmed')
+            row = {
+                'transaction_id': entry.get('transaction_id') or str(uuid.uuid4()),
+                'member_id': member_id,
+                'account_type': entry['account_type'],
+                'transaction_type': entry['transaction_type'],
+                'amount': amount,
+                'balance_before': balance_before,
+                'balance_after': balance_after,
+                'status': status,
+                'confirmed_at': entry.get('confirmed_at') or (now if status == 'confirmed' else None),
+                'created_at': entry.get('created_at') or now,
+            }
+            if loan_id:
+                row['loan_id'] = loan_id
+            for field in TRANSACTION_FIELDS:
+                if entry.get(field) is not None:
+                    row[field] = entry[field]
+            rows.append(row)
+            if apply:
+                events.append(self._event(row, direction))
+
+        db.session.bulk_insert_mappings(Transaction, rows)
+        # Bulk inserts bypass the unit of work the summary listener watches
+        summary_service.touch(row['member_id'] for row in rows)
+        self._record_events(events)
+        return rows
+
+    def settle_pending(self, transaction: Transaction, status: str, confirmed_by: Optional[int] = None) -> Transaction:
+        """
+        Confirm or fail a pending deposit/withdrawal under the account lock.
+
+        Confirming a deposit credits the account and restamps the row's running
+        balances; failing a withdrawal refunds the amount it reserved.
+        """
+        if transaction.status != 'pending':
+            raise ValueError(f"Transaction is already {transaction.status}")
+
+        credit = (
+            (transaction.transaction_type == 'deposit' and status == 'confirmed') or
+            (transaction.transaction_type == 'withdrawal' and status == 'failed')
+        )
+        if credit:
+            key = (transaction.account_type, transaction.member_id)
+            account = self.lock_accounts([key]).get(key)
+            if not account:
+                raise LookupError(f"{transaction.account_type} account not found")
+            balance_before = Decimal(str(account.balance or 0))
+            account.balance = balance_before + Decimal(str(transaction.amount))
+            if transaction.transaction_type == 'deposit':
+                transaction.balance_before = balance_before
+                transaction.balance_after = account.balance
+
+        transaction.status = status
+        transaction.confirmed_by = confirmed_by
+        transaction.confirmed_at = datetime.utcnow()
+        if transaction.transaction_type == 'deposit' and status == 'confirmed':
+            self._record_events([self._event({
+                'transaction_id': transaction.transaction_id,
+                'member_id': transaction.member_id,
+                'account_type': transaction.account_type,
+                'transaction_type': transaction.transaction_type,
+                'amount': transaction.amount,
+                'created_at': transaction.confirmed_at
+            }, 'credit')])
+        return transaction
+
+    @staticmethod
+    def _event(row: Dict[str, Any], direction: str) -> Dict[str, str]:
+        return {
+            'transaction_id': row['transaction_id'],
+            'member_id': str(row['member_id']),
+            'account_type': row['account_type'],
+            'transaction_type': row['transaction_type'],
+            'direction': direction,
+            'amount': str(row['amount']),
+            'created_at': row['created_at'].isoformat()
+        }
+
+    @staticmethod
+    def _record_events(events: List[Dict[str, str]]):
+        # Published to the transaction event stream once the session commits
+        if events:
+            db.session.info.setdefault(LEDGER_EVENTS_KEY, []).extend(events)
+
+    @staticmethod
+    def _reduce_loan(loan: Loan, amount: Decimal) -> Decimal:
+        outstanding = Decimal(str(loan.outstanding_balance)) - amount
+        if outstanding <= 0:
+            outstanding = Decimal('0')
+            loan.status = 'completed'
+        loan.outstanding_balance = outstanding
+        return outstanding
+
+
+ledger_service = LedgerService()
@@ -2,8 +2,11 @@ from decimal import Decimal
 from datetime import datetime, timedelta, timezone
 import logging
 from typing import Dict, Any, Optional, List
-from app.models import LoanType, Loan, SavingsAccount, Member, Transaction
+from sqlalchemy import case, update
+from app.models import LoanType, Loan, SavingsAccount, Member, Transaction, LoanProduct
 from app import db
+from app.services.ledger_service import ledger_service
+from app.services.stock_service import stock_service
 
 class LoanService:
     def calculate_interest(self, principle: Decimal, loan_type: LoanType) -> Decimal:
@@ -67,6 +70,78 @@ class LoanService:
             'total_amount': total_amount.quantize(Decimal('0.01'))
         }
 
+    def lock_cart_products(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Resolve cart items against their products, locked with one SELECT ... FOR UPDATE.
+        
+        Raises LookupError for unknown products and ValueError for bad quantities or
+        insufficient stock. Locks are taken in product id order to avoid deadlocks.
+        """
+        quantities = {}
+        for item in items:
+            product_id = int(item.get('productId'))
+            quantity = int(item.get('quantity', 1))
+            if quantity <= 0:
+                raise ValueError(f'Invalid quantity for product {product_id}')
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+        
+        products = LoanProduct.query.filter(
+            LoanProduct.id.in_(list(quantities))
+        ).order_by(LoanProduct.id).with_for_update().all()
+        products_by_id = {product.id: product for product in products}
+        
+        cart = []
+        for product_id, quantity in quantities.items():
+            product = products_by_id.get(product_id)
+            if not product:
+                raise LookupError(f'Product {product_id} not found')
+            if product.stock_quantity < quantity:
+                raise ValueError(f'Insufficient stock for {product.name}')
+            cart.append({
+                'product': product,
+                'quantity': quantity,
+                'unit_price': product.selling_price,
+                'total_price': product.selling_price * quantity
+            })
+        return cart
+
+    def decrement_stock(self, quantities: Dict[int, int]):
+        """Deduct stock for several products with a single conditional UPDATE"""
+        if not quantities:
+            return
+        requested = case(quantities, value=LoanProduct.id)
+        written = db.session.execute(
+            update(LoanProduct)
+            .where(LoanProduct.id.in_(list(quantities)), LoanProduct.stock_quantity >= requested)
+            .values(stock_quantity=LoanProduct.stock_quantity - requested)
+            .returning(LoanProduct.id, LoanProduct.stock_quantity,
+                       LoanProduct.low_stock_threshold, LoanProduct.critical_stock_threshold)
+            .execution_options(synchronize_session=False)
+        ).all()
+        if len(written) != len(quantities):
+            raise ValueError('Insufficient stock for one or more products')
+        stock_service.record_levels([
+            (product_id, None, stock, -quantities[product_id], low, critical)
+            for product_id, stock, low, critical in written
+        ])
+
+    def restore_stock(self, quantities: Dict[int, int]):
+        """Give stock back for a cancelled or rejected loan's items"""
+        quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity}
+        if not quantities:
+            return
+        written = db.session.execute(
+            update(LoanProduct)
+            .where(LoanProduct.id.in_(list(quantities)))
+            .values(stock_quantity=LoanProduct.stock_quantity + case(quantities, value=LoanProduct.id))
+            .returning(LoanProduct.id, LoanProduct.stock_quantity,
+                       LoanProduct.low_stock_threshold, LoanProduct.critical_stock_threshold)
+            .execution_options(synchronize_session=False)
+        ).all()
+        stock_service.record_levels([
+            (product_id, None, stock, quantities[product_id], low, critical)
+            for product_id, stock, low, critical in written
+        ])
+
     def calculate_penalty(self, loan: Loan) -> Decimal:
         """Calculate penalty for overdue loan"""
         if not loan.due_date:
@@ -266,10 +341,8 @@ class LoanService:
     def automatic_savings_deduction(self, member: Member, loan: Loan) -> Dict[str, Any]:
         """Automatically deduct loan repayment from savings account"""
         try:
-            savings = SavingsAccount.query.filter_by(
-                member_id=member.id,
-                account_type='savings'
-            ).first()
+            # Lock the savings account before reading the balance we deduct from
+            savings = ledger_service.lock_accounts([('savings', member.id)], create_missing=False).get(('savings', member.id))
             
             if not savings:
                 return {
@@ -284,44 +357,35 @@ class LoanService:
             )
             total_amount = Decimal(str(loan_calc['total_amount']))
             num_payments = loan.loan_type.duration_months
-            monthly_payment = total_amount / Decimal(str(num_payments))
+            monthly_payment = (total_amount / Decimal(str(num_payments))).quantize(Decimal('0.01'))
             
             if savings.balance < monthly_payment:
                 return {
                     'status': 'insufficient_balance',
                     'required': float(monthly_payment),
-                    'available': savings.balance,
+                    'available': float(savings.balance),
                     'shortfall': float(monthly_payment - Decimal(str(savings.balance)))
                 }
             
-            # Deduct from savings
-            balance_before = savings.balance
-            savings.balance -= float(monthly_payment)
-            
-            # Create transaction record
-            transaction = Transaction(
-                member_id=member.id,
-                account_type='savings',
-                transaction_type='loan_repayment',
-                amount=float(monthly_payment),
-                balance_before=balance_before,
-                balance_after=savings.balance,
-                reference=f"Loan Repayment - {loan.loan_number}",
-                status='confirmed',
-                confirmed_at=datetime.utcnow()
-            )
-            
-            db.session.add(transaction)
-            loan.outstanding_balance -= float(monthly_payment)
+            # Deduct from savings and pay down the loan in one posting
+            [row] = ledger_service.post_entries([{
+                'member_id': member.id,
+                'account_type': 'savings',
+                'transaction_type': 'loan_repayment',
+                'amount': monthly_payment,
+                'loan_id': loan.id,
+                'settle_loan': True,
+                'reference': f"Loan Repayment - {loan.loan_number}"
+            }])
             
             db.session.commit()
             
             return {
                 'status': 'success',
                 'deducted_amount': float(monthly_payment),
-                'balance_before': balance_before,
-                'balance_after': savings.balance,
-                'loan_outstanding': loan.outstanding_balance
+                'balance_before': float(row['balance_before']),
+                'balance_after': float(row['balance_after']),
+                'loan_outstanding': float(loan.outstanding_balance)
             }
             
         except Exception as e:
@@ -332,8 +396,7 @@ class LoanService:
     def auto_repay_from_drawdown(self, member_id: int) -> Dict[str, Any]:
         """Automatically repay loans using funds available in the drawdown account"""
         try:
-            from app.models import DrawdownAccount
-            drawdown = DrawdownAccount.query.filter_by(member_id=member_id).first()
+            drawdown = ledger_service.lock_accounts([('drawdown', member_id)], create_missing=False).get(('drawdown', member_id))
             
             if not drawdown or drawdown.balance <= 0:
                 return {'status': 'no_funds', 'balance': 0}
@@ -348,46 +411,35 @@ class LoanService:
             if not loans:
                 return {'status': 'no_loans', 'balance': float(drawdown.balance)}
             
-            total_repaid = Decimal('0')
-            initial_balance = Decimal(str(drawdown.balance))
-            current_balance = initial_balance
+            # Lock the loans too so repayment amounts come from current outstanding balances
+            locked_loans = ledger_service.lock_loans(loan.id for loan in loans)
             
-            import uuid
+            initial_balance = Decimal(str(drawdown.balance))
+            available = initial_balance
+            entries = []
             
             for loan in loans:
-                if current_balance <= 0:
+                if available <= 0:
                     break
                 
-                repayment_amount = min(current_balance, Decimal(str(loan.outstanding_balance)))
-                
-                # Update loan
-                loan.outstanding_balance = Decimal(str(loan.outstanding_balance)) - repayment_amount
-                if loan.outstanding_balance <= 0:
-                    loan.outstanding_balance = Decimal('0')
-                    loan.status = 'completed'
+                outstanding = Decimal(str(locked_loans[loan.id].outstanding_balance))
+                repayment_amount = min(available, outstanding)
+                if repayment_amount <= 0:
+                    continue
+                available -= repayment_amount
                 
-                # Update drawdown balance
-                current_balance -= repayment_amount
-                
-                # Create transaction record
-                transaction = Transaction(
-                    transaction_id=str(uuid.uuid4()),
-                    member_id=member_id,
-                    account_type='drawdown',
-                    transaction_type='loan_repayment',
-                    amount=repayment_amount,
-                    balance_before=Decimal(str(drawdown.balance)),
-                    balance_after=current_balance,
-                    reference=f"Auto-Repayment - {loan.loan_number}",
-                    loan_id=loan.id,
-                    status='confirmed',
-                    confirmed_at=datetime.utcnow()
-                )
-                db.session.add(transaction)
-                
-                # Update actual account balance for next iteration/commit
-                drawdown.balance = current_balance
-                total_repaid += repayment_amount
+                entries.append({
+                    'member_id': member_id,
+                    'account_type': 'drawdown',
+                    'transaction_type': 'loan_repayment',
+                    'amount': repayment_amount,
+                    'loan_id': loan.id,
+                    'settle_loan': True,
+                    'reference': f"Auto-Repayment - {loan.loan_number}"
+                })
+            
+            rows = ledger_service.post_entries(entries)
+            total_repaid = sum((row['amount'] for row in rows), Decimal('0'))
             
             db.session.commit()
             
@@ -395,7 +447,7 @@ class LoanService:
                 'status': 'success',
                 'total_repaid': float(total_repaid),
                 'initial_balance': float(initial_balance),
-                'final_balance': float(current_balance),
+                'final_balance': float(drawdown.balance),
                 'loans_affected': len(loans)
             }
         except Exception as e:
@@ -0,0 +1,226 @@
+"""
+Staff messaging storage.
+
+Every pair of users shares one `conversations` row, keyed by the ordered
+pair (user_low_id, user_high_id). The row carries the last message time,
+sender and preview plus one unread counter per participant, so the inbox
+list is a single query over the user's conversations and the unread badge is
+a sum of counters instead of a COUNT over messages. Sending upserts the
+conversation, bumping the recipient's counter in the same statement. Threads
+are read newest first over the (conversation_id, created_at) index and the
+inbox over (user, last_message_at), both with an opaque (timestamp, id)
+cursor, and mark-read is one UPDATE of the unread messages followed by
+decrementing the counter by the rows it touched.
+"""
+import base64
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import case, func, or_, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import joinedload
+
+from app import db
+from app.models import Conversation, Message, Role, User
+
+PREVIEW_LENGTH = 140
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class MessagingService:
+    def __init__(self, app=None):
+        self.app = None
+        self.page_size = DEFAULT_PAGE_SIZE
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize messaging service with Flask app"""
+        self.app = app
+        self.page_size = app.config.get('MESSAGE_PAGE_SIZE', self.page_size)
+
+    @staticmethod
+    def user_pair(user_id: int, other_id: int) -> Tuple[int, int]:
+        return (user_id, other_id) if user_id < other_id else (other_id, user_id)
+
+    def page_limit(self, limit: Optional[int]) -> int:
+        return max(1, min(limit or self.page_size, MAX_PAGE_SIZE))
+
+    # ------------------------------------------------------------------
+    # Cursors
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def encode_cursor(at: datetime, row_id: int) -> str:
+        raw = f"{at.isoformat()}|{row_id}"
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[datetime, int]]:
+        """(timestamp, id) of the cursor row; raises ValueError for a malformed cursor"""
+        if not cursor:
+            return None
+        # binascii.Error and UnicodeDecodeError are ValueErrors too
+        at, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(at), int(row_id)
+
+    # ------------------------------------------------------------------
+    # Conversations
+    # ------------------------------------------------------------------
+
+    def find(self, user_id: int, other_id: int) -> Optional[Conversation]:
+        low, high = self.user_pair(user_id, other_id)
+        return Conversation.query.filter_by(user_low_id=low, user_high_id=high).first()
+
+    def get_for_user(self, conversation_id: int, user_id: int) -> Optional[Conversation]:
+        """The conversation, if the user takes part in it"""
+        conversation = Conversation.query.get(conversation_id)
+        if conversation and user_id in (conversation.user_low_id, conversation.user_high_id):
+            return conversation
+        return None
+
+    def send(self, sender_id: int, recipient_id: int, content: str) -> Message:
+        """Add a message to the pair's conversation; the caller commits"""
+        low, high = self.user_pair(sender_id, recipient_id)
+        now = datetime.utcnow()
+        to_low = 1 if recipient_id == low else 0
+
+        stmt = pg_insert(Conversation).values(
+            user_low_id=low,
+            user_high_id=high,
+            last_message_at=now,
+            last_sender_id=sender_id,
+            last_message_preview=content[:PREVIEW_LENGTH],
+            unread_low=to_low,
+            unread_high=1 - to_low,
+            created_at=now
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_low_id', 'user_high_id'],
+            set_={
+                'last_message_at': stmt.excluded.last_message_at,
+                'last_sender_id': stmt.excluded.last_sender_id,
+                'last_message_preview': stmt.excluded.last_message_preview,
+                'unread_low': Conversation.unread_low + stmt.excluded.unread_low,
+                'unread_high': Conversation.unread_high + stmt.excluded.unread_high
+            }
+        ).returning(Conversation.id)
+        conversation_id = db.session.execute(stmt).scalar_one()
+
+        message = Message(
+            conversation_id=conversation_id,
+            sender_id=sender_id,
+            recipient_id=recipient_id,
+            content=content,
+            created_at=now
+        )
+        db.session.add(message)
+        return message
+
+    def conversations_for(self, user_id: int, limit: Optional[int] = None,
+                          before: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """One page of the user's inbox, most recent first, and the cursor of the next page"""
+        limit = self.page_limit(limit)
+        other_id = case(
+            (Conversation.user_low_id == user_id, Conversation.user_high_id),
+            else_=Conversation.user_low_id
+        )
+        query = db.session.query(Conversation, User, Role.name).join(
+            User, User.id == other_id
+        ).outerjoin(Role, Role.id == User.role_id).filter(
+            or_(Conversation.user_low_id == user_id, Conversation.user_high_id == user_id)
+        )
+        position = self.decode_cursor(before)
+        if position:
+            query = query.filter(tuple_(Conversation.last_message_at, Conversation.id) < position)
+
+        rows = query.order_by(
+            Conversation.last_message_at.desc(), Conversation.id.desc()
+        ).limit(limit + 1).all()
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1][0]
+            next_cursor = self.encode_cursor(last.last_message_at, last.id)
+
+        inbox = [{
+            'id': conversation.id,
+            'contact': {
+                'id': contact.id,
+                'firstName': contact.first_name,
+                'lastName': contact.last_name,
+                'role': role_name
+            },
+            'lastMessageAt': conversation.last_message_at.isoformat(),
+            'lastSenderId': conversation.last_sender_id,
+            'lastMessagePreview': conversation.last_message_preview,
+            'unreadCount': conversation.unread_for(user_id)
+        } for conversation, contact, role_name in rows[:limit]]
+        return inbox, next_cursor
+
+    def unread_count(self, user_id: int) -> int:
+        total = db.session.query(func.coalesce(func.sum(case(
+            (Conversation.user_low_id == user_id, Conversation.unread_low),
+            else_=Conversation.unread_high
+        )), 0)).filter(
+            or_(Conversation.user_low_id == user_id, Conversation.user_high_id == user_id)
+        ).scalar()
+        return int(total)
+
+    # ------------------------------------------------------------------
+    # Threads
+    # ------------------------------------------------------------------
+
+    def thread(self, conversation: Conversation, before: Optional[str] = None,
+               limit: Optional[int] = None) -> Tuple[List[Message], Optional[str]]:
+        """One page of messages older than the cursor, oldest first, and the cursor of the next page"""
+        limit = self.page_limit(limit)
+        query = Message.query.options(
+            joinedload(Message.sender), joinedload(Message.recipient)
+        ).filter(Message.conversation_id == conversation.id)
+        position = self.decode_cursor(before)
+        if position:
+            query = query.filter(tuple_(Message.created_at, Message.id) < position)
+
+        page = query.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit + 1).all()
+        next_cursor = None
+        if len(page) > limit:
+            last = page[limit - 1]
+            next_cursor = self.encode_cursor(last.created_at, last.id)
+        return list(reversed(page[:limit])), next_cursor
+
+    def history(self, conversation: Conversation) -> List[Message]:
+        """Every message of the conversation, oldest first"""
+        return Message.query.options(
+            joinedload(Message.sender), joinedload(Message.recipient)
+        ).filter(Message.conversation_id == conversation.id).order_by(
+            Message.created_at, Message.id
+        ).all()
+
+    def mark_read(self, conversation: Conversation, user_id: int) -> int:
+        """Mark everything the user received in the conversation as read; the caller commits"""
+        if not conversation.unread_for(user_id):
+            return 0
+
+        result = db.session.execute(
+            update(Message).where(
+                Message.conversation_id == conversation.id,
+                Message.recipient_id == user_id,
+                Message.is_read.is_(False)
+            ).values(is_read=True, read_at=datetime.utcnow()).execution_options(synchronize_session=False)
+        )
+        read = result.rowcount
+
+        # Messages sent since the UPDATE above stay counted
+        counter = Conversation.unread_low if user_id == conversation.user_low_id else Conversation.unread_high
+        db.session.execute(
+            update(Conversation).where(Conversation.id == conversation.id).values({
+                counter: case((counter > read, counter - read), else_=0)
+            }).execution_options(synchronize_session=False)
+        )
+        db.session.expire(conversation, ['unread_low', 'unread_high'])
+        return read
+
+
+messaging_service = MessagingService()
@@ -281,6 +281,16 @@ class NotificationService:
                 language="en",
                 category="loan"
             ),
+            NotificationTemplate(
+                template_id="stock_alert",
+                name="Stock Threshold Alert",
+                channel=NotificationChannel.IN_APP,
+                subject="Stock Alert",
+                body_template="{{product_name}} is {{level}} on stock at {{location}}: {{stock}} left.",
+                variables=["product_name", "level", "stock", "location"],
+                language="en",
+                category="inventory"
+            ),
             NotificationTemplate(
                 template_id="meeting_reminder",
                 name="Meeting Reminder",
@@ -452,9 +462,8 @@ class NotificationService:
                 success = self._send_email(notification_data)
             elif channel == NotificationChannel.WHATSAPP:
                 success = self._send_whatsapp(notification_data)
-            elif channel == NotificationChannel.IN_APP:
-                success = True  # Already stored in Redis
-            elif channel == NotificationChannel.WEBSOCKET:
+            elif channel in (NotificationChannel.IN_APP, NotificationChannel.WEBSOCKET):
+                # In-app notifications are already stored in Redis; both are pushed to open sessions
                 success = self._send_websocket(notification_data)
             else:
                 success = False
@@ -690,16 +699,17 @@ class NotificationService:
             return False
     
     def _send_websocket(self, notification_data: Dict[str, Any]) -> bool:
-        """Send notification via WebSocket"""
+        """Push notification to the recipient's open sessions through the event bus"""
+        from app.services.event_bus import event_bus
         try:
-            # If socketio is initialized, emit the message
-            # For now, we'll just return True as it's also stored in Redis for polling
-            if hasattr(self.app, 'socketio'):
-                self.app.socketio.emit(
-                    'notification', 
-                    notification_data, 
-                    room=f"user_{notification_data['recipient_id']}"
-                )
+            # Delivery does not depend on an open session: the notification stays in Redis
+            event_bus.publish('notification', {
+                'notificationId': notification_data['notification_id'],
+                'subject': notification_data.get('subject'),
+                'message': notification_data.get('message'),
+                'priority': notification_data.get('priority'),
+                'data': notification_data.get('data') or {}
+            }, user_ids=[notification_data['recipient_id']])
             return True
         except Exception as e:
             logging.error(f"Error sending WebSocket notification: {str(e)}")
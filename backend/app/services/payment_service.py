@@ -4,18 +4,28 @@ Handles STK Push, C2B, and Transaction Status
 """
 import requests
 import base64
+import hashlib
 from datetime import datetime, timedelta
 import logging
 from typing import Dict, Any, Optional, List
 from flask import current_app
 import json
+import time
 import uuid
 import redis
 from decimal import Decimal
-from app.models import Transaction, Member, SavingsAccount, Loan, User
+from sqlalchemy import Float, case, cast, func
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from app.models import Transaction, Member, Loan, User, MpesaCallback
 from app import db
+from app.utils.phone import phone_key, phone_variants
+from app.services.ledger_service import ledger_service
 from app.services.notification_service import notification_service, NotificationChannel, NotificationPriority
 
+ANALYTICS_GRANULARITIES = ('hour', 'day')
+ANALYTICS_PERCENTILES = (0.25, 0.5, 0.75, 0.9, 0.95, 0.99)
+
 class PaymentService:
     def __init__(self, app=None):
         self.app = None
@@ -28,6 +38,11 @@ class PaymentService:
         self.redis_client = None
         self.max_retries = 3
         self.retry_delay = 300  # 5 minutes
+        self.callback_batch_size = 500
+        # phone key -> (expires_at, member row tuple) for callback posting
+        self._member_by_phone = {}
+        self.member_cache_ttl = 600
+        self.analytics_cache_ttl = 60
         
         if app:
             self.init_app(app)
@@ -60,6 +75,10 @@ class PaymentService:
         except Exception as e:
             logging.warning(f"Failed to initialize Redis: {str(e)}")
         
+        self.callback_batch_size = app.config.get('MPESA_CALLBACK_BATCH_SIZE', 500)
+        self.member_cache_ttl = app.config.get('MPESA_MEMBER_CACHE_TTL', 600)
+        self.analytics_cache_ttl = app.config.get('PAYMENT_ANALYTICS_CACHE_TTL', 60)
+        
         logging.info(f"Payment Service initialized in {self.env} mode")
 
     def _get_access_token(self) -> Optional[str]:
@@ -136,86 +155,260 @@ class PaymentService:
             logging.error(f"Error initiating STK push: {str(e)}")
             raise
 
-    def handle_callback(self, data: Dict[str, Any]):
-        """Handle M-Pesa callback"""
-        try:
-            # Parse callback data
-            body = data.get('Body', {}).get('stkCallback', {})
-            result_code = body.get('ResultCode')
-            result_desc = body.get('ResultDesc')
-            merchant_request_id = body.get('MerchantRequestID')
-            checkout_request_id = body.get('CheckoutRequestID')
-            
-            logging.info(f"M-Pesa Callback: {result_code} - {result_desc}")
-            
-            if result_code == 0:
-                # Success
-                metadata = body.get('CallbackMetadata', {}).get('Item', [])
-                amount = next((item['Value'] for item in metadata if item['Name'] == 'Amount'), 0)
-                mpesa_receipt_number = next((item['Value'] for item in metadata if item['Name'] == 'MpesaReceiptNumber'), None)
-                phone_number = next((item['Value'] for item in metadata if item['Name'] == 'PhoneNumber'), None)
-                
-                # Find pending transaction or create new one
-                # In a real app, we would have stored the CheckoutRequestID when initiating STK push
-                # and linked it to a pending transaction.
-                # For now, we'll assume we can find the user by phone number or create a generic deposit.
-                
-                # TODO: Implement logic to match transaction
-                logging.info(f"Payment received: {mpesa_receipt_number} - {amount} from {phone_number}")
-                
-                # Example: Find member by phone
-                # member = Member.query.join(User).filter(User.phone == str(phone_number)).first()
-                # if member:
-                #     self._process_deposit(member, amount, mpesa_receipt_number)
-                
+    def handle_callback(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Handle M-Pesa callback by durably queueing it for the posting worker"""
+        return self.enqueue_callback(data)
+
+    @staticmethod
+    def parse_callback(data: Dict[str, Any]) -> Dict[str, Any]:
+        """Extract the posting fields from an STK Push or C2B confirmation payload"""
+        if 'TransID' in data:
+            # C2B confirmation
+            return {
+                'receipt_number': data.get('TransID'),
+                'checkout_request_id': None,
+                'result_code': 0,
+                'amount': data.get('TransAmount'),
+                'phone_number': data.get('MSISDN')
+            }
+        
+        body = data.get('Body', {}).get('stkCallback', {})
+        metadata = body.get('CallbackMetadata', {}).get('Item', [])
+        values = {item.get('Name'): item.get('Value') for item in metadata}
+        return {
+            'receipt_number': values.get('MpesaReceiptNumber'),
+            'checkout_request_id': body.get('CheckoutRequestID'),
+            'result_code': body.get('ResultCode'),
+            'amount': values.get('Amount'),
+            'phone_number': values.get('PhoneNumber')
+        }
+
+    def enqueue_callback(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Store the raw callback once, keyed by receipt number; redeliveries are no-ops"""
+        fields = self.parse_callback(data)
+        if fields['receipt_number']:
+            idempotency_key = fields['receipt_number']
+        elif fields['checkout_request_id']:
+            idempotency_key = f"checkout:{fields['checkout_request_id']}"
+        else:
+            # Nothing identifies the payment; only an identical redelivery is a duplicate
+            idempotency_key = f"payload:{hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()}"
+        succeeded = fields['result_code'] == 0 and fields['receipt_number'] is not None
+        
+        result = db.session.execute(
+            pg_insert(MpesaCallback).values(
+                idempotency_key=idempotency_key,
+                checkout_request_id=fields['checkout_request_id'],
+                receipt_number=fields['receipt_number'],
+                phone_number=str(fields['phone_number']) if fields['phone_number'] else None,
+                amount=Decimal(str(fields['amount'])) if fields['amount'] is not None else None,
+                result_code=fields['result_code'],
+                payload=data,
+                status='queued' if succeeded else 'failed',
+                attempts=0,
+                error_message=None if succeeded else 'Payment not completed by customer',
+                received_at=datetime.utcnow()
+            ).on_conflict_do_nothing(index_elements=['idempotency_key'])
+        )
+        db.session.commit()
+        
+        duplicate = result.rowcount == 0
+        logging.info(f"M-Pesa callback {idempotency_key} {'duplicate' if duplicate else 'queued'}")
+        return {'idempotency_key': idempotency_key, 'queued': succeeded and not duplicate, 'duplicate': duplicate}
+
+    def _resolve_members(self, phones: List[str]) -> Dict[str, tuple]:
+        """Map phone keys to (member_id, member_code, user_id), cached in-process"""
+        now = time.monotonic()
+        resolved, missing = {}, set()
+        for phone in phones:
+            key = phone_key(phone)
+            cached = self._member_by_phone.get(key)
+            if cached and cached[0] > now:
+                resolved[key] = cached[1]
             else:
-                # Failed
-                logging.warning(f"Payment failed: {result_desc}")
-                
+                missing.add(phone)
+        
+        if missing:
+            variants = [variant for phone in missing for variant in phone_variants(phone)]
+            rows = db.session.query(User.phone, Member.id, Member.member_code, Member.user_id).join(
+                Member, Member.user_id == User.id
+            ).filter(User.phone.in_(variants)).all()
+            for phone, member_id, member_code, user_id in rows:
+                key = phone_key(phone)
+                resolved[key] = (member_id, member_code, user_id)
+                self._member_by_phone[key] = (now + self.member_cache_ttl, resolved[key])
+            if len(self._member_by_phone) > 50000:
+                self._member_by_phone = {k: v for k, v in self._member_by_phone.items() if v[0] > now}
+        
+        return resolved
+
+    def process_callback_batch(self, batch_size: Optional[int] = None) -> Dict[str, Any]:
+        """Post one micro-batch of queued callbacks as a single ledger transaction"""
+        batch_size = batch_size or self.callback_batch_size
+        callbacks = MpesaCallback.query.filter_by(status='queued').order_by(
+            MpesaCallback.id
+        ).limit(batch_size).with_for_update(skip_locked=True).all()
+        
+        if not callbacks:
+            return {'processed': 0, 'posted': 0, 'duplicate': 0, 'unmatched': 0, 'failed': 0}
+        
+        try:
+            counts = self._post_callbacks(callbacks)
+            db.session.commit()
         except Exception as e:
-            logging.error(f"Error handling callback: {str(e)}")
-            raise
+            logging.error(f"Error posting M-Pesa callback batch: {str(e)}")
+            db.session.rollback()
+            ids = [callback.id for callback in callbacks]
+            db.session.query(MpesaCallback).filter(MpesaCallback.id.in_(ids)).update({
+                MpesaCallback.attempts: MpesaCallback.attempts + 1,
+                MpesaCallback.error_message: str(e)[:500]
+            }, synchronize_session=False)
+            db.session.query(MpesaCallback).filter(
+                MpesaCallback.id.in_(ids), MpesaCallback.attempts >= self.max_retries
+            ).update({MpesaCallback.status: 'failed'}, synchronize_session=False)
+            db.session.commit()
+            return {'processed': 0, 'error': str(e)}
+        
+        self._notify_deposits(counts.pop('notifications'))
+        counts['processed'] = len(callbacks)
+        return counts
+
+    def _post_callbacks(self, callbacks: List[MpesaCallback]) -> Dict[str, Any]:
+        receipts = [callback.receipt_number for callback in callbacks]
+        already_posted = {
+            code for (code,) in db.session.query(Transaction.mpesa_code).filter(
+                Transaction.mpesa_code.in_(receipts)
+            )
+        }
+        members = self._resolve_members([callback.phone_number for callback in callbacks])
+        
+        now = datetime.utcnow()
+        counts = {'posted': 0, 'duplicate': 0, 'unmatched': 0, 'failed': 0, 'notifications': []}
+        pending = []
+        
+        for callback in callbacks:
+            callback.attempts += 1
+            callback.processed_at = now
+            
+            if callback.receipt_number in already_posted:
+                callback.status = 'duplicate'
+                counts['duplicate'] += 1
+                continue
+            
+            if callback.amount is None or callback.amount <= 0 or not phone_key(callback.phone_number):
+                # Retrying cannot fix the payload; fail it now and leave the rest of the batch alone
+                callback.status = 'failed'
+                callback.error_message = 'Malformed callback: missing amount or phone number'
+                counts['failed'] += 1
+                continue
+            
+            member = members.get(phone_key(callback.phone_number))
+            if not member:
+                callback.status = 'unmatched'
+                counts['unmatched'] += 1
+                continue
+            
+            member_id, _, user_id = member
+            entry = {
+                'transaction_id': str(uuid.uuid4()),
+                'member_id': member_id,
+                'account_type': 'savings',
+                'transaction_type': 'deposit',
+                'amount': Decimal(str(callback.amount)),
+                'reference': "M-Pesa Deposit",
+                'mpesa_code': callback.receipt_number,
+                'created_at': now
+            }
+            already_posted.add(callback.receipt_number)
+            pending.append((callback, entry, user_id))
+        
+        if not pending:
+            return counts
+        
+        # One lock pass over every affected account and one bulk insert, under a
+        # savepoint; if any entry fails, post each callback under its own savepoint
+        # so only the failing callbacks are retried
+        try:
+            with db.session.begin_nested():
+                rows = ledger_service.post_entries([entry for _, entry, _ in pending])
+            posted = list(zip(pending, rows))
+        except Exception as e:
+            logging.warning(f"M-Pesa callback batch failed, posting callbacks one by one: {str(e)}")
+            posted = []
+            for item in pending:
+                callback = item[0]
+                try:
+                    with db.session.begin_nested():
+                        rows = ledger_service.post_entries([item[1]])
+                    posted.append((item, rows[0]))
+                except Exception as e:
+                    logging.error(f"Error posting M-Pesa callback {callback.idempotency_key}: {str(e)}")
+                    callback.error_message = str(e)[:500]
+                    callback.status = 'failed' if callback.attempts >= self.max_retries else 'queued'
+                    counts['failed'] += 1
+        
+        for (callback, entry, user_id), row in posted:
+            callback.status = 'posted'
+            callback.member_id = entry['member_id']
+            callback.transaction_id = entry['transaction_id']
+            callback.error_message = None
+            counts['posted'] += 1
+            counts['notifications'].append((user_id, callback.phone_number, row['amount'], row['balance_after']))
+        return counts
+
+    def _notify_deposits(self, notifications: List[tuple]):
+        for user_id, phone_number, amount, balance in notifications:
+            try:
+                notification_service.send_notification(
+                    recipient_id=user_id,
+                    template_id="payment_confirmation",
+                    variables={
+                        "amount": float(amount),
+                        "phone_number": phone_number,
+                        "balance": str(balance)
+                    },
+                    channel=NotificationChannel.SMS
+                )
+            except Exception as e:
+                logging.warning(f"Failed to send deposit notification to user {user_id}: {str(e)}")
+
+    def replay_callbacks(self, statuses: Optional[List[str]] = None, since: Optional[datetime] = None,
+                         until: Optional[datetime] = None, receipts: Optional[List[str]] = None) -> int:
+        """Requeue stored callbacks; already-posted receipts come back out as duplicates"""
+        query = db.session.query(MpesaCallback).filter(MpesaCallback.result_code == 0)
+        if statuses:
+            query = query.filter(MpesaCallback.status.in_(statuses))
+        if since:
+            query = query.filter(MpesaCallback.received_at >= since)
+        if until:
+            query = query.filter(MpesaCallback.received_at <= until)
+        if receipts:
+            query = query.filter(MpesaCallback.receipt_number.in_(receipts))
+        
+        requeued = query.update({
+            MpesaCallback.status: 'queued',
+            MpesaCallback.attempts: 0,
+            MpesaCallback.error_message: None
+        }, synchronize_session=False)
+        db.session.commit()
+        return requeued
 
     def _process_deposit(self, member: Member, amount: float, receipt: str, account_type: str = 'savings'):
         """Process successful deposit"""
         try:
-            from app.models import DrawdownAccount
             from app.services.loan_service import loan_service
             
-            account = None
-            if account_type == 'savings':
-                account = SavingsAccount.query.filter_by(member_id=member.id).first()
-                if not account:
-                    account = SavingsAccount(member_id=member.id, account_number=f"SAV-{member.member_code}")
-                    db.session.add(account)
-            elif account_type == 'drawdown':
-                account = DrawdownAccount.query.filter_by(member_id=member.id).first()
-                if not account:
-                    account = DrawdownAccount(member_id=member.id, account_number=f"DRD-{member.member_code}")
-                    db.session.add(account)
-            
-            if not account:
+            if account_type not in ('savings', 'drawdown'):
                 return
-                
-            balance_before = account.balance
-            account.balance += amount
-            
-            # Create transaction record
-            transaction = Transaction(
-                transaction_id=str(uuid.uuid4()),
-                member_id=member.id,
-                account_type=account_type,
-                transaction_type='deposit',
-                amount=amount,
-                balance_before=balance_before,
-                balance_after=account.balance,
-                reference=f"M-Pesa Deposit",
-                mpesa_code=receipt,
-                status='confirmed',
-                confirmed_at=datetime.utcnow()
-            )
             
-            db.session.add(transaction)
+            [row] = ledger_service.post_entries([{
+                'member_id': member.id,
+                'account_type': account_type,
+                'transaction_type': 'deposit',
+                'amount': amount,
+                'reference': "M-Pesa Deposit",
+                'mpesa_code': receipt
+            }])
             db.session.flush()
             
             # Auto-repay if drawdown
@@ -231,7 +424,7 @@ class PaymentService:
                 variables={
                     "amount": amount,
                     "phone_number": member.user.phone,
-                    "balance": str(account.balance)
+                    "balance": str(row['balance_after'])
                 },
                 channel=NotificationChannel.SMS
             )
@@ -342,12 +535,12 @@ class PaymentService:
             transaction = Transaction.query.filter_by(
                 mpesa_code=receipt_number,
                 status='pending'
-            ).first()
+            ).with_for_update().first()
             
             if not transaction:
                 # Try to find by phone number
                 member = Member.query.join(Member.user).filter(
-                    User.phone == str(phone_number)
+                    User.phone.in_(phone_variants(phone_number))
                 ).first()
                 
                 if not member:
@@ -356,43 +549,25 @@ class PaymentService:
                         'message': 'No matching transaction found'
                     }
                 
-                # Create new transaction
-                transaction = Transaction(
-                    transaction_id=str(uuid.uuid4()),
-                    member_id=member.id,
-                    account_type='savings', # Defaults to savings if unmatched
-                    transaction_type='deposit',
-                    amount=amount,
-                    status='confirmed',
-                    mpesa_code=receipt_number,
-                    confirmed_at=datetime.utcnow()
-                )
-                db.session.add(transaction)
+                # Defaults to savings if unmatched
+                [row] = ledger_service.post_entries([{
+                    'member_id': member.id,
+                    'account_type': 'savings',
+                    'transaction_type': 'deposit',
+                    'amount': amount,
+                    'mpesa_code': receipt_number
+                }])
+                transaction_id = row['transaction_id']
             else:
-                # Update existing transaction
-                transaction.status = 'confirmed'
-                transaction.confirmed_at = datetime.utcnow()
-                transaction.mpesa_code = receipt_number
-            
-            db.session.flush()
-            
-            # Update account balance
-            from app.models import DrawdownAccount
-            account = None
-            if transaction.account_type == 'savings':
-                account = SavingsAccount.query.filter_by(member_id=member.id).first()
-            elif transaction.account_type == 'drawdown':
-                account = DrawdownAccount.query.filter_by(member_id=member.id).first()
-                
-            if account:
-                transaction.balance_before = account.balance
-                account.balance += Decimal(str(amount))
-                transaction.balance_after = account.balance
+                # Credit the account under its row lock and restamp the running balances
+                ledger_service.settle_pending(transaction, 'confirmed')
+                transaction_id = transaction.transaction_id
                 
                 # Auto-repay if drawdown
                 if transaction.account_type == 'drawdown':
+                    db.session.flush()
                     from app.services.loan_service import loan_service
-                    loan_service.auto_repay_from_drawdown(member.id)
+                    loan_service.auto_repay_from_drawdown(transaction.member_id)
             
             db.session.commit()
             
@@ -400,7 +575,7 @@ class PaymentService:
             if self.redis_client:
                 payment_key = f"payment:{receipt_number}"
                 self.redis_client.setex(payment_key, 86400, json.dumps({
-                    'transaction_id': transaction.transaction_id,
+                    'transaction_id': transaction_id,
                     'amount': amount,
                     'timestamp': datetime.utcnow().isoformat(),
                     'phone_number': phone_number
@@ -408,7 +583,7 @@ class PaymentService:
             
             return {
                 'status': 'reconciled',
-                'transaction_id': transaction.transaction_id,
+                'transaction_id': transaction_id,
                 'message': 'Payment reconciled successfully'
             }
             
@@ -473,54 +648,140 @@ class PaymentService:
                 'message': str(e)
             }
 
-    def get_payment_analytics(self, days: int = 30) -> Dict[str, Any]:
-        """Get payment analytics"""
+    def get_payment_analytics(self, days: int = 30, branch_id: Optional[int] = None,
+                              granularity: str = 'day') -> Dict[str, Any]:
+        """Get payment analytics, aggregated in SQL and cached per (days, branch, granularity)"""
+        if granularity not in ANALYTICS_GRANULARITIES:
+            raise ValueError(f"Granularity must be one of {', '.join(ANALYTICS_GRANULARITIES)}")
+        
+        cache_key = f"payment_analytics:{days}:{branch_id or 'all'}:{granularity}"
+        if self.redis_client:
+            try:
+                cached = self.redis_client.get(cache_key)
+                if cached:
+                    return json.loads(cached)
+            except Exception as e:
+                logging.warning(f"Failed to read payment analytics cache: {str(e)}")
+        
         try:
-            analytics = {
-                'total_payments': 0,
-                'total_amount': 0,
-                'successful_payments': 0,
-                'failed_payments': 0,
-                'pending_payments': 0,
-                'average_amount': 0,
-                'daily_totals': {}
-            }
-            
-            # Query from database
-            end_date = datetime.utcnow()
-            start_date = end_date - timedelta(days=days)
-            
-            transactions = Transaction.query.filter(
-                Transaction.created_at >= start_date,
-                Transaction.created_at <= end_date,
-                Transaction.transaction_type.in_(['deposit', 'payment'])
-            ).all()
-            
-            for transaction in transactions:
-                analytics['total_payments'] += 1
-                analytics['total_amount'] += transaction.amount
-                
-                if transaction.status == 'confirmed':
-                    analytics['successful_payments'] += 1
-                elif transaction.status == 'failed':
-                    analytics['failed_payments'] += 1
-                elif transaction.status == 'pending':
-                    analytics['pending_payments'] += 1
-                
-                # Daily totals
-                date_key = transaction.created_at.strftime('%Y-%m-%d')
-                if date_key not in analytics['daily_totals']:
-                    analytics['daily_totals'][date_key] = 0
-                analytics['daily_totals'][date_key] += transaction.amount
-            
-            if transactions:
-                analytics['average_amount'] = analytics['total_amount'] / len(transactions)
-            
-            return analytics
-            
+            analytics = self._compute_payment_analytics(days, branch_id, granularity)
         except Exception as e:
             logging.error(f"Error getting payment analytics: {str(e)}")
+            db.session.rollback()
             return {}
+        
+        if self.redis_client:
+            try:
+                self.redis_client.setex(cache_key, self.analytics_cache_ttl, json.dumps(analytics))
+            except Exception as e:
+                logging.warning(f"Failed to cache payment analytics: {str(e)}")
+        return analytics
+
+    def _compute_payment_analytics(self, days: int, branch_id: Optional[int], granularity: str) -> Dict[str, Any]:
+        end_date = datetime.utcnow()
+        start_date = end_date - timedelta(days=days)
+        
+        # Deposits carry no channel column: receipts mean M-Pesa, an officer means a counter deposit
+        channel = case(
+            (Transaction.mpesa_code.isnot(None), 'mpesa'),
+            (Transaction.processed_by.isnot(None), 'field_officer'),
+            else_='other'
+        ).label('channel')
+        bucket = func.date_trunc(granularity, Transaction.created_at).label('bucket')
+        
+        def scoped(query):
+            query = query.filter(
+                Transaction.created_at >= start_date,
+                Transaction.created_at <= end_date,
+                Transaction.transaction_type.in_(['deposit', 'payment'])
+            )
+            if branch_id:
+                query = query.join(Member, Member.id == Transaction.member_id).filter(Member.branch_id == branch_id)
+            return query
+        
+        grouped = scoped(db.session.query(
+            bucket, Transaction.status, channel,
+            func.count(Transaction.id), func.coalesce(func.sum(Transaction.amount), 0)
+        )).group_by(bucket, Transaction.status, channel).all()
+        
+        quantiles = cast(postgresql.array(list(ANALYTICS_PERCENTILES)), postgresql.ARRAY(Float))
+        distribution = scoped(db.session.query(
+            channel,
+            func.count(Transaction.id),
+            func.avg(Transaction.amount),
+            func.min(Transaction.amount),
+            func.max(Transaction.amount),
+            func.percentile_cont(quantiles).within_group(Transaction.amount)
+        )).group_by(channel).all()
+        overall = scoped(db.session.query(
+            func.percentile_cont(quantiles).within_group(Transaction.amount)
+        )).scalar()
+        
+        analytics = {
+            'total_payments': 0,
+            'total_amount': 0.0,
+            'successful_payments': 0,
+            'failed_payments': 0,
+            'pending_payments': 0,
+            'average_amount': 0.0,
+            'daily_totals': {},
+            'granularity': granularity,
+            'branch_id': branch_id,
+            'by_status': {},
+            'by_channel': {},
+            'timeseries': [],
+            'amount_distribution': {},
+            'generated_at': end_date.isoformat()
+        }
+        status_counters = {'confirmed': 'successful_payments', 'failed': 'failed_payments', 'pending': 'pending_payments'}
+        series = {}
+        
+        for bucket_start, status, channel_name, count, amount in grouped:
+            amount = float(amount)
+            analytics['total_payments'] += count
+            analytics['total_amount'] += amount
+            if status in status_counters:
+                analytics[status_counters[status]] += count
+            
+            for key, group in (('by_status', status), ('by_channel', channel_name)):
+                totals = analytics[key].setdefault(group, {'count': 0, 'amount': 0.0})
+                totals['count'] += count
+                totals['amount'] += amount
+            
+            point = series.setdefault(bucket_start, {
+                'bucket': bucket_start.isoformat(), 'count': 0, 'amount': 0.0, 'by_status': {}
+            })
+            point['count'] += count
+            point['amount'] += amount
+            point['by_status'][status] = point['by_status'].get(status, 0) + count
+            
+            date_key = bucket_start.strftime('%Y-%m-%d')
+            analytics['daily_totals'][date_key] = analytics['daily_totals'].get(date_key, 0.0) + amount
+        
+        analytics['timeseries'] = [series[key] for key in sorted(series)]
+        if granularity == 'hour':
+            analytics['hourly_totals'] = {
+                key.strftime('%Y-%m-%d %H:00'): series[key]['amount'] for key in sorted(series)
+            }
+        if analytics['total_payments']:
+            analytics['average_amount'] = analytics['total_amount'] / analytics['total_payments']
+        
+        def percentiles(values):
+            return {
+                f"p{int(q * 100)}": float(value) if value is not None else None
+                for q, value in zip(ANALYTICS_PERCENTILES, values or [None] * len(ANALYTICS_PERCENTILES))
+            }
+        
+        analytics['amount_distribution'] = {'overall': percentiles(overall)}
+        for channel_name, count, average, minimum, maximum, values in distribution:
+            analytics['amount_distribution'][channel_name] = {
+                'count': count,
+                'average': float(average or 0),
+                'min': float(minimum or 0),
+                'max': float(maximum or 0),
+                **percentiles(values)
+            }
+        return analytics
 
 # Global Payment service instance
 payment_service = PaymentService()
@@ -0,0 +1,163 @@
+"""
+Staff presence.
+
+Authenticated requests record a heartbeat: the user's last-seen time is
+written to a Redis sorted set (user id -> epoch seconds), and to one sorted
+set per branch for branch staff. Each worker process writes a given user at
+most once per PRESENCE_HEARTBEAT_SECONDS, so a busy session costs one Redis
+round trip a minute instead of one per request. "Who is online" is then a
+single ZRANGEBYSCORE over the last PRESENCE_ONLINE_SECONDS, and last-seen
+times for a page of users are a single ZMSCORE. Entries older than a day are
+trimmed as heartbeats are written. Each user's branch is kept in a Redis hash
+shared by every worker, so a branch move recorded by one worker is seen by
+all of them on their next heartbeat.
+"""
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+import redis
+
+PRESENCE_KEY = 'presence:last_seen'
+BRANCH_PRESENCE_KEY = 'presence:branch:{branch_id}'
+# user id -> branch id ('' for users without a branch)
+USER_BRANCH_KEY = 'presence:user_branch'
+RETENTION_SECONDS = 24 * 60 * 60
+# Local throttle entries kept per process
+MAX_TRACKED_USERS = 50000
+
+
+class PresenceService:
+    def __init__(self, app=None):
+        self.redis_client = None
+        self.app = None
+        self.heartbeat_seconds = 60
+        self.online_seconds = 15 * 60
+        self._lock = threading.Lock()
+        self._last_beat = {}
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize presence service with Flask app"""
+        self.app = app
+        try:
+            self.redis_client = redis.from_url(app.config.get('REDIS_URL'), decode_responses=True)
+        except Exception as e:
+            logging.warning(f"Failed to initialize Redis for presence: {str(e)}")
+
+        self.heartbeat_seconds = app.config.get('PRESENCE_HEARTBEAT_SECONDS', self.heartbeat_seconds)
+        self.online_seconds = app.config.get('PRESENCE_ONLINE_SECONDS', self.online_seconds)
+
+    # ------------------------------------------------------------------
+    # Heartbeats
+    # ------------------------------------------------------------------
+
+    def heartbeat(self, user_id: int, now: Optional[float] = None) -> bool:
+        """Record that the user is active; returns whether Redis was written"""
+        if not self.redis_client or not user_id:
+            return False
+        now = now or time.time()
+        user_id = int(user_id)
+        with self._lock:
+            if now - self._last_beat.get(user_id, 0) < self.heartbeat_seconds:
+                return False
+            if len(self._last_beat) >= MAX_TRACKED_USERS:
+                self._last_beat.clear()
+            self._last_beat[user_id] = now
+
+        branch_id = self._branch_of(user_id)
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.zadd(PRESENCE_KEY, {user_id: now})
+            pipe.zremrangebyscore(PRESENCE_KEY, '-inf', now - RETENTION_SECONDS)
+            if branch_id is not None:
+                branch_key = BRANCH_PRESENCE_KEY.format(branch_id=branch_id)
+                pipe.zadd(branch_key, {user_id: now})
+                pipe.zremrangebyscore(branch_key, '-inf', now - RETENTION_SECONDS)
+            pipe.execute()
+            return True
+        except redis.RedisError as e:
+            logging.warning(f"Failed to record presence for user {user_id}: {str(e)}")
+            return False
+
+    def _branch_of(self, user_id: int) -> Optional[int]:
+        try:
+            cached = self.redis_client.hget(USER_BRANCH_KEY, user_id)
+        except redis.RedisError as e:
+            logging.warning(f"Failed to read presence branch for user {user_id}: {str(e)}")
+            cached = None
+        if cached is not None:
+            return int(cached) if cached else None
+
+        from app import db
+        from app.models import User
+        branch_id = db.session.query(User.branch_id).filter(User.id == user_id).scalar()
+        self._remember_branch(user_id, branch_id)
+        return branch_id
+
+    def _remember_branch(self, user_id: int, branch_id: Optional[int]):
+        try:
+            self.redis_client.hset(USER_BRANCH_KEY, user_id, '' if branch_id is None else branch_id)
+        except redis.RedisError as e:
+            logging.warning(f"Failed to store presence branch for user {user_id}: {str(e)}")
+
+    def moved_branch(self, user_id: int, old_branch_id: Optional[int], new_branch_id: Optional[int]):
+        """Record a committed branch move and take the user out of the old branch's set"""
+        user_id = int(user_id)
+        with self._lock:
+            # The next request writes the new branch straight away
+            self._last_beat.pop(user_id, None)
+        if not self.redis_client:
+            return
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.hset(USER_BRANCH_KEY, user_id, '' if new_branch_id is None else new_branch_id)
+            if old_branch_id is not None:
+                pipe.zrem(BRANCH_PRESENCE_KEY.format(branch_id=old_branch_id), user_id)
+            pipe.execute()
+        except redis.RedisError as e:
+            logging.warning(f"Failed to move presence for user {user_id}: {str(e)}")
+
+    # ------------------------------------------------------------------
+    # Lookups
+    # ------------------------------------------------------------------
+
+    def online_users(self, branch_id: Optional[int] = None, now: Optional[float] = None) -> Dict[int, datetime]:
+        """Users seen within the online window, with their last-seen time; all branches when branch_id is None"""
+        if not self.redis_client:
+            return {}
+        now = now or time.time()
+        key = PRESENCE_KEY if branch_id is None else BRANCH_PRESENCE_KEY.format(branch_id=branch_id)
+        try:
+            members = self.redis_client.zrangebyscore(key, now - self.online_seconds, '+inf', withscores=True)
+        except redis.RedisError as e:
+            logging.warning(f"Failed to read presence: {str(e)}")
+            return {}
+        return {int(user_id): datetime.utcfromtimestamp(score) for user_id, score in members}
+
+    def last_seen(self, user_ids: Iterable[int]) -> Dict[int, Optional[datetime]]:
+        """Last heartbeat of each user, None for users not seen in the last day"""
+        user_ids = list(dict.fromkeys(int(user_id) for user_id in user_ids))
+        if not self.redis_client or not user_ids:
+            return {user_id: None for user_id in user_ids}
+        try:
+            scores = self.redis_client.zmscore(PRESENCE_KEY, user_ids)
+        except redis.RedisError as e:
+            logging.warning(f"Failed to read presence: {str(e)}")
+            return {user_id: None for user_id in user_ids}
+        return {
+            user_id: datetime.utcfromtimestamp(score) if score is not None else None
+            for user_id, score in zip(user_ids, scores)
+        }
+
+    def is_online(self, last_seen: Optional[datetime], now: Optional[datetime] = None) -> bool:
+        if last_seen is None:
+            return False
+        return ((now or datetime.utcnow()) - last_seen).total_seconds() < self.online_seconds
+
+
+presence_service = PresenceService()
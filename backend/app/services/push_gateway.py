@@ -0,0 +1,245 @@
+"""
+Server-Sent Events push gateway.
+
+Browsers keep one `GET /api/events/stream` open instead of polling the
+unread counters and dashboard feeds. Each process runs a single listener on
+the event bus channel (started lazily, once per forked worker) and fans every
+event out to the matching open streams through small per-stream queues;
+events are formatted once, not once per stream. Streams are idle most of the
+time, so the gateway is meant to run on an async worker:
+
+    gunicorn -k gevent -w 1 --worker-connections 10000 -b 0.0.0.0:5000 wsgi:app
+
+behind nginx's /api/events/ location (the push-gateway compose service), so
+the sync API workers never hold these streams. A stream whose queue fills up
+(a stalled client) is closed; the browser reconnects and refetches. After the
+listener reconnects to Redis every stream gets a `resync` event, since events
+may have been missed in between.
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterator, Optional
+
+import redis
+
+from app.services.event_bus import DEFAULT_CHANNEL
+
+
+class Subscription:
+    __slots__ = ('user_id', 'role', 'branch_id', 'queue', 'closed', 'connected_at')
+
+    def __init__(self, user_id: int, role: Optional[str], branch_id: Optional[int], queue_size: int):
+        self.user_id = user_id
+        self.role = role
+        self.branch_id = branch_id
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.closed = False
+        self.connected_at = time.time()
+
+
+def format_event(event_type: str, data: Any) -> str:
+    return f"event: {event_type}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+class PushGateway:
+    def __init__(self, app=None):
+        self.app = None
+        self.redis_url = None
+        self.channel = DEFAULT_CHANNEL
+        self.heartbeat_seconds = 25
+        self.queue_size = 100
+        self.max_connections = 10000
+        self.retry_ms = 5000
+        self.reconnect_seconds = 5
+
+        self._lock = threading.Lock()
+        self._streams = set()
+        self._by_user = defaultdict(set)
+        self._by_branch = defaultdict(set)
+        self._by_role = defaultdict(set)
+        self._listener_pid = None
+        self._counters = defaultdict(int)
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize push gateway with Flask app"""
+        self.app = app
+        self.redis_url = app.config.get('REDIS_URL')
+        self.channel = app.config.get('EVENT_BUS_CHANNEL', self.channel)
+        self.heartbeat_seconds = app.config.get('PUSH_HEARTBEAT_SECONDS', self.heartbeat_seconds)
+        self.queue_size = app.config.get('PUSH_QUEUE_SIZE', self.queue_size)
+        self.max_connections = app.config.get('PUSH_MAX_CONNECTIONS', self.max_connections)
+
+    # ------------------------------------------------------------------
+    # Streams
+    # ------------------------------------------------------------------
+
+    def connect(self, user_id: int, role: Optional[str] = None,
+                branch_id: Optional[int] = None) -> Optional[Subscription]:
+        """Register a stream, or None when this process is at capacity"""
+        self._ensure_listener()
+        subscription = Subscription(user_id, role, branch_id, self.queue_size)
+        with self._lock:
+            if len(self._streams) >= self.max_connections:
+                self._counters['rejected'] += 1
+                return None
+            self._streams.add(subscription)
+            self._by_user[user_id].add(subscription)
+            if branch_id is not None:
+                self._by_branch[branch_id].add(subscription)
+            if role:
+                self._by_role[role].add(subscription)
+            self._counters['connected'] += 1
+        return subscription
+
+    def disconnect(self, subscription: Subscription):
+        subscription.closed = True
+        self._wake(subscription)
+        with self._lock:
+            if subscription not in self._streams:
+                return
+            self._streams.discard(subscription)
+            for index, key in ((self._by_user, subscription.user_id),
+                               (self._by_branch, subscription.branch_id),
+                               (self._by_role, subscription.role)):
+                streams = index.get(key)
+                if streams is not None:
+                    streams.discard(subscription)
+                    if not streams:
+                        del index[key]
+            self._counters['disconnected'] += 1
+
+    @staticmethod
+    def _wake(subscription: Subscription):
+        """Put the end-of-stream sentinel on the queue, dropping queued events to make room"""
+        while True:
+            try:
+                subscription.queue.put_nowait(None)
+                return
+            except queue.Full:
+                try:
+                    subscription.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def stream(self, subscription: Subscription) -> Iterator[str]:
+        """SSE body for one subscription: a ready event, then events and keepalives until closed"""
+        try:
+            yield f"retry: {self.retry_ms}\n\n"
+            yield format_event('ready', {'userId': subscription.user_id})
+            while not subscription.closed:
+                try:
+                    message = subscription.queue.get(timeout=self.heartbeat_seconds)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                # None is the sentinel from disconnect(): end the response now
+                if message is None or subscription.closed:
+                    break
+                yield message
+        finally:
+            self.disconnect(subscription)
+
+    # ------------------------------------------------------------------
+    # Fan-out
+    # ------------------------------------------------------------------
+
+    def dispatch(self, event: Dict[str, Any]) -> int:
+        """Queue an event bus event on every matching stream of this process"""
+        message = format_event(event['type'], dict(event.get('data') or {}, at=event.get('at')))
+        with self._lock:
+            if not (event.get('users') or event.get('branches') or event.get('roles')):
+                targets = set(self._streams)
+            else:
+                targets = set()
+                for user_id in event.get('users', ()):
+                    targets.update(self._by_user.get(user_id, ()))
+                for branch_id in event.get('branches', ()):
+                    targets.update(self._by_branch.get(branch_id, ()))
+                for role in event.get('roles', ()):
+                    targets.update(self._by_role.get(role, ()))
+
+        delivered = 0
+        for subscription in targets:
+            try:
+                subscription.queue.put_nowait(message)
+                delivered += 1
+            except queue.Full:
+                # The client has stopped reading; it refetches when it reconnects
+                self._counters['overflowed'] += 1
+                self.disconnect(subscription)
+        self._counters['events'] += 1
+        self._counters['delivered'] += delivered
+        return delivered
+
+    def broadcast(self, event_type: str, data: Dict[str, Any]) -> int:
+        """Queue an event on every stream of this process"""
+        return self.dispatch({'type': event_type, 'data': data})
+
+    def _ensure_listener(self):
+        if self._listener_pid == os.getpid() or not self.redis_url:
+            return
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            # Started lazily so each forked worker runs its own subscriber
+            self._listener_pid = os.getpid()
+        threading.Thread(target=self._listen, name='push-gateway', daemon=True).start()
+
+    def _listen(self):
+        client = redis.Redis.from_url(self.redis_url, decode_responses=True, health_check_interval=30)
+        subscribed_before = False
+        while True:
+            try:
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                if subscribed_before:
+                    self.broadcast('resync', {})
+                subscribed_before = True
+                for item in pubsub.listen():
+                    try:
+                        self.dispatch(json.loads(item['data']))
+                    except (ValueError, KeyError, TypeError) as e:
+                        logging.warning(f"Dropped malformed push event: {str(e)}")
+            except Exception as e:
+                logging.warning(f"Push gateway listener error: {str(e)}")
+                time.sleep(self.reconnect_seconds)
+
+    # ------------------------------------------------------------------
+    # Stats
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _rss_bytes() -> Optional[int]:
+        try:
+            with open('/proc/self/status') as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            streams = len(self._streams)
+            users = len(self._by_user)
+        return {
+            'pid': os.getpid(),
+            'streams': streams,
+            'users': users,
+            'maxConnections': self.max_connections,
+            'rssBytes': self._rss_bytes(),
+            'listening': self._listener_pid == os.getpid(),
+            'counters': dict(self._counters)
+        }
+
+
+push_gateway = PushGateway()
@@ -0,0 +1,479 @@
+"""
+Bulk M-Pesa statement reconciliation.
+
+A paybill statement CSV is streamed into a per-connection temporary table with
+COPY and reconciled against transactions in a single set-based query: first on
+receipt number, then on (phone, amount, time window) for rows whose receipt is
+not on file. Every statement row comes out as matched, unmatched or duplicate.
+"""
+import csv
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal, InvalidOperation
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from dateutil import parser as date_parser
+from sqlalchemy import text
+
+from app import db
+from app.utils.phone import phone_key
+
+# Normalised header -> staging field, covering the Safaricom portal export,
+# Daraja C2B field names and hand-made spreadsheets
+STATEMENT_COLUMNS = {
+    'receipt no.': 'receipt', 'receipt no': 'receipt', 'receipt': 'receipt',
+    'receipt_number': 'receipt', 'receiptnumber': 'receipt', 'transid': 'receipt',
+    'transaction id': 'receipt', 'mpesa_code': 'receipt', 'mpesacode': 'receipt',
+    'completion time': 'completed_at', 'completed_at': 'completed_at',
+    'transtime': 'completed_at', 'transaction time': 'completed_at', 'date': 'completed_at',
+    'paid in': 'amount', 'paid_in': 'amount', 'amount': 'amount', 'transamount': 'amount',
+    'other party info': 'phone', 'msisdn': 'phone', 'phone': 'phone', 'phone_number': 'phone',
+    'transaction status': 'status', 'status': 'status',
+}
+
+STATEMENT_TIME_FORMATS = ('%Y-%m-%d %H:%M:%S', '%d-%m-%Y %H:%M:%S', '%d/%m/%Y %H:%M:%S',
+                          '%Y%m%d%H%M%S', '%Y-%m-%dT%H:%M:%S')
+
+COPY_NULL = '\\N'
+
+OUTCOMES = ('matched', 'unmatched', 'duplicate')
+
+RESULT_COLUMNS = ('line_no', 'receipt', 'completed_at', 'amount', 'phone_key', 'outcome',
+                  'match_type', 'transaction_id', 'transaction_status', 'member_id',
+                  'transaction_amount')
+
+CREATE_STAGE_SQL = """
+CREATE TEMPORARY TABLE mpesa_statement_stage (
+    line_no integer NOT NULL,
+    receipt text NOT NULL,
+    completed_at timestamp NOT NULL,
+    amount numeric(12, 2) NOT NULL,
+    phone_key text
+) ON COMMIT DROP
+"""
+
+# One pass over the staged statement. Receipt matches win; only rows whose
+# receipt is not on file fall back to phone + amount within the window, and
+# only against transactions that never recorded a receipt. A statement row is
+# a duplicate when its receipt already appeared earlier in the statement or
+# when an earlier row already claimed the same transaction.
+RECONCILE_SQL = """
+WITH stage AS (
+    SELECT s.*,
+           row_number() OVER (PARTITION BY s.receipt ORDER BY s.line_no) AS receipt_rank
+    FROM mpesa_statement_stage s
+),
+by_receipt AS (
+    SELECT DISTINCT ON (st.line_no)
+           st.line_no, t.id AS txn_pk, t.transaction_id, t.status, t.member_id, t.amount
+    FROM stage st
+    JOIN transactions t ON t.mpesa_code = st.receipt
+    WHERE t.status IN ('pending', 'confirmed')
+    ORDER BY st.line_no, (t.status = 'confirmed') DESC, t.id
+),
+member_phones AS (
+    SELECT m.id AS member_id,
+           right(regexp_replace(u.phone, '[^0-9]', '', 'g'), 9) AS phone_key
+    FROM members m
+    JOIN users u ON u.id = m.user_id
+),
+by_fallback AS (
+    SELECT DISTINCT ON (st.line_no)
+           st.line_no, t.id AS txn_pk, t.transaction_id, t.status, t.member_id, t.amount
+    FROM stage st
+    JOIN member_phones mp ON mp.phone_key = st.phone_key
+    JOIN transactions t ON t.member_id = mp.member_id
+         AND t.amount = st.amount
+         AND t.created_at BETWEEN st.completed_at - make_interval(mins => :window_minutes)
+                              AND st.completed_at + make_interval(mins => :window_minutes)
+    WHERE st.receipt_rank = 1
+      AND st.phone_key IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM by_receipt r WHERE r.line_no = st.line_no)
+      AND t.mpesa_code IS NULL
+      AND t.status IN ('pending', 'confirmed')
+      AND t.transaction_type NOT IN ('withdrawal', 'loan_disbursement')
+    ORDER BY st.line_no, abs(extract(epoch FROM t.created_at - st.completed_at)), t.id
+),
+resolved AS (
+    SELECT st.line_no, st.receipt, st.completed_at, st.amount, st.phone_key, st.receipt_rank,
+           CASE WHEN r.line_no IS NOT NULL THEN 'receipt'
+                WHEN f.line_no IS NOT NULL THEN 'fallback' END AS match_type,
+           coalesce(r.txn_pk, f.txn_pk) AS txn_pk,
+           coalesce(r.transaction_id, f.transaction_id) AS transaction_id,
+           coalesce(r.status, f.status) AS transaction_status,
+           coalesce(r.member_id, f.member_id) AS member_id,
+           coalesce(r.amount, f.amount) AS transaction_amount
+    FROM stage st
+    LEFT JOIN by_receipt r ON r.line_no = st.line_no
+    LEFT JOIN by_fallback f ON f.line_no = st.line_no AND r.line_no IS NULL
+),
+claimed AS (
+    SELECT resolved.*,
+           CASE WHEN txn_pk IS NULL THEN 1
+                ELSE row_number() OVER (
+                    PARTITION BY txn_pk
+                    ORDER BY (match_type = 'receipt') DESC, line_no
+                ) END AS claim_rank
+    FROM resolved
+)
+SELECT line_no, receipt, completed_at, amount, phone_key,
+       CASE WHEN receipt_rank > 1 OR claim_rank > 1 THEN 'duplicate'
+            WHEN txn_pk IS NOT NULL THEN 'matched'
+            ELSE 'unmatched' END AS outcome,
+       match_type, transaction_id, transaction_status, member_id, transaction_amount
+FROM claimed
+ORDER BY line_no
+"""
+
+
+class _StatementCopyStream:
+    """File-like adapter feeding normalised statement rows to COPY ... FROM STDIN"""
+
+    def __init__(self, rows: Iterable[str]):
+        self._rows = iter(rows)
+        self._buffer = ''
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._rows)
+            except StopIteration:
+                break
+        if size < 0:
+            chunk, self._buffer = self._buffer, ''
+        else:
+            chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+
+class StatementReconciliationService:
+    def __init__(self, app=None):
+        self.app = None
+        self.window_minutes = 10
+        self.utc_offset_hours = 3
+        self.fetch_size = 5000
+        self.progress_every = 10000
+        self.sample_limit = 100
+        self.report_dir = os.path.join(tempfile.gettempdir(), 'statement_reconciliation')
+        self.job_ttl = 86400
+        # job id -> state, used when Redis is unavailable
+        self._jobs = {}
+        self._jobs_lock = threading.Lock()
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize statement reconciliation with Flask app"""
+        self.app = app
+        self.window_minutes = app.config.get('MPESA_RECONCILIATION_WINDOW_MINUTES', 10)
+        # Statements are exported in EAT while transactions are stamped in UTC
+        self.utc_offset_hours = app.config.get('MPESA_STATEMENT_UTC_OFFSET_HOURS', 3)
+        self.fetch_size = app.config.get('MPESA_RECONCILIATION_FETCH_SIZE', 5000)
+        self.report_dir = app.config.get('MPESA_RECONCILIATION_REPORT_DIR', self.report_dir)
+
+    # ------------------------------------------------------------------
+    # Statement parsing
+    # ------------------------------------------------------------------
+
+    def _parse_time(self, value: str) -> datetime:
+        value = value.strip()
+        for fmt in STATEMENT_TIME_FORMATS:
+            try:
+                parsed = datetime.strptime(value, fmt)
+                break
+            except ValueError:
+                continue
+        else:
+            parsed = date_parser.parse(value, dayfirst=True)
+        if parsed.tzinfo is not None:
+            return parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        return parsed - timedelta(hours=self.utc_offset_hours)
+
+    @staticmethod
+    def _parse_amount(value: str) -> Optional[Decimal]:
+        value = (value or '').replace(',', '').strip()
+        if not value:
+            return None
+        amount = Decimal(value)
+        return amount if amount > 0 else None
+
+    @staticmethod
+    def _parse_phone(value: str) -> Optional[str]:
+        # "254712345678 - JOHN DOE"; masked numbers (2547****678) cannot be matched
+        token = (value or '').split('-')[0].strip()
+        if '*' in token:
+            return None
+        key = phone_key(token)
+        return key if len(key) == 9 else None
+
+    def iter_statement(self, stream, stats: Dict[str, Any]):
+        """Yield COPY lines for the credit rows of a statement CSV read from `stream`"""
+        reader = csv.reader(stream)
+        columns = None
+        for row in reader:
+            # Portal exports carry a few lines of account details above the header
+            headers = [cell.strip().lower() for cell in row]
+            if 'receipt' in {STATEMENT_COLUMNS.get(h) for h in headers}:
+                columns = {STATEMENT_COLUMNS[h]: i for i, h in enumerate(headers) if h in STATEMENT_COLUMNS}
+                break
+        if columns is None:
+            raise ValueError('Statement has no receipt column')
+        missing = {'receipt', 'completed_at', 'amount'} - set(columns)
+        if missing:
+            raise ValueError(f"Statement is missing columns: {', '.join(sorted(missing))}")
+
+        for row in reader:
+            stats['rows_read'] += 1
+            line_no = reader.line_num
+            try:
+                if 'status' in columns and row[columns['status']].strip().lower() not in ('', 'completed'):
+                    stats['skipped'] += 1
+                    continue
+                amount = self._parse_amount(row[columns['amount']])
+                receipt = row[columns['receipt']].strip().upper()
+                if amount is None or not receipt:
+                    stats['skipped'] += 1
+                    continue
+                if not receipt.isalnum():
+                    raise ValueError(f"Malformed receipt {receipt!r}")
+                completed_at = self._parse_time(row[columns['completed_at']])
+                phone = self._parse_phone(row[columns['phone']]) if 'phone' in columns else None
+            except (IndexError, ValueError, InvalidOperation, OverflowError):
+                stats['rejected'] += 1
+                if len(stats['rejected_lines']) < self.sample_limit:
+                    stats['rejected_lines'].append(line_no)
+                continue
+
+            stats['rows_staged'] += 1
+            yield f"{line_no}\t{receipt}\t{completed_at.isoformat(sep=' ')}\t{amount}\t{phone or COPY_NULL}\n"
+
+    # ------------------------------------------------------------------
+    # Reconciliation
+    # ------------------------------------------------------------------
+
+    def reconcile_statement(self, stream, output_dir: Optional[str] = None,
+                            window_minutes: Optional[int] = None,
+                            progress: Optional[Callable[[str, int, Optional[int]], None]] = None) -> Dict[str, Any]:
+        """
+        Reconcile a statement CSV stream against transactions.
+
+        Writes matched.csv, unmatched.csv and duplicate.csv into `output_dir`
+        when given, otherwise returns up to `sample_limit` rows of each set.
+        `progress(phase, done, total)` is called while loading and emitting.
+        """
+        window_minutes = window_minutes or self.window_minutes
+        report = progress or (lambda phase, done, total: None)
+        started = time.perf_counter()
+        stats = {'rows_read': 0, 'rows_staged': 0, 'skipped': 0, 'rejected': 0, 'rejected_lines': []}
+        summary = {outcome: {'count': 0, 'amount': Decimal('0')} for outcome in OUTCOMES}
+        summary['matched'].update({'byReceipt': 0, 'byFallback': 0, 'amountMismatches': 0})
+        samples = {outcome: [] for outcome in OUTCOMES}
+
+        writers, files = {}, []
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+            for outcome in OUTCOMES:
+                handle = open(os.path.join(output_dir, f"{outcome}.csv"), 'w', newline='')
+                files.append(handle)
+                writers[outcome] = csv.writer(handle)
+                writers[outcome].writerow(RESULT_COLUMNS)
+
+        def staged_lines():
+            for line in self.iter_statement(stream, stats):
+                yield line
+                if stats['rows_staged'] % self.progress_every == 0:
+                    report('loading', stats['rows_staged'], None)
+
+        try:
+            connection = db.session.connection()
+            connection.execute(text(CREATE_STAGE_SQL))
+            cursor = connection.connection.cursor()
+            try:
+                cursor.copy_expert(
+                    "COPY mpesa_statement_stage (line_no, receipt, completed_at, amount, phone_key) "
+                    "FROM STDIN WITH (FORMAT text)",
+                    _StatementCopyStream(staged_lines())
+                )
+            finally:
+                cursor.close()
+            connection.execute(text("ANALYZE mpesa_statement_stage"))
+            loaded_at = time.perf_counter()
+            report('loading', stats['rows_staged'], stats['rows_staged'])
+
+            result = connection.execution_options(stream_results=True).execute(
+                text(RECONCILE_SQL), {'window_minutes': window_minutes}
+            )
+            emitted = 0
+            report('matching', 0, stats['rows_staged'])
+            while True:
+                rows = result.fetchmany(self.fetch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    record = dict(zip(RESULT_COLUMNS, row))
+                    outcome = record['outcome']
+                    bucket = summary[outcome]
+                    bucket['count'] += 1
+                    bucket['amount'] += record['amount']
+                    if outcome == 'matched':
+                        bucket['byReceipt' if record['match_type'] == 'receipt' else 'byFallback'] += 1
+                        if record['transaction_amount'] != record['amount']:
+                            bucket['amountMismatches'] += 1
+                    if outcome in writers:
+                        writers[outcome].writerow([record[c] for c in RESULT_COLUMNS])
+                    elif len(samples[outcome]) < self.sample_limit:
+                        samples[outcome].append(self._row_to_dict(record))
+                emitted += len(rows)
+                report('matching', emitted, stats['rows_staged'])
+            result.close()
+        finally:
+            # Read-only: rolling back also drops the ON COMMIT DROP staging table
+            db.session.rollback()
+            for handle in files:
+                handle.close()
+
+        finished = time.perf_counter()
+        response = {
+            'rowsRead': stats['rows_read'],
+            'rowsStaged': stats['rows_staged'],
+            'skipped': stats['skipped'],
+            'rejected': stats['rejected'],
+            'rejectedLines': stats['rejected_lines'],
+            'windowMinutes': window_minutes,
+            'summary': {
+                outcome: {**values, 'amount': str(values['amount'])}
+                for outcome, values in summary.items()
+            },
+            'timings': {
+                'loadSeconds': round(loaded_at - started, 3),
+                'matchSeconds': round(finished - loaded_at, 3),
+                'totalSeconds': round(finished - started, 3)
+            }
+        }
+        if output_dir:
+            response['files'] = {outcome: os.path.join(output_dir, f"{outcome}.csv") for outcome in OUTCOMES}
+        else:
+            response['samples'] = samples
+        logging.info(f"Statement reconciled: {response['summary']} in {response['timings']['totalSeconds']}s")
+        return response
+
+    @staticmethod
+    def _row_to_dict(record: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'lineNo': record['line_no'],
+            'receipt': record['receipt'],
+            'completedAt': record['completed_at'].isoformat(),
+            'amount': str(record['amount']),
+            'phoneKey': record['phone_key'],
+            'matchType': record['match_type'],
+            'transactionId': record['transaction_id'],
+            'transactionStatus': record['transaction_status'],
+            'memberId': record['member_id'],
+            'transactionAmount': str(record['transaction_amount']) if record['transaction_amount'] is not None else None
+        }
+
+    # ------------------------------------------------------------------
+    # Background jobs
+    # ------------------------------------------------------------------
+
+    def _job_key(self, job_id: str) -> str:
+        return f"statement_reconciliation:{job_id}"
+
+    def _save_job(self, job_id: str, state: Dict[str, Any]):
+        from app.services.payment_service import payment_service
+        redis_client = payment_service.redis_client
+        if redis_client:
+            try:
+                redis_client.setex(self._job_key(job_id), self.job_ttl, json.dumps(state, default=str))
+                return
+            except Exception as e:
+                logging.warning(f"Failed to store reconciliation job in Redis: {str(e)}")
+        with self._jobs_lock:
+            self._jobs[job_id] = state
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Current state of a reconciliation job, or None if unknown or expired"""
+        from app.services.payment_service import payment_service
+        redis_client = payment_service.redis_client
+        if redis_client:
+            try:
+                raw = redis_client.get(self._job_key(job_id))
+                if raw:
+                    return json.loads(raw)
+            except Exception as e:
+                logging.warning(f"Failed to read reconciliation job from Redis: {str(e)}")
+        with self._jobs_lock:
+            return self._jobs.get(job_id)
+
+    def job_report_path(self, job_id: str, outcome: str) -> Optional[str]:
+        if outcome not in OUTCOMES or not re.fullmatch(r'[0-9a-f]{32}', job_id):
+            return None
+        path = os.path.join(self.report_dir, job_id, f"{outcome}.csv")
+        return path if os.path.exists(path) else None
+
+    def start_job(self, upload, window_minutes: Optional[int] = None) -> str:
+        """Spool an uploaded statement to disk and reconcile it in a background thread"""
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.report_dir, job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        statement_path = os.path.join(job_dir, 'statement.csv')
+        upload.save(statement_path)
+
+        state = {
+            'jobId': job_id,
+            'status': 'queued',
+            'phase': None,
+            'processed': 0,
+            'total': None,
+            'createdAt': datetime.utcnow().isoformat()
+        }
+        self._save_job(job_id, state)
+
+        app = self.app
+        thread = threading.Thread(
+            target=self._run_job, args=(app, job_id, statement_path, job_dir, window_minutes, state),
+            name=f"statement-reconciliation-{job_id[:8]}", daemon=True
+        )
+        thread.start()
+        return job_id
+
+    def _run_job(self, app, job_id, statement_path, job_dir, window_minutes, state):
+        last_saved = [0.0]
+
+        def progress(phase, done, total):
+            state.update({'status': 'running', 'phase': phase, 'processed': done, 'total': total})
+            now = time.monotonic()
+            if now - last_saved[0] >= 0.5 or done == total:
+                last_saved[0] = now
+                self._save_job(job_id, state)
+
+        with app.app_context():
+            try:
+                with open(statement_path, newline='', encoding='utf-8-sig') as stream:
+                    result = self.reconcile_statement(
+                        stream, output_dir=job_dir, window_minutes=window_minutes, progress=progress
+                    )
+                result.pop('files', None)
+                state.update({'status': 'completed', 'result': result,
+                              'completedAt': datetime.utcnow().isoformat()})
+            except Exception as e:
+                logging.error(f"Statement reconciliation {job_id} failed: {str(e)}")
+                state.update({'status': 'failed', 'error': str(e)})
+            finally:
+                db.session.remove()
+                self._save_job(job_id, state)
+                try:
+                    os.remove(statement_path)
+                except OSError:
+                    pass
+
+
+statement_reconciliation_service = StatementReconciliationService()
@@ -0,0 +1,211 @@
+"""
+Meeting reminder scheduler.
+
+Reminders are no longer sent when an officer happens to open the app. A
+periodic `schedule` pass reads every upcoming GroupVisit in one indexed range
+query and writes each visit's reminder fire time into a Redis sorted set;
+visits created through the API are scheduled as soon as they are saved. A
+frequent `dispatch` pass pops due entries in batches, sends the in-app
+reminders and records what was sent in one pipeline per batch. Entries are
+claimed with ZREM, so several dispatchers can run side by side without
+sending a reminder twice.
+"""
+import logging
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+import redis
+from sqlalchemy.orm import joinedload
+
+from app.models import GroupVisit
+
+SCHEDULE_KEY = 'reminders:meetings'
+# One set per visit day of the ZSET members already dispatched
+SENT_KEY = 'reminders:meetings:sent:{day}'
+SENT_TTL = 3 * 24 * 60 * 60
+RETRY_DELAY = timedelta(minutes=5)
+
+
+class MeetingReminderScheduler:
+    def __init__(self, app=None):
+        self.redis_client = None
+        self.app = None
+        # Hour of the visit day (UTC) the reminder goes out
+        self.reminder_hour = 7
+        self.horizon_days = 7
+        self.batch_size = 500
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize meeting reminder scheduler with Flask app"""
+        self.app = app
+        try:
+            self.redis_client = redis.from_url(app.config.get('REDIS_URL'), decode_responses=True)
+        except Exception as e:
+            logging.warning(f"Failed to initialize Redis for meeting reminders: {str(e)}")
+
+        self.reminder_hour = app.config.get('MEETING_REMINDER_HOUR', self.reminder_hour)
+        self.horizon_days = app.config.get('MEETING_REMINDER_HORIZON_DAYS', self.horizon_days)
+        self.batch_size = app.config.get('MEETING_REMINDER_BATCH_SIZE', self.batch_size)
+
+    @staticmethod
+    def _member(visit: GroupVisit) -> str:
+        # The date is part of the entry so a rescheduled visit gets a fresh reminder
+        return f"{visit.id}:{visit.visit_date.isoformat()}"
+
+    def fire_time(self, visit_date: date) -> datetime:
+        return datetime.combine(visit_date, time(hour=self.reminder_hour))
+
+    @staticmethod
+    def _score(moment: datetime) -> float:
+        # Naive datetimes in this app are UTC
+        return moment.replace(tzinfo=timezone.utc).timestamp()
+
+    # ------------------------------------------------------------------
+    # Scheduling
+    # ------------------------------------------------------------------
+
+    def schedule(self, horizon_days: Optional[int] = None) -> Dict[str, int]:
+        """Put every visit from today to the horizon into the schedule"""
+        today = datetime.utcnow().date()
+        until = today + timedelta(days=horizon_days or self.horizon_days)
+        visits = GroupVisit.query.filter(
+            GroupVisit.visit_date >= today,
+            GroupVisit.visit_date <= until
+        ).with_entities(GroupVisit.id, GroupVisit.visit_date).all()
+        scheduled = self.schedule_visits(visits)
+        return {'visits': len(visits), 'scheduled': scheduled}
+
+    def schedule_visits(self, visits: Iterable[Any]) -> int:
+        """Add visits (anything with id and visit_date) to the schedule, skipping reminders already sent"""
+        if not self.redis_client:
+            return 0
+        today = datetime.utcnow().date()
+        by_day = {}
+        for visit in visits:
+            if visit.visit_date >= today:
+                by_day.setdefault(visit.visit_date, []).append(visit)
+        if not by_day:
+            return 0
+
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for day in by_day:
+                pipe.smembers(SENT_KEY.format(day=day.isoformat()))
+            sent = set().union(*pipe.execute())
+
+            scheduled = 0
+            pipe = self.redis_client.pipeline(transaction=False)
+            for day, day_visits in by_day.items():
+                fire_at = self._score(self.fire_time(day))
+                mapping = {
+                    self._member(visit): fire_at for visit in day_visits
+                    if self._member(visit) not in sent
+                }
+                if mapping:
+                    pipe.zadd(SCHEDULE_KEY, mapping)
+                    scheduled += len(mapping)
+            pipe.execute()
+            return scheduled
+        except redis.RedisError as e:
+            logging.warning(f"Failed to schedule meeting reminders: {str(e)}")
+            return 0
+
+    # ------------------------------------------------------------------
+    # Dispatch
+    # ------------------------------------------------------------------
+
+    def dispatch(self, now: Optional[datetime] = None, max_batches: int = 100) -> Dict[str, int]:
+        """Send every reminder whose fire time has passed, batch_size at a time"""
+        from app.services.notification_service import notification_service, NotificationChannel
+
+        if not self.redis_client:
+            return {'claimed': 0, 'sent': 0, 'skipped': 0, 'failed': 0}
+        now = now or datetime.utcnow()
+        totals = {'claimed': 0, 'sent': 0, 'skipped': 0, 'failed': 0}
+
+        for _ in range(max_batches):
+            due = self.redis_client.zrangebyscore(SCHEDULE_KEY, '-inf', self._score(now), start=0, num=self.batch_size)
+            if not due:
+                break
+
+            # ZREM reports 1 only to the dispatcher that removed the entry
+            pipe = self.redis_client.pipeline(transaction=False)
+            for member in due:
+                pipe.zrem(SCHEDULE_KEY, member)
+            claimed = [member for member, removed in zip(due, pipe.execute()) if removed]
+            totals['claimed'] += len(claimed)
+            if not claimed:
+                continue
+
+            entries = {}
+            for member in claimed:
+                visit_id, visit_day = member.split(':', 1)
+                entries[int(visit_id)] = (member, visit_day)
+            visits = GroupVisit.query.options(joinedload(GroupVisit.group)).filter(
+                GroupVisit.id.in_(list(entries))
+            ).all()
+
+            sent, failed = [], []
+            for visit in visits:
+                member, visit_day = entries[visit.id]
+                # Deleted, moved or already-past visits are dropped
+                if visit.visit_date.isoformat() != visit_day or visit.visit_date < now.date():
+                    continue
+                try:
+                    notification_service.send_notification(
+                        recipient_id=visit.field_officer_id,
+                        template_id="meeting_reminder",
+                        variables={
+                            "group_name": visit.group.name if visit.group else "Your Group",
+                            "time": "Today" if visit.visit_date == now.date() else visit.visit_date.strftime('%A %d %B'),
+                            "location": visit.group.location if visit.group and visit.group.location else "Scheduled Location"
+                        },
+                        channel=NotificationChannel.IN_APP,
+                        data={'groupVisitId': visit.id, 'groupId': visit.group_id}
+                    )
+                    sent.append((member, visit_day))
+                except Exception as e:
+                    logging.error(f"Failed to send meeting reminder for visit {visit.id}: {str(e)}")
+                    failed.append(member)
+            totals['sent'] += len(sent)
+            totals['failed'] += len(failed)
+            totals['skipped'] += len(claimed) - len(sent) - len(failed)
+
+            pipe = self.redis_client.pipeline(transaction=False)
+            for member, visit_day in sent:
+                pipe.sadd(SENT_KEY.format(day=visit_day), member)
+            for visit_day in {visit_day for _, visit_day in sent}:
+                pipe.expire(SENT_KEY.format(day=visit_day), SENT_TTL)
+            if failed:
+                # Retried on a later pass
+                pipe.zadd(SCHEDULE_KEY, {member: self._score(now + RETRY_DELAY) for member in failed})
+            pipe.execute()
+
+            if len(due) < self.batch_size:
+                break
+
+        if totals['claimed']:
+            logging.info(f"Meeting reminders dispatched: {totals}")
+        return totals
+
+    def upcoming_for(self, officer_id: int) -> List[Dict[str, Any]]:
+        """An officer's visits from today to the horizon with their reminder times"""
+        today = datetime.utcnow().date()
+        visits = GroupVisit.query.options(joinedload(GroupVisit.group)).filter(
+            GroupVisit.field_officer_id == officer_id,
+            GroupVisit.visit_date >= today,
+            GroupVisit.visit_date <= today + timedelta(days=self.horizon_days)
+        ).order_by(GroupVisit.visit_date).all()
+        return [{
+            'groupVisitId': visit.id,
+            'groupId': visit.group_id,
+            'groupName': visit.group.name if visit.group else None,
+            'visitDate': visit.visit_date.isoformat(),
+            'remindAt': self.fire_time(visit.visit_date).isoformat()
+        } for visit in visits]
+
+
+meeting_reminders = MeetingReminderScheduler()
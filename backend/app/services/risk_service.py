@@ -1,16 +1,110 @@
-from app.models import Member, Loan, SavingsAccount, Transaction
+from app.models import Member, Loan, SavingsAccount, DrawdownAccount, Transaction
 from app import db
+from sqlalchemy import func
 import logging
-from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, Iterable, List, Optional
 from decimal import Decimal
 import redis
 import json
 
+from app.services.transaction_monitor import transaction_monitor
+
+# Longest lookback any scorer needs (savings consistency, fraud volume baseline)
+TRANSACTION_WINDOW_DAYS = 90
+# Members per IN (...) list when loading contexts in bulk
+CONTEXT_BATCH_SIZE = 500
+
+CREDIT_TYPES = ('deposit', 'credit')
+DEBIT_TYPES = ('withdrawal', 'debit')
+
+
+class MemberRiskContext:
+    """
+    Everything the risk scorers read about one member, fetched once: the member,
+    their loans (newest first), when each loan last received a repayment,
+    savings and drawdown accounts, the last TRANSACTION_WINDOW_DAYS of
+    transactions and the AML monitor's window snapshot.
+    """
+    __slots__ = ('member', 'loans', 'last_repaid', 'savings', 'drawdown', 'transactions', 'snapshot', 'now')
+
+    def __init__(self, member: Member, now: datetime = None):
+        self.member = member
+        self.loans = []
+        self.last_repaid = {}
+        self.savings = None
+        self.drawdown = None
+        self.transactions = []
+        self.snapshot = None
+        self.now = now or datetime.utcnow()
+
+    @classmethod
+    def load(cls, member_id: int) -> Optional['MemberRiskContext']:
+        return cls.load_many([member_id]).get(member_id)
+
+    @classmethod
+    def load_many(cls, member_ids: Iterable[int]) -> Dict[int, 'MemberRiskContext']:
+        """Contexts keyed by member id, in input order; unknown ids are left out.
+        
+        Issues one query per table for every CONTEXT_BATCH_SIZE members and one
+        pipelined Redis round trip for the AML snapshots.
+        """
+        member_ids = list(dict.fromkeys(member_ids))
+        now = datetime.utcnow()
+        since = now - timedelta(days=TRANSACTION_WINDOW_DAYS)
+        contexts = {}
+        
+        for offset in range(0, len(member_ids), CONTEXT_BATCH_SIZE):
+            chunk = member_ids[offset:offset + CONTEXT_BATCH_SIZE]
+            for member in Member.query.filter(Member.id.in_(chunk)):
+                contexts[member.id] = cls(member, now)
+            ids = [member_id for member_id in chunk if member_id in contexts]
+            if not ids:
+                continue
+            
+            for loan in Loan.query.filter(Loan.member_id.in_(ids)).order_by(Loan.created_at.desc()):
+                contexts[loan.member_id].loans.append(loan)
+            # A completed loan was cleared by its last repayment
+            last_repaid = db.session.query(
+                Transaction.member_id, Transaction.loan_id, func.max(Transaction.created_at)
+            ).filter(
+                Transaction.member_id.in_(ids),
+                Transaction.transaction_type == 'loan_repayment',
+                Transaction.status == 'confirmed',
+                Transaction.loan_id.isnot(None)
+            ).group_by(Transaction.member_id, Transaction.loan_id)
+            for member_id, loan_id, repaid_at in last_repaid:
+                contexts[member_id].last_repaid[loan_id] = repaid_at
+            for account in SavingsAccount.query.filter(SavingsAccount.member_id.in_(ids)):
+                contexts[account.member_id].savings = account
+            for account in DrawdownAccount.query.filter(DrawdownAccount.member_id.in_(ids)):
+                contexts[account.member_id].drawdown = account
+            transactions = Transaction.query.filter(
+                Transaction.member_id.in_(ids),
+                Transaction.created_at >= since
+            ).order_by(Transaction.created_at)
+            for transaction in transactions:
+                contexts[transaction.member_id].transactions.append(transaction)
+        
+        for member_id, snapshot in transaction_monitor.get_snapshots(contexts).items():
+            contexts[member_id].snapshot = snapshot
+        
+        return {member_id: contexts[member_id] for member_id in member_ids if member_id in contexts}
+
+    def recent_transactions(self, since: datetime, account_type: str = None,
+                            types: Iterable[str] = None) -> List[Transaction]:
+        return [
+            transaction for transaction in self.transactions
+            if transaction.created_at >= since
+            and (account_type is None or transaction.account_type == account_type)
+            and (types is None or transaction.transaction_type in types)
+        ]
+
 class RiskService:
     def __init__(self, app=None):
         self.redis_client = None
         self.app = None
+        self.score_cache_ttl = 6 * 60 * 60
         
         if app:
             self.init_app(app)
@@ -28,74 +122,118 @@ class RiskService:
         except Exception as e:
             logging.warning(f"Failed to initialize Redis for risk service: {str(e)}")
         
+        self.score_cache_ttl = app.config.get('RISK_SCORE_CACHE_TTL', 6 * 60 * 60)
         logging.info("Risk Service initialized successfully")
     
-    def calculate_risk_score(self, member_id: int) -> dict:
+    def calculate_risk_score(self, member_id: int, context: 'MemberRiskContext' = None) -> dict:
         """
         Calculate risk score based on 5-factor model
         Returns score (0-100) and breakdown
         """
         try:
-            member = Member.query.get(member_id)
-            if not member:
+            context = context or MemberRiskContext.load(member_id)
+            if not context:
                 return {'score': 0, 'category': 'Unknown', 'factors': {}}
-                
-            score = 50 # Base score
-            factors = {}
-            
-            # 1. Repayment History (Max 35 points)
-            repayment_score = self._calculate_repayment_score(member)
-            score += repayment_score
-            factors['repayment_history'] = repayment_score
-            
-            # 2. Savings History (Max 25 points)
-            savings_score = self._calculate_savings_score(member)
-            score += savings_score
-            factors['savings_history'] = savings_score
-            
-            # 3. Loan Utilization (Max 15 points)
-            utilization_score = self._calculate_utilization_score(member)
-            score += utilization_score
-            factors['loan_utilization'] = utilization_score
-            
-            # 4. Group Performance (Max 15 points)
-            group_score = self._calculate_group_score(member)
-            score += group_score
-            factors['group_performance'] = group_score
             
-            # 5. Demographics/Stability (Max 10 points)
-            demographic_score = self._calculate_demographic_score(member)
-            score += demographic_score
-            factors['demographics'] = demographic_score
-            
-            # Normalize score to 0-100
-            final_score = min(max(int(score), 0), 100)
-            category = self.get_risk_category(final_score)
-            
-            # Update member profile
-            member.risk_score = final_score
-            member.risk_category = category
+            result = self._score(context)
             db.session.commit()
-            
-            return {
-                'score': final_score,
-                'category': category,
-                'factors': factors
-            }
+            self._cache_risk_scores({member_id: result})
+            return result
             
         except Exception as e:
+            db.session.rollback()
             logging.error(f"Error calculating risk score: {str(e)}")
             return {'score': 0, 'category': 'Error', 'factors': {}}
 
+    def _score(self, context: 'MemberRiskContext') -> dict:
+        """Run the five scorers and update the member profile; the caller commits"""
+        score = 50 # Base score
+        factors = {}
+        
+        # 1. Repayment History (Max 35 points)
+        repayment_score = self._calculate_repayment_score(context)
+        score += repayment_score
+        factors['repayment_history'] = repayment_score
+        
+        # 2. Savings History (Max 25 points)
+        savings_score = self._calculate_savings_score(context)
+        score += savings_score
+        factors['savings_history'] = savings_score
+        
+        # 3. Loan Utilization (Max 15 points)
+        utilization_score = self._calculate_utilization_score(context)
+        score += utilization_score
+        factors['loan_utilization'] = utilization_score
+        
+        # 4. Group Performance (Max 15 points)
+        group_score = self._calculate_group_score(context)
+        score += group_score
+        factors['group_performance'] = group_score
+        
+        # 5. Demographics/Stability (Max 10 points)
+        demographic_score = self._calculate_demographic_score(context)
+        score += demographic_score
+        factors['demographics'] = demographic_score
+        
+        # Normalize score to 0-100
+        final_score = min(max(int(score), 0), 100)
+        category = self.get_risk_category(final_score)
+        
+        # Update member profile
+        context.member.risk_score = final_score
+        context.member.risk_category = category
+        
+        return {
+            'score': final_score,
+            'category': category,
+            'factors': factors,
+            'computed_at': context.now.isoformat()
+        }
+
+    def get_cached_risk_score(self, member: Member) -> dict:
+        """Recently computed risk score without re-running the scorers.
+        
+        Reads the Redis copy written by calculate_risk_score, then the score persisted
+        on the member row; only members that were never scored are computed inline.
+        """
+        if self.redis_client:
+            try:
+                cached = self.redis_client.get(f"risk_score:{member.id}")
+                if cached:
+                    return json.loads(cached)
+            except Exception as e:
+                logging.warning(f"Failed to read cached risk score: {str(e)}")
+        
+        if member.risk_category and member.risk_category not in ('Unknown', 'Error'):
+            return {
+                'score': member.risk_score,
+                'category': member.risk_category,
+                'factors': {},
+                'computed_at': None
+            }
+        
+        return self.calculate_risk_score(member.id)
+
+    def _cache_risk_scores(self, results: Dict[int, dict]):
+        if not self.redis_client or not results:
+            return
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for member_id, result in results.items():
+                pipe.setex(f"risk_score:{member_id}", self.score_cache_ttl, json.dumps(result))
+            pipe.execute()
+        except Exception as e:
+            logging.warning(f"Failed to cache risk score: {str(e)}")
+
     def get_risk_category(self, score: int) -> str:
         if score >= 80: return 'Low Risk'
         if score >= 60: return 'Medium Risk'
         if score >= 40: return 'High Risk'
         return 'Critical Risk'
 
-    def _calculate_repayment_score(self, member: Member) -> int:
+    def _calculate_repayment_score(self, context: 'MemberRiskContext') -> int:
         """Calculate repayment history score (Max 35 points)"""
-        loans = Loan.query.filter_by(member_id=member.id).all()
+        loans = context.loans
         if not loans:
             return 0
             
@@ -110,8 +248,9 @@ class RiskService:
                 completed += 1
                 score += 5  # Base points for completion
                 
-                # Check if completed on time
-                if loan.paid_date and loan.due_date and loan.paid_date <= loan.due_date:
+                # On time when the repayment that cleared it landed by the due date
+                paid_at = context.last_repaid.get(loan.id)
+                if paid_at and loan.due_date and paid_at <= loan.due_date:
                     on_time += 1
                     score += 3  # Bonus for on-time payment
             elif loan.status == 'defaulted':
@@ -119,9 +258,9 @@ class RiskService:
                 score -= 20
             elif loan.status == 'disbursed':
                 # Check for overdue status
-                if loan.due_date and datetime.utcnow() > loan.due_date and loan.outstanding_balance > 0:
+                if loan.due_date and context.now > loan.due_date and loan.outstanding_balance > 0:
                     overdue += 1
-                    days_overdue = (datetime.utcnow() - loan.due_date).days
+                    days_overdue = (context.now - loan.due_date).days
                     score -= min(10, 2 + (days_overdue // 10))
         
         # Completion rate bonus
@@ -134,13 +273,9 @@ class RiskService:
         
         return min(max(score, -35), 35)
 
-    def _calculate_savings_score(self, member: Member) -> int:
+    def _calculate_savings_score(self, context: 'MemberRiskContext') -> int:
         """Calculate savings history score (Max 25 points)"""
-        savings = SavingsAccount.query.filter_by(
-            member_id=member.id,
-            account_type='savings'
-        ).first()
-        
+        savings = context.savings
         if not savings:
             return 0
             
@@ -164,12 +299,9 @@ class RiskService:
             score += 0
         
         # Savings consistency (based on transaction history)
-        deposits = Transaction.query.filter(
-            Transaction.member_id == member.id,
-            Transaction.account_type == 'savings',
-            Transaction.transaction_type.in_(['deposit', 'credit']),
-            Transaction.created_at >= datetime.utcnow() - timedelta(days=90)
-        ).count()
+        deposits = len(context.recent_transactions(
+            context.now - timedelta(days=90), account_type='savings', types=CREDIT_TYPES
+        ))
         
         if deposits >= 12:  # At least monthly deposits
             score += 5
@@ -178,78 +310,83 @@ class RiskService:
         
         return min(max(score, -25), 25)
 
-    def _calculate_utilization_score(self, member: Member) -> int:
+    def _calculate_utilization_score(self, context: 'MemberRiskContext') -> int:
         # Logic: Frequency of loans
-        loan_count = Loan.query.filter_by(member_id=member.id).count()
+        loan_count = len(context.loans)
         if loan_count > 10: return 15
         if loan_count > 5: return 10
         if loan_count > 2: return 5
         return 0
 
-    def _calculate_group_score(self, member: Member) -> int:
+    def _calculate_group_score(self, context: 'MemberRiskContext') -> int:
         # Logic: Average score of group members
-        if not member.group_id:
+        if not context.member.group_id:
             return 0
             
         # This could be expensive, simplified for now
         return 5
 
-    def _calculate_demographic_score(self, member: Member) -> int:
+    def _calculate_demographic_score(self, context: 'MemberRiskContext') -> int:
         # Logic: Age, location stability (placeholder)
         return 5
 
-    def detect_fraud(self, member_id: int) -> Dict[str, Any]:
+    def detect_fraud(self, member_id: int, context: 'MemberRiskContext' = None) -> Dict[str, Any]:
         """Check for potential fraud indicators"""
+        context = context or MemberRiskContext.load(member_id)
+        if not context:
+            return {'risk_level': 'low', 'risk_score': 0, 'flags': []}
+        return self._fraud(context)
+
+    def _fraud(self, context: 'MemberRiskContext') -> Dict[str, Any]:
         flags = []
         risk_score = 0
+        now = context.now
         
         # Check 1: Multiple loan applications in short time
-        last_24h = datetime.utcnow() - timedelta(hours=24)
-        recent_applications = Loan.query.filter(
-            Loan.member_id == member_id,
-            Loan.created_at >= last_24h
-        ).count()
+        last_24h = now - timedelta(hours=24)
+        recent_applications = sum(1 for loan in context.loans if loan.created_at >= last_24h)
         
         if recent_applications >= 3:
             flags.append('Multiple loan applications in 24 hours')
             risk_score += 25
         
-        # Check 2: Rapid withdrawal after large deposit
-        large_deposit = Transaction.query.filter(
-            Transaction.member_id == member_id,
-            Transaction.transaction_type.in_(['deposit', 'credit']),
-            Transaction.amount > 50000,
-            Transaction.created_at >= datetime.utcnow() - timedelta(hours=1)
-        ).first()
-        
-        if large_deposit:
-            rapid_withdrawal = Transaction.query.filter(
-                Transaction.member_id == member_id,
-                Transaction.transaction_type.in_(['withdrawal', 'debit']),
-                Transaction.amount > large_deposit.amount * 0.8,
-                Transaction.created_at >= large_deposit.created_at,
-                Transaction.created_at <= large_deposit.created_at + timedelta(hours=1)
-            ).first()
+        # Checks 2 and 3 read the streaming monitor's window snapshot when it
+        # has one; the monitor already paired deposits with withdrawals and
+        # compared volume against the 30-day baseline as the events arrived
+        snapshot = context.snapshot
+        if snapshot is not None:
+            now_ts = now.replace(tzinfo=timezone.utc).timestamp()
+            if snapshot.get('rapid_withdrawal_at', 0) >= now_ts - 3600:
+                flags.append('Suspicious rapid withdrawal after large deposit')
+                risk_score += 30
+            if snapshot.get('unusual_pattern_at', 0) >= now_ts - 86400:
+                flags.append('Unusual transaction volume increase')
+                risk_score += 15
+        else:
+            # Check 2: Rapid withdrawal after large deposit
+            large_deposits = [
+                transaction for transaction in context.recent_transactions(now - timedelta(hours=1), types=CREDIT_TYPES)
+                if transaction.amount > 50000
+            ]
+            withdrawals = context.recent_transactions(now - timedelta(hours=1), types=DEBIT_TYPES)
             
-            if rapid_withdrawal:
+            if any(
+                withdrawal.amount > deposit.amount * Decimal('0.8')
+                and deposit.created_at <= withdrawal.created_at <= deposit.created_at + timedelta(hours=1)
+                for deposit in large_deposits
+                for withdrawal in withdrawals
+            ):
                 flags.append('Suspicious rapid withdrawal after large deposit')
                 risk_score += 30
-        
-        # Check 3: Pattern deviation (significantly different behavior)
-        # Compare current month vs average of last 3 months
-        current_month_total = Transaction.query.filter(
-            Transaction.member_id == member_id,
-            Transaction.created_at >= datetime.utcnow() - timedelta(days=30)
-        ).count()
-        
-        three_month_avg = Transaction.query.filter(
-            Transaction.member_id == member_id,
-            Transaction.created_at >= datetime.utcnow() - timedelta(days=90)
-        ).count() / 3
-        
-        if three_month_avg > 0 and current_month_total > three_month_avg * 3:
-            flags.append('Unusual transaction volume increase')
-            risk_score += 15
+            
+            # Check 3: Pattern deviation (significantly different behavior)
+            # Compare current month vs average of last 3 months
+            current_month_total = len(context.recent_transactions(now - timedelta(days=30)))
+            three_month_avg = len(context.recent_transactions(now - timedelta(days=90))) / 3
+            
+            if three_month_avg > 0 and current_month_total > three_month_avg * 3:
+                flags.append('Unusual transaction volume increase')
+                risk_score += 15
         
         # Determine risk level
         if risk_score >= 50:
@@ -262,7 +399,7 @@ class RiskService:
             risk_level = 'low'
         
         if risk_level in ['high', 'critical']:
-            logging.warning(f"Fraud alert for member {member_id}: {flags}")
+            logging.warning(f"Fraud alert for member {context.member.id}: {flags}")
         
         return {
             'risk_level': risk_level,
@@ -270,23 +407,24 @@ class RiskService:
             'flags': flags
         }
 
-    def predict_default_probability(self, member_id: int, loan_id: int = None) -> Dict[str, Any]:
+    def predict_default_probability(self, member_id: int, loan_id: int = None,
+                                    context: 'MemberRiskContext' = None) -> Dict[str, Any]:
         """Predict probability of loan default using risk factors"""
-        member = Member.query.get(member_id)
-        if not member:
+        context = context or MemberRiskContext.load(member_id)
+        if not context:
             return {'probability': 0, 'confidence': 0}
-        
-        risk_score = member.risk_score or 0
+        return self._default_probability(context, loan_id)
+
+    def _default_probability(self, context: 'MemberRiskContext', loan_id: int = None) -> Dict[str, Any]:
+        risk_score = context.member.risk_score or 0
+        active_loans = [loan for loan in context.loans if loan.status == 'disbursed']
         
         # Get relevant loan
         if loan_id:
-            loan = Loan.query.get(loan_id)
+            loan = next((loan for loan in context.loans if loan.id == loan_id), None) or Loan.query.get(loan_id)
         else:
-            # Get most recent active loan
-            loan = Loan.query.filter_by(
-                member_id=member_id,
-                status='disbursed'
-            ).order_by(Loan.created_at.desc()).first()
+            # Get most recent active loan (context loans are newest first)
+            loan = active_loans[0] if active_loans else None
         
         if not loan:
             return {'probability': 0, 'confidence': 0}
@@ -310,13 +448,10 @@ class RiskService:
             probability += 50
         
         # Factor 2: Loan-to-Savings ratio
-        savings = SavingsAccount.query.filter_by(
-            member_id=member_id,
-            account_type='savings'
-        ).first()
+        savings = context.savings
         
         if savings and savings.balance > 0:
-            ratio = float(loan.approved_amount) / savings.balance
+            ratio = float(loan.principle_amount) / float(savings.balance)
             if ratio > 4:
                 probability += 25
             elif ratio > 2:
@@ -327,42 +462,41 @@ class RiskService:
             probability += 30
         
         # Factor 3: Multiple active loans
-        active_loans = Loan.query.filter_by(
-            member_id=member_id,
-            status='disbursed'
-        ).count()
-        
-        if active_loans >= 3:
+        if len(active_loans) >= 3:
             probability += 10
-        elif active_loans >= 2:
+        elif len(active_loans) >= 2:
             probability += 5
         
         # Normalize to 0-100
         probability = min(max(probability, 0), 100)
         
         return {
-            'member_id': member_id,
+            'member_id': context.member.id,
             'loan_id': loan_id,
             'default_probability': probability,
             'risk_level': 'high' if probability > 60 else 'medium' if probability > 30 else 'low',
             'confidence': 75  # Confidence in the prediction
         }
     
-    def check_early_warnings(self, member_id: int) -> Dict[str, Any]:
+    def check_early_warnings(self, member_id: int, context: 'MemberRiskContext' = None) -> Dict[str, Any]:
         """Check for early warning signs of financial distress"""
-        member = Member.query.get(member_id)
-        if not member:
+        context = context or MemberRiskContext.load(member_id)
+        if not context:
             return {'warnings': []}
         
+        result = self._early_warnings(context)
+        self._store_warnings([result])
+        return result
+
+    def _early_warnings(self, context: 'MemberRiskContext') -> Dict[str, Any]:
         warnings = []
         alerts = []
         
         # Warning 1: Multiple overdue loans
-        overdue_loans = Loan.query.filter(
-            Loan.member_id == member_id,
-            Loan.status == 'disbursed',
-            Loan.due_date < datetime.utcnow()
-        ).all()
+        overdue_loans = [
+            loan for loan in context.loans
+            if loan.status == 'disbursed' and loan.due_date and loan.due_date < context.now
+        ]
         
         if len(overdue_loans) >= 2:
             warnings.append({
@@ -373,29 +507,21 @@ class RiskService:
             alerts.append('send_sms')
         
         # Warning 2: Declining savings
-        savings = SavingsAccount.query.filter_by(
-            member_id=member_id,
-            account_type='savings'
-        ).first()
+        savings = context.savings
         
         if savings:
-            month_ago = datetime.utcnow() - timedelta(days=30)
+            month_ago = context.now - timedelta(days=30)
             # Check if withdrawals exceed deposits in last month
-            withdrawals = Transaction.query.filter(
-                Transaction.member_id == member_id,
-                Transaction.account_type == 'savings',
-                Transaction.transaction_type.in_(['withdrawal', 'debit']),
-                Transaction.created_at >= month_ago
-            ).with_entities(db.func.sum(Transaction.amount)).scalar() or 0
-            
-            deposits = Transaction.query.filter(
-                Transaction.member_id == member_id,
-                Transaction.account_type == 'savings',
-                Transaction.transaction_type.in_(['deposit', 'credit']),
-                Transaction.created_at >= month_ago
-            ).with_entities(db.func.sum(Transaction.amount)).scalar() or 0
+            withdrawals = sum(
+                transaction.amount for transaction in
+                context.recent_transactions(month_ago, account_type='savings', types=DEBIT_TYPES)
+            )
+            deposits = sum(
+                transaction.amount for transaction in
+                context.recent_transactions(month_ago, account_type='savings', types=CREDIT_TYPES)
+            )
             
-            if withdrawals > deposits * 1.5:
+            if withdrawals > deposits * Decimal('1.5'):
                 warnings.append({
                     'type': 'declining_savings',
                     'message': 'Savings declining rapidly',
@@ -412,20 +538,85 @@ class RiskService:
                 'severity': 'low'
             })
         
-        # Store warnings in Redis if available
-        if self.redis_client and warnings:
-            warning_key = f"warnings:{member_id}:{datetime.utcnow().strftime('%Y%m%d')}"
-            self.redis_client.setex(
-                warning_key,
-                7*24*60*60,
-                json.dumps(warnings)
-            )
-        
         return {
-            'member_id': member_id,
+            'member_id': context.member.id,
             'warnings': warnings,
             'recommended_actions': alerts
         }
+
+    def _store_warnings(self, results: List[Dict[str, Any]]):
+        """Keep each day's warnings in Redis for a week"""
+        results = [result for result in results if result['warnings']]
+        if not self.redis_client or not results:
+            return
+        day = datetime.utcnow().strftime('%Y%m%d')
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for result in results:
+                pipe.setex(f"warnings:{result['member_id']}:{day}", 7*24*60*60, json.dumps(result['warnings']))
+            pipe.execute()
+        except Exception as e:
+            logging.warning(f"Failed to store early warnings: {str(e)}")
+
+    def comprehensive_report(self, member_id: int, context: 'MemberRiskContext' = None,
+                             base_rate: float = 15.0) -> Optional[Dict[str, Any]]:
+        """Score, fraud check, default probability and early warnings from one context"""
+        context = context or MemberRiskContext.load(member_id)
+        if not context:
+            return None
+        return self._comprehensive_reports([context], base_rate)[0]
+
+    def comprehensive_reports(self, member_ids: List[int], base_rate: float = 15.0) -> List[Dict[str, Any]]:
+        """
+        Comprehensive reports for many members, e.g. a whole group or branch.
+        
+        Contexts are loaded with one query per table for the whole list, the
+        updated risk scores are committed together and the Redis writes are
+        pipelined, so the cost no longer grows by ~20 queries per member.
+        """
+        contexts = MemberRiskContext.load_many(member_ids)
+        return self._comprehensive_reports(list(contexts.values()), base_rate)
+
+    def _comprehensive_reports(self, contexts: List['MemberRiskContext'], base_rate: float) -> List[Dict[str, Any]]:
+        reports, scores, warnings = [], {}, []
+        try:
+            for context in contexts:
+                # Scored first: the default probability reads the refreshed member.risk_score
+                risk_score_data = self._score(context)
+                fraud_data = self._fraud(context)
+                default_probability_data = self._default_probability(context)
+                warnings_data = self._early_warnings(context)
+                recommended_rate = self.get_interest_rate_recommendation(risk_score_data['score'], base_rate)
+                
+                scores[context.member.id] = risk_score_data
+                warnings.append(warnings_data)
+                reports.append({
+                    'member_id': context.member.id,
+                    'risk_assessment': {
+                        'score': risk_score_data['score'],
+                        'category': risk_score_data['category'],
+                        'factors': risk_score_data['factors']
+                    },
+                    'fraud_check': fraud_data,
+                    'default_probability': default_probability_data,
+                    'early_warnings': {
+                        'warnings': warnings_data['warnings'],
+                        'recommended_actions': warnings_data['recommended_actions']
+                    },
+                    'interest_rate': {
+                        'recommended_rate': recommended_rate,
+                        'rate_adjustment': recommended_rate - base_rate
+                    },
+                    'timestamp': context.now.isoformat()
+                })
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        
+        self._cache_risk_scores(scores)
+        self._store_warnings(warnings)
+        return reports
     
     def get_interest_rate_recommendation(self, risk_score: int, base_rate: float) -> float:
         """
@@ -0,0 +1,488 @@
+"""
+Stock movement engine.
+
+Every change to product or branch stock is a StockMovement row. A batch of
+movements (a whole delivery note, say) is folded into one net delta per product
+and per (branch, product); product totals move with a single conditional
+UPDATE, branch gains are upserted and branch draws are conditional UPDATEs, so
+stock can never go negative whatever runs concurrently. The movement rows are
+inserted in the same transaction, which keeps branch stock replayable from the
+ledger. Callers commit, or roll back on error. A branch stock count is a
+'count' movement: it corrects that branch's stock by the difference but leaves
+the product's company-wide total alone, unlike an 'adjustment'.
+
+Every stock write also checks whether the row crossed its low or critical
+threshold and keeps the stock_alerts table of currently alerting items in step,
+so low-stock reads never scan the catalogue.
+"""
+import logging
+import threading
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import and_, case, delete, event as sa_event, func, insert, literal_column, select, text, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session, joinedload
+
+from app import db
+from app.models import StockMovement, LoanProduct, BranchProduct, Branch, Supplier, StockAlert
+from app.utils.session_state import discard_pending, track_savepoints
+
+# Sign applied to a movement's quantity for the product total
+MOVEMENT_SIGNS = {'in': 1, 'out': -1, 'transfer': -1, 'adjustment': 1, 'count': 0}
+# Movement types that also move the named branch's stock
+BRANCH_MOVEMENT_TYPES = ('in', 'out', 'adjustment', 'count')
+# Movement types whose quantity carries its own sign
+SIGNED_MOVEMENT_TYPES = ('adjustment', 'count')
+
+DEFAULT_BRANCH_LOW_STOCK_THRESHOLD = 10
+
+# Session.info key holding threshold crossings until the surrounding transaction commits
+STOCK_ALERT_EVENTS_KEY = 'stock_alert_events'
+
+REBUILD_ALERTS_SQL = (
+    """
+    INSERT INTO stock_alerts (product_id, branch_id, level, stock_quantity, threshold, raised_at, updated_at)
+    SELECT id, NULL,
+           CASE WHEN stock_quantity <= critical_stock_threshold THEN 'critical' ELSE 'low' END,
+           stock_quantity,
+           CASE WHEN stock_quantity <= critical_stock_threshold THEN critical_stock_threshold ELSE low_stock_threshold END,
+           now(), now()
+    FROM loan_products
+    WHERE stock_quantity <= low_stock_threshold OR stock_quantity <= critical_stock_threshold
+    """,
+    """
+    INSERT INTO stock_alerts (product_id, branch_id, level, stock_quantity, threshold, raised_at, updated_at)
+    SELECT bp.product_id, bp.branch_id,
+           CASE WHEN bp.stock_quantity <= p.critical_stock_threshold THEN 'critical' ELSE 'low' END,
+           bp.stock_quantity,
+           CASE WHEN bp.stock_quantity <= p.critical_stock_threshold THEN p.critical_stock_threshold ELSE bp.low_stock_threshold END,
+           now(), now()
+    FROM branch_products bp
+    JOIN loan_products p ON p.id = bp.product_id
+    WHERE bp.stock_quantity <= bp.low_stock_threshold OR bp.stock_quantity <= p.critical_stock_threshold
+    """,
+)
+
+
+class InsufficientStockError(ValueError):
+    """Raised when a batch would take product or branch stock below zero"""
+
+    def __init__(self, shortages: List[Dict[str, Any]]):
+        self.shortages = shortages
+        super().__init__('Insufficient stock for one or more products')
+
+
+class StockService:
+    def __init__(self, app=None):
+        self.app = None
+        self._listeners_registered = False
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize stock service with Flask app"""
+        self.app = app
+        if not self._listeners_registered:
+            sa_event.listen(Session, 'after_commit', self._on_commit)
+            sa_event.listen(Session, 'after_rollback', self._on_rollback)
+            track_savepoints(STOCK_ALERT_EVENTS_KEY)
+            self._listeners_registered = True
+
+    def normalize(self, movement: Dict[str, Any], defaults: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Validate one camelCase movement (falling back to batch defaults) into column values"""
+        defaults = defaults or {}
+
+        def pick(key):
+            return movement.get(key) if movement.get(key) is not None else defaults.get(key)
+
+        if movement.get('productId') is None:
+            raise ValueError('productId is required')
+        movement_type = pick('movementType')
+        if movement_type not in MOVEMENT_SIGNS:
+            raise ValueError(f"Invalid movement type. Must be one of: {', '.join(MOVEMENT_SIGNS)}")
+        try:
+            quantity = int(movement['quantity'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError('Invalid quantity')
+        # Adjustments and counts carry their own sign; every other type moves a positive quantity
+        if quantity == 0 or (quantity < 0 and movement_type not in SIGNED_MOVEMENT_TYPES):
+            raise ValueError('Quantity must be positive')
+
+        branch_id, supplier_id = pick('branchId'), pick('supplierId')
+        if movement_type == 'count' and not branch_id:
+            raise ValueError('branchId is required for count movements')
+        return {
+            'product_id': int(movement['productId']),
+            'branch_id': int(branch_id) if branch_id else None,
+            'supplier_id': int(supplier_id) if supplier_id else None,
+            'movement_type': movement_type,
+            'quantity': quantity,
+            'reference_number': pick('referenceNumber'),
+            'notes': pick('notes'),
+        }
+
+    def apply_movements(self, movements: List[Dict[str, Any]], processed_by: Optional[int] = None) -> List[StockMovement]:
+        """
+        Apply normalized movements and insert their StockMovement rows.
+
+        Raises LookupError for unknown products, branches or suppliers and
+        InsufficientStockError when any product or branch would go negative;
+        the caller must roll back in that case. Returns the inserted movements.
+        """
+        if not movements:
+            return []
+        self._check_references(movements)
+
+        product_deltas = defaultdict(int)
+        branch_deltas = defaultdict(int)
+        for movement in movements:
+            quantity = movement['quantity']
+            product_deltas[movement['product_id']] += MOVEMENT_SIGNS[movement['movement_type']] * quantity
+            if movement['branch_id'] and movement['movement_type'] in BRANCH_MOVEMENT_TYPES:
+                sign = -1 if movement['movement_type'] == 'out' else 1
+                branch_deltas[(movement['branch_id'], movement['product_id'])] += sign * quantity
+
+        shortages = self._move_products(product_deltas) + self._move_branches(branch_deltas)
+        if shortages:
+            raise InsufficientStockError(shortages)
+
+        now = datetime.utcnow()
+        rows = [{**movement, 'processed_by': processed_by, 'created_at': now} for movement in movements]
+        return db.session.scalars(insert(StockMovement).returning(StockMovement), rows).all()
+
+    def _check_references(self, movements: List[Dict[str, Any]]):
+        # One IN query per referenced table instead of a lookup per movement
+        for model, key, label in ((LoanProduct, 'product_id', 'Product'),
+                                  (Branch, 'branch_id', 'Branch'),
+                                  (Supplier, 'supplier_id', 'Supplier')):
+            wanted = {movement[key] for movement in movements if movement[key]}
+            if not wanted:
+                continue
+            found = {row_id for (row_id,) in db.session.query(model.id).filter(model.id.in_(wanted))}
+            missing = sorted(wanted - found)
+            if missing:
+                raise LookupError(f"{label} not found: {', '.join(map(str, missing))}")
+
+    def _move_products(self, deltas: Dict[int, int]) -> List[Dict[str, Any]]:
+        deltas = {product_id: delta for product_id, delta in deltas.items() if delta}
+        if not deltas:
+            return []
+        needed = {product_id: -delta for product_id, delta in deltas.items() if delta < 0}
+        # Only draws are guarded; gains compare the stock with itself
+        guard = case(needed, value=LoanProduct.id, else_=LoanProduct.stock_quantity) if needed else LoanProduct.stock_quantity
+        written = db.session.execute(
+            update(LoanProduct)
+            .where(LoanProduct.id.in_(list(deltas)), LoanProduct.stock_quantity >= guard)
+            .values(stock_quantity=LoanProduct.stock_quantity + case(deltas, value=LoanProduct.id))
+            .returning(LoanProduct.id, LoanProduct.stock_quantity,
+                       LoanProduct.low_stock_threshold, LoanProduct.critical_stock_threshold)
+            .execution_options(synchronize_session=False)
+        ).all()
+        if len(written) == len(deltas):
+            self.record_levels([
+                (product_id, None, stock, deltas[product_id], low, critical)
+                for product_id, stock, low, critical in written
+            ])
+            return []
+        # Rows that failed the guard were left untouched, so their stock is still current
+        return [
+            {'productId': product_id, 'branchId': None, 'available': available, 'requested': needed[product_id]}
+            for product_id, available in db.session.query(LoanProduct.id, LoanProduct.stock_quantity)
+            .filter(LoanProduct.id.in_(list(needed)))
+            if available < needed[product_id]
+        ]
+
+    def _move_branches(self, deltas: Dict[tuple, int]) -> List[Dict[str, Any]]:
+        gains = {key: delta for key, delta in deltas.items() if delta > 0}
+        draws = {key: -delta for key, delta in deltas.items() if delta < 0}
+        returning = (BranchProduct.branch_id, BranchProduct.product_id,
+                     BranchProduct.stock_quantity, BranchProduct.low_stock_threshold)
+        written = []
+
+        if gains:
+            now = datetime.utcnow()
+            statement = pg_insert(BranchProduct).values([
+                {'branch_id': branch_id, 'product_id': product_id, 'stock_quantity': delta,
+                 'low_stock_threshold': DEFAULT_BRANCH_LOW_STOCK_THRESHOLD, 'created_at': now}
+                for (branch_id, product_id), delta in sorted(gains.items())
+            ])
+            written += db.session.execute(statement.on_conflict_do_update(
+                constraint='uq_branch_products_branch_product',
+                set_={'stock_quantity': BranchProduct.stock_quantity + statement.excluded.stock_quantity}
+            ).returning(*returning)).all()
+
+        shortages = []
+        if draws:
+            # A draw against a branch with no inventory row is always a shortage
+            rows = {
+                (branch_id, product_id): row_id
+                for row_id, branch_id, product_id in db.session.query(
+                    BranchProduct.id, BranchProduct.branch_id, BranchProduct.product_id
+                ).filter(tuple_(BranchProduct.branch_id, BranchProduct.product_id).in_(list(draws)))
+            }
+            needed = {rows[key]: quantity for key, quantity in draws.items() if key in rows}
+            drawn = []
+            if needed:
+                drawn = db.session.execute(
+                    update(BranchProduct)
+                    .where(BranchProduct.id.in_(list(needed)),
+                           BranchProduct.stock_quantity >= case(needed, value=BranchProduct.id))
+                    .values(stock_quantity=BranchProduct.stock_quantity - case(needed, value=BranchProduct.id))
+                    .returning(*returning)
+                    .execution_options(synchronize_session=False)
+                ).all()
+            written += drawn
+
+            if len(drawn) != len(draws):
+                available = dict(
+                    db.session.query(BranchProduct.id, BranchProduct.stock_quantity).filter(BranchProduct.id.in_(list(needed)))
+                ) if needed else {}
+                shortages = [
+                    {'productId': product_id, 'branchId': branch_id,
+                     'available': available.get(rows.get((branch_id, product_id)), 0), 'requested': quantity}
+                    for (branch_id, product_id), quantity in sorted(draws.items())
+                    if available.get(rows.get((branch_id, product_id)), 0) < quantity
+                ]
+
+        if written and not shortages:
+            # Branch rows carry only a low threshold; critical is the product's
+            critical = dict(db.session.query(LoanProduct.id, LoanProduct.critical_stock_threshold).filter(
+                LoanProduct.id.in_({product_id for _, product_id, _, _ in written})
+            ))
+            self.record_levels([
+                (product_id, branch_id, stock, deltas[(branch_id, product_id)], low, critical.get(product_id, 0))
+                for branch_id, product_id, stock, low in written
+            ])
+        return shortages
+
+    @staticmethod
+    def alert_level(stock: int, low_threshold: int, critical_threshold: int) -> Optional[str]:
+        if stock <= critical_threshold:
+            return 'critical'
+        if stock <= low_threshold:
+            return 'low'
+        return None
+
+    def record_levels(self, levels: List[tuple]):
+        """
+        Keep stock_alerts in step with stock rows that were just written.
+
+        Each level is (product_id, branch_id, stock after, delta applied, low
+        threshold, critical threshold). The stock before the write follows
+        from the delta, so a threshold crossing is detected without reading
+        anything back. Alerting rows are upserted with their new stock, rows
+        that recovered are deleted, and crossings are queued for
+        notification once the transaction commits.
+        """
+        self._sync_alerts([
+            (product_id, branch_id, stock, self.alert_level(stock - delta, low, critical), low, critical)
+            for product_id, branch_id, stock, delta, low, critical in levels
+        ])
+
+    def record_thresholds(self, product_id: int, branch_id: Optional[int], stock: int,
+                          previous: tuple, current: tuple):
+        """
+        Keep stock_alerts in step with a threshold edit at unchanged stock.
+
+        `previous` and `current` are (low, critical) thresholds. Branch rows
+        alert against the product's critical threshold, so a product edit
+        that changes it also re-levels every branch row of the product.
+        Record the edit before moving stock in the same request, so the
+        movement's crossing is judged against the new thresholds.
+        """
+        changes = [(product_id, branch_id, stock, self.alert_level(stock, *previous), *current)]
+        if branch_id is None and previous[1] != current[1]:
+            for row_branch_id, row_stock, row_low in db.session.query(
+                BranchProduct.branch_id, BranchProduct.stock_quantity, BranchProduct.low_stock_threshold
+            ).filter(BranchProduct.product_id == product_id):
+                changes.append((product_id, row_branch_id, row_stock,
+                                self.alert_level(row_stock, row_low, previous[1]), row_low, current[1]))
+        self._sync_alerts(changes)
+
+    def _sync_alerts(self, changes: List[tuple]):
+        """Apply (product_id, branch_id, stock, level before, low, critical) changes to stock_alerts"""
+        now = datetime.utcnow()
+        upserts = {'product': [], 'branch': []}
+        cleared = {'product': [], 'branch': []}
+        events = []
+        for product_id, branch_id, stock, before, low, critical in changes:
+            after = self.alert_level(stock, low, critical)
+            scope = 'product' if branch_id is None else 'branch'
+            if after:
+                upserts[scope].append({
+                    'product_id': product_id, 'branch_id': branch_id, 'level': after,
+                    'stock_quantity': stock, 'threshold': critical if after == 'critical' else low,
+                    'raised_at': now, 'updated_at': now
+                })
+            elif before:
+                cleared[scope].append((branch_id, product_id))
+            if before != after:
+                events.append({
+                    'productId': product_id, 'branchId': branch_id, 'from': before, 'to': after,
+                    'stockQuantity': stock, 'lowThreshold': low, 'criticalThreshold': critical,
+                    'at': now.isoformat()
+                })
+
+        for scope, index_elements, index_where in (
+                ('product', ['product_id'], StockAlert.branch_id.is_(None)),
+                ('branch', ['branch_id', 'product_id'], StockAlert.branch_id.isnot(None))):
+            if upserts[scope]:
+                statement = pg_insert(StockAlert).values(upserts[scope])
+                db.session.execute(statement.on_conflict_do_update(
+                    index_elements=index_elements,
+                    index_where=index_where,
+                    set_={
+                        'level': statement.excluded.level,
+                        'stock_quantity': statement.excluded.stock_quantity,
+                        'threshold': statement.excluded.threshold,
+                        'updated_at': statement.excluded.updated_at
+                    }
+                ))
+        if cleared['product']:
+            db.session.execute(delete(StockAlert).where(
+                StockAlert.branch_id.is_(None),
+                StockAlert.product_id.in_([product_id for _, product_id in cleared['product']])
+            ))
+        if cleared['branch']:
+            db.session.execute(delete(StockAlert).where(
+                tuple_(StockAlert.branch_id, StockAlert.product_id).in_(cleared['branch'])
+            ))
+        if events:
+            db.session.info.setdefault(STOCK_ALERT_EVENTS_KEY, []).extend(events)
+
+    def rebuild_alerts(self) -> int:
+        """Recompute stock_alerts from a full scan, e.g. after thresholds are edited"""
+        db.session.execute(delete(StockAlert))
+        for statement in REBUILD_ALERTS_SQL:
+            db.session.execute(text(statement))
+        db.session.commit()
+        return db.session.query(func.count(StockAlert.id)).scalar()
+
+    def get_alerts(self, branch_id: Optional[int] = None, level: Optional[str] = None) -> List[StockAlert]:
+        """Currently alerting items, product-wide unless a branch is given"""
+        query = StockAlert.query.options(joinedload(StockAlert.product)).filter(
+            StockAlert.branch_id == branch_id if branch_id else StockAlert.branch_id.is_(None)
+        )
+        if level:
+            query = query.filter(StockAlert.level == level)
+        return query.order_by(StockAlert.stock_quantity, StockAlert.product_id).all()
+
+    def _on_commit(self, session):
+        if session.in_nested_transaction():
+            # Releasing a savepoint also fires the commit events; wait for the outer commit
+            return
+        events = session.info.pop(STOCK_ALERT_EVENTS_KEY, None)
+        if events and self.app:
+            # The session cannot run SQL inside after_commit, so notify from a thread
+            threading.Thread(
+                target=self._notify, args=(self.app, events), name='stock-alert-notify', daemon=True
+            ).start()
+
+    def _on_rollback(self, session):
+        discard_pending(session, STOCK_ALERT_EVENTS_KEY)
+
+    def _notify(self, app, events: List[Dict[str, Any]]):
+        """Tell procurement (and the branch's managers) about items that became low or critical"""
+        from app.models import User, Role
+        from app.services.notification_service import notification_service, NotificationChannel, NotificationPriority
+
+        events = [event for event in events if event['to']]
+        if not events:
+            return
+        with app.app_context():
+            try:
+                names = dict(db.session.query(LoanProduct.id, LoanProduct.name).filter(
+                    LoanProduct.id.in_({event['productId'] for event in events})
+                ))
+                officers = [user_id for (user_id,) in db.session.query(User.id).join(Role).filter(
+                    Role.name == 'procurement_officer', User.is_active == True
+                )]
+                managers = defaultdict(list)
+                branch_ids = {event['branchId'] for event in events if event['branchId']}
+                if branch_ids:
+                    for user_id, branch_id in db.session.query(User.id, User.branch_id).join(Role).filter(
+                            Role.name == 'branch_manager', User.is_active == True, User.branch_id.in_(branch_ids)):
+                        managers[branch_id].append(user_id)
+
+                for event in events:
+                    for recipient_id in officers + managers.get(event['branchId'], []):
+                        notification_service.send_notification(
+                            recipient_id=recipient_id,
+                            template_id="stock_alert",
+                            variables={
+                                "product_name": names.get(event['productId'], f"Product {event['productId']}"),
+                                "level": event['to'],
+                                "stock": event['stockQuantity'],
+                                "location": f"branch {event['branchId']}" if event['branchId'] else "all branches"
+                            },
+                            channel=NotificationChannel.IN_APP,
+                            priority=NotificationPriority.HIGH if event['to'] == 'critical' else NotificationPriority.NORMAL,
+                            data=event
+                        )
+            except Exception as e:
+                logging.error(f"Failed to send stock alert notifications: {str(e)}")
+            finally:
+                db.session.remove()
+
+    def replay(self, branch_id: Optional[int] = None, product_id: Optional[int] = None,
+               drift_only: bool = False) -> List[Dict[str, Any]]:
+        """
+        Rebuild branch stock from the movement ledger and compare it with branch_products.
+
+        Returns one row per (branch, product) seen in either place with the
+        replayed quantity, the stored quantity and their difference.
+        """
+        signed = case(
+            (StockMovement.movement_type == 'out', -StockMovement.quantity),
+            else_=StockMovement.quantity
+        )
+        filters = [StockMovement.branch_id.isnot(None), StockMovement.movement_type.in_(BRANCH_MOVEMENT_TYPES)]
+        stored_filters = []
+        if branch_id:
+            filters.append(StockMovement.branch_id == branch_id)
+            stored_filters.append(BranchProduct.branch_id == branch_id)
+        if product_id:
+            filters.append(StockMovement.product_id == product_id)
+            stored_filters.append(BranchProduct.product_id == product_id)
+
+        ledger = select(
+            StockMovement.branch_id, StockMovement.product_id,
+            func.sum(signed).label('quantity'), func.count().label('movements')
+        ).where(*filters).group_by(StockMovement.branch_id, StockMovement.product_id).subquery()
+        stored = select(
+            BranchProduct.branch_id, BranchProduct.product_id, BranchProduct.stock_quantity
+        ).where(*stored_filters).subquery()
+
+        ledger_quantity = func.coalesce(ledger.c.quantity, 0)
+        stored_quantity = func.coalesce(stored.c.stock_quantity, 0)
+        query = select(
+            func.coalesce(ledger.c.branch_id, stored.c.branch_id).label('branch_id'),
+            func.coalesce(ledger.c.product_id, stored.c.product_id).label('product_id'),
+            ledger_quantity.label('ledger_quantity'),
+            stored_quantity.label('stored_quantity'),
+            func.coalesce(ledger.c.movements, 0).label('movements')
+        ).select_from(ledger.outerjoin(
+            stored,
+            and_(ledger.c.branch_id == stored.c.branch_id, ledger.c.product_id == stored.c.product_id),
+            full=True
+        ))
+        if drift_only:
+            query = query.where(ledger_quantity != stored_quantity)
+
+        return [
+            {
+                'branchId': row.branch_id,
+                'productId': row.product_id,
+                'ledgerQuantity': int(row.ledger_quantity),
+                'storedQuantity': int(row.stored_quantity),
+                'drift': int(row.stored_quantity) - int(row.ledger_quantity),
+                'movements': row.movements
+            }
+            for row in db.session.execute(query.order_by(literal_column('branch_id'), literal_column('product_id')))
+        ]
+
+
+stock_service = StockService()
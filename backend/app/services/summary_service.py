@@ -0,0 +1,395 @@
+"""
+Denormalized member and group read models.
+
+member_summaries holds one row per member with the balances, loan totals,
+loan limit and repayment rate the field officer dashboard shows, plus the
+member's share of its group's figures; group_stats sums those shares per
+group. Rows are kept current from the write path: a session listener notes
+every member whose loans, transactions, savings or drawdown account (or
+status or group) were written during the transaction, and just before it
+commits those members' rows are recomputed from their own loans and
+transactions, then their groups' rows are re-summed from member_summaries,
+so a group refresh never rescans the group's loan and transaction history.
+Each step is one grouped SELECT and one upsert, run under a savepoint: if it
+fails the affected rows are dropped (and rebuilt on their next read) rather
+than failing the business transaction. Sums stay in SQL NUMERIC and come
+back as Decimal. Ledger postings bulk-insert their Transaction rows outside
+the unit of work, so post_entries touches its members explicitly.
+"""
+import logging
+from datetime import datetime
+from decimal import Decimal
+from itertools import chain
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import and_, case, delete, event as sa_event, func, inspect, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session, joinedload
+
+from app import db
+from app.models import Member, MemberSummary, Group, GroupStats, Loan, Transaction, SavingsAccount, DrawdownAccount
+from app.utils.session_state import discard_pending, track_savepoints
+
+# Session.info keys holding the member and group ids to refresh before commit
+SUMMARY_MEMBERS_KEY = 'summary_member_ids'
+SUMMARY_GROUPS_KEY = 'summary_group_ids'
+
+ACTIVE_LOAN_STATUSES = ('approved', 'disbursed', 'released')
+# Loans counted as money lent out in group stats
+DISBURSED_LOAN_STATUSES = ('disbursed', 'released', 'completed')
+LOAN_LIMIT_MULTIPLIER = Decimal('4')
+MAX_LOAN_LIMIT = Decimal('50000')
+# Largest value a Numeric(7, 2) rate column holds
+MAX_RATE = Decimal('99999.99')
+
+# Members or groups per grouped refresh statement
+REFRESH_BATCH_SIZE = 1000
+
+SUMMARISED_MODELS = (Loan, Transaction, SavingsAccount, DrawdownAccount)
+
+
+def rate(part: Decimal, whole: Decimal) -> Decimal:
+    """part as a percentage of whole, clamped to what a rate column can hold"""
+    if whole <= 0:
+        return Decimal('0')
+    return min(max(part * 100 / whole, Decimal('0')), MAX_RATE).quantize(Decimal('0.01'))
+
+
+class SummaryService:
+    def __init__(self, app=None):
+        self.app = None
+        self._listeners_registered = False
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize summary service with Flask app"""
+        self.app = app
+        if not self._listeners_registered:
+            sa_event.listen(Session, 'after_flush', self._on_flush)
+            sa_event.listen(Session, 'before_commit', self._before_commit)
+            sa_event.listen(Session, 'after_rollback', self._on_rollback)
+            track_savepoints(SUMMARY_MEMBERS_KEY, SUMMARY_GROUPS_KEY)
+            self._listeners_registered = True
+
+    def touch(self, member_ids: Iterable[int], session: Optional[Session] = None):
+        """Refresh these members' summaries (and their groups) when the surrounding transaction commits"""
+        session = session or db.session
+        session.info.setdefault(SUMMARY_MEMBERS_KEY, set()).update(int(member_id) for member_id in member_ids)
+
+    def touch_groups(self, group_ids: Iterable[int], session: Optional[Session] = None):
+        session = session or db.session
+        session.info.setdefault(SUMMARY_GROUPS_KEY, set()).update(int(group_id) for group_id in group_ids)
+
+    # ------------------------------------------------------------------
+    # Write path
+    # ------------------------------------------------------------------
+
+    def _on_flush(self, session, flush_context):
+        member_ids, group_ids = set(), set()
+        for instance in chain(session.new, session.dirty, session.deleted):
+            if isinstance(instance, SUMMARISED_MODELS):
+                if instance.member_id:
+                    member_ids.add(instance.member_id)
+            elif isinstance(instance, Member):
+                # Status drives the loan limit and active counts; risk score and other edits do not matter here
+                attrs = inspect(instance).attrs
+                if instance in session.new or attrs.status.history.has_changes():
+                    member_ids.add(instance.id)
+                if attrs.group_id.history.has_changes():
+                    # The new group is reached through the member; the old one has to be named
+                    member_ids.add(instance.id)
+                    group_ids.update(group_id for group_id in attrs.group_id.history.deleted if group_id)
+            elif isinstance(instance, Group):
+                if instance in session.new or inspect(instance).attrs.branch_id.history.has_changes():
+                    group_ids.add(instance.id)
+        if member_ids:
+            self.touch(member_ids, session)
+        if group_ids:
+            self.touch_groups(group_ids, session)
+
+    def _before_commit(self, session):
+        if session.in_nested_transaction():
+            # Releasing a savepoint also fires the commit events; wait for the outer commit
+            return
+        # Commit flushes after before_commit runs; flush now so pending writes are both seen and summarised
+        session.flush()
+        member_ids = session.info.pop(SUMMARY_MEMBERS_KEY, None) or set()
+        group_ids = session.info.pop(SUMMARY_GROUPS_KEY, None) or set()
+        if not (member_ids or group_ids):
+            return
+        try:
+            with session.begin_nested():
+                if member_ids:
+                    group_ids |= self.refresh(member_ids, session)
+                if group_ids:
+                    self.refresh_groups(group_ids, session)
+        except Exception as e:
+            # A read model must never fail the write it summarises
+            logging.error(f"Failed to refresh summaries of {len(member_ids)} members and {len(group_ids)} groups: {str(e)}")
+            self._discard(member_ids, group_ids, session)
+
+    @staticmethod
+    def _discard(member_ids: Set[int], group_ids: Set[int], session: Session):
+        """Drop rows that could not be refreshed; the read path rebuilds missing rows"""
+        try:
+            with session.begin_nested():
+                if member_ids:
+                    group_ids = group_ids | {
+                        group_id for group_id, in session.query(Member.group_id).filter(
+                            Member.id.in_(member_ids), Member.group_id.isnot(None)
+                        )
+                    }
+                    session.execute(delete(MemberSummary).where(MemberSummary.member_id.in_(member_ids)))
+                if group_ids:
+                    session.execute(delete(GroupStats).where(GroupStats.group_id.in_(group_ids)))
+        except Exception as e:
+            logging.error(f"Failed to discard stale summaries: {str(e)}")
+
+    def _on_rollback(self, session):
+        discard_pending(session, SUMMARY_MEMBERS_KEY, SUMMARY_GROUPS_KEY)
+
+    def refresh(self, member_ids: Iterable[int], session: Optional[Session] = None) -> Set[int]:
+        """Recompute and upsert the summaries of these members; returns their group ids. The caller commits"""
+        session = session or db.session
+        member_ids = sorted(set(member_ids))
+        now = datetime.utcnow()
+        group_ids = set()
+        for offset in range(0, len(member_ids), REFRESH_BATCH_SIZE):
+            chunk = member_ids[offset:offset + REFRESH_BATCH_SIZE]
+            rows = []
+            for row in session.execute(self._summary_query(chunk)):
+                rows.append(self._summary_row(row, now))
+                if row.group_id:
+                    group_ids.add(row.group_id)
+            self._upsert(session, MemberSummary, 'member_id', rows)
+        return group_ids
+
+    def refresh_groups(self, group_ids: Iterable[int], session: Optional[Session] = None) -> int:
+        """Re-sum and upsert the stats of these groups from their member summaries; the caller commits"""
+        session = session or db.session
+        group_ids = sorted(set(group_ids))
+        now = datetime.utcnow()
+        written = 0
+        for offset in range(0, len(group_ids), REFRESH_BATCH_SIZE):
+            chunk = group_ids[offset:offset + REFRESH_BATCH_SIZE]
+            # Members written before member_summaries existed have no share yet
+            unsummarised = [member_id for member_id, in session.execute(
+                select(Member.id).outerjoin(MemberSummary, MemberSummary.member_id == Member.id).where(
+                    Member.group_id.in_(chunk), MemberSummary.member_id.is_(None)
+                )
+            )]
+            if unsummarised:
+                self.refresh(unsummarised, session)
+            rows = [self._group_row(row, now) for row in session.execute(self.group_stats_query(chunk))]
+            self._upsert(session, GroupStats, 'group_id', rows)
+            written += len(rows)
+        return written
+
+    @staticmethod
+    def _upsert(session, model, key: str, rows: List[Dict]):
+        if not rows:
+            return
+        statement = pg_insert(model).values(rows)
+        session.execute(statement.on_conflict_do_update(
+            index_elements=[key],
+            set_={column: statement.excluded[column] for column in rows[0] if column != key}
+        ))
+
+    @staticmethod
+    def _summary_query(member_ids: List[int]):
+        running = Loan.status == 'disbursed'
+        loans = select(
+            Loan.member_id,
+            func.count(Loan.id).label('loan_count'),
+            func.sum(case((Loan.status.in_(ACTIVE_LOAN_STATUSES), 1), else_=0)).label('active_loan_count'),
+            func.sum(Loan.principle_amount).label('total_borrowed'),
+            func.sum(case((Loan.status.in_(ACTIVE_LOAN_STATUSES), Loan.outstanding_balance), else_=0)).label('total_outstanding'),
+            func.sum(case((Loan.status.in_(DISBURSED_LOAN_STATUSES), Loan.principle_amount), else_=0)).label('disbursed_principal'),
+            func.sum(case((running, Loan.outstanding_balance), else_=0)).label('running_outstanding'),
+            func.sum(case((running, Loan.total_amount), else_=0)).label('running_due'),
+            func.sum(case((running, 1), else_=0)).label('running_loan_count')
+        ).where(Loan.member_id.in_(member_ids)).group_by(Loan.member_id).subquery()
+
+        repayment = Transaction.transaction_type == 'loan_repayment'
+        transactions = select(
+            Transaction.member_id,
+            func.sum(case((repayment, Transaction.amount), else_=0)).label('total_repaid'),
+            func.sum(case((and_(repayment, running), Transaction.amount), else_=0)).label('running_repaid'),
+            func.max(Transaction.created_at).label('last_transaction_at')
+        ).outerjoin(Loan, Loan.id == Transaction.loan_id).where(
+            Transaction.member_id.in_(member_ids)
+        ).group_by(Transaction.member_id).subquery()
+
+        savings = select(
+            SavingsAccount.member_id, func.sum(SavingsAccount.balance).label('balance')
+        ).where(SavingsAccount.member_id.in_(member_ids)).group_by(SavingsAccount.member_id).subquery()
+
+        drawdown = select(
+            DrawdownAccount.member_id, func.sum(DrawdownAccount.balance).label('balance')
+        ).where(DrawdownAccount.member_id.in_(member_ids)).group_by(DrawdownAccount.member_id).subquery()
+
+        return select(
+            Member.id.label('member_id'),
+            Member.group_id,
+            Member.status,
+            savings.c.balance.label('savings_balance'),
+            drawdown.c.balance.label('drawdown_balance'),
+            loans.c.loan_count,
+            loans.c.active_loan_count,
+            loans.c.total_borrowed,
+            loans.c.total_outstanding,
+            loans.c.disbursed_principal,
+            loans.c.running_outstanding,
+            loans.c.running_due,
+            loans.c.running_loan_count,
+            transactions.c.total_repaid,
+            transactions.c.running_repaid,
+            transactions.c.last_transaction_at
+        ).select_from(Member).outerjoin(
+            savings, savings.c.member_id == Member.id
+        ).outerjoin(
+            drawdown, drawdown.c.member_id == Member.id
+        ).outerjoin(
+            loans, loans.c.member_id == Member.id
+        ).outerjoin(
+            transactions, transactions.c.member_id == Member.id
+        ).where(Member.id.in_(member_ids))
+
+    @staticmethod
+    def _summary_row(row, now: datetime) -> Dict:
+        def amount(value):
+            return Decimal(str(value)) if value is not None else Decimal('0')
+
+        savings_balance = amount(row.savings_balance)
+        total_outstanding = amount(row.total_outstanding)
+        total_borrowed = amount(row.total_borrowed)
+        total_repaid = amount(row.total_repaid)
+
+        # Loan limit is 4 times savings, capped at 50000, and only for active members
+        if row.status != 'active':
+            max_loan_limit = Decimal('0')
+        else:
+            max_loan_limit = min(savings_balance * LOAN_LIMIT_MULTIPLIER, MAX_LOAN_LIMIT)
+
+        return {
+            'member_id': row.member_id,
+            'savings_balance': savings_balance,
+            'drawdown_balance': amount(row.drawdown_balance),
+            'loan_count': int(row.loan_count or 0),
+            'active_loan_count': int(row.active_loan_count or 0),
+            'total_borrowed': total_borrowed,
+            'total_outstanding': total_outstanding,
+            'total_repaid': total_repaid,
+            'max_loan_limit': max_loan_limit,
+            'available_loan': max(Decimal('0'), max_loan_limit - total_outstanding),
+            'repayment_rate': rate(total_repaid, total_borrowed),
+            'disbursed_principal': amount(row.disbursed_principal),
+            'running_outstanding': amount(row.running_outstanding),
+            'running_due': amount(row.running_due),
+            'running_repaid': amount(row.running_repaid),
+            'running_loan_count': int(row.running_loan_count or 0),
+            'last_transaction_at': row.last_transaction_at,
+            'updated_at': now
+        }
+
+    @staticmethod
+    def group_stats_query(group_ids: List[int]):
+        """Member counts and the sum of the members' summary shares for these groups, as one grouped statement"""
+        members = select(
+            Member.group_id,
+            func.count(Member.id).label('total_members'),
+            func.sum(case((Member.status == 'active', 1), else_=0)).label('active_members'),
+            func.sum(MemberSummary.savings_balance).label('total_savings'),
+            func.sum(MemberSummary.disbursed_principal).label('total_loans_disbursed'),
+            func.sum(MemberSummary.running_outstanding).label('total_loans_outstanding'),
+            func.sum(MemberSummary.running_due).label('total_due'),
+            func.sum(MemberSummary.running_loan_count).label('active_loan_count'),
+            func.sum(MemberSummary.total_repaid).label('total_repaid'),
+            func.sum(MemberSummary.running_repaid).label('running_repaid')
+        ).outerjoin(MemberSummary, MemberSummary.member_id == Member.id).where(
+            Member.group_id.in_(group_ids)
+        ).group_by(Member.group_id).subquery()
+
+        return select(
+            Group.id.label('group_id'),
+            Group.branch_id,
+            members.c.total_members,
+            members.c.active_members,
+            members.c.total_savings,
+            members.c.total_loans_disbursed,
+            members.c.total_loans_outstanding,
+            members.c.total_due,
+            members.c.active_loan_count,
+            members.c.total_repaid,
+            members.c.running_repaid
+        ).select_from(Group).outerjoin(
+            members, members.c.group_id == Group.id
+        ).where(Group.id.in_(group_ids))
+
+    @staticmethod
+    def _group_row(row, now: datetime) -> Dict:
+        def amount(value):
+            return Decimal(str(value)) if value is not None else Decimal('0')
+
+        total_due = amount(row.total_due)
+        total_repaid = amount(row.total_repaid)
+        active_loan_count = int(row.active_loan_count or 0)
+
+        return {
+            'group_id': row.group_id,
+            'branch_id': row.branch_id,
+            'total_members': int(row.total_members or 0),
+            'active_members': int(row.active_members or 0),
+            'total_savings': amount(row.total_savings),
+            'total_loans_disbursed': amount(row.total_loans_disbursed),
+            'total_loans_outstanding': amount(row.total_loans_outstanding),
+            'total_due': total_due,
+            'total_repaid': total_repaid,
+            'active_loan_count': active_loan_count,
+            # Repaid on the group's running loans against what they are due to repay
+            'repayment_rate': min(rate(amount(row.running_repaid), total_due), Decimal('100'))
+                              if active_loan_count else Decimal('0'),
+            'updated_at': now
+        }
+
+    # ------------------------------------------------------------------
+    # Read path
+    # ------------------------------------------------------------------
+
+    def get_member_summary(self, member: Member) -> MemberSummary:
+        """The member's summary row, built on first read for members written before the table existed"""
+        summary = member.summary
+        if summary is None:
+            self.refresh([member.id])
+            db.session.commit()
+            summary = MemberSummary.query.get(member.id)
+        return summary
+
+    def get_group_stats(self, group_ids: Iterable[int]) -> Dict[int, GroupStats]:
+        """Stats rows by group id, rolling up on first read any group written before the table existed"""
+        group_ids = list(group_ids)
+        query = GroupStats.query.options(joinedload(GroupStats.group))
+        stats = {row.group_id: row for row in query.filter(GroupStats.group_id.in_(group_ids))}
+        missing = [group_id for group_id in group_ids if group_id not in stats]
+        if missing:
+            self.refresh_groups(missing)
+            db.session.commit()
+            stats.update((row.group_id, row) for row in query.filter(GroupStats.group_id.in_(missing)))
+        return stats
+
+    def rebuild(self) -> Dict[str, int]:
+        """Recompute every member summary and group stats row from a full scan"""
+        member_ids = [member_id for member_id, in db.session.query(Member.id)]
+        group_ids = [group_id for group_id, in db.session.query(Group.id)]
+        db.session.execute(delete(MemberSummary))
+        db.session.execute(delete(GroupStats))
+        self.refresh(member_ids)
+        groups = self.refresh_groups(group_ids)
+        db.session.commit()
+        logging.info(f"Rebuilt {len(member_ids)} member summaries and {groups} group stats")
+        return {'members': len(member_ids), 'groups': groups}
+
+
+summary_service = SummaryService()
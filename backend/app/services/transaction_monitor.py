@@ -0,0 +1,504 @@
+"""
+Streaming AML transaction monitor.
+
+Ledger postings are published to a Redis stream when their database
+transaction commits. The monitor consumes that stream, keeps per-member sliding
+windows (counts and sums over 1h, 24h and 30d for credits and debits, plus the
+recent large deposits used for deposit -> withdrawal pairing), evaluates every
+rule in O(1) per event and bulk-writes alerts to the aml_alerts table. A
+summary of each member's windows is mirrored to Redis for on-demand checks.
+"""
+import logging
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+import redis
+from sqlalchemy import and_, or_, event as sa_event
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models import AmlAlert, Transaction
+from app.utils.session_state import discard_pending, track_savepoints
+
+STREAM_KEY = 'transactions:events'
+CONSUMER_GROUP = 'aml-monitor'
+
+WINDOWS = (('1h', 3600), ('24h', 86400), ('30d', 30 * 86400))
+DIRECTIONS = ('credit', 'debit')
+DEBIT_TYPES = {'withdrawal', 'debit', 'loan_repayment'}
+
+# Rule name -> points added to the event's risk score
+RULE_POINTS = {
+    'high_amount': 30,
+    'rapid_activity': 25,
+    'structuring': 40,
+    'rapid_withdrawal': 30,
+    'unusual_pattern': 15,
+}
+
+
+class _Window:
+    """Count and sum of the events in the trailing `span` seconds"""
+    __slots__ = ('span', 'events', 'count', 'total')
+
+    def __init__(self, span: int):
+        self.span = span
+        self.events = deque()
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, ts: float, amount: float):
+        self.events.append((ts, amount))
+        self.count += 1
+        self.total += amount
+
+    def expire(self, now: float):
+        # Each event is appended and popped once, so this is amortised O(1)
+        horizon = now - self.span
+        events = self.events
+        while events and events[0][0] <= horizon:
+            _, amount = events.popleft()
+            self.count -= 1
+            self.total -= amount
+
+
+class _MemberState:
+    __slots__ = ('windows', 'large_deposits', 'last_event_at', 'flags')
+
+    def __init__(self):
+        self.windows = {
+            (direction, name): _Window(span)
+            for direction in DIRECTIONS
+            for name, span in WINDOWS
+        }
+        self.large_deposits = deque()
+        self.last_event_at = 0.0
+        # rule name -> timestamp it last fired
+        self.flags = {}
+
+
+class TransactionMonitor:
+    def __init__(self, app=None):
+        self.app = None
+        self.redis_client = None
+        self.members: Dict[int, _MemberState] = {}
+        self.high_amount = 10000.0
+        self.velocity_1h = 10
+        self.velocity_24h = 40
+        self.reporting_threshold = 1000000.0
+        self.structuring_min_deposits = 3
+        self.pair_deposit_min = 50000.0
+        self.pair_ratio = 0.8
+        self.pair_window = 3600
+        self.unusual_multiplier = 3.0
+        self.unusual_min_history = 10
+        self.alert_min_score = 50
+        self.stream_maxlen = 1000000
+        self.snapshot_ttl = 31 * 86400
+        # Last stream entry folded into the windows, and alerts from it not yet stored
+        self._applied_through = None
+        self._unstored_alerts: List[Dict[str, Any]] = []
+        self._listeners_registered = False
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize transaction monitor with Flask app"""
+        self.app = app
+        try:
+            self.redis_client = redis.Redis(
+                host=app.config.get('REDIS_HOST', 'localhost'),
+                port=app.config.get('REDIS_PORT', 6379),
+                db=app.config.get('REDIS_DB', 7),
+                decode_responses=True
+            )
+        except Exception as e:
+            logging.warning(f"Failed to initialize Redis for transaction monitor: {str(e)}")
+
+        self.high_amount = float(app.config.get('AML_HIGH_AMOUNT', self.high_amount))
+        self.velocity_1h = app.config.get('AML_VELOCITY_1H', self.velocity_1h)
+        self.velocity_24h = app.config.get('AML_VELOCITY_24H', self.velocity_24h)
+        self.reporting_threshold = float(app.config.get('AML_REPORTING_THRESHOLD', self.reporting_threshold))
+        self.pair_deposit_min = float(app.config.get('AML_PAIR_DEPOSIT_MIN', self.pair_deposit_min))
+        self.alert_min_score = app.config.get('AML_ALERT_MIN_SCORE', self.alert_min_score)
+
+        if not self._listeners_registered:
+            from app.services.ledger_service import LEDGER_EVENTS_KEY
+            sa_event.listen(Session, 'after_commit', self._on_commit)
+            sa_event.listen(Session, 'after_rollback', self._on_rollback)
+            track_savepoints(LEDGER_EVENTS_KEY)
+            self._listeners_registered = True
+
+    # ------------------------------------------------------------------
+    # Event stream
+    # ------------------------------------------------------------------
+
+    def _on_commit(self, session):
+        if session.in_nested_transaction():
+            # Releasing a savepoint also fires the commit events; wait for the outer commit
+            return
+        from app.services.ledger_service import LEDGER_EVENTS_KEY
+        events = session.info.pop(LEDGER_EVENTS_KEY, None)
+        if events:
+            self.publish(events)
+
+    def _on_rollback(self, session):
+        from app.services.ledger_service import LEDGER_EVENTS_KEY
+        discard_pending(session, LEDGER_EVENTS_KEY)
+
+    def publish(self, events: List[Dict[str, str]]):
+        """Append committed postings to the transaction event stream"""
+        if not self.redis_client:
+            return
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for event in events:
+                pipe.xadd(STREAM_KEY, event, maxlen=self.stream_maxlen, approximate=True)
+            pipe.execute()
+        except Exception as e:
+            logging.warning(f"Failed to publish {len(events)} transaction events: {str(e)}")
+
+    def consume(self, consumer: str, batch_size: int = 500, block_ms: int = 1000) -> Dict[str, int]:
+        """
+        Read one batch from the stream, evaluate it, store alerts and ack.
+
+        Entries redelivered after a failed batch are not folded into the
+        windows again; the alerts they raised are kept until stored.
+        """
+        try:
+            self.redis_client.xgroup_create(STREAM_KEY, CONSUMER_GROUP, id='0', mkstream=True)
+        except redis.ResponseError:
+            pass
+
+        # Entries delivered to this consumer but never acked come first
+        response = self.redis_client.xreadgroup(CONSUMER_GROUP, consumer, {STREAM_KEY: '0'}, count=batch_size)
+        if not response or not response[0][1]:
+            response = self.redis_client.xreadgroup(
+                CONSUMER_GROUP, consumer, {STREAM_KEY: '>'}, count=batch_size, block=block_ms
+            )
+        if not response:
+            return {'events': 0, 'alerts': 0}
+
+        entries = response[0][1]
+        alerts, touched = self._unstored_alerts, set()
+        for entry_id, fields in entries:
+            position = self._stream_position(entry_id)
+            if self._applied_through is not None and position <= self._applied_through:
+                continue
+            alert = self.process_event(fields)
+            self._applied_through = position
+            touched.add(int(fields['member_id']))
+            if alert:
+                alerts.append(alert)
+
+        self.store_alerts(alerts)
+        self._unstored_alerts = []
+        self.write_snapshots(touched)
+        self.redis_client.xack(STREAM_KEY, CONSUMER_GROUP, *[entry_id for entry_id, _ in entries])
+        return {'events': len(entries), 'alerts': len(alerts)}
+
+    @staticmethod
+    def _stream_position(entry_id) -> tuple:
+        milliseconds, _, sequence = str(entry_id).partition('-')
+        return int(milliseconds), int(sequence or 0)
+
+    # ------------------------------------------------------------------
+    # Evaluation
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _direction(event: Dict[str, Any]) -> str:
+        direction = event.get('direction')
+        if direction in DIRECTIONS:
+            return direction
+        return 'debit' if event.get('transaction_type') in DEBIT_TYPES else 'credit'
+
+    @staticmethod
+    def _timestamp(value) -> float:
+        if isinstance(value, (int, float)):
+            return float(value)
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        # Transactions are stamped in naive UTC
+        return value.replace(tzinfo=timezone.utc).timestamp() if value.tzinfo is None else value.timestamp()
+
+    def process_event(self, event: Dict[str, Any], state: Optional[_MemberState] = None) -> Optional[Dict[str, Any]]:
+        """
+        Fold one posting into its member's windows and evaluate the rules.
+
+        Returns an aml_alerts row when the event scores at least
+        alert_min_score, otherwise None. Events must arrive in time order per member.
+        """
+        member_id = int(event['member_id'])
+        if state is None:
+            state = self.members.get(member_id)
+            if state is None:
+                state = self.members[member_id] = _MemberState()
+
+        ts, rules = self._apply(event, state)
+        score = sum(rules.values())
+        if score < self.alert_min_score:
+            return None
+        return {
+            'member_id': member_id,
+            'transaction_id': event.get('transaction_id'),
+            'transaction_type': event.get('transaction_type'),
+            'amount': float(event['amount']),
+            'rules': rules,
+            'risk_score': score,
+            'risk_level': self.risk_level(score),
+            'window_stats': self._stats(state),
+            'status': 'open',
+            'event_at': datetime.utcfromtimestamp(ts),
+            'created_at': datetime.utcnow()
+        }
+
+    def _apply(self, event: Dict[str, Any], state: _MemberState):
+        """Advance the windows to the event, add it and return (timestamp, fired rules)"""
+        ts = self._timestamp(event['created_at'])
+        amount = float(event['amount'])
+        direction = self._direction(event)
+
+        for window in state.windows.values():
+            window.expire(ts)
+        large_deposits = state.large_deposits
+        while large_deposits and large_deposits[0][0] <= ts - self.pair_window:
+            large_deposits.popleft()
+
+        rules = {}
+        if amount > self.high_amount:
+            rules['high_amount'] = RULE_POINTS['high_amount']
+
+        if direction == 'debit':
+            # Withdrawal of most of a large deposit made within the pair window
+            for _, deposit in large_deposits:
+                if amount >= deposit * self.pair_ratio:
+                    rules['rapid_withdrawal'] = RULE_POINTS['rapid_withdrawal']
+                    break
+        elif amount >= self.pair_deposit_min:
+            large_deposits.append((ts, amount))
+
+        for (window_direction, _), window in state.windows.items():
+            if window_direction == direction:
+                window.add(ts, amount)
+        state.last_event_at = ts
+
+        windows = state.windows
+        count_1h = windows[('credit', '1h')].count + windows[('debit', '1h')].count
+        count_24h = windows[('credit', '24h')].count + windows[('debit', '24h')].count
+        if count_1h >= self.velocity_1h or count_24h >= self.velocity_24h:
+            rules['rapid_activity'] = RULE_POINTS['rapid_activity']
+
+        credits_24h = windows[('credit', '24h')]
+        if (direction == 'credit' and amount < self.reporting_threshold
+                and credits_24h.count >= self.structuring_min_deposits
+                and credits_24h.total >= self.reporting_threshold):
+            # Deposits each under the reporting threshold that add up past it
+            rules['structuring'] = RULE_POINTS['structuring']
+
+        volume_24h = credits_24h.total + windows[('debit', '24h')].total
+        volume_30d = windows[('credit', '30d')].total + windows[('debit', '30d')].total
+        count_30d = windows[('credit', '30d')].count + windows[('debit', '30d')].count
+        if count_30d >= self.unusual_min_history and volume_24h > self.unusual_multiplier * volume_30d / 30:
+            rules['unusual_pattern'] = RULE_POINTS['unusual_pattern']
+
+        for rule in rules:
+            state.flags[rule] = ts
+        return ts, rules
+
+    @staticmethod
+    def risk_level(score: int) -> str:
+        if score >= 75:
+            return 'high'
+        if score >= 50:
+            return 'medium'
+        return 'low'
+
+    @staticmethod
+    def _stats(state: _MemberState) -> Dict[str, Any]:
+        stats = {}
+        for (direction, name), window in state.windows.items():
+            stats[f"{direction}_{name}_count"] = window.count
+            stats[f"{direction}_{name}_sum"] = round(window.total, 2)
+        return stats
+
+    # ------------------------------------------------------------------
+    # State and storage
+    # ------------------------------------------------------------------
+
+    def _history(self, member_ids: Optional[Iterable[int]], since: datetime, until: Optional[datetime] = None):
+        """Stored postings as events shaped like the stream's, direction included"""
+        from app.services.ledger_service import posted_direction
+
+        query = db.session.query(
+            Transaction.transaction_id, Transaction.member_id, Transaction.account_type,
+            Transaction.transaction_type, Transaction.amount, Transaction.balance_before,
+            Transaction.balance_after, Transaction.created_at
+        ).filter(
+            Transaction.created_at >= since,
+            # Money has moved for confirmed rows and for withdrawals reserved while pending
+            or_(
+                Transaction.status == 'confirmed',
+                and_(Transaction.status == 'pending', Transaction.transaction_type == 'withdrawal')
+            )
+        )
+        if until:
+            query = query.filter(Transaction.created_at < until)
+        if member_ids is not None:
+            query = query.filter(Transaction.member_id.in_(list(member_ids)))
+        for row in query.order_by(Transaction.created_at, Transaction.id).yield_per(5000):
+            yield {
+                'transaction_id': row.transaction_id,
+                'member_id': row.member_id,
+                'account_type': row.account_type,
+                'transaction_type': row.transaction_type,
+                # Transfer legs share a type, so the balances tell debit from credit
+                'direction': posted_direction(row.transaction_type, row.account_type,
+                                              row.balance_before, row.balance_after),
+                'amount': row.amount,
+                'created_at': row.created_at
+            }
+
+    def warm_up(self, days: int = 30, until: Optional[datetime] = None) -> int:
+        """
+        Rebuild every member's windows from the transactions of the last `days`.
+
+        Pass the creation time of the oldest unconsumed stream event as `until`
+        so the backlog is not counted twice when the consumer catches up.
+        """
+        self.members = {}
+        # The backlog after `until` is folded in afresh as it is consumed
+        self._applied_through = None
+        self._unstored_alerts = []
+        loaded = 0
+        until = until or datetime.utcnow()
+        for event in self._history(None, until - timedelta(days=days), until=until):
+            state = self.members.get(event['member_id'])
+            if state is None:
+                state = self.members[event['member_id']] = _MemberState()
+            self._apply(event, state)
+            loaded += 1
+        return loaded
+
+    def backlog_start(self) -> Optional[datetime]:
+        """Creation time of the oldest stream event the consumer group has not acked"""
+        try:
+            pending = self.redis_client.xpending(STREAM_KEY, CONSUMER_GROUP)
+            if pending and pending.get('pending'):
+                entries = self.redis_client.xrange(STREAM_KEY, pending['min'], pending['min'])
+            else:
+                groups = {g['name']: g for g in self.redis_client.xinfo_groups(STREAM_KEY)}
+                last_delivered = groups[CONSUMER_GROUP]['last-delivered-id'] if CONSUMER_GROUP in groups else '0'
+                entries = self.redis_client.xrange(STREAM_KEY, f"({last_delivered}", '+', count=1)
+        except redis.ResponseError:
+            return None
+        if not entries:
+            return None
+        return datetime.fromisoformat(entries[0][1]['created_at'])
+
+    def evaluate(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Evaluate a single event on demand, outside the stream consumer.
+
+        The member's windows are rebuilt from the database up to the event so
+        the shared consumer state is never touched. Alerts are stored.
+        """
+        member_id = int(event['member_id'])
+        created_at = event.get('created_at') or datetime.utcnow()
+        if isinstance(created_at, str):
+            created_at = datetime.fromisoformat(created_at)
+        event = {**event, 'created_at': created_at}
+
+        state = _MemberState()
+        for past in self._history([member_id], created_at - timedelta(days=30), until=created_at):
+            self._apply(past, state)
+        ts, rules = self._apply(event, state)
+        score = sum(rules.values())
+
+        alerted = score >= self.alert_min_score
+        if alerted:
+            self.store_alerts([{
+                'member_id': member_id,
+                'transaction_id': event.get('transaction_id'),
+                'transaction_type': event.get('transaction_type'),
+                'amount': float(event['amount']),
+                'rules': rules,
+                'risk_score': score,
+                'risk_level': self.risk_level(score),
+                'window_stats': self._stats(state),
+                'status': 'open',
+                'event_at': datetime.utcfromtimestamp(ts),
+                'created_at': datetime.utcnow()
+            }])
+        return {
+            'rules': rules,
+            'risk_score': score,
+            'risk_level': self.risk_level(score),
+            'window_stats': self._stats(state),
+            'alerted': alerted
+        }
+
+    def store_alerts(self, alerts: List[Dict[str, Any]]):
+        if not alerts:
+            return
+        try:
+            db.session.bulk_insert_mappings(AmlAlert, alerts)
+            db.session.commit()
+        except Exception as e:
+            logging.error(f"Failed to store {len(alerts)} AML alerts: {str(e)}")
+            db.session.rollback()
+            raise
+
+    def write_snapshots(self, member_ids: Iterable[int]):
+        """Mirror the members' window summaries to Redis for on-demand checks"""
+        if not self.redis_client:
+            return
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for member_id in member_ids:
+                state = self.members.get(member_id)
+                if not state:
+                    continue
+                snapshot = self._stats(state)
+                snapshot['last_event_at'] = state.last_event_at
+                for rule, ts in state.flags.items():
+                    snapshot[f"{rule}_at"] = ts
+                key = f"aml:windows:{member_id}"
+                pipe.hset(key, mapping=snapshot)
+                pipe.expire(key, self.snapshot_ttl)
+            pipe.execute()
+        except Exception as e:
+            logging.warning(f"Failed to write AML window snapshots: {str(e)}")
+
+    def get_snapshot(self, member_id: int) -> Optional[Dict[str, float]]:
+        if not self.redis_client:
+            return None
+        try:
+            snapshot = self.redis_client.hgetall(f"aml:windows:{member_id}")
+        except Exception as e:
+            logging.warning(f"Failed to read AML window snapshot: {str(e)}")
+            return None
+        return {key: float(value) for key, value in snapshot.items()} if snapshot else None
+
+    def get_snapshots(self, member_ids: Iterable[int]) -> Dict[int, Optional[Dict[str, float]]]:
+        """get_snapshot for many members in one pipelined round trip"""
+        member_ids = list(member_ids)
+        if not self.redis_client or not member_ids:
+            return {member_id: None for member_id in member_ids}
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for member_id in member_ids:
+                pipe.hgetall(f"aml:windows:{member_id}")
+            snapshots = pipe.execute()
+        except Exception as e:
+            logging.warning(f"Failed to read AML window snapshots: {str(e)}")
+            return {member_id: None for member_id in member_ids}
+        return {
+            member_id: {key: float(value) for key, value in snapshot.items()} if snapshot else None
+            for member_id, snapshot in zip(member_ids, snapshots)
+        }
+
+
+transaction_monitor = TransactionMonitor()
@@ -4,11 +4,89 @@ Enables feature phone users to access loan services via USSD codes
 """
 import logging
 import json
+import inspect
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Callable
 from flask import current_app
 import redis
 
+# Declarative menu table: state -> {input: (next_state, handler)}.
+# '*' matches any other input and a next_state of None ends the session.
+# The table is compiled into a dispatch dict once, in init_app.
+USSD_MENU = {
+    'main_menu': {
+        '1': ('check_balance', '_check_balance_menu'),
+        '2': ('loan_info', '_loan_info_menu'),
+        '3': ('quick_loan', '_quick_loan_menu'),
+        '4': ('make_payment', '_make_payment_menu'),
+        '5': ('contact_support', '_contact_support_menu'),
+        '0': (None, '_exit_response'),
+        '*': ('main_menu', '_main_menu'),
+    },
+    'check_balance': {
+        '0': ('main_menu', '_main_menu'),
+        '*': ('check_balance', '_check_balance_info'),
+    },
+    'loan_info': {
+        '0': ('main_menu', '_main_menu'),
+        '*': ('loan_info', '_loan_info_detail'),
+    },
+    'quick_loan': {
+        '0': ('main_menu', '_main_menu'),
+        '*': ('quick_loan', '_quick_loan_process'),
+    },
+    'make_payment': {
+        '0': ('main_menu', '_main_menu'),
+        '*': ('make_payment', '_make_payment_process'),
+    },
+    'contact_support': {
+        '0': ('main_menu', '_main_menu'),
+        '*': ('contact_support', '_support_response'),
+    },
+}
+
+SESSION_TTL = 600  # 10 minutes session timeout
+
+
+class _TTLCache:
+    """Small thread-safe LRU with per-entry expiry, used when Redis is unavailable"""
+
+    def __init__(self, maxsize: int = 10000, ttl: int = SESSION_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._data.get(key)
+            if not entry:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return dict(value)
+
+    def set(self, key: str, value: Dict[str, Any]):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, dict(value))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
 class USSDService:
     """USSD menu system for feature phone users"""
     
@@ -17,6 +95,8 @@ class USSDService:
         self.redis_client = None
         self.ussd_code = "*123#"
         self.provider = "africastalking"  # or "twilio"
+        self.local_sessions = _TTLCache()
+        self.dispatch = {}
         
         if app:
             self.init_app(app)
@@ -26,19 +106,49 @@ class USSDService:
         self.app = app
         self.ussd_code = app.config.get('USSD_CODE', '*123#')
         self.provider = app.config.get('USSD_PROVIDER', 'africastalking')
+        self.local_sessions = _TTLCache(
+            maxsize=app.config.get('USSD_LOCAL_SESSION_LIMIT', 10000),
+            ttl=SESSION_TTL
+        )
         
         try:
+            # Short socket timeouts keep a slow Redis inside the ~2s telco hop budget
             self.redis_client = redis.Redis(
                 host=app.config.get('REDIS_HOST', 'localhost'),
                 port=app.config.get('REDIS_PORT', 6379),
                 db=app.config.get('REDIS_DB', 6),
-                decode_responses=True
+                decode_responses=True,
+                socket_connect_timeout=0.2,
+                socket_timeout=0.2
             )
         except Exception as e:
             logging.warning(f"Failed to initialize Redis for USSD: {str(e)}")
         
+        self.dispatch = self._compile_menu(USSD_MENU)
+        
         logging.info(f"USSD Service initialized with code: {self.ussd_code}")
     
+    def _compile_menu(self, menu: Dict[str, Dict[str, tuple]]) -> Dict[str, Dict[str, tuple]]:
+        """Resolve handler names into bound callables taking (session, user_input)"""
+        compiled = {}
+        for state, transitions in menu.items():
+            compiled[state] = {}
+            for key, (next_state, handler_name) in transitions.items():
+                if next_state is not None and next_state not in menu:
+                    raise ValueError(f"USSD state '{state}' points at unknown state '{next_state}'")
+                compiled[state][key] = (next_state, self._bind_handler(getattr(self, handler_name)))
+        return compiled
+    
+    @staticmethod
+    def _bind_handler(handler: Callable) -> Callable:
+        """Adapt a handler to the uniform (session, user_input) call signature"""
+        arity = len(inspect.signature(handler).parameters)
+        if arity == 0:
+            return lambda session, user_input: handler()
+        if arity == 1:
+            return lambda session, user_input: handler(session)
+        return handler
+    
     def handle_ussd_request(self, phone_number: str, user_input: str, 
                            session_id: str) -> Dict[str, Any]:
         """Handle incoming USSD request"""
@@ -60,7 +170,10 @@ class USSDService:
             
             response = self._process_input(session, user_input)
             
-            self._save_session(session_id, session)
+            if response.get('continue_session', True):
+                self._save_session(session_id, session)
+            else:
+                self._end_session(session_id)
             
             return response
         
@@ -69,84 +182,128 @@ class USSDService:
             return self._error_response("System error. Please try again.")
     
     def _get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
-        """Get USSD session"""
-        try:
-            if self.redis_client:
-                session_json = self.redis_client.get(f"ussd_session:{session_id}")
-                if session_json:
-                    return json.loads(session_json)
-            return None
-        except Exception as e:
-            logging.error(f"Error getting USSD session: {str(e)}")
-            return None
+        """Get USSD session from Redis, falling back to the in-process store"""
+        key = f"ussd_session:{session_id}"
+        if self.redis_client:
+            try:
+                fields = self.redis_client.hgetall(key)
+                if fields:
+                    return self._decode_session(fields)
+            except Exception as e:
+                logging.warning(f"USSD session store unavailable, using local fallback: {str(e)}")
+        return self.local_sessions.get(key)
     
     def _save_session(self, session_id: str, session: Dict[str, Any]) -> bool:
-        """Save USSD session"""
-        try:
-            if self.redis_client:
-                self.redis_client.setex(
-                    f"ussd_session:{session_id}",
-                    600,  # 10 minutes session timeout
-                    json.dumps(session)
-                )
-                return True
+        """Save USSD session as hash fields; always mirrored to the in-process store"""
+        key = f"ussd_session:{session_id}"
+        self.local_sessions.set(key, session)
+        if not self.redis_client:
             return False
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.hset(key, mapping=self._encode_session(session))
+            pipe.expire(key, SESSION_TTL)
+            pipe.execute()
+            return True
         except Exception as e:
-            logging.error(f"Error saving USSD session: {str(e)}")
+            logging.warning(f"Error saving USSD session to Redis: {str(e)}")
             return False
     
+    def _end_session(self, session_id: str):
+        """Drop a finished session from both stores"""
+        key = f"ussd_session:{session_id}"
+        self.local_sessions.delete(key)
+        if self.redis_client:
+            try:
+                self.redis_client.delete(key)
+            except Exception as e:
+                logging.warning(f"Error ending USSD session: {str(e)}")
+    
+    @staticmethod
+    def _encode_session(session: Dict[str, Any]) -> Dict[str, str]:
+        """Flatten a session into Redis hash fields"""
+        fields = {}
+        for name, value in session.items():
+            if value is None:
+                continue
+            if isinstance(value, (dict, list)):
+                fields[name] = json.dumps(value, separators=(',', ':'))
+            else:
+                fields[name] = str(value)
+        return fields
+    
+    @staticmethod
+    def _decode_session(fields: Dict[str, str]) -> Dict[str, Any]:
+        """Rebuild a session from Redis hash fields"""
+        session = dict(fields)
+        session['interactions'] = int(session.get('interactions', 0))
+        if 'member' in session:
+            session['member'] = json.loads(session['member'])
+        return session
+    
     def _process_input(self, session: Dict[str, Any], user_input: str) -> Dict[str, Any]:
-        """Process USSD user input based on current state"""
-        state = session.get('state', 'main_menu')
+        """Process USSD user input through the compiled state table"""
+        transitions = self.dispatch.get(session.get('state', 'main_menu'))
+        if transitions is None:
+            # Sub-states without their own table (e.g. amount entry) restart at the main menu
+            session['state'] = 'main_menu'
+            return self._main_menu()
         
-        if state == 'main_menu':
-            if user_input == '1':
-                session['state'] = 'check_balance'
-                return self._check_balance_menu(session)
-            elif user_input == '2':
-                session['state'] = 'loan_info'
-                return self._loan_info_menu(session)
-            elif user_input == '3':
-                session['state'] = 'quick_loan'
-                return self._quick_loan_menu(session)
-            elif user_input == '4':
-                session['state'] = 'make_payment'
-                return self._make_payment_menu(session)
-            elif user_input == '5':
-                session['state'] = 'contact_support'
-                return self._contact_support_menu(session)
-            elif user_input == '0':
-                return self._exit_response()
-            else:
-                return self._main_menu()
+        next_state, handler = transitions.get(user_input) or transitions['*']
+        if next_state:
+            session['state'] = next_state
+        return handler(session, user_input)
+    
+    def _get_member_snapshot(self, session: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Member balances and loans by phone, looked up once per session"""
+        if 'member' in session:
+            return session['member'] or None
         
-        elif state == 'check_balance':
-            if user_input == '0':
-                return self._main_menu_with_prev(session)
-            return self._check_balance_info(session)
+        snapshot = {}
+        try:
+            snapshot = self._lookup_member(session.get('phone_number', '')) or {}
+        except Exception as e:
+            logging.error(f"Error looking up USSD member: {str(e)}")
+            return None
         
-        elif state == 'loan_info':
-            if user_input == '0':
-                return self._main_menu_with_prev(session)
-            return self._loan_info_detail(session, user_input)
+        session['member'] = snapshot
+        return snapshot or None
+    
+    def _lookup_member(self, phone: str) -> Optional[Dict[str, Any]]:
+        """Load the member's savings balance and active loans in two queries"""
+        from app import db
+        from app.models import User, Member, SavingsAccount, Loan
+        from app.utils.phone import phone_variants
         
-        elif state == 'quick_loan':
-            if user_input == '0':
-                return self._main_menu_with_prev(session)
-            return self._quick_loan_process(session, user_input)
+        row = db.session.query(Member.id, Member.status, SavingsAccount.balance).join(
+            User, Member.user_id == User.id
+        ).outerjoin(
+            SavingsAccount, SavingsAccount.member_id == Member.id
+        ).filter(User.phone.in_(phone_variants(phone))).first()
         
-        elif state == 'make_payment':
-            if user_input == '0':
-                return self._main_menu_with_prev(session)
-            return self._make_payment_process(session, user_input)
+        if not row:
+            return None
         
-        elif state == 'contact_support':
-            if user_input == '0':
-                return self._main_menu_with_prev(session)
-            return self._support_response(session)
+        loans = db.session.query(
+            Loan.loan_number, Loan.outstanding_balance, Loan.due_date
+        ).filter(
+            Loan.member_id == row.id,
+            Loan.status.in_(['active', 'disbursed', 'approved'])
+        ).order_by(Loan.due_date).limit(3).all()
         
-        else:
-            return self._main_menu()
+        return {
+            'member_id': row.id,
+            'status': row.status,
+            'savings': float(row.balance or 0),
+            'loans': [
+                {
+                    'number': loan.loan_number,
+                    'balance': float(loan.outstanding_balance or 0),
+                    'due': loan.due_date.strftime('%d %b') if loan.due_date else None
+                }
+                for loan in loans
+            ]
+        }
     
     def _main_menu(self) -> Dict[str, Any]:
         """Main menu"""
@@ -161,11 +318,6 @@ class USSDService:
             'continue_session': True
         }
     
-    def _main_menu_with_prev(self, session: Dict[str, Any]) -> Dict[str, Any]:
-        """Main menu after previous selection"""
-        session['state'] = 'main_menu'
-        return self._main_menu()
-    
     def _check_balance_menu(self, session: Dict[str, Any]) -> Dict[str, Any]:
         """Check balance submenu"""
         return {
@@ -179,12 +331,16 @@ class USSDService:
     
     def _check_balance_info(self, session: Dict[str, Any]) -> Dict[str, Any]:
         """Get balance information"""
-        phone = session.get('phone_number')
+        member = self._get_member_snapshot(session)
+        if not member:
+            return self._error_response("No member account is linked to this number.")
+        
+        loan_balance = sum(loan['balance'] for loan in member['loans'])
         
         balance_response = "Your Balance:\n"
-        balance_response += "Savings: KES 15,000\n"
-        balance_response += "Loan Balance: KES 8,500\n"
-        balance_response += "Status: Active\n\n"
+        balance_response += f"Savings: KES {member['savings']:,.0f}\n"
+        balance_response += f"Loan Balance: KES {loan_balance:,.0f}\n"
+        balance_response += f"Status: {member['status'].title()}\n\n"
         balance_response += "0. Back to Menu"
         
         return {
@@ -206,10 +362,14 @@ class USSDService:
     def _loan_info_detail(self, session: Dict[str, Any], user_input: str) -> Dict[str, Any]:
         """Get loan information detail"""
         if user_input == '1':
+            member = self._get_member_snapshot(session)
+            loans = member['loans'] if member else []
             response = "Your Loans:\n"
-            response += "1. Standard Loan (KES 50,000) - Due: 15 Jan\n"
-            response += "2. Emergency Loan (KES 20,000) - Due: 30 Jan\n"
-            response += "3. Check another loan\n"
+            for index, loan in enumerate(loans, start=1):
+                due = f" - Due: {loan['due']}" if loan['due'] else ""
+                response += f"{index}. {loan['number']} (KES {loan['balance']:,.0f}){due}\n"
+            if not loans:
+                response += "No active loans\n"
             response += "0. Back to Menu"
         elif user_input == '3':
             response = "Loan Rates:\n"
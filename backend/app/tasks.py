@@ -0,0 +1,39 @@
+"""
+Celery tasks.
+
+Forecast models are fitted here rather than inside HTTP requests. Tasks are
+routed to the `forecasts` queue so a dedicated worker (see docker-compose)
+fits them across its process pool; beat refreshes every scope on schedule.
+Meeting reminders are scheduled and dispatched on the `reminders` queue.
+"""
+from celery import shared_task, group
+
+
+@shared_task(name='forecasts.compute', bind=True)
+def compute_forecast_task(self, forecast_type, months_ahead=None, branch_id=None, product_id=None):
+    from app.services.ai_analytics_service import AIAnalyticsService
+    return AIAnalyticsService.compute_forecast(
+        forecast_type, months_ahead, branch_id=branch_id, product_id=product_id, job_id=self.request.id
+    )
+
+
+@shared_task(name='forecasts.refresh_all', bind=True)
+def refresh_forecasts_task(self):
+    """Fan one compute task per forecast scope out over the worker pool"""
+    from app.services.ai_analytics_service import AIAnalyticsService
+    scopes = AIAnalyticsService.forecast_scopes()
+    result = group(compute_forecast_task.s(*scope) for scope in scopes).apply_async()
+    result.save()
+    return {'scopes': len(scopes), 'group_id': result.id}
+
+
+@shared_task(name='reminders.schedule')
+def schedule_meeting_reminders_task():
+    from app.services.reminder_scheduler import meeting_reminders
+    return meeting_reminders.schedule()
+
+
+@shared_task(name='reminders.dispatch')
+def dispatch_meeting_reminders_task():
+    from app.services.reminder_scheduler import meeting_reminders
+    return meeting_reminders.dispatch()
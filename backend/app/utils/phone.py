@@ -0,0 +1,16 @@
+from typing import List
+
+
+def phone_key(phone) -> str:
+    """Canonical lookup key for a Kenyan MSISDN: its last nine digits"""
+    digits = ''.join(ch for ch in str(phone or '') if ch.isdigit())
+    return digits[-9:]
+
+
+def phone_variants(phone) -> List[str]:
+    """Local and international spellings of a Kenyan MSISDN, for matching users.phone"""
+    phone = str(phone or '')
+    local = phone_key(phone)
+    if len(local) < 9:
+        return [phone]
+    return list({phone, f"0{local}", f"254{local}", f"+254{local}"})
@@ -0,0 +1,55 @@
+"""
+Savepoint-aware work queued in Session.info.
+
+Services queue events and ids in session.info while a transaction runs and
+act on them after it commits. A savepoint that rolls back has to take the
+entries queued inside it with it, while entries queued before it stay: a
+retried item would otherwise be published twice. track_savepoints()
+snapshots the given keys when each savepoint begins (a list by its length, a
+set by a copy) and discard_pending() restores them from an after_rollback
+listener, or drops them when the whole transaction rolls back.
+"""
+from sqlalchemy import event as sa_event
+from sqlalchemy.orm import Session
+
+SAVEPOINT_SNAPSHOTS_KEY = 'savepoint_snapshots'
+
+
+def track_savepoints(*keys: str):
+    """Snapshot these session.info entries whenever a savepoint begins"""
+    def on_begin(session, transaction):
+        if not transaction.nested:
+            return
+        snapshot = session.info.setdefault(SAVEPOINT_SNAPSHOTS_KEY, {}).setdefault(transaction, {})
+        for key in keys:
+            value = session.info.get(key)
+            snapshot[key] = len(value) if isinstance(value, list) else set(value) if value is not None else None
+
+    def on_end(session, transaction):
+        snapshots = session.info.get(SAVEPOINT_SNAPSHOTS_KEY)
+        if snapshots:
+            snapshots.pop(transaction, None)
+
+    sa_event.listen(Session, 'after_transaction_create', on_begin)
+    sa_event.listen(Session, 'after_transaction_end', on_end)
+
+
+def discard_pending(session: Session, *keys: str):
+    """Drop what was queued inside the savepoint rolling back, or everything on a full rollback"""
+    savepoint = session.get_nested_transaction()
+    if savepoint is None:
+        for key in keys:
+            session.info.pop(key, None)
+        return
+
+    snapshot = session.info.get(SAVEPOINT_SNAPSHOTS_KEY, {}).get(savepoint, {})
+    for key in keys:
+        if key not in snapshot:
+            continue
+        before = snapshot[key]
+        if before is None:
+            session.info.pop(key, None)
+        elif isinstance(before, int):
+            del session.info.get(key, [])[before:]
+        else:
+            session.info[key] = before
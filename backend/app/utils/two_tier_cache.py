@@ -0,0 +1,345 @@
+"""
+Two-tier Flask-Caching backend shared across gunicorn workers.
+
+L1 is a small per-process LRU whose entries live at most CACHE_L1_TTL
+seconds; L2 is Redis, shared by every worker. Values are stored as bytes:
+JSON-native values through orjson, anything else through pickle, and
+payloads over CACHE_COMPRESS_THRESHOLD bytes are zlib-compressed. Every
+write and delete is announced on a pub/sub channel so the other workers drop
+their L1 copy. When Redis is unreachable the cache keeps serving from L1
+alone and retries Redis after CACHE_REDIS_RETRY_SECONDS.
+
+Enabled in create_app with CACHE_TYPE='app.utils.two_tier_cache.TwoTierCache';
+`cache.cache.stats()` returns hit/miss/latency counters per key prefix.
+"""
+import logging
+import os
+import pickle
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict, defaultdict
+
+import redis
+from flask_caching.backends.base import BaseCache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# First payload byte: bit 0 set for pickle, bit 1 set when compressed
+PICKLED = 0x01
+COMPRESSED = 0x02
+
+
+class TwoTierCache(BaseCache):
+    def __init__(self, redis_url=None, key_prefix='cache:', l1_max_entries=1024, l1_ttl=30,
+                 compress_threshold=1024, retry_seconds=30, socket_timeout=0.5,
+                 channel='cache:invalidate', default_timeout=300, **kwargs):
+        super().__init__(default_timeout=default_timeout, **kwargs)
+        self.redis_url = redis_url
+        self.key_prefix = key_prefix
+        self.l1_max_entries = l1_max_entries
+        self.l1_ttl = l1_ttl
+        self.compress_threshold = compress_threshold
+        self.retry_seconds = retry_seconds
+        self.socket_timeout = socket_timeout
+        self.channel = channel
+        # Identifies this process's own invalidation messages
+        self.origin = uuid.uuid4().hex
+
+        self._l1 = OrderedDict()
+        self._lock = threading.Lock()
+        self._client = None
+        self._down_until = 0.0
+        self._listener_pid = None
+        self._stats = defaultdict(lambda: defaultdict(float))
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        kwargs.update(
+            redis_url=config.get('CACHE_REDIS_URL') or config.get('REDIS_URL'),
+            key_prefix=config.get('CACHE_KEY_PREFIX') or 'cache:',
+            l1_max_entries=config.get('CACHE_L1_MAX_ENTRIES', 1024),
+            l1_ttl=config.get('CACHE_L1_TTL', 30),
+            compress_threshold=config.get('CACHE_COMPRESS_THRESHOLD', 1024),
+            retry_seconds=config.get('CACHE_REDIS_RETRY_SECONDS', 30),
+            socket_timeout=config.get('CACHE_REDIS_SOCKET_TIMEOUT', 0.5)
+        )
+        return cls(*args, **kwargs)
+
+    # ------------------------------------------------------------------
+    # Cache API
+    # ------------------------------------------------------------------
+
+    def get(self, key):
+        payload = self._l1_get(key)
+        if payload is not None:
+            self._count(key, 'l1_hits')
+            return self._loads(payload)
+
+        client = self._redis()
+        if client is not None:
+            started = time.perf_counter()
+            try:
+                payload = client.get(self.key_prefix + key)
+            except redis.RedisError as e:
+                self._fail(key, e)
+            else:
+                self._timed(key, started)
+                if payload is not None:
+                    self._count(key, 'l2_hits')
+                    self._l1_set(key, payload, None)
+                    return self._loads(payload)
+
+        self._count(key, 'misses')
+        return None
+
+    def set(self, key, value, timeout=None):
+        timeout = self._normalize_timeout(timeout)
+        payload = self._dumps(value)
+        self._l1_set(key, payload, timeout)
+        self._count(key, 'sets')
+
+        client = self._redis()
+        if client is not None:
+            started = time.perf_counter()
+            try:
+                client.set(self.key_prefix + key, payload, ex=timeout or None)
+                self._publish(client, {'keys': [key]})
+            except redis.RedisError as e:
+                self._fail(key, e)
+            else:
+                self._timed(key, started)
+        return True
+
+    def add(self, key, value, timeout=None):
+        timeout = self._normalize_timeout(timeout)
+        payload = self._dumps(value)
+
+        client = self._redis()
+        if client is not None:
+            try:
+                added = client.set(self.key_prefix + key, payload, ex=timeout or None, nx=True)
+            except redis.RedisError as e:
+                self._fail(key, e)
+            else:
+                if added:
+                    self._l1_set(key, payload, timeout)
+                    self._count(key, 'sets')
+                return bool(added)
+
+        if self._l1_get(key) is not None:
+            return False
+        self._l1_set(key, payload, timeout)
+        self._count(key, 'sets')
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            self._l1.pop(key, None)
+        self._count(key, 'deletes')
+
+        client = self._redis()
+        if client is not None:
+            try:
+                client.delete(self.key_prefix + key)
+                self._publish(client, {'keys': [key]})
+            except redis.RedisError as e:
+                self._fail(key, e)
+        return True
+
+    def delete_matching(self, prefix):
+        """Delete every key starting with `prefix` from both tiers"""
+        with self._lock:
+            for key in [key for key in self._l1 if key.startswith(prefix)]:
+                del self._l1[key]
+        self._count(prefix, 'deletes')
+
+        client = self._redis()
+        if client is not None:
+            try:
+                pipe = client.pipeline(transaction=False)
+                for name in client.scan_iter(match=f"{self.key_prefix}{prefix}*", count=500):
+                    pipe.delete(name)
+                pipe.execute()
+                self._publish(client, {'prefix': prefix})
+            except redis.RedisError as e:
+                self._fail(prefix, e)
+        return True
+
+    def has(self, key):
+        if self._l1_get(key) is not None:
+            return True
+        client = self._redis()
+        if client is not None:
+            try:
+                return bool(client.exists(self.key_prefix + key))
+            except redis.RedisError as e:
+                self._fail(key, e)
+        return False
+
+    def clear(self):
+        with self._lock:
+            self._l1.clear()
+        client = self._redis()
+        if client is not None:
+            try:
+                pipe = client.pipeline(transaction=False)
+                for name in client.scan_iter(match=f"{self.key_prefix}*", count=500):
+                    pipe.delete(name)
+                pipe.execute()
+                self._publish(client, {'clear': True})
+            except redis.RedisError as e:
+                self._fail('', e)
+                return False
+        return True
+
+    def stats(self):
+        """Per-process counters by key prefix, plus tier state"""
+        prefixes = {}
+        for prefix, counters in list(self._stats.items()):
+            lookups = counters['l1_hits'] + counters['l2_hits'] + counters['misses']
+            prefixes[prefix] = {
+                'l1Hits': int(counters['l1_hits']),
+                'l2Hits': int(counters['l2_hits']),
+                'misses': int(counters['misses']),
+                'sets': int(counters['sets']),
+                'deletes': int(counters['deletes']),
+                'errors': int(counters['errors']),
+                'hitRate': round((counters['l1_hits'] + counters['l2_hits']) / lookups, 4) if lookups else None,
+                'l2AvgMs': round(counters['l2_seconds'] * 1000 / counters['l2_calls'], 3) if counters['l2_calls'] else None,
+                'l2MaxMs': round(counters['l2_max_seconds'] * 1000, 3)
+            }
+        return {
+            'pid': os.getpid(),
+            'l1Entries': len(self._l1),
+            'l1MaxEntries': self.l1_max_entries,
+            'redis': 'unavailable' if time.monotonic() < self._down_until else
+                     'available' if self.redis_url else 'not_configured',
+            'prefixes': prefixes
+        }
+
+    # ------------------------------------------------------------------
+    # L1
+    # ------------------------------------------------------------------
+
+    def _l1_get(self, key):
+        with self._lock:
+            entry = self._l1.get(key)
+            if entry is None:
+                return None
+            expires_at, payload = entry
+            if expires_at < time.monotonic():
+                del self._l1[key]
+                return None
+            self._l1.move_to_end(key)
+            return payload
+
+    def _l1_set(self, key, payload, timeout):
+        ttl = min(self.l1_ttl, timeout) if timeout else self.l1_ttl
+        with self._lock:
+            self._l1[key] = (time.monotonic() + ttl, payload)
+            self._l1.move_to_end(key)
+            while len(self._l1) > self.l1_max_entries:
+                self._l1.popitem(last=False)
+
+    def _invalidate(self, message):
+        with self._lock:
+            if message.get('clear'):
+                self._l1.clear()
+                return
+            if message.get('prefix'):
+                for key in [key for key in self._l1 if key.startswith(message['prefix'])]:
+                    del self._l1[key]
+            for key in message.get('keys', []):
+                self._l1.pop(key, None)
+
+    # ------------------------------------------------------------------
+    # L2 and invalidation
+    # ------------------------------------------------------------------
+
+    def _redis(self):
+        """The Redis client, or None while Redis is unconfigured or backing off"""
+        if not self.redis_url or time.monotonic() < self._down_until:
+            return None
+        if self._client is None:
+            self._client = redis.Redis.from_url(
+                self.redis_url, socket_timeout=self.socket_timeout, socket_connect_timeout=self.socket_timeout
+            )
+        if self._listener_pid != os.getpid():
+            # Started lazily so each forked worker runs its own subscriber
+            self._listener_pid = os.getpid()
+            threading.Thread(target=self._listen, name='cache-invalidation', daemon=True).start()
+        return self._client
+
+    def _fail(self, key, error):
+        self._count(key, 'errors')
+        if time.monotonic() >= self._down_until:
+            logger.warning(f"Redis cache unavailable, serving from L1 only for {self.retry_seconds}s: {str(error)}")
+        self._down_until = time.monotonic() + self.retry_seconds
+
+    def _publish(self, client, message):
+        message['origin'] = self.origin
+        client.publish(self.channel, self._dumps(message))
+
+    def _listen(self):
+        client = redis.Redis.from_url(self.redis_url, health_check_interval=30)
+        while True:
+            try:
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # Invalidations may have been missed while unsubscribed
+                with self._lock:
+                    self._l1.clear()
+                for item in pubsub.listen():
+                    message = self._loads(item['data'])
+                    if message.get('origin') != self.origin:
+                        self._invalidate(message)
+            except Exception as e:
+                logger.warning(f"Cache invalidation listener error: {str(e)}")
+                time.sleep(self.retry_seconds)
+
+    # ------------------------------------------------------------------
+    # Serialization and stats
+    # ------------------------------------------------------------------
+
+    def _dumps(self, value):
+        flags = 0
+        payload = None
+        if orjson is not None:
+            try:
+                # Datetimes and dataclasses go to pickle so they come back as themselves
+                payload = orjson.dumps(value, option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS)
+            except TypeError:
+                payload = None
+        if payload is None:
+            flags |= PICKLED
+            payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(payload) > self.compress_threshold:
+            flags |= COMPRESSED
+            payload = zlib.compress(payload, 3)
+        return bytes([flags]) + payload
+
+    @staticmethod
+    def _loads(data):
+        flags, payload = data[0], data[1:]
+        if flags & COMPRESSED:
+            payload = zlib.decompress(payload)
+        if flags & PICKLED:
+            return pickle.loads(payload)
+        return orjson.loads(payload)
+
+    def _count(self, key, counter):
+        self._stats[key.split(':', 1)[0]][counter] += 1
+
+    def _timed(self, key, started):
+        elapsed = time.perf_counter() - started
+        counters = self._stats[key.split(':', 1)[0]]
+        counters['l2_calls'] += 1
+        counters['l2_seconds'] += elapsed
+        counters['l2_max_seconds'] = max(counters['l2_max_seconds'], elapsed)
@@ -1,5 +1,4 @@
 from app import create_app
-from app.celery_utils import make_celery
 
 app = create_app()
-celery = make_celery(app)
+celery = app.extensions['celery']
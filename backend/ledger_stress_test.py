@@ -0,0 +1,122 @@
+"""
+Ledger concurrency stress test.
+
+Runs many parallel writers posting deposits and withdrawals against a small set
+of hot savings accounts through the ledger posting engine, then checks that no
+update was lost and that every account's running balances chain correctly.
+Needs PostgreSQL (row locks) and members with savings accounts. Writes real
+transactions - run against a dev database.
+
+Usage:
+    python ledger_stress_test.py [--writers 100] [--postings 50] [--accounts 10] [--batch 1]
+"""
+import argparse
+import random
+import time
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from app import create_app, db
+from app.models import SavingsAccount, Transaction
+from app.services.ledger_service import ledger_service, InsufficientFundsError
+
+
+def run_writer(app, member_ids, args, tag):
+    """Post random entries; returns (per-member applied deltas, outcome counts)"""
+    deltas = defaultdict(Decimal)
+    outcomes = Counter()
+    with app.app_context():
+        for _ in range(args.postings):
+            batch = []
+            for _ in range(args.batch):
+                amount = Decimal(random.randint(1, 500))
+                batch.append({
+                    'member_id': random.choice(member_ids),
+                    'account_type': 'savings',
+                    'transaction_type': random.choice(['deposit', 'deposit', 'withdrawal']),
+                    'amount': amount,
+                    'reference': tag
+                })
+            try:
+                rows = ledger_service.post_entries(batch)
+                db.session.commit()
+            except InsufficientFundsError:
+                db.session.rollback()
+                outcomes['insufficient_funds'] += 1
+                continue
+            except Exception as e:
+                db.session.rollback()
+                outcomes[type(e).__name__] += 1
+                continue
+            for row in rows:
+                sign = 1 if row['transaction_type'] == 'deposit' else -1
+                deltas[row['member_id']] += sign * row['amount']
+            outcomes['committed'] += 1
+        db.session.remove()
+    return deltas, outcomes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parallel writers against hot ledger accounts')
+    parser.add_argument('--writers', type=int, default=100)
+    parser.add_argument('--postings', type=int, default=50, help='batches per writer')
+    parser.add_argument('--accounts', type=int, default=10)
+    parser.add_argument('--batch', type=int, default=1, help='entries per batch')
+    args = parser.parse_args()
+
+    app = create_app()
+    tag = f"ledger-stress-{uuid.uuid4().hex[:8]}"
+
+    with app.app_context():
+        accounts = SavingsAccount.query.order_by(SavingsAccount.id).limit(args.accounts).all()
+        if not accounts:
+            raise SystemExit("No savings accounts found")
+        initial = {account.member_id: Decimal(account.balance) for account in accounts}
+    member_ids = list(initial)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.writers) as pool:
+        results = list(pool.map(lambda _: run_writer(app, member_ids, args, tag), range(args.writers)))
+    elapsed = time.perf_counter() - started
+
+    expected = dict(initial)
+    outcomes = Counter()
+    for deltas, counts in results:
+        outcomes.update(counts)
+        for member_id, delta in deltas.items():
+            expected[member_id] += delta
+
+    with app.app_context():
+        final = {
+            account.member_id: Decimal(account.balance)
+            for account in SavingsAccount.query.filter(SavingsAccount.member_id.in_(member_ids))
+        }
+        rows = Transaction.query.filter_by(reference=tag).order_by(Transaction.id).all()
+        last_after, chain_breaks = {}, 0
+        for row in rows:
+            previous = last_after.get(row.member_id)
+            if previous is not None and row.balance_before != previous:
+                chain_breaks += 1
+            last_after[row.member_id] = row.balance_after
+
+    lost = {member_id: final[member_id] - expected[member_id]
+            for member_id in member_ids if final[member_id] != expected[member_id]}
+    negative = [member_id for member_id in member_ids if final[member_id] < 0]
+
+    print(f"Writers:          {args.writers}")
+    print(f"Hot accounts:     {len(member_ids)}")
+    print(f"Outcomes:         {dict(outcomes)}")
+    print(f"Rows posted:      {len(rows)}")
+    print(f"Elapsed:          {elapsed:.2f}s")
+    print(f"Throughput:       {outcomes['committed'] / elapsed:.0f} batches/s, {len(rows) / elapsed:.0f} entries/s")
+    print(f"Lost updates:     {len(lost)} accounts {lost if lost else ''}")
+    print(f"Chain breaks:     {chain_breaks}")
+    print(f"Negative:         {len(negative)}")
+    if lost or chain_breaks or negative:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Loan origination concurrency test.
+
+Fires many parallel product-loan applications at a single product and checks
+that stock is never oversold. Needs a PostgreSQL database (row locks) with a
+member whose savings cover the requested items.
+
+Usage:
+    python loan_concurrency_test.py --member-id 1 --loan-type-id 1 --product-id 1 \
+        [--requests 200] [--stock 50] [--workers 50]
+"""
+import argparse
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from app import create_app, db
+from app.models import LoanProduct, Loan
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parallel loan applications against one product')
+    parser.add_argument('--member-id', type=int, required=True)
+    parser.add_argument('--loan-type-id', type=int, required=True)
+    parser.add_argument('--product-id', type=int, required=True)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--stock', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=50)
+    args = parser.parse_args()
+
+    app = create_app()
+
+    with app.app_context():
+        product = LoanProduct.query.get(args.product_id)
+        if not product:
+            raise SystemExit(f"Product {args.product_id} not found")
+        product.stock_quantity = args.stock
+        db.session.commit()
+        loans_before = Loan.query.count()
+
+    payload = {
+        'memberId': args.member_id,
+        'loanTypeId': args.loan_type_id,
+        'items': [{'productId': args.product_id, 'quantity': 1}]
+    }
+
+    def apply(_):
+        with app.test_client() as client:
+            response = client.post(f"/api/loans?user_id={args.member_id}", json=payload)
+            return response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        statuses = Counter(pool.map(apply, range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        final_stock = LoanProduct.query.get(args.product_id).stock_quantity
+        created = Loan.query.count() - loans_before
+
+    print(f"Requests:        {args.requests}")
+    print(f"Statuses:        {dict(statuses)}")
+    print(f"Loans created:   {created}")
+    print(f"Initial stock:   {args.stock}")
+    print(f"Final stock:     {final_stock}")
+    print(f"Elapsed:         {elapsed:.2f}s ({args.requests / elapsed:.0f} req/s)")
+
+    oversold = final_stock < 0 or statuses.get(201, 0) > args.stock
+    consistent = final_stock == args.stock - statuses.get(201, 0)
+    print(f"Oversold:        {'YES' if oversold else 'no'}")
+    print(f"Stock consistent with accepted applications: {'yes' if consistent else 'NO'}")
+    if oversold or not consistent:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+M-Pesa callback pipeline tool.
+
+    python mpesa_callbacks.py worker [--batch-size 500] [--idle-sleep 1]
+        Post queued callbacks in micro-batches until interrupted.
+
+    python mpesa_callbacks.py replay [--status unmatched --status failed] [--since ISO] [--until ISO]
+        Requeue stored callbacks and drain them through the pipeline.
+
+    python mpesa_callbacks.py benchmark [--callbacks 10000] [--batch-size 500]
+        Enqueue synthetic callbacks for existing members and measure ingest and
+        posting throughput. Writes real deposits - run against a dev database.
+"""
+import argparse
+import random
+import time
+import uuid
+from datetime import datetime
+
+from app import create_app, db
+from app.models import User, Member
+from app.services.payment_service import payment_service
+
+
+def drain(batch_size):
+    """Process batches until the queue is empty; returns aggregated counts"""
+    totals = {'processed': 0, 'posted': 0, 'duplicate': 0, 'unmatched': 0}
+    while True:
+        result = payment_service.process_callback_batch(batch_size)
+        if result.get('error'):
+            print(f"Batch failed: {result['error']}")
+            continue
+        if not result['processed']:
+            return totals
+        for key in totals:
+            totals[key] += result.get(key, 0)
+
+
+def run_worker(args):
+    print(f"Posting M-Pesa callbacks in batches of {args.batch_size}")
+    while True:
+        try:
+            result = payment_service.process_callback_batch(args.batch_size)
+        except Exception as e:
+            db.session.rollback()
+            print(f"Worker error: {e}")
+            time.sleep(args.idle_sleep)
+            continue
+        if result.get('processed'):
+            print(f"{datetime.utcnow().isoformat()} {result}")
+        else:
+            time.sleep(args.idle_sleep)
+
+
+def run_replay(args):
+    requeued = payment_service.replay_callbacks(
+        statuses=args.status or ['unmatched', 'failed'],
+        since=datetime.fromisoformat(args.since) if args.since else None,
+        until=datetime.fromisoformat(args.until) if args.until else None
+    )
+    print(f"Requeued {requeued} callbacks")
+    started = time.perf_counter()
+    totals = drain(args.batch_size)
+    print(f"Replayed in {time.perf_counter() - started:.2f}s: {totals}")
+
+
+def stk_payload(receipt, phone, amount):
+    return {
+        'Body': {
+            'stkCallback': {
+                'MerchantRequestID': uuid.uuid4().hex,
+                'CheckoutRequestID': f"ws_CO_{uuid.uuid4().hex}",
+                'ResultCode': 0,
+                'ResultDesc': 'The service request is processed successfully.',
+                'CallbackMetadata': {
+                    'Item': [
+                        {'Name': 'Amount', 'Value': amount},
+                        {'Name': 'MpesaReceiptNumber', 'Value': receipt},
+                        {'Name': 'TransactionDate', 'Value': int(datetime.utcnow().strftime('%Y%m%d%H%M%S'))},
+                        {'Name': 'PhoneNumber', 'Value': phone}
+                    ]
+                }
+            }
+        }
+    }
+
+
+def run_benchmark(args):
+    phones = [phone for (phone,) in db.session.query(User.phone).join(Member, Member.user_id == User.id).limit(1000)]
+    if not phones:
+        raise SystemExit("No members found to deposit into")
+
+    payloads = [
+        stk_payload(f"BENCH{uuid.uuid4().hex[:10].upper()}", random.choice(phones), random.randint(50, 5000))
+        for _ in range(args.callbacks)
+    ]
+    # Redeliver 5% of callbacks to exercise idempotency
+    payloads += random.sample(payloads, max(1, args.callbacks // 20))
+
+    started = time.perf_counter()
+    for payload in payloads:
+        payment_service.enqueue_callback(payload)
+    ingest_elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    totals = drain(args.batch_size)
+    post_elapsed = time.perf_counter() - started
+
+    print(f"Callbacks delivered: {len(payloads)} ({len(payloads) - args.callbacks} redeliveries)")
+    print(f"Ingest:  {ingest_elapsed:.2f}s ({len(payloads) / ingest_elapsed:.0f} callbacks/s)")
+    print(f"Posting: {post_elapsed:.2f}s ({totals['processed'] / max(post_elapsed, 1e-9):.0f} callbacks/s)")
+    print(f"Result:  {totals}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='M-Pesa callback pipeline tool')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    worker = sub.add_parser('worker')
+    worker.add_argument('--batch-size', type=int, default=500)
+    worker.add_argument('--idle-sleep', type=float, default=1.0)
+
+    replay = sub.add_parser('replay')
+    replay.add_argument('--status', action='append')
+    replay.add_argument('--since')
+    replay.add_argument('--until')
+    replay.add_argument('--batch-size', type=int, default=500)
+
+    benchmark = sub.add_parser('benchmark')
+    benchmark.add_argument('--callbacks', type=int, default=10000)
+    benchmark.add_argument('--batch-size', type=int, default=500)
+
+    args = parser.parse_args()
+    app = create_app()
+    with app.app_context():
+        {'worker': run_worker, 'replay': run_replay, 'benchmark': run_benchmark}[args.command](args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Push gateway load test.
+
+Opens many concurrent idle SSE streams against a running push gateway, waits
+for every stream's `ready` event, then reads the gateway's own stats to
+report resident memory per open connection. With --broadcast one event is
+published on the event bus and the time until each stream receives it is
+measured.
+
+Usage:
+    gunicorn -k gevent -w 1 --worker-connections 10000 -b 127.0.0.1:5001 wsgi:app
+    python push_load_test.py [--url http://127.0.0.1:5001] [--connections 5000] [--user-id 1] [--broadcast]
+"""
+import argparse
+import asyncio
+import resource
+import statistics
+import time
+import uuid
+from urllib.parse import urlparse
+
+import redis
+import requests
+
+from app.services.event_bus import DEFAULT_CHANNEL, encode_event
+
+
+def raise_fd_limit(needed):
+    """Lift the soft open-files limit so one process can hold every stream"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = needed + 256 if hard == resource.RLIM_INFINITY else min(needed + 256, hard)
+    if soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+def gateway_stats(url, user_id):
+    response = requests.get(f"{url}/api/events/stats", params={'user_id': user_id}, timeout=10)
+    response.raise_for_status()
+    return response.json()
+
+
+async def read_until(reader, marker):
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError('stream closed')
+        if line.startswith(marker):
+            return
+
+
+async def open_stream(host, port, user_id, limiter, timeout):
+    """Open one stream and return it once the gateway has sent `ready`"""
+    async with limiter:
+        started = time.perf_counter()
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        writer.write(
+            f"GET /api/events/stream?user_id={user_id} HTTP/1.1\r\n"
+            f"Host: {host}:{port}\r\nAccept: text/event-stream\r\nCache-Control: no-cache\r\n\r\n".encode()
+        )
+        await writer.drain()
+        status = await asyncio.wait_for(reader.readline(), timeout)
+        if b' 200 ' not in status:
+            writer.close()
+            raise ConnectionError(status.decode(errors='replace').strip() or 'no response')
+        await asyncio.wait_for(read_until(reader, b'event: ready'), timeout)
+        return reader, writer, time.perf_counter() - started
+
+
+async def run(args):
+    parsed = urlparse(args.url)
+    host, port = parsed.hostname, parsed.port or 80
+    limiter = asyncio.Semaphore(args.ramp)
+
+    before = gateway_stats(args.url, args.user_id)
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *(open_stream(host, port, args.user_id, limiter, args.timeout) for _ in range(args.connections)),
+        return_exceptions=True
+    )
+    ramp_elapsed = time.perf_counter() - started
+    streams = [result for result in results if not isinstance(result, BaseException)]
+    errors = [result for result in results if isinstance(result, BaseException)]
+
+    # Let the gateway settle with every stream idle
+    await asyncio.sleep(args.hold)
+    after = gateway_stats(args.url, args.user_id)
+
+    fan_out = []
+    if args.broadcast and streams:
+        marker = f"loadtest-{uuid.uuid4().hex}"
+        published = None
+
+        async def wait_for_event(reader):
+            await read_until(reader, f"event: {marker}".encode())
+            fan_out.append(time.perf_counter() - published)
+
+        waiters = [asyncio.ensure_future(wait_for_event(reader)) for reader, _, _ in streams]
+        published = time.perf_counter()
+        redis.from_url(args.redis_url).publish(args.channel, encode_event(marker, {}, user_ids=[args.user_id]))
+        await asyncio.wait(waiters, timeout=args.timeout)
+
+    for _, writer, _ in streams:
+        writer.close()
+
+    connect_times = sorted(latency for _, _, latency in streams)
+    print(f"Requested streams:   {args.connections}")
+    print(f"Open streams:        {len(streams)}")
+    print(f"Failed:              {len(errors)}")
+    if errors:
+        print(f"First error:         {errors[0]!r}")
+    print(f"Ramp elapsed:        {ramp_elapsed:.2f}s")
+    if connect_times:
+        print(f"Connect p50:         {statistics.median(connect_times) * 1000:.1f}ms")
+        print(f"Connect p95:         {connect_times[int(len(connect_times) * 0.95) - 1] * 1000:.1f}ms")
+    print(f"Gateway streams:     {before['streams']} -> {after['streams']}")
+    if before.get('rssBytes') and after.get('rssBytes'):
+        grown = after['rssBytes'] - before['rssBytes']
+        opened = max(after['streams'] - before['streams'], 1)
+        print(f"Gateway RSS:         {before['rssBytes'] / 2 ** 20:.1f}MiB -> {after['rssBytes'] / 2 ** 20:.1f}MiB")
+        print(f"Memory per stream:   {grown / opened / 1024:.1f}KiB")
+    if args.broadcast:
+        fan_out.sort()
+        print(f"Broadcast received:  {len(fan_out)}/{len(streams)}")
+        if fan_out:
+            print(f"Fan-out p50:         {statistics.median(fan_out) * 1000:.1f}ms")
+            print(f"Fan-out max:         {fan_out[-1] * 1000:.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Hold many idle SSE streams open against the push gateway')
+    parser.add_argument('--url', default='http://127.0.0.1:5001')
+    parser.add_argument('--connections', type=int, default=5000)
+    parser.add_argument('--user-id', type=int, default=1, help='existing user the streams authenticate as')
+    parser.add_argument('--ramp', type=int, default=200, help='streams being opened at once')
+    parser.add_argument('--hold', type=float, default=5.0, help='seconds to stay idle before sampling memory')
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--broadcast', action='store_true', help='measure fan-out of one event to every stream')
+    parser.add_argument('--redis-url', default='redis://localhost:6379/0')
+    parser.add_argument('--channel', default=DEFAULT_CHANNEL)
+    args = parser.parse_args()
+
+    limit = raise_fd_limit(args.connections)
+    if limit < args.connections + 64:
+        print(f"Open-files limit is {limit}; raise it (ulimit -n) for {args.connections} streams")
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Bulk M-Pesa statement reconciliation tool.
+
+    python reconcile_statement.py run statement.csv [--output-dir DIR] [--window-minutes 10]
+        Reconcile a paybill statement CSV against transactions and write the
+        matched, unmatched and duplicate sets as CSV files.
+
+    python reconcile_statement.py generate statement.csv [--rows 100000]
+        Build a synthetic statement from existing M-Pesa transactions (plus
+        unknown receipts and repeated rows) for timing a reconciliation run.
+"""
+import argparse
+import csv
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from app import create_app, db
+from app.models import Transaction, Member, User
+from app.services.reconciliation_service import statement_reconciliation_service
+
+
+def print_progress(phase, done, total):
+    suffix = f"/{total}" if total else ''
+    sys.stdout.write(f"\r{phase:<9} {done}{suffix} rows")
+    sys.stdout.flush()
+    if total and done == total:
+        sys.stdout.write('\n')
+
+
+def run_reconcile(args):
+    output_dir = args.output_dir or f"reconciliation-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
+    with open(args.statement, newline='', encoding='utf-8-sig') as stream:
+        result = statement_reconciliation_service.reconcile_statement(
+            stream, output_dir=output_dir, window_minutes=args.window_minutes, progress=print_progress
+        )
+
+    print(f"Rows read:       {result['rowsRead']}")
+    print(f"Rows staged:     {result['rowsStaged']} ({result['skipped']} skipped, {result['rejected']} rejected)")
+    for outcome, values in result['summary'].items():
+        print(f"{outcome.capitalize() + ':':<16} {values['count']} (KES {values['amount']})")
+    matched = result['summary']['matched']
+    print(f"  by receipt:    {matched['byReceipt']}")
+    print(f"  by fallback:   {matched['byFallback']}")
+    print(f"  amount diffs:  {matched['amountMismatches']}")
+    timings = result['timings']
+    print(f"Elapsed:         {timings['totalSeconds']}s (load {timings['loadSeconds']}s, match {timings['matchSeconds']}s)")
+    print(f"Reports:         {output_dir}")
+
+
+def run_generate(args):
+    offset = timedelta(hours=statement_reconciliation_service.utc_offset_hours)
+    known = (
+        db.session.query(Transaction.mpesa_code, Transaction.amount, Transaction.created_at, User.phone)
+        .join(Member, Member.id == Transaction.member_id)
+        .join(User, User.id == Member.user_id)
+        .filter(Transaction.mpesa_code.isnot(None))
+        .order_by(Transaction.id.desc())
+        .limit(int(args.rows * 0.9))
+        .all()
+    )
+    rows = [(code, amount, created_at + offset, phone) for code, amount, created_at, phone in known]
+    now = datetime.utcnow() + offset
+    while len(rows) < args.rows * 0.97:
+        rows.append((f"Q{uuid.uuid4().hex[:9].upper()}", random.randint(50, 5000),
+                     now - timedelta(minutes=random.randint(0, 60 * 24 * 30)),
+                     f"2547{random.randint(10000000, 99999999)}"))
+    rows += random.sample(rows, args.rows - len(rows))
+
+    with open(args.statement, 'w', newline='') as handle:
+        writer = csv.writer(handle)
+        writer.writerow(['Receipt No.', 'Completion Time', 'Details', 'Transaction Status',
+                         'Paid In', 'Withdrawn', 'Balance', 'Other Party Info'])
+        for code, amount, completed_at, phone in rows:
+            writer.writerow([code, completed_at.strftime('%Y-%m-%d %H:%M:%S'), 'Pay Bill from',
+                             'Completed', f"{float(amount):,.2f}", '', '', f"{phone} - MEMBER"])
+    print(f"Wrote {len(rows)} rows ({len(known)} known receipts) to {args.statement}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='M-Pesa statement reconciliation tool')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run = sub.add_parser('run')
+    run.add_argument('statement')
+    run.add_argument('--output-dir')
+    run.add_argument('--window-minutes', type=int)
+
+    generate = sub.add_parser('generate')
+    generate.add_argument('statement')
+    generate.add_argument('--rows', type=int, default=100000)
+
+    args = parser.parse_args()
+    app = create_app()
+    with app.app_context():
+        started = time.perf_counter()
+        {'run': run_reconcile, 'generate': run_generate}[args.command](args)
+        print(f"Done in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+USSD load-test harness.
+
+Simulates many concurrent USSD sessions walking the menu tree against the
+in-process USSD service and reports per-hop latency against the ~2s telco budget.
+
+Usage:
+    python ussd_load_test.py [--sessions 1000] [--workers 100]
+"""
+import argparse
+import random
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from app import create_app
+from app.services.ussd_service import ussd_service
+
+# Keypress journeys a feature phone user typically takes through the menus
+JOURNEYS = [
+    ['', '1', '1', '0', '0'],
+    ['', '2', '1', '0', '0'],
+    ['', '3', '1', '0', '0'],
+    ['', '4', '3', '0', '5', '1', '0', '0'],
+    ['', '2', '3', '0', '1', '2', '0'],
+]
+
+
+def run_session(app, phone_number):
+    """Drive one session end to end and return the latency of every hop"""
+    session_id = f"load_{uuid.uuid4().hex}"
+    latencies = []
+    with app.app_context():
+        for user_input in random.choice(JOURNEYS):
+            started = time.perf_counter()
+            ussd_service.handle_ussd_request(phone_number, user_input, session_id)
+            latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate concurrent USSD sessions')
+    parser.add_argument('--sessions', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=100)
+    args = parser.parse_args()
+
+    app = create_app()
+    phones = [f"+2547{random.randint(10000000, 99999999)}" for _ in range(args.sessions)]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        results = list(pool.map(lambda phone: run_session(app, phone), phones))
+    elapsed = time.perf_counter() - started
+
+    hops = sorted(latency for session in results for latency in session)
+    print(f"Sessions:        {args.sessions}")
+    print(f"Hops:            {len(hops)}")
+    print(f"Elapsed:         {elapsed:.2f}s")
+    print(f"Throughput:      {len(hops) / elapsed:.0f} hops/s")
+    print(f"Latency p50:     {statistics.median(hops) * 1000:.1f}ms")
+    print(f"Latency p95:     {hops[int(len(hops) * 0.95) - 1] * 1000:.1f}ms")
+    print(f"Latency max:     {hops[-1] * 1000:.1f}ms")
+    print(f"Over 2s budget:  {sum(1 for h in hops if h > 2)}")
+    print(f"Local sessions:  {len(ussd_service.local_sessions)}")
+
+
+if __name__ == '__main__':
+    main()
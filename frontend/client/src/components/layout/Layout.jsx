@@ -94,6 +94,7 @@ import { useLocation } from "wouter";
 import { useToast } from "@/hooks/use-toast";
 import { useQuery, useMutation } from "@tanstack/react-query";
 import { api } from "@/lib/api";
+import { useEventStream } from "@/hooks/use-event-stream";
 import { Popover, PopoverContent, PopoverTrigger } from "@/components/ui/popover";
 import { format } from "date-fns";
 import { Badge } from "@/components/ui/badge";
@@ -115,12 +116,15 @@ export default function Layout(_a) {
     var userInitials = user ? "".concat(((_b = user.firstName) === null || _b === void 0 ? void 0 : _b[0]) || '').concat(((_c = user.lastName) === null || _c === void 0 ? void 0 : _c[0]) || '').toUpperCase() : 'A';
     var userName = user ? "".concat(user.firstName, " ").concat(user.lastName) : 'Admin';
 
+    // Pushed events refresh the badges below; polling only while the stream is down
+    var streamConnected = useEventStream(!!userId);
+
     // Fetch notifications
     var _f = useQuery({
         queryKey: ["notifications", userId],
         queryFn: function () { return api.getNotifications(userId); },
         enabled: !!userId,
-        refetchInterval: 30000, // Poll every 30 seconds
+        refetchInterval: streamConnected ? false : 30000, // Poll every 30 seconds
     }), notificationData = _f.data, refetchNotifications = _f.refetch;
     var notifications = (notificationData === null || notificationData === void 0 ? void 0 : notificationData.notifications) || [];
 
@@ -129,7 +133,7 @@ export default function Layout(_a) {
         queryKey: ["unread-message-count"],
         queryFn: api.getUnreadMessageCount,
         enabled: !!userId,
-        refetchInterval: 30000,
+        refetchInterval: streamConnected ? false : 30000,
     });
     var unreadMessages = ((_b = unreadMessageQuery.data) === null || _b === void 0 ? void 0 : _b.count) || 0;
 
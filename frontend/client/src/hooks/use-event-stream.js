@@ -0,0 +1,99 @@
+import { useEffect, useState } from "react";
+import { useQueryClient } from "@tanstack/react-query";
+import { eventStreamUrl } from "@/lib/api";
+// Queries refreshed when the push gateway reports a change
+var INVALIDATIONS = {
+    message: [["unread-message-count"], ["conversation"], ["conversations"]],
+    notification: [["notifications"]],
+    activity: [["dashboardActivities"]],
+    "loan.status": [["loans"], ["adminDashboard"], ["adminDashboard_v2"]],
+};
+// One EventSource is shared by every mounted component; pages remount Layout
+// on navigation, so closing waits briefly for the next page to subscribe
+var CLOSE_DELAY = 2000;
+var source = null;
+var subscribers = 0;
+var connected = false;
+var closeTimer = null;
+var listeners = new Set();
+var setConnected = function (value) {
+    connected = value;
+    listeners.forEach(function (listener) { listener(value); });
+};
+var invalidate = function (queryClient, keys) {
+    keys.forEach(function (queryKey) {
+        queryClient.invalidateQueries({ queryKey: queryKey });
+    });
+};
+var invalidateAll = function (queryClient) {
+    Object.keys(INVALIDATIONS).forEach(function (type) {
+        invalidate(queryClient, INVALIDATIONS[type]);
+    });
+};
+var open = function (queryClient) {
+    if (typeof window === "undefined" || !window.EventSource) {
+        return;
+    }
+    source = new EventSource(eventStreamUrl(), { withCredentials: true });
+    // Anything may have changed while the stream was down
+    source.addEventListener("ready", function () {
+        setConnected(true);
+        invalidateAll(queryClient);
+    });
+    source.addEventListener("resync", function () {
+        invalidateAll(queryClient);
+    });
+    Object.keys(INVALIDATIONS).forEach(function (type) {
+        source.addEventListener(type, function () {
+            invalidate(queryClient, INVALIDATIONS[type]);
+        });
+    });
+    // EventSource reconnects by itself; polling covers the gap
+    source.onerror = function () {
+        setConnected(false);
+    };
+};
+var close = function () {
+    if (source) {
+        source.close();
+        source = null;
+    }
+    setConnected(false);
+};
+/**
+ * Subscribe to pushed events. Returns whether the stream is connected, so
+ * callers can switch their polling off while it is.
+ */
+export var useEventStream = function (enabled) {
+    if (enabled === void 0) { enabled = true; }
+    var queryClient = useQueryClient();
+    var _a = useState(connected), isConnected = _a[0], setIsConnected = _a[1];
+    useEffect(function () {
+        if (!enabled) {
+            return undefined;
+        }
+        listeners.add(setIsConnected);
+        subscribers += 1;
+        if (closeTimer) {
+            clearTimeout(closeTimer);
+            closeTimer = null;
+        }
+        if (!source) {
+            open(queryClient);
+        }
+        setIsConnected(connected);
+        return function () {
+            listeners.delete(setIsConnected);
+            subscribers -= 1;
+            if (subscribers === 0) {
+                closeTimer = setTimeout(function () {
+                    closeTimer = null;
+                    if (subscribers === 0) {
+                        close();
+                    }
+                }, CLOSE_DELAY);
+            }
+        };
+    }, [queryClient, enabled]);
+    return enabled && isConnected;
+};
@@ -44,6 +44,15 @@ async function fetchAPI(endpoint: string, options: RequestInit = {}) {
 
 export const apiCall = fetchAPI;
 
+// Server-Sent Events stream served by the push gateway. nginx routes /api/events/ to it;
+// deployments that host the gateway elsewhere point VITE_EVENTS_URL at its /api base.
+const EVENTS_BASE = import.meta.env.VITE_EVENTS_URL || API_BASE;
+
+export const eventStreamUrl = () => {
+    const userId = getUserId();
+    return userId ? `${EVENTS_BASE}/events/stream?user_id=${userId}` : `${EVENTS_BASE}/events/stream`;
+};
+
 export const api = {
     // Generic methods
     get: (endpoint: string) => fetchAPI(endpoint),
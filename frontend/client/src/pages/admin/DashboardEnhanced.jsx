@@ -1,6 +1,7 @@
 import React, { useState, useMemo } from 'react';
 import { useQuery } from '@tanstack/react-query';
 import Layout from '@/components/layout/Layout';
+import { useEventStream } from '@/hooks/use-event-stream';
 import { api } from '@/lib/api';
 import {
   AlertCircle, Download, RefreshCw, TrendingUp, TrendingDown,
@@ -37,6 +38,7 @@ const KPICard = ({ title, value, icon: Icon, subtitle }) => (
 
 export default function AdminDashboardEnhanced() {
   const [activityPeriod, setActivityPeriod] = useState('daily');
+  const streamConnected = useEventStream();
   const [isRefreshing, setIsRefreshing] = useState(false);
 
   const formatCurrency = (value) => {
@@ -91,7 +93,8 @@ export default function AdminDashboardEnhanced() {
     queryKey: ['dashboardActivities', activityPeriod],
     queryFn: () => api.getDashboardActivities(activityPeriod, 10),
     staleTime: 2 * 60 * 1000,
-    refetchInterval: 30 * 1000,
+    // New activity is pushed; poll only while the stream is down
+    refetchInterval: streamConnected ? false : 30 * 1000,
   });
 
   const handleRefresh = async () => {
@@ -1,6 +1,7 @@
 import React, { useMemo, useState } from 'react';
 import { useQuery } from '@tanstack/react-query';
 import Layout from '@/components/layout/Layout';
+import { useEventStream } from '@/hooks/use-event-stream';
 import { Card, CardContent } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
 import {
@@ -42,6 +43,7 @@ const neon = {
 
 export default function AdminDashboardNeon() {
   const [activityPeriod, setActivityPeriod] = useState('daily');
+  const streamConnected = useEventStream();
 
   const { data: dashboard, isLoading, isError } = useQuery({
     queryKey: ['adminDashboard'],
@@ -61,7 +63,8 @@ export default function AdminDashboardNeon() {
     queryKey: ['dashboardActivities', activityPeriod],
     queryFn: () => api.getDashboardActivities(activityPeriod, 5),
     staleTime: 2 * 60 * 1000,
-    refetchInterval: 30 * 1000,
+    // New activity is pushed; poll only while the stream is down
+    refetchInterval: streamConnected ? false : 30 * 1000,
   });
 
   const userStr = typeof window !== 'undefined' ? localStorage.getItem('user') : null;
@@ -1,6 +1,7 @@
 import React, { useState, useEffect, useRef } from "react";
 import { useQuery, useMutation, useQueryClient } from "@tanstack/react-query";
 import { api } from "@/lib/api";
+import { useEventStream } from "@/hooks/use-event-stream";
 import Layout from "@/components/layout/Layout";
 import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
 import { Input } from "@/components/ui/input";
@@ -18,6 +19,7 @@ export default function MessagesPage() {
     const [searchQuery, setSearchQuery] = useState("");
     const scrollRef = useRef(null);
     const queryClient = useQueryClient();
+    const streamConnected = useEventStream();
 
     const { data: contacts = [], isLoading: contactsLoading } = useQuery({
         queryKey: ["contacts"],
@@ -28,7 +30,8 @@ export default function MessagesPage() {
         queryKey: ["conversation", selectedContact?.id],
         queryFn: () => api.getConversation(selectedContact.id),
         enabled: !!selectedContact,
-        refetchInterval: 5000, // Poll for new messages every 5 seconds
+        // New messages are pushed; poll every 5 seconds only while the stream is down
+        refetchInterval: streamConnected ? false : 5000,
     });
 
     const sendMutation = useMutation({